@@ -0,0 +1,183 @@
+"""Upload bandwidth shaping, shared by every deploy on the agent host."""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from plugin_scripts.config import env_float, env_str
+
+MIB = 1024 * 1024
+# Bytes reserved at a time; streams waiting on the limiter take turns at
+# this granularity, so a large upload cannot hold back a small one
+DEFAULT_QUANTUM = 64 * 1024
+# Smallest chunk size of a resumable GCS upload
+GCS_CHUNK_SIZE = 256 * 1024
+
+
+class BandwidthLimiter:
+    """
+    Token bucket over upload bytes, optionally shared through a file.
+
+    Every reservation takes one quantum and may borrow against future
+    refills; the caller then sleeps until its quantum is paid for. A
+    stream only reserves its next quantum after sending the previous one,
+    so concurrent streams, in this process or any other using the same
+    ``share_file``, interleave quantum by quantum.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        share_file: Path | None = None,
+        quantum: int = DEFAULT_QUANTUM,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError("Upload rate limit must be positive")
+        self.rate = rate
+        self.share_file = share_file
+        self.quantum = quantum
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._state = {"tokens": float(quantum), "updated": clock()}
+
+    def _take(self, state: dict[str, float], now: float) -> float:
+        """Take a quantum from the bucket state, returning the wait."""
+        elapsed = max(0.0, now - state["updated"])
+        tokens = min(float(self.quantum), state["tokens"] + elapsed * self.rate)
+        tokens -= self.quantum
+        state.update(tokens=tokens, updated=now)
+        return max(0.0, -tokens / self.rate)
+
+    def _reserve_shared(self, share_file: Path) -> float:
+        """Take a quantum from the bucket in ``share_file``, under ``flock``."""
+        fd = os.open(share_file, os.O_RDWR | os.O_CREAT, 0o666)
+        with os.fdopen(fd, "r+") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                stored = json.loads(handle.read())
+                state = {
+                    "tokens": float(stored["tokens"]),
+                    "updated": float(stored["updated"]),
+                }
+            except (ValueError, KeyError, TypeError):
+                state = {"tokens": float(self.quantum), "updated": self._clock()}
+            wait = self._take(state, self._clock())
+            handle.seek(0)
+            handle.truncate()
+            handle.write(json.dumps(state))
+            # The lock is released when the file is closed
+        return wait
+
+    def reserve(self) -> float:
+        """
+        Reserve one quantum of bandwidth.
+
+        Returns:
+            Seconds to wait before sending it
+        """
+        with self._lock:
+            if self.share_file is not None:
+                return self._reserve_shared(self.share_file)
+            return self._take(self._state, self._clock())
+
+    def acquire(self) -> int:
+        """
+        Wait until one quantum may be sent.
+
+        Returns:
+            The number of bytes granted
+        """
+        wait = self.reserve()
+        if wait > 0:
+            self._sleep(wait)
+        return self.quantum
+
+    def wrap(self, data: BinaryIO) -> "ThrottledReader":
+        """Shape the reads of an upload stream."""
+        return ThrottledReader(data, self)
+
+
+class ThrottledReader:
+    """
+    File-like wrapper that only hands out bytes the limiter granted.
+
+    Seeking and ``tell`` pass through, so HTTP clients can still compute
+    the content length and rewind for retries.
+    """
+
+    def __init__(self, data: BinaryIO, limiter: BandwidthLimiter):
+        self.data = data
+        self.limiter = limiter
+        self._credit = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes, waiting for the bandwidth to send them."""
+        chunk = self.data.read(size)
+        while self._credit < len(chunk):
+            self._credit += self.limiter.acquire()
+        self._credit -= len(chunk)
+        return chunk
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """Move the underlying stream's position."""
+        return self.data.seek(offset, whence)
+
+    def tell(self) -> int:
+        """Return the underlying stream's position."""
+        return self.data.tell()
+
+
+_limiters: dict[tuple[float, str], BandwidthLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def upload_limiter() -> BandwidthLimiter | None:
+    """
+    Return the process wide limiter configured by ``upload_rate_limit``.
+
+    Uploads share it so their combined rate stays within the limit; with
+    ``upload_share_file``, set by the hook, so do the deploys of every
+    other job on the host.
+
+    Returns:
+        The limiter, or None when uploads are not shaped
+    """
+    rate = env_float("upload_rate_limit", 0.0)
+    if rate <= 0:
+        return None
+    share_file = env_str("upload_share_file")
+    with _limiters_lock:
+        key = (rate, share_file)
+        if key not in _limiters:
+            _limiters[key] = BandwidthLimiter(
+                rate * MIB, Path(share_file) if share_file else None
+            )
+        return _limiters[key]
+
+
+def shaped(data: Any, blob: Any = None) -> Any:
+    """
+    Shape an upload stream when ``upload_rate_limit`` is set.
+
+    Args:
+        data: The stream to upload
+        blob: The GCS blob it goes to, switched to chunked resumable
+            uploads so the stream is read chunk by chunk
+
+    Returns:
+        The stream to hand to the upload call
+    """
+    limiter = upload_limiter()
+    if limiter is None:
+        return data
+    if blob is not None:
+        blob.chunk_size = GCS_CHUNK_SIZE
+    return limiter.wrap(data)
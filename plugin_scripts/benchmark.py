@@ -0,0 +1,207 @@
+"""Post-deploy latency benchmark and its regression gate."""
+
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from typing import Any, NamedTuple
+
+import requests
+
+from plugin_scripts import buildkite
+from plugin_scripts.state import StateStore
+from plugin_scripts.warmup import DEFAULT_REQUEST_TIMEOUT, http_session, percentile
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_MAX_ERROR_RATE = 0.01
+DEFAULT_MIX = "GET /"
+GATE_FAIL = "fail"
+GATE_ANNOTATE = "annotate"
+GATES = (GATE_FAIL, GATE_ANNOTATE)
+
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+# Latency increases smaller than this are noise, whatever their ratio
+_NOISE_FLOOR = 0.005
+
+
+class MixEntry(NamedTuple):
+    """One kind of request in the benchmark and its share of the traffic."""
+
+    method: str
+    path: str
+    weight: int
+
+
+def parse_mix(entries: list[str]) -> list[MixEntry]:
+    """
+    Parse ``METHOD PATH [WEIGHT]`` request mix entries.
+
+    Args:
+        entries: The entries, e.g. ``["GET /health", "POST /orders 3"]``
+
+    Returns:
+        The parsed entries
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    mix = []
+    for entry in entries:
+        fields = entry.split()
+        if len(fields) not in (2, 3) or not fields[1].startswith("/"):
+            raise ValueError(
+                f"Invalid benchmark request {entry!r}, expected METHOD /PATH [WEIGHT]"
+            )
+        weight = fields[2] if len(fields) == 3 else "1"
+        if not weight.isdigit() or int(weight) < 1:
+            raise ValueError(f"Invalid weight in benchmark request {entry!r}")
+        mix.append(MixEntry(fields[0].upper(), fields[1], int(weight)))
+    return mix
+
+
+class BenchmarkResult(NamedTuple):
+    """Latency percentiles, in seconds, and errors of one benchmark run."""
+
+    requests: int
+    errors: int
+    p50: float
+    p95: float
+    p99: float
+
+    @property
+    def error_rate(self) -> float:
+        """Share of requests without a successful response."""
+        return self.errors / self.requests if self.requests else 0.0
+
+    def summary(self) -> str:
+        """Describe the run in one line."""
+        latencies = ", ".join(
+            f"{name} {getattr(self, name) * 1000:.0f}ms" for name, _ in PERCENTILES
+        )
+        return f"{self.requests} requests, {latencies}, {self.error_rate:.1%} errors"
+
+
+def run_benchmark(
+    base_url: str,
+    mix: list[MixEntry],
+    total: int,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    headers: dict[str, str] | None = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+) -> BenchmarkResult:
+    """
+    Drive a request mix against a function and measure its latency.
+
+    ``concurrency`` workers send the requests back to back, cycling
+    through the mix in proportion to the weights. Requests without a
+    response or with a ``4xx``/``5xx`` status count as errors.
+
+    Args:
+        base_url: The function's HTTPS trigger URL
+        mix: The requests to send
+        total: Number of requests to send
+        concurrency: Requests in flight at once
+        headers: Extra request headers, e.g. an ``Authorization`` token
+        timeout: Seconds to wait for each response
+
+    Returns:
+        The latency percentiles and error count
+    """
+    weighted = [entry for entry in mix for _ in range(entry.weight)]
+    schedule = list(itertools.islice(itertools.cycle(weighted), total))
+    concurrency = max(1, min(concurrency, total))
+    session = http_session(concurrency)
+
+    def send(entry: MixEntry) -> tuple[float, bool]:
+        url = f"{base_url.rstrip('/')}/{entry.path.lstrip('/')}"
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                entry.method, url, headers=headers, timeout=timeout
+            )
+            failed = response.status_code >= 400
+        except requests.RequestException:
+            failed = True
+        return time.perf_counter() - start, failed
+
+    with session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(send, schedule))
+
+    latencies = [seconds for seconds, _ in samples]
+    return BenchmarkResult(
+        len(samples),
+        sum(failed for _, failed in samples),
+        *(percentile(latencies, fraction) for _, fraction in PERCENTILES),
+    )
+
+
+def regressions(
+    current: BenchmarkResult,
+    previous: BenchmarkResult | None,
+    threshold: float = DEFAULT_THRESHOLD,
+    max_error_rate: float = DEFAULT_MAX_ERROR_RATE,
+) -> list[str]:
+    """
+    Compare a run with the previous deploy's.
+
+    Args:
+        current: This deploy's run
+        previous: The previous deploy's run, if known
+        threshold: Allowed relative increase of each percentile
+        max_error_rate: Highest acceptable error rate, regardless of history
+
+    Returns:
+        A description of each regression found
+    """
+    problems = []
+    if current.error_rate > max_error_rate:
+        problems.append(
+            f"error rate {current.error_rate:.1%} is above {max_error_rate:.1%}"
+        )
+    if previous is None:
+        return problems
+    for name, _ in PERCENTILES:
+        before, after = getattr(previous, name), getattr(current, name)
+        if after - before > _NOISE_FLOOR and after > before * (1 + threshold):
+            change = f" ({after / before:.1f}x)" if before else ""
+            problems.append(
+                f"{name} rose from {before * 1000:.0f}ms to {after * 1000:.0f}ms"
+                f"{change}"
+            )
+    return problems
+
+
+def report_table(current: BenchmarkResult, previous: BenchmarkResult | None) -> str:
+    """Tabulate a run next to the previous one, in Markdown."""
+    rows = ["| | Previous deploy | This deploy |", "| --- | --- | --- |"]
+    for name, _ in PERCENTILES:
+        before = f"{getattr(previous, name) * 1000:.0f}ms" if previous else "-"
+        rows.append(f"| {name} | {before} | {getattr(current, name) * 1000:.0f}ms |")
+    before = f"{previous.error_rate:.1%}" if previous else "-"
+    rows.append(f"| error rate | {before} | {current.error_rate:.1%} |")
+    return "\n".join(rows)
+
+
+class BenchmarkHistory:
+    """The last accepted benchmark result of a function, in ``state_bucket``."""
+
+    def __init__(self, store: StateStore, function_path: str):
+        self.store = store
+        self.key = f"benchmarks/{function_path}.json"
+
+    def previous(self) -> BenchmarkResult | None:
+        """Return the stored result, if there is one."""
+        document, _ = self.store.read_json(self.key)
+        if not document:
+            return None
+        return BenchmarkResult(*(document[field] for field in BenchmarkResult._fields))
+
+    def save(self, result: BenchmarkResult) -> None:
+        """Store a result as the baseline for the next deploy."""
+        document: dict[str, Any] = {
+            **result._asdict(),
+            "recorded_at": datetime.now(UTC).isoformat(timespec="seconds"),
+            **buildkite.build_info(),
+        }
+        self.store.write_json(self.key, document)
@@ -0,0 +1,213 @@
+"""Remote build durations of a function, read from its deploy operations."""
+
+import re
+import statistics
+from datetime import UTC, datetime, timedelta
+from typing import Any, NamedTuple
+
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts import buildkite
+from plugin_scripts.state import StateStore
+
+DEFAULT_HISTORY = 50
+DEFAULT_OUTLIER_FACTOR = 2.0
+TREND_WINDOW = timedelta(days=7)
+# Fractions of a second beyond microseconds, which datetime cannot parse
+_NANOSECONDS = re.compile(r"(\.\d{6})\d+")
+
+
+def parse_timestamp(value: str | None) -> datetime | None:
+    """
+    Parse an RFC 3339 timestamp as returned by Google APIs.
+
+    Args:
+        value: e.g. ``2024-05-01T12:00:00.123456789Z``
+
+    Returns:
+        The timestamp in UTC, or None if missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(
+            _NANOSECONDS.sub(r"\1", value).replace("Z", "+00:00")
+        )
+    except ValueError:
+        return None
+    return parsed.astimezone(UTC) if parsed.tzinfo else parsed.replace(tzinfo=UTC)
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration as e.g. ``2m 05s`` or ``45s``."""
+    minutes, rest = divmod(round(seconds), 60)
+    return f"{minutes}m {rest:02d}s" if minutes else f"{rest}s"
+
+
+class BuildTiming(NamedTuple):
+    """How long GCP took to build and roll out one deploy."""
+
+    operation: str
+    build_id: str
+    started_at: str
+    finished_at: str
+    seconds: float
+    build_number: str = ""
+
+    @classmethod
+    def from_operation(
+        cls,
+        submitted: dict[str, Any],
+        finished: dict[str, Any],
+        observed_start: datetime,
+        observed_end: datetime,
+    ) -> "BuildTiming":
+        """
+        Time a deploy from its operation's metadata.
+
+        Cloud Functions v1 operations only carry an ``updateTime``, so the
+        build runs from the ``updateTime`` of the operation returned by the
+        patch to that of the finished operation. ``createTime`` and
+        ``endTime`` are preferred where the API provides them. The times
+        the plugin observed fill in anything missing.
+
+        Args:
+            submitted: The operation returned by the patch
+            finished: The same operation once done
+            observed_start: When the plugin started waiting
+            observed_end: When the plugin saw the operation finish
+
+        Returns:
+            The timing
+        """
+        before = submitted.get("metadata", {})
+        after = finished.get("metadata", {})
+        started = (
+            parse_timestamp(after.get("createTime"))
+            or parse_timestamp(before.get("updateTime"))
+            or observed_start
+        )
+        ended = (
+            parse_timestamp(after.get("endTime"))
+            or parse_timestamp(after.get("updateTime"))
+            or observed_end
+        )
+        build_id = after.get("buildId") or before.get("buildId") or ""
+        if not build_id and after.get("buildName"):
+            build_id = after["buildName"].rsplit("/", 1)[-1]
+        return cls(
+            finished.get("name") or submitted.get("name", ""),
+            build_id,
+            started.isoformat(timespec="seconds"),
+            ended.isoformat(timespec="seconds"),
+            max((ended - started).total_seconds(), 0.0),
+            buildkite.build_info().get("build_number", ""),
+        )
+
+
+class BuildTrend(NamedTuple):
+    """A build compared with the function's recent builds, in seconds."""
+
+    current: float
+    # Median of the builds in the last week, or of all earlier builds
+    baseline: float | None
+    # Median of the week before that, for the week over week trend
+    previous_week: float | None
+    outlier: bool
+
+    def summary(self) -> str:
+        """Describe the trend in one line."""
+        parts = [f"build took {format_duration(self.current)}"]
+        if self.baseline:
+            parts.append(
+                f"{self.current / self.baseline:.1f}x the recent median of "
+                f"{format_duration(self.baseline)}"
+            )
+        if self.baseline and self.previous_week:
+            change = self.baseline / self.previous_week
+            direction = "up" if change >= 1 else "down"
+            parts.append(
+                f"weekly median {direction} {max(change, 1 / change):.1f}x "
+                "since last week"
+            )
+        return ", ".join(parts)
+
+
+def build_trend(
+    current: BuildTiming,
+    history: list[BuildTiming],
+    outlier_factor: float = DEFAULT_OUTLIER_FACTOR,
+) -> BuildTrend:
+    """
+    Compare a build with the function's earlier builds.
+
+    Args:
+        current: The build just finished
+        history: Earlier builds, in any order
+        outlier_factor: A build this many times slower than the baseline
+            is an outlier
+
+    Returns:
+        The comparison
+    """
+    now = parse_timestamp(current.finished_at) or datetime.now(UTC)
+
+    def durations(newest: datetime, oldest: datetime) -> list[float]:
+        return [
+            timing.seconds
+            for timing in history
+            if (finished := parse_timestamp(timing.finished_at)) is not None
+            and oldest <= finished < newest
+        ]
+
+    last_week = durations(now, now - TREND_WINDOW)
+    week_before = durations(now - TREND_WINDOW, now - 2 * TREND_WINDOW)
+    recent = last_week or [timing.seconds for timing in history]
+    baseline = statistics.median(recent) if recent else None
+    return BuildTrend(
+        current.seconds,
+        baseline,
+        statistics.median(week_before) if week_before and last_week else None,
+        baseline is not None and 0 < baseline * outlier_factor <= current.seconds,
+    )
+
+
+class BuildTimeHistory:
+    """The recent build timings of a function, kept in ``state_bucket``."""
+
+    def __init__(self, store: StateStore, function_path: str, keep: int):
+        self.store = store
+        self.key = f"build-times/{function_path}.json"
+        self.keep = max(keep, 1)
+
+    def timings(self) -> list[BuildTiming]:
+        """Return the stored timings, newest first."""
+        document, _ = self.store.read_json(self.key)
+        return [BuildTiming(**entry) for entry in (document or {}).get("builds", [])]
+
+    def record(self, timing: BuildTiming) -> None:
+        """
+        Add a timing, dropping all but the newest ``keep``.
+
+        The document is updated with a generation precondition, so
+        concurrent deploys of the function keep each other's timings.
+        """
+        while True:
+            document, generation = self.store.read_json(self.key)
+            builds = [timing._asdict(), *(document or {}).get("builds", [])]
+            try:
+                self.store.write_json(
+                    self.key,
+                    {"builds": builds[: self.keep]},
+                    if_generation_match=generation,
+                )
+                return
+            except PreconditionFailed:
+                continue
+
+
+def report_markdown(function_path: str, timing: BuildTiming, trend: BuildTrend) -> str:
+    """Describe a build and its trend for a build annotation."""
+    heading = "Slow remote build" if trend.outlier else "Remote build"
+    build = f" (build `{timing.build_id}`)" if timing.build_id else ""
+    return f"**{heading} of `{function_path}`**{build}: {trend.summary()}\n"
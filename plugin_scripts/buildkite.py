@@ -0,0 +1,116 @@
+"""Thin wrapper around the ``buildkite-agent`` binary mounted by the hook."""
+
+import logging
+import os
+import shutil
+import subprocess  # noqa: S404 - invoking the mounted buildkite-agent
+
+_logger = logging.getLogger("cloud-function")
+
+AGENT_BINARY = "buildkite-agent"
+
+# Build meta-data recorded with releases and benchmark results
+_BUILD_VARIABLES = {
+    "build_number": "BUILDKITE_BUILD_NUMBER",
+    "commit": "BUILDKITE_COMMIT",
+    "pipeline": "BUILDKITE_PIPELINE_SLUG",
+}
+
+
+def agent_path() -> str | None:
+    """
+    Locate a usable ``buildkite-agent``.
+
+    Returns:
+        The binary path, or None outside a Buildkite job
+    """
+    if not os.environ.get("BUILDKITE_AGENT_ACCESS_TOKEN"):
+        return None
+    return shutil.which(AGENT_BINARY)
+
+
+def build_info() -> dict[str, str]:
+    """
+    Identify the Buildkite build running this step.
+
+    Returns:
+        The build number, commit and pipeline slug that are set
+    """
+    return {
+        field: os.environ[variable]
+        for field, variable in _BUILD_VARIABLES.items()
+        if os.environ.get(variable)
+    }
+
+
+def _run(*args: str, stdin: str | None = None) -> str:
+    agent = agent_path()
+    if agent is None:
+        raise RuntimeError("buildkite-agent is not available")
+
+    _logger.debug(f"Running buildkite-agent {' '.join(args[:2])}")
+    result = subprocess.run(  # noqa: S603 - fixed binary, no shell
+        [agent, *args],
+        input=stdin,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def meta_data_get(key: str) -> str:
+    """
+    Read a build meta-data value.
+
+    Args:
+        key: Meta-data key
+
+    Returns:
+        The stored value, or an empty string if it was never set
+    """
+    return _run("meta-data", "get", key, "--default", "")
+
+
+def meta_data_set(key: str, value: str) -> None:
+    """
+    Store a build meta-data value, passing it on stdin to avoid size limits.
+
+    Args:
+        key: Meta-data key
+        value: Value to store
+    """
+    _run("meta-data", "set", key, stdin=value)
+
+
+def artifact_upload(*paths: str) -> None:
+    """
+    Upload files as artifacts of the current job.
+
+    Args:
+        paths: Paths relative to the working directory
+    """
+    _run("artifact", "upload", ";".join(paths))
+
+
+def annotate(body: str, style: str = "info", context: str = "cloud-functions") -> None:
+    """
+    Add or replace an annotation on the build page.
+
+    Args:
+        body: Markdown body, passed on stdin
+        style: One of ``success``, ``info``, ``warning`` or ``error``
+        context: Annotations with the same context replace each other
+    """
+    _run("annotate", "--style", style, "--context", context, stdin=body)
+
+
+def artifact_download(path: str, destination: str = ".") -> None:
+    """
+    Download an artifact uploaded earlier in the build.
+
+    Args:
+        path: Artifact path, as it was uploaded
+        destination: Directory to download into, keeping the artifact path
+    """
+    _run("artifact", "download", path, destination)
@@ -0,0 +1,197 @@
+"""Precompiled bytecode for the Python runtime a function runs on."""
+
+import importlib.util
+import json
+import logging
+import marshal
+import re
+import shutil
+import subprocess  # noqa: S404 - running the runtime's interpreter
+import sys
+from collections.abc import Sequence
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+
+_logger = logging.getLogger("cloud-function")
+
+# A source file on disk, or source code already in memory
+Source = Path | bytes
+
+_RUNTIME = re.compile(r"^python(\d)(\d+)$")
+
+# Hash based pycs that are never checked against their source (PEP 552)
+_UNCHECKED_HASH_FLAGS = 0b01
+
+_COMPILE_SCRIPT = """
+import json, py_compile, sys
+mode = py_compile.PycInvalidationMode.UNCHECKED_HASH
+for source, cfile, dfile in json.load(sys.stdin):
+    try:
+        py_compile.compile(
+            source, cfile=cfile, dfile=dfile, doraise=True, invalidation_mode=mode
+        )
+    except py_compile.PyCompileError as e:
+        print(e.msg, file=sys.stderr)
+"""
+
+
+def runtime_version(runtime: str) -> tuple[int, int] | None:
+    """
+    Read the Python version of a Cloud Functions runtime.
+
+    Args:
+        runtime: Runtime identifier, e.g. ``python312``
+
+    Returns:
+        The major and minor version, or None for other languages
+    """
+    match = _RUNTIME.match(runtime)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def pyc_name(arcname: str, cache_tag: str) -> str:
+    """
+    Name the bytecode file the interpreter looks up for a source file.
+
+    Args:
+        arcname: Archive path of the ``.py`` file
+        cache_tag: Interpreter cache tag, e.g. ``cpython-312``
+
+    Returns:
+        Archive path of the ``__pycache__`` entry
+    """
+    source = PurePosixPath(arcname)
+    return str(source.parent / "__pycache__" / f"{source.stem}.{cache_tag}.pyc")
+
+
+def compile_unchecked(source: bytes, filename: str) -> bytes:
+    """
+    Compile source into an unchecked hash based pyc with this interpreter.
+
+    Args:
+        source: Python source code
+        filename: File name recorded in code objects and tracebacks
+
+    Returns:
+        The pyc file contents
+
+    Raises:
+        SyntaxError: If the source does not compile
+    """
+    code = compile(source, filename, "exec", dont_inherit=True)
+    return (
+        importlib.util.MAGIC_NUMBER
+        + _UNCHECKED_HASH_FLAGS.to_bytes(4, "little")
+        + importlib.util.source_hash(source)
+        + marshal.dumps(code)
+    )
+
+
+class BytecodeCompiler:
+    """
+    Compile sources for one Python version.
+
+    Sources are compiled in process when the runtime matches this
+    interpreter, otherwise by the matching ``pythonX.Y`` found on ``PATH``.
+    The pycs use unchecked hash invalidation, so the runtime loads them
+    without comparing them to the source files' timestamps or contents.
+    """
+
+    def __init__(self, version: tuple[int, int], interpreter: str | None = None):
+        self.version = version
+        self.interpreter = interpreter
+
+    @classmethod
+    def for_runtime(cls, runtime: str) -> "BytecodeCompiler | None":
+        """
+        Find a compiler for a Cloud Functions runtime.
+
+        Args:
+            runtime: Runtime identifier, e.g. ``python312``
+
+        Returns:
+            The compiler, or None when the runtime is not Python or no
+            matching interpreter is available
+        """
+        version = runtime_version(runtime)
+        if version is None:
+            return None
+        if version == sys.version_info[:2]:
+            return cls(version)
+
+        interpreter = shutil.which(f"python{version[0]}.{version[1]}")
+        if interpreter is None:
+            _logger.warning(
+                f"No Python {version[0]}.{version[1]} interpreter found, "
+                f"skipping bytecode for {runtime}"
+            )
+            return None
+        return cls(version, interpreter)
+
+    @property
+    def cache_tag(self) -> str:
+        """The ``__pycache__`` tag of the target interpreter."""
+        return f"cpython-{self.version[0]}{self.version[1]}"
+
+    def _compile_externally(
+        self, sources: Sequence[tuple[Source, str]]
+    ) -> dict[str, bytes]:
+        compiled: dict[str, bytes] = {}
+        with TemporaryDirectory() as tmp:
+            jobs = []
+            for index, (source, arcname) in enumerate(sources):
+                if isinstance(source, bytes):
+                    path = Path(tmp, f"{index}.py")
+                    path.write_bytes(source)
+                    source = path
+                jobs.append((str(source), str(Path(tmp, f"{index}.pyc")), arcname))
+            try:
+                result = subprocess.run(  # noqa: S603 - interpreter found on PATH
+                    [str(self.interpreter), "-c", _COMPILE_SCRIPT],
+                    input=json.dumps(jobs),
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+            except (OSError, subprocess.CalledProcessError) as e:
+                _logger.warning(f"{self.interpreter} failed to compile bytecode: {e}")
+                return compiled
+            for line in result.stderr.splitlines():
+                _logger.warning(f"Could not compile bytecode: {line}")
+            for _, cfile, arcname in jobs:
+                if Path(cfile).is_file():
+                    compiled[arcname] = Path(cfile).read_bytes()
+        return compiled
+
+    def compile(self, sources: Sequence[tuple[Source, str]]) -> dict[str, bytes]:
+        """
+        Compile source files for the archive.
+
+        Files that do not compile are skipped with a warning.
+
+        Args:
+            sources: Source file paths or contents, and their archive paths
+
+        Returns:
+            pyc contents by archive path of the ``__pycache__`` entry
+        """
+        if self.interpreter is not None:
+            compiled = self._compile_externally(sources)
+        else:
+            compiled = {}
+            for source, arcname in sources:
+                if isinstance(source, Path):
+                    source = source.read_bytes()
+                try:
+                    compiled[arcname] = compile_unchecked(source, arcname)
+                except SyntaxError as e:
+                    _logger.warning(f"Could not compile bytecode: {arcname}: {e}")
+
+        _logger.info(
+            f"Compiled {len(compiled)} of {len(sources)} files for {self.cache_tag}"
+        )
+        return {
+            pyc_name(arcname, self.cache_tag): pyc for arcname, pyc in compiled.items()
+        }
@@ -0,0 +1,23 @@
+"""Cache directory that outlives the container, mounted by the hook."""
+
+from pathlib import Path
+
+from plugin_scripts.config import env_str
+
+
+def cache_path(*parts: str) -> Path | None:
+    """
+    Locate a directory inside the ``cache_dir`` mount, creating it if needed.
+
+    Args:
+        parts: Path components below the cache root
+
+    Returns:
+        The directory, or None when no cache is configured
+    """
+    root = env_str("cache_dir")
+    if not root:
+        return None
+    path = Path(root, *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,143 @@
+"""Deploy checkpoints that let a retried Buildkite job resume where it failed."""
+
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any
+
+from plugin_scripts import buildkite
+from plugin_scripts.config import env_bool, env_str
+from plugin_scripts.scanner import scan_tree
+
+_logger = logging.getLogger("cloud-function")
+
+# Phases in the order a deploy completes them
+PHASE_UPLOADED = "uploaded"
+PHASE_PATCHED = "patched"
+PHASE_DEPLOYED = "deployed"
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Signed upload URLs let anyone holding them replace the sources, so they are
+# only kept in checkpoint_file, never in build meta-data
+_LOCAL_ONLY = frozenset({"upload_url"})
+
+# Targets deployed concurrently share one checkpoint file
+_FILE_LOCK = threading.Lock()
+
+
+def source_digest(directory: Path) -> str:
+    """
+    Hash the function sources, independent of file timestamps.
+
+    Args:
+        directory: The cloud function directory
+
+    Returns:
+        Hex SHA-256 over every file's relative path and contents
+    """
+    digest = hashlib.sha256()
+    for entry in scan_tree(directory):
+        digest.update(entry.relative.as_posix().encode())
+        digest.update(b"\0")
+        with entry.path.open("rb") as f:
+            while chunk := f.read(_CHUNK_SIZE):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Persist the progress of one function's deploy.
+
+    Checkpoints live in build meta-data, which survives job retries, or in a
+    local JSON file when ``checkpoint_file`` is configured. Signed upload
+    URLs are left out of build meta-data, so there only archive uploads can
+    be resumed.
+    """
+
+    def __init__(self, key: str, path: Path | None = None):
+        self.key = key
+        self.path = path
+
+    @classmethod
+    def from_env(cls, function_path: str) -> "CheckpointStore | None":
+        """
+        Build a store when ``resume_on_retry`` is enabled.
+
+        Args:
+            function_path: Fully qualified function name
+
+        Returns:
+            The store, or None when resuming is disabled or has nowhere to
+            keep its state
+        """
+        if not env_bool("resume_on_retry"):
+            return None
+
+        key = f"cloud-functions-checkpoint:{function_path}"
+        checkpoint_file = env_str("checkpoint_file")
+        if checkpoint_file:
+            return cls(key, Path(checkpoint_file))
+        if buildkite.agent_path() is not None:
+            return cls(key)
+
+        _logger.warning(
+            "resume_on_retry is enabled but neither buildkite-agent nor "
+            "checkpoint_file is available, checkpoints are disabled"
+        )
+        return None
+
+    @staticmethod
+    def _read_file(path: Path) -> dict[str, Any]:
+        if not path.is_file():
+            return {}
+        return json.loads(path.read_text())
+
+    def load(self) -> dict[str, Any] | None:
+        """
+        Read the stored checkpoint.
+
+        Returns:
+            The checkpoint, or None if there is none or it cannot be read
+        """
+        try:
+            if self.path is not None:
+                with _FILE_LOCK:
+                    checkpoint = self._read_file(self.path).get(self.key)
+            else:
+                value = buildkite.meta_data_get(self.key)
+                checkpoint = json.loads(value) if value else None
+        except Exception as e:
+            _logger.warning(f"Could not read deploy checkpoint: {e}")
+            return None
+        return checkpoint or None
+
+    def save(self, checkpoint: dict[str, Any]) -> None:
+        """
+        Store a checkpoint. Failures are logged, never raised.
+
+        Args:
+            checkpoint: The checkpoint to store, or an empty dict to clear it
+        """
+        try:
+            if self.path is not None:
+                with _FILE_LOCK:
+                    checkpoints = self._read_file(self.path)
+                    checkpoints[self.key] = checkpoint
+                    self.path.write_text(json.dumps(checkpoints, sort_keys=True))
+            else:
+                shared = {k: v for k, v in checkpoint.items() if k not in _LOCAL_ONLY}
+                buildkite.meta_data_set(self.key, json.dumps(shared))
+        except Exception as e:
+            _logger.warning(f"Could not save deploy checkpoint: {e}")
+            return
+        if checkpoint:
+            _logger.info(f"Saved deploy checkpoint: {checkpoint['phase']}")
+
+    def clear(self) -> None:
+        """Forget the stored checkpoint."""
+        self.save({})
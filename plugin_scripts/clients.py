@@ -0,0 +1,89 @@
+"""Credentials and API clients kept warm between deploys by the daemon."""
+
+import json
+import threading
+from collections.abc import Callable, Hashable
+from typing import Any
+
+from googleapiclient import discovery_cache
+
+_lock = threading.Lock()
+# None unless the process serves several deploys
+_cache: dict[Hashable, Any] | None = None
+
+
+def keep_warm() -> None:
+    """Reuse credentials and clients across deploys in this process."""
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = {}
+
+
+def clear() -> None:
+    """Stop reusing credentials and clients, dropping the cached ones."""
+    global _cache
+    with _lock:
+        _cache = None
+
+
+def cached(key: Hashable, build: Callable[[], Any]) -> Any:
+    """
+    Build a value once per process when kept warm, every time otherwise.
+
+    Args:
+        key: Identifies the value, e.g. ``("credentials", <json>)``
+        build: Builds the value
+
+    Returns:
+        The cached or freshly built value
+    """
+    with _lock:
+        cache = _cache
+        if cache is not None and key in cache:
+            return cache[key]
+    value = build()
+    if cache is not None:
+        with _lock:
+            value = cache.setdefault(key, value)
+    return value
+
+
+def client_for(credentials: Any, factory: Callable[..., Any]) -> Any:
+    """
+    Return an API client for the credentials, e.g. a ``storage.Client``.
+
+    When kept warm the client, and its connection pool, are shared by every
+    deploy using the same cached credentials object. The cache holds on to
+    the credentials, so their ``id`` cannot be reused by another object.
+
+    Args:
+        credentials: Credentials for the client
+        factory: Builds the client from ``credentials=``
+
+    Returns:
+        The client
+    """
+    _, client = cached(
+        ("client", factory, id(credentials)),
+        lambda: (credentials, factory(credentials=credentials)),
+    )
+    return client
+
+
+def discovery_document(api: str, version: str) -> dict[str, Any] | None:
+    """
+    Return the parsed discovery document of an API when kept warm.
+
+    Returns:
+        The document, or None when not kept warm or not bundled with the
+        API client library
+    """
+    if _cache is None:
+        return None
+
+    def load() -> dict[str, Any] | None:
+        document = discovery_cache.get_static_doc(api, version)
+        return json.loads(document) if document else None
+
+    return cached(("discovery", api, version), load)
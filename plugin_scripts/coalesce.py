@@ -0,0 +1,165 @@
+"""Per-function deploy lock with "latest build wins" coalescing."""
+
+import logging
+import socket
+import time
+from collections.abc import Callable
+
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts.state import StateStore
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_LEASE_SECONDS = 1800
+DEFAULT_POLL_INTERVAL = 15.0
+
+
+class DeployCoalescer:
+    """
+    Serialise deploys of one function and skip deploys that are superseded.
+
+    Two documents in the state store coordinate concurrent pipelines:
+
+    - ``intents/<function>/<pipeline>.json`` records the newest build number
+      that wants to deploy the function. It only ever moves forward, updated
+      with a generation precondition so concurrent writers cannot regress it.
+    - ``locks/<function>.json`` is the lock, created with the "object must
+      not exist" precondition and deleted with the holder's generation. A
+      lock whose lease has expired may be taken over.
+
+    A deploy that finds a newer build registered, before or while waiting for
+    the lock, skips itself because the newer build will ship its changes.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        function_path: str,
+        pipeline: str,
+        build_number: int | None,
+        owner: str,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.store = store
+        self.function_path = function_path
+        self.pipeline = pipeline
+        self.build_number = build_number
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._sleep = sleep
+        self._lock_generation: int | None = None
+
+    @property
+    def lock_key(self) -> str:
+        """State store key of the function's lock document."""
+        return f"locks/{self.function_path}.json"
+
+    @property
+    def intent_key(self) -> str:
+        """State store key of the pipeline's newest-build document."""
+        return f"intents/{self.function_path}/{self.pipeline}.json"
+
+    def latest_build(self) -> int | None:
+        """Return the newest build number registered for this pipeline."""
+        intent, _ = self.store.read_json(self.intent_key)
+        return intent["build_number"] if intent else None
+
+    def superseded_by(self) -> int | None:
+        """
+        Check whether a newer build of the pipeline wants to deploy.
+
+        Returns:
+            The newer build number, or None if this build is the newest
+        """
+        if self.build_number is None:
+            return None
+        latest = self.latest_build()
+        if latest is not None and latest > self.build_number:
+            return latest
+        return None
+
+    def register(self) -> None:
+        """Record this build as the newest one, unless a newer one exists."""
+        if self.build_number is None:
+            return
+
+        while True:
+            intent, generation = self.store.read_json(self.intent_key)
+            if intent and intent["build_number"] >= self.build_number:
+                return
+            try:
+                self.store.write_json(
+                    self.intent_key,
+                    {"build_number": self.build_number, "owner": self.owner},
+                    if_generation_match=generation,
+                )
+                return
+            except PreconditionFailed:
+                # Another build registered concurrently, re-read and compare
+                continue
+
+    def _try_lock(self) -> bool:
+        now = self._clock()
+        document = {"owner": self.owner, "expires_at": now + self.lease_seconds}
+
+        lock, generation = self.store.read_json(self.lock_key)
+        if lock is not None and lock["expires_at"] > now:
+            _logger.info(
+                f"Deploy of {self.function_path} is locked by {lock['owner']}, "
+                f"waiting {self.poll_interval:.0f}s"
+            )
+            return False
+        if lock is not None:
+            _logger.warning(f"Taking over expired deploy lock from {lock['owner']}")
+
+        try:
+            self._lock_generation = self.store.write_json(
+                self.lock_key, document, if_generation_match=generation
+            )
+        except PreconditionFailed:
+            return False
+        return True
+
+    def acquire(self) -> bool:
+        """
+        Wait for the function's deploy lock.
+
+        Returns:
+            True once the lock is held, or False if a newer build superseded
+            this one while waiting (the lock is not held in that case)
+        """
+        self.register()
+        while True:
+            newer = self.superseded_by()
+            if newer is not None:
+                _logger.info(
+                    f"Skipping deploy of build {self.build_number}: "
+                    f"superseded by build {newer}"
+                )
+                return False
+            if self._try_lock():
+                _logger.info(f"Acquired deploy lock for {self.function_path}")
+                return True
+            self._sleep(self.poll_interval)
+
+    def release(self) -> None:
+        """Release the lock if this deploy still holds it."""
+        if self._lock_generation is None:
+            return
+        try:
+            self.store.delete(self.lock_key, if_generation_match=self._lock_generation)
+            _logger.info(f"Released deploy lock for {self.function_path}")
+        except PreconditionFailed:
+            _logger.warning("Deploy lock was taken over before it was released")
+        self._lock_generation = None
+
+
+def default_owner() -> str:
+    """Identify this deploy in lock documents."""
+    return f"{socket.gethostname()}:{time.time_ns()}"
@@ -0,0 +1,127 @@
+"""Archive size budget and a report of what takes up the space."""
+
+import zipfile
+from collections import Counter
+from pathlib import PurePosixPath
+
+from plugin_scripts.config import env_bool, env_int
+from plugin_scripts.pipeline_exceptions import ArchiveTooLarge
+
+# Largest archive the Cloud Functions upload URL accepts
+MAX_ARCHIVE_SIZE = 104857600
+
+# Zip structures around each member's data
+_LOCAL_HEADER_SIZE = 30
+_DATA_DESCRIPTOR_SIZE = 16
+_CENTRAL_HEADER_SIZE = 46
+_END_RECORD_SIZE = 22
+
+# Smaller files compress badly regardless of their contents
+_RATIO_MIN_SIZE = 4096
+
+
+def format_size(size: float) -> str:
+    """Format a byte count for people, e.g. ``1.5 MiB``."""
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class ArchiveComposition:
+    """
+    Running account of an archive's size while it is being written.
+
+    Every member is recorded as soon as it is written, so a budget is
+    enforced before the rest of the sources are compressed. The size
+    includes the zip headers and the central directory written on close.
+    """
+
+    def __init__(self, budget: int = MAX_ARCHIVE_SIZE, log_report: bool = False):
+        self.budget = budget
+        self.log_report = log_report
+        self.size = _END_RECORD_SIZE
+        self.uncompressed_size = 0
+        self.files: list[tuple[str, int, int]] = []
+        self.directories: Counter[str] = Counter()
+
+    @classmethod
+    def from_env(cls) -> "ArchiveComposition":
+        """Build from the ``archive_size_budget`` and ``archive_report`` settings."""
+        return cls(
+            budget=env_int("archive_size_budget", MAX_ARCHIVE_SIZE),
+            log_report=env_bool("archive_report"),
+        )
+
+    def add(self, info: zipfile.ZipInfo) -> None:
+        """
+        Record a member written to the archive.
+
+        Args:
+            info: The member, after its data was written
+
+        Raises:
+            ArchiveTooLarge: If the archive has outgrown the budget
+        """
+        name_size = len(info.filename.encode()) + len(info.extra)
+        self.size += _LOCAL_HEADER_SIZE + name_size + info.compress_size
+        self.size += _CENTRAL_HEADER_SIZE + name_size + len(info.comment)
+        if info.flag_bits & 0x08:
+            self.size += _DATA_DESCRIPTOR_SIZE
+        self.uncompressed_size += info.file_size
+        self.files.append((info.filename, info.file_size, info.compress_size))
+        for parent in PurePosixPath(info.filename).parents:
+            if parent.name:
+                self.directories[parent.as_posix()] += info.compress_size
+
+        if self.budget and self.size > self.budget:
+            raise ArchiveTooLarge(self.size, self.budget, self.report())
+
+    def report(self, top: int = 10) -> str:
+        """
+        Describe where the archive's size comes from.
+
+        Args:
+            top: Number of entries listed per section
+
+        Returns:
+            The largest directories and files, by compressed size, and the
+            files that compress worst
+        """
+        lines = [
+            f"Archive composition: {format_size(self.size)} compressed, "
+            f"{format_size(self.uncompressed_size)} uncompressed, "
+            f"{len(self.files)} files"
+        ]
+
+        if self.directories:
+            lines.append("Largest directories:")
+            lines += [
+                f"  {format_size(size):>10}  {name}/"
+                for name, size in self.directories.most_common(top)
+            ]
+
+        largest = sorted(self.files, key=lambda f: (-f[2], f[0]))[:top]
+        if largest:
+            lines.append("Largest files:")
+            lines += [
+                f"  {format_size(compressed):>10}  {name}"
+                for name, _, compressed in largest
+            ]
+
+        ratios = sorted(
+            (
+                (compressed / size, compressed, name, size)
+                for name, size, compressed in self.files
+                if size >= _RATIO_MIN_SIZE
+            ),
+            reverse=True,
+        )[:top]
+        if ratios:
+            lines.append("Worst compression ratios (compressed / original):")
+            lines += [
+                f"  {ratio:>9.0%}  {name} ({format_size(size)})"
+                for ratio, _, name, size in ratios
+            ]
+        return "\n".join(lines)
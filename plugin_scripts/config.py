@@ -0,0 +1,110 @@
+"""Helpers for reading optional plugin settings from the environment."""
+
+import os
+
+_TRUE_VALUES = {"true", "on", "1", "yes"}
+_FALSE_VALUES = {"false", "off", "0", "no", ""}
+
+
+def env_str(name: str, default: str = "") -> str:
+    """
+    Read a string setting, stripping surrounding whitespace.
+
+    Args:
+        name: Environment variable name
+        default: Value to use when the variable is unset
+
+    Returns:
+        The configured value or the default
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip()
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """
+    Read a boolean setting using the same spelling the hook accepts.
+
+    Args:
+        name: Environment variable name
+        default: Value to use when the variable is unset
+
+    Returns:
+        The parsed boolean
+
+    Raises:
+        ValueError: If the value is not a recognised boolean
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+
+    normalized = value.strip().lower()
+    if normalized in _TRUE_VALUES:
+        return True
+    if normalized in _FALSE_VALUES:
+        return False
+    raise ValueError(f"Invalid boolean for `{name}`: {value!r}")
+
+
+def env_int(name: str, default: int) -> int:
+    """
+    Read an integer setting.
+
+    Args:
+        name: Environment variable name
+        default: Value to use when the variable is unset or empty
+
+    Returns:
+        The parsed integer
+
+    Raises:
+        ValueError: If the value is not an integer
+    """
+    value = env_str(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid integer for `{name}`: {value!r}") from e
+
+
+def env_float(name: str, default: float) -> float:
+    """
+    Read a floating point setting.
+
+    Args:
+        name: Environment variable name
+        default: Value to use when the variable is unset or empty
+
+    Returns:
+        The parsed float
+
+    Raises:
+        ValueError: If the value is not a number
+    """
+    value = env_str(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid number for `{name}`: {value!r}") from e
+
+
+def env_list(name: str) -> list[str]:
+    """
+    Read a list setting separated by commas or newlines.
+
+    Args:
+        name: Environment variable name
+
+    Returns:
+        The non-empty entries, in order
+    """
+    value = env_str(name)
+    entries = value.replace("\n", ",").split(",")
+    return [entry.strip() for entry in entries if entry.strip()]
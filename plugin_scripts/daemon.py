@@ -0,0 +1,169 @@
+"""
+Long running deploy daemon for an agent host.
+
+A deploy in a fresh container pays for the interpreter start, the
+imports, parsing the service account and building the API clients
+before it does any work. The daemon keeps all of that warm and runs the
+deploys ``hooks/command`` submits through ``daemon_client.py`` over a
+Unix socket.
+
+Deploys are configured through ``os.environ``, so the daemon runs one
+job at a time, in the job's environment and checkout, and streams the
+deploy log back to the client.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socketserver
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from plugin_scripts import clients, deploy
+from plugin_scripts.daemon_client import PROTOCOL_VERSION
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_SOCKET = "/tmp/cloud-functions-deploy.sock"  # noqa: S108 - created 0600
+
+
+class _ForwardingHandler(logging.Handler):
+    """Sends the deploy log of a job to its client."""
+
+    def __init__(self, send: Any):
+        super().__init__()
+        self._send = send
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._send({"log": self.format(record)})
+        except OSError:
+            # The client went away; the deploy still runs to completion
+            pass
+
+
+@contextlib.contextmanager
+def _job_context(env: dict[str, str], cwd: str) -> Iterator[None]:
+    """
+    Run in the environment and checkout of a job, restoring the daemon's.
+
+    Args:
+        env: The job's environment variables, on top of the daemon's
+        cwd: The job's checkout
+    """
+    saved_env = dict(os.environ)
+    saved_cwd = Path.cwd()
+    saved_level = _logger.level
+    os.environ.update(env)
+    try:
+        os.chdir(cwd)
+        yield
+    finally:
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+        _logger.setLevel(saved_level)
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    """Runs the deploy job sent over one connection."""
+
+    server: "DeployDaemon"
+
+    def _send(self, message: dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("version") != PROTOCOL_VERSION:
+                raise ValueError(
+                    f"unsupported protocol version {request.get('version')}"
+                )
+            env = {str(name): str(value) for name, value in request["env"].items()}
+            cwd = str(request["cwd"])
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send({"exit": 2, "error": f"Invalid deploy job: {e}"})
+            return
+        code, error = self.server.run_job(env, cwd, _ForwardingHandler(self._send))
+        with contextlib.suppress(OSError):
+            self._send({"exit": code, "error": error})
+
+
+class DeployDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server running deploy jobs one at a time.
+
+    Connections are accepted concurrently so waiting clients are not
+    refused, but jobs queue on a lock.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self._job_lock = threading.Lock()
+        with contextlib.suppress(FileNotFoundError):
+            # A socket left behind by a daemon that did not shut down cleanly
+            Path(socket_path).unlink()
+        # Only the agent's user may submit deploys
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _JobHandler)
+        finally:
+            os.umask(umask)
+        clients.keep_warm()
+
+    def run_job(
+        self, env: dict[str, str], cwd: str, handler: logging.Handler
+    ) -> tuple[int, str | None]:
+        """
+        Run one deploy.
+
+        Args:
+            env: The job's environment variables
+            cwd: The job's checkout
+            handler: Receives the job's deploy log
+
+        Returns:
+            The exit status and the error that failed the deploy, if any
+        """
+        with self._job_lock:
+            _logger.addHandler(handler)
+            try:
+                with _job_context(env, cwd):
+                    deploy.main()
+            except Exception as e:
+                _logger.error(f"Deploy failed: {e}")
+                return 1, str(e)
+            finally:
+                _logger.removeHandler(handler)
+        return 0, None
+
+    def server_close(self) -> None:
+        """Close the socket and remove it from the filesystem."""
+        super().server_close()
+        with contextlib.suppress(FileNotFoundError):
+            Path(self.socket_path).unlink()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Serve deploy jobs until interrupted."""
+    parser = argparse.ArgumentParser(description="Run cloud function deploys")
+    parser.add_argument(
+        "--socket", default=DEFAULT_SOCKET, help="Unix socket to listen on"
+    )
+    arguments = parser.parse_args(argv)
+    with DeployDaemon(arguments.socket) as server:
+        _logger.info(f"Deploy daemon listening on {arguments.socket}")
+        with contextlib.suppress(KeyboardInterrupt):
+            server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Thin client submitting a deploy to the deploy daemon.
+
+``hooks/command`` runs it with the agent's ``python3`` by path, so it
+only uses the standard library and imports nothing from
+``plugin_scripts``. It reads the ``docker create`` arguments the hook
+assembled, NUL separated on stdin so the credentials never show up in
+the process list, and forwards their ``--env`` settings as the job.
+"""
+
+import json
+import os
+import socket
+import sys
+from collections.abc import Iterable
+from pathlib import Path
+from typing import TextIO
+
+PROTOCOL_VERSION = 1
+
+
+def job_environment(args: Iterable[str]) -> dict[str, str]:
+    """
+    Collect the ``--env`` settings of ``docker create`` arguments.
+
+    Args:
+        args: The arguments; ``--env NAME`` takes the value from this
+            process' environment, like docker does
+
+    Returns:
+        The job's environment variables
+    """
+    env = {}
+    args = iter(args)
+    for arg in args:
+        if arg != "--env":
+            continue
+        name, separator, value = next(args, "").partition("=")
+        if separator:
+            env[name] = value
+        elif name in os.environ:
+            env[name] = os.environ[name]
+    return env
+
+
+def submit(
+    socket_path: str, env: dict[str, str], cwd: str, out: TextIO = sys.stdout
+) -> int:
+    """
+    Run a deploy in the daemon, streaming its log.
+
+    Args:
+        socket_path: The daemon's Unix socket
+        env: The job's environment variables
+        cwd: The checkout the job runs in
+        out: Where the job's log is written
+
+    Returns:
+        The job's exit status
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        request = {"version": PROTOCOL_VERSION, "env": env, "cwd": cwd}
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        with connection.makefile("r", encoding="utf-8") as replies:
+            for line in replies:
+                reply = json.loads(line)
+                if "log" in reply:
+                    out.write(reply["log"] + "\n")
+                    out.flush()
+                if "exit" in reply:
+                    return int(reply["exit"])
+    out.write("The deploy daemon closed the connection before the job ended\n")
+    return 1
+
+
+def main(argv: list[str] | None = None, stdin: TextIO = sys.stdin) -> int:
+    """
+    Submit the job described on stdin to the daemon listening on ``argv[0]``.
+
+    Returns:
+        The job's exit status
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.stderr.write("usage: daemon_client.py SOCKET < docker-create-args\n")
+        return 2
+    args = [arg for arg in stdin.read().split("\0") if arg]
+    try:
+        return submit(argv[0], job_environment(args), str(Path.cwd()))
+    except OSError as e:
+        sys.stderr.write(f"Could not reach the deploy daemon at {argv[0]}: {e}\n")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
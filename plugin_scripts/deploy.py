@@ -1,41 +1,149 @@
 import ast
+import contextvars
+import io
 import json
 import logging
 import os
+import sys
+import threading
+import time
 import zipfile
-from pathlib import Path
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing, contextmanager
+from datetime import UTC, datetime
+from functools import partial
+from pathlib import Path, PurePosixPath
 from pprint import pformat
-from tempfile import TemporaryFile
-from typing import Any
+from tempfile import TemporaryDirectory
+from typing import Any, BinaryIO, cast
 from urllib.parse import urlparse
 
+import google.auth.transport.requests
 import requests
 from google.cloud import storage
 from google.oauth2 import service_account
 from googleapiclient import discovery
 from requests import Response
 
+from plugin_scripts import benchmark, buildkite, clients, tracing
+from plugin_scripts.bandwidth import shaped
+from plugin_scripts.build_times import (
+    DEFAULT_HISTORY,
+    DEFAULT_OUTLIER_FACTOR,
+    BuildTimeHistory,
+    BuildTiming,
+    build_trend,
+    report_markdown,
+)
+from plugin_scripts.bytecode import BytecodeCompiler, runtime_version
+from plugin_scripts.cache import cache_path
+from plugin_scripts.checkpoint import (
+    PHASE_DEPLOYED,
+    PHASE_PATCHED,
+    PHASE_UPLOADED,
+    CheckpointStore,
+    source_digest,
+)
+from plugin_scripts.coalesce import (
+    DEFAULT_LEASE_SECONDS,
+    DeployCoalescer,
+    default_owner,
+)
+from plugin_scripts.composition import (
+    MAX_ARCHIVE_SIZE,
+    ArchiveComposition,
+    format_size,
+)
+from plugin_scripts.config import env_bool, env_float, env_int, env_list, env_str
+from plugin_scripts.function_config import (
+    config_changes,
+    desired_config,
+    field_mask,
+)
+from plugin_scripts.includes import (
+    FragmentCache,
+    SharedInclude,
+    SharedIncludes,
+    includes_digest,
+)
+from plugin_scripts.inventory import FunctionInventory
+from plugin_scripts.operations import DEFAULT_OPERATION_TIMEOUT, wait_for_operation
+from plugin_scripts.packaging import (
+    archive_digest,
+    build_manifest,
+    manifest_path,
+    read_manifest,
+    write_manifest,
+)
 from plugin_scripts.pipeline_exceptions import (
+    ArchiveTooLarge,
+    BenchmarkRegression,
     CloudFunctionDirectoryNonExistent,
     DeployFailed,
     MissingConfigError,
+    SourceValidationFailed,
 )
+from plugin_scripts.preflight import REQUIREMENTS_FILE, validate_sources
+from plugin_scripts.profiles import (
+    PROFILE_NONE,
+    PROFILES,
+    PackagingProfile,
+    select_profile,
+)
+from plugin_scripts.profiling import DeployProfile
+from plugin_scripts.releases import ReleaseStore
+from plugin_scripts.resolve import DependencyResolver
+from plugin_scripts.retry import error_status, source_gone
+from plugin_scripts.scanner import scan_tree
+from plugin_scripts.scheduler import RequestScheduler
+from plugin_scripts.spool import ArchiveSpool, SharedReader
+from plugin_scripts.staging import StagedArchives
+from plugin_scripts.state import StateStore
+from plugin_scripts.targets import DeployTarget, targets_from_env
+from plugin_scripts.vendor import WheelVendor, vendor_wheels
+from plugin_scripts.warmup import DEFAULT_CONCURRENCY, warm_up
 
 _logger = logging.getLogger("cloud-function")
 _logger.setLevel(logging.INFO)
 console = logging.StreamHandler()
 _logger.addHandler(console)
 
-
-def _zip_directory(handler: zipfile.ZipFile) -> None:
+DEFAULT_CONFLICT_WAIT_TIMEOUT = 900.0
+DEFAULT_PACKAGE_OUTPUT_DIR = "cloud-function-packages"
+DEFAULT_PARALLEL = 8
+MODES = ("deploy", "package", "config", "rollback")
+_CONFLICT_POLL_INTERVAL = 10
+_IN_PROGRESS_STATUSES = frozenset({"DEPLOY_IN_PROGRESS", "DELETE_IN_PROGRESS"})
+
+
+def _zip_directory(
+    handler: zipfile.ZipFile,
+    compilers: Sequence[BytecodeCompiler] = (),
+    wheels: Sequence[Path] = (),
+    profile: PackagingProfile | None = None,
+    composition: ArchiveComposition | None = None,
+    includes: SharedIncludes | None = None,
+) -> None:
     """
     Zip the cloud function directory for deployment.
 
     Args:
         handler: ZipFile handler to write files to
+        compilers: Add bytecode for these Python versions, in place of any
+            ``__pycache__`` directories in the sources
+        wheels: Install these wheels into the archive in place of
+            ``requirements.txt``
+        profile: Leave out the paths this packaging profile excludes.
+            Excluded directories are not descended into.
+        composition: Record every member written here, enforcing its size
+            budget as the archive grows
+        includes: Add these shared includes from their cached fragments,
+            without compressing them again
 
     Raises:
         ValueError: If cloud_function_directory is not set
+        ArchiveTooLarge: If the archive outgrows the composition's budget
     """
     cloud_function_directory_str = os.environ.get("cloud_function_directory")
     if not cloud_function_directory_str:
@@ -46,14 +154,73 @@ def _zip_directory(handler: zipfile.ZipFile) -> None:
     cloud_function_directory = Path(cloud_function_directory_str)
     _logger.info(f"Zipping directory: {cloud_function_directory}")
 
+    profile = (profile or PROFILES[PROFILE_NONE]).for_directory(
+        cloud_function_directory
+    )
+
+    def record() -> None:
+        if composition is not None:
+            composition.add(handler.filelist[-1])
+
+    on_write = composition.add if composition is not None else None
+
     file_count = 0
-    for file_path in cloud_function_directory.rglob("*"):
-        if file_path.is_file():
-            arcname = file_path.relative_to(cloud_function_directory)
-            handler.write(file_path, arcname)
+    source_bytes = 0
+    excluded = 0
+    sources: list[tuple[Path | bytes, str]] = []
+
+    def prune(relative: PurePosixPath) -> bool:
+        nonlocal excluded
+        if profile.excludes(relative):
+            excluded += 1
+            return True
+        return False
+
+    with closing(scan_tree(cloud_function_directory, prune)) as entries:
+        for entry in entries:
+            arcname = Path(entry.relative)
+            if compilers and "__pycache__" in arcname.parts:
+                continue
+            if wheels and arcname == Path(REQUIREMENTS_FILE):
+                # Nothing left for the remote build to install
+                continue
+            if profile.excludes(entry.relative):
+                excluded += 1
+                continue
+            handler.write(entry.path, arcname)
+            record()
             file_count += 1
+            source_bytes += entry.stat.st_size
+            if arcname.suffix == ".py":
+                sources.append((entry.path, entry.relative.as_posix()))
+    if excluded:
+        _logger.info(
+            f"Left out {excluded} paths excluded by the {profile.name} profile"
+        )
+
+    if includes is not None:
 
-    _logger.info(f"Successfully zipped {file_count} files")
+        def exclude(relative: PurePosixPath) -> bool:
+            if compilers and "__pycache__" in relative.parts:
+                return True
+            return profile.excludes(relative)
+
+        sources += includes.splice_into(handler, exclude, on_write)
+
+    if wheels:
+        sources += vendor_wheels(handler, list(wheels), on_write)
+
+    for compiler in compilers:
+        for pyc_arcname, pyc in compiler.compile(sources).items():
+            handler.writestr(pyc_arcname, pyc)
+            record()
+            file_count += 1
+
+    _logger.info(
+        f"Successfully zipped {file_count} files ({format_size(source_bytes)})"
+    )
+    if composition is not None and composition.log_report:
+        _logger.info(composition.report())
 
 
 def _get_bq_credentials() -> service_account.Credentials:
@@ -75,13 +242,32 @@ def _get_bq_credentials() -> service_account.Credentials:
     try:
         svc = json.loads(credentials_str)
         _logger.debug("Successfully parsed credentials JSON")
-        return service_account.Credentials.from_service_account_info(svc)
+        return clients.cached(
+            ("credentials", credentials_str),
+            lambda: service_account.Credentials.from_service_account_info(svc),
+        )
     except json.JSONDecodeError as e:
         _logger.error(f"Invalid credentials JSON: {e}")
         raise ValueError(f"Invalid credentials JSON: {e}") from e
 
 
-def _upload_source_code_using_archive_url(archive_url: str, data: Any) -> None:
+def _remaining_size(data: BinaryIO) -> int:
+    """
+    Count the bytes between the current position and the end of a stream.
+
+    Args:
+        data: Seekable binary stream
+
+    Returns:
+        The number of bytes left to read
+    """
+    position = data.tell()
+    end = data.seek(0, io.SEEK_END)
+    data.seek(position)
+    return end - position
+
+
+def _upload_source_code_using_archive_url(archive_url: str, data: Any) -> int | None:
     """
     Upload source code to GCS using archive URL.
 
@@ -89,6 +275,9 @@ def _upload_source_code_using_archive_url(archive_url: str, data: Any) -> None:
         archive_url: GCS URL to upload to
         data: File-like object containing the zipped source code
 
+    Returns:
+        The generation of the uploaded object
+
     Raises:
         Exception: If upload fails
     """
@@ -98,14 +287,38 @@ def _upload_source_code_using_archive_url(archive_url: str, data: Any) -> None:
     blob_name = object_path.path.lstrip("/")
 
     try:
-        storage_client = storage.Client(credentials=_get_bq_credentials())
+        storage_client = clients.client_for(_get_bq_credentials(), storage.Client)
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
-        blob.upload_from_string(data.read())
+        # Stream from the archive instead of reading it into memory first
+        blob.upload_from_file(
+            shaped(data, blob),
+            size=_remaining_size(data),
+            content_type="application/zip",
+        )
         _logger.info(f"Source code object {blob_name} uploaded to bucket {bucket_name}")
     except Exception as e:
         _logger.error(f"Failed to upload source code: {e}")
         raise DeployFailed(f"Failed to upload source code: {e}") from e
+    return blob.generation
+
+
+def _archive_generation(archive_url: str) -> int | None:
+    """
+    Look up the current generation of a source archive object.
+
+    Args:
+        archive_url: GCS URL of the archive
+
+    Returns:
+        The object's generation, or None if it does not exist
+    """
+    object_path = urlparse(archive_url)
+    storage_client = clients.client_for(_get_bq_credentials(), storage.Client)
+    blob = storage_client.bucket(object_path.netloc).get_blob(
+        object_path.path.lstrip("/")
+    )
+    return int(blob.generation) if blob is not None else None
 
 
 def _upload_source_code_using_upload_url(
@@ -127,12 +340,12 @@ def _upload_source_code_using_upload_url(
     _logger.info("Uploading source code using upload URL")
     headers = {
         "content-type": "application/zip",
-        "x-goog-content-length-range": "0,104857600",
+        "x-goog-content-length-range": f"0,{MAX_ARCHIVE_SIZE}",
     }
 
     try:
         response: Response = requests.put(
-            upload_url, headers=headers, data=data, timeout=300
+            upload_url, headers=headers, data=shaped(data), timeout=300
         )
         _logger.info(f"HTTP Status Code for uploading data: {response.status_code}")
 
@@ -208,93 +421,1515 @@ def _handle_exception(e: Exception, debug_mode: bool) -> None:
         _logger.debug(f"Exception details: {pformat(e)}")
 
 
-def _deploy(debug_mode: bool) -> None:
+def _wait_for_in_flight_operation(
+    cloud_functions: Any,
+    scheduler: RequestScheduler,
+    function_path: str,
+    quota_key: str,
+) -> None:
     """
-    Deploy the cloud function to Google Cloud Platform.
+    Block until no operation is rolling out on the cloud function.
 
     Args:
-        debug_mode: Whether to enable debug logging
+        cloud_functions: Cloud Functions API resource
+        scheduler: Scheduler used to rate limit the status polls
+        function_path: Fully qualified function name
+        quota_key: Quota bucket key for the function's location
 
     Raises:
-        DeployFailed: If deployment fails
+        DeployFailed: If the operation does not finish within
+            ``conflict_wait_timeout`` seconds
     """
-    _logger.info("Starting cloud function deployment...")
-    deploy_failed = False
+    timeout = env_float("conflict_wait_timeout", DEFAULT_CONFLICT_WAIT_TIMEOUT)
+    deadline = time.monotonic() + timeout
 
-    try:
-        gcp_project = os.environ.get("gcp_project")
-        gcp_region = os.environ.get("gcp_region")
-        cloud_function_name = os.environ.get("cloud_function_name")
-
-        parent = f"projects/{gcp_project}/locations/{gcp_region}"
-        function_path = (
-            f"projects/{gcp_project}/locations/{gcp_region}/"
-            f"functions/{cloud_function_name}"
+    while True:
+        function = scheduler.execute(cloud_functions.get(name=function_path), quota_key)
+        status = function.get("status")
+        if status not in _IN_PROGRESS_STATUSES:
+            _logger.info(f"In-flight operation finished, function is {status}")
+            return
+
+        if time.monotonic() >= deadline:
+            raise DeployFailed(
+                f"Timed out after {timeout:.0f}s waiting for the in-progress "
+                f"operation on {function_path}",
+                status_code=409,
+            )
+
+        _logger.info(
+            f"Function is {status}, checking again in {_CONFLICT_POLL_INTERVAL}s"
         )
+        time.sleep(_CONFLICT_POLL_INTERVAL)
+
+
+def _api_failure(action: str, e: Exception) -> DeployFailed:
+    """
+    Wrap an API error in DeployFailed, keeping its message and status code.
+
+    Args:
+        action: What was being attempted, e.g. "get cloud function"
+        e: The error raised by the API client
+
+    Returns:
+        The DeployFailed exception to raise
+    """
+    return DeployFailed(f"Failed to {action}: {e}", status_code=error_status(e))
+
+
+def _bytecode_compilers(runtimes: Iterable[str]) -> list[BytecodeCompiler]:
+    """
+    Pick bytecode compilers for the runtimes, when ``bytecode`` is enabled.
+
+    Args:
+        runtimes: Runtimes of the functions the archive is deployed to
 
-        _logger.info(f"Deploying function: {function_path}")
+    Returns:
+        One compiler per distinct Python version that can be compiled for
+    """
+    if not env_bool("bytecode"):
+        return []
+    compilers: dict[tuple[int, int], BytecodeCompiler] = {}
+    for runtime in sorted(set(runtimes)):
+        compiler = BytecodeCompiler.for_runtime(runtime)
+        if compiler is not None:
+            compilers.setdefault(compiler.version, compiler)
+    if not compilers:
+        _logger.warning("bytecode is enabled but no Python runtime can be compiled for")
+    return list(compilers.values())
+
+
+@contextmanager
+def _vendored_wheels(runtimes: Iterable[str]) -> Iterator[list[Path]]:
+    """
+    Fetch the wheels to vendor, when ``vendor_wheels`` is enabled.
+
+    Wheels come from the shared cache in ``cache_dir``, or from a
+    directory that only lasts for the build when no cache is configured.
+
+    Args:
+        runtimes: Runtimes of the functions the archive is deployed to
 
-        service = discovery.build(
-            "cloudfunctions", "v1", credentials=_get_bq_credentials()
+    Yields:
+        The wheels to install into the archive
+
+    Raises:
+        DeployFailed: If the targets run different Python versions or the
+            wheels cannot be downloaded
+    """
+    if not env_bool("vendor_wheels"):
+        yield []
+        return
+
+    versions = {
+        version
+        for runtime in set(runtimes)
+        if (version := runtime_version(runtime)) is not None
+    }
+    if not versions:
+        _logger.warning("vendor_wheels is enabled but no target runs Python")
+        yield []
+        return
+    if len(versions) > 1:
+        found = ", ".join(f"{major}.{minor}" for major, minor in sorted(versions))
+        raise DeployFailed(
+            f"vendor_wheels needs every target on one Python version, found {found}"
         )
-        cloud_functions = service.projects().locations().functions()
 
-        # check if cloud function exists, if it exists execution continues
-        # as is otherwise it will raise an exception
+    directory = Path(os.environ.get("cloud_function_directory", ""))
+    cache_root = cache_path("wheels")
+    with ExitStack() as stack:
+        if cache_root is None:
+            _logger.warning("cache_dir is not set, wheels are not kept between builds")
+            cache_root = Path(stack.enter_context(TemporaryDirectory()))
+        yield WheelVendor.from_env(versions.pop(), cache_root).wheels(directory)
+
+
+@contextmanager
+def _shared_includes() -> Iterator[SharedIncludes | None]:
+    """
+    Prepare the ``shared_includes``, compressed once into cached fragments.
+
+    Fragments are kept in ``cache_dir``, so every function of a build
+    reuses them, or in a directory that only lasts for the step when no
+    cache is configured.
+
+    Yields:
+        The shared includes, or None when none are configured
+    """
+    includes = [SharedInclude.parse(value) for value in env_list("shared_includes")]
+    if not includes:
+        yield None
+        return
+
+    cache_root = cache_path("includes")
+    with ExitStack() as stack:
+        if cache_root is None:
+            _logger.warning(
+                "cache_dir is not set, shared include fragments are not kept "
+                "between builds"
+            )
+            cache_root = Path(stack.enter_context(TemporaryDirectory()))
+        yield SharedIncludes(includes, FragmentCache(cache_root))
+
+
+@contextmanager
+def _build_archive(
+    archive_path: Path | None = None, runtimes: Iterable[str] = ()
+) -> Iterator[BinaryIO]:
+    """
+    Provide the zipped function sources.
+
+    Args:
+        archive_path: Prebuilt archive to use instead of zipping the
+            cloud function directory
+        runtimes: Runtimes of the target functions, for the packaging
+            profile, ``bytecode`` and ``vendor_wheels``
+
+    Yields:
+        Binary stream positioned at the start of the archive
+    """
+    if archive_path is not None:
+        _logger.info(f"Using prebuilt archive: {archive_path}")
+        with archive_path.open("rb") as prebuilt:
+            yield prebuilt
+        return
+
+    runtimes = set(runtimes)
+    profile = select_profile(runtimes)
+    compilers = _bytecode_compilers(runtimes)
+    with (
+        _vendored_wheels(runtimes) as wheels,
+        _shared_includes() as includes,
+        ArchiveSpool.from_env() as data,
+    ):
+        with tracing.span("build archive") as span:
+            file_handler = zipfile.ZipFile(
+                data, mode="w", compression=zipfile.ZIP_DEFLATED
+            )
+            _zip_directory(
+                file_handler,
+                compilers,
+                wheels,
+                profile,
+                ArchiveComposition.from_env(),
+                includes,
+            )
+            file_handler.close()
+            if span is not None:
+                span.attributes.update(size=data.size, tier=data.tier)
+        _logger.info(f"Archive is {data.size} bytes, kept in {data.tier}")
+        data.seek(0)
+        yield cast(BinaryIO, data)
+
+
+def _prebuilt_archive() -> Path | None:
+    """
+    Locate the archive configured with ``prebuilt_archive``.
+
+    The archive is downloaded from the build's artifacts when it is not in
+    the checkout, and checked against its manifest when one is available.
+
+    Returns:
+        Path to the archive, or None when no prebuilt archive is configured
+
+    Raises:
+        DeployFailed: If the archive is missing or does not match its manifest
+    """
+    configured = env_str("prebuilt_archive")
+    if not configured:
+        return None
+
+    archive_path = Path(configured)
+    if not archive_path.is_file() and buildkite.agent_path() is not None:
+        _logger.info(f"Downloading prebuilt archive artifact: {configured}")
         try:
-            function = cloud_functions.get(name=function_path).execute()
-            _logger.info(f"Found existing cloud function: {cloud_function_name}")
+            buildkite.artifact_download(configured)
+            buildkite.artifact_download(str(manifest_path(archive_path)))
         except Exception as e:
-            _logger.error(f"Failed to get cloud function: {e}")
+            _logger.warning(f"Could not download prebuilt archive artifacts: {e}")
+
+    if not archive_path.is_file():
+        raise DeployFailed(f"Prebuilt archive not found: {configured}")
+
+    manifest = read_manifest(archive_path)
+    if manifest is not None:
+        with archive_path.open("rb") as data:
+            digest = archive_digest(data)
+        if digest != manifest["sha256"]:
             raise DeployFailed(
-                f"Cloud function not found: {cloud_function_name}"
-            ) from e
+                f"Prebuilt archive {configured} does not match its manifest "
+                f"(sha256 {digest}, expected {manifest['sha256']})"
+            )
+        _logger.info(f"Verified prebuilt archive against manifest: {digest}")
+    return archive_path
 
-        if debug_mode:
-            _logger.debug(f"Function Definition: {pformat(function)}")
 
-        with TemporaryFile() as data:
-            file_handler = zipfile.ZipFile(data, mode="w")
-            _zip_directory(file_handler)
-            file_handler.close()
-            data.seek(0)
+def _package(debug_mode: bool) -> None:
+    """
+    Build the function archive and its manifest without deploying.
 
-            if "sourceArchiveUrl" in function:
-                archive_url = function["sourceArchiveUrl"]
-                _upload_source_code_using_archive_url(archive_url, data)
-            else:
-                # https://cloud.google.com/functions/docs/reference/rest/v1/projects.locations.functions/generateUploadUrl
-                try:
-                    upload_url = cloud_functions.generateUploadUrl(
-                        parent=parent, body={}
-                    ).execute()["uploadUrl"]
-                    _logger.info("Generated upload URL for source code")
-                except Exception as e:
-                    _logger.error(f"Failed to generate upload URL: {e}")
-                    raise DeployFailed(f"Failed to generate upload URL: {e}") from e
-
-                _upload_source_code_using_upload_url(upload_url, debug_mode, data)
-                function["sourceUploadUrl"] = upload_url
+    The files are written to ``package_output_dir`` and uploaded as
+    artifacts of the job so later steps can deploy them with
+    ``prebuilt_archive``.
+
+    Args:
+        debug_mode: Whether to log debug information
+    """
+    cloud_function_name = os.environ.get("cloud_function_name", "")
+    output_dir = Path(env_str("package_output_dir", DEFAULT_PACKAGE_OUTPUT_DIR))
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    archive_path = output_dir / f"{cloud_function_name}.zip"
+    runtimes = env_list("package_runtimes")
+    profile = select_profile(runtimes)
+    compilers = _bytecode_compilers(runtimes)
+    try:
+        with (
+            _vendored_wheels(runtimes) as wheels,
+            _shared_includes() as includes,
+            zipfile.ZipFile(
+                archive_path, mode="w", compression=zipfile.ZIP_DEFLATED
+            ) as file_handler,
+        ):
+            _zip_directory(
+                file_handler,
+                compilers,
+                wheels,
+                profile,
+                ArchiveComposition.from_env(),
+                includes,
+            )
+    except ArchiveTooLarge:
+        archive_path.unlink(missing_ok=True)
+        raise
+
+    manifest = build_manifest(archive_path, cloud_function_name)
+    manifest_file = write_manifest(archive_path, manifest)
+    _logger.info(
+        f"Packaged {len(manifest['files'])} files into {archive_path} "
+        f"({manifest['size']} bytes, sha256 {manifest['sha256']})"
+    )
+    if debug_mode:
+        _logger.debug(f"Manifest: {pformat(manifest)}")
+
+    if buildkite.agent_path() is None:
+        _logger.warning("buildkite-agent not available, skipping artifact upload")
+        return
+    buildkite.artifact_upload(str(archive_path), str(manifest_file))
+    _logger.info("Uploaded archive and manifest as build artifacts")
+
+
+def _package_and_upload(
+    function: dict[str, Any],
+    cloud_functions: Any,
+    scheduler: RequestScheduler,
+    parent: str,
+    quota_key: str,
+    debug_mode: bool,
+    archive_path: Path | None = None,
+    releases: ReleaseStore | None = None,
+) -> dict[str, Any]:
+    """
+    Zip the function sources and upload them where the function expects.
+
+    Functions deployed from a GCS archive get the archive overwritten;
+    otherwise a fresh upload URL is generated and recorded on ``function``.
+
+    Args:
+        function: Function definition, updated with the new source location
+        cloud_functions: Cloud Functions API resource
+        scheduler: Scheduler used for API calls
+        parent: ``projects/<project>/locations/<region>``
+        quota_key: Quota bucket key for the function's location
+        debug_mode: Whether to log debug information
+        archive_path: Prebuilt archive to upload instead of zipping
+        releases: Also retain the archive as a release of the function
+
+    Returns:
+        Where the source was uploaded, and the digest of the retained
+        release if any, for the deploy checkpoint
+
+    Raises:
+        DeployFailed: If generating the upload URL or uploading fails
+    """
+    with _build_archive(archive_path, [function.get("runtime", "")]) as data:
+        release = {"release": releases.retain(data)} if releases is not None else {}
+        if "sourceArchiveUrl" in function:
+            archive_url = function["sourceArchiveUrl"]
+            with tracing.span("upload archive", url=archive_url):
+                generation = _upload_source_code_using_archive_url(archive_url, data)
+            return {"archive_url": archive_url, "generation": generation, **release}
+
+        # https://cloud.google.com/functions/docs/reference/rest/v1/projects.locations.functions/generateUploadUrl
+        try:
+            upload_url = scheduler.execute(
+                cloud_functions.generateUploadUrl(parent=parent, body={}),
+                quota_key,
+            )["uploadUrl"]
+            _logger.info("Generated upload URL for source code")
+        except Exception as e:
+            _logger.error(f"Failed to generate upload URL: {e}")
+            raise _api_failure("generate upload URL", e) from e
+
+        with tracing.span("upload archive"):
+            _upload_source_code_using_upload_url(upload_url, debug_mode, data)
+        function["sourceUploadUrl"] = upload_url
+        return {"upload_url": upload_url, **release}
+
+
+def _resume_upload(function: dict[str, Any], checkpoint: dict[str, Any]) -> bool:
+    """
+    Point the function at the source uploaded by a previous attempt.
+
+    Args:
+        function: Function definition, updated with the upload URL
+        checkpoint: Checkpoint saved after the previous upload
+
+    Returns:
+        True if the uploaded source can be reused
+    """
+    if "upload_url" in checkpoint and "sourceArchiveUrl" not in function:
+        function["sourceUploadUrl"] = checkpoint["upload_url"]
+        return True
+
+    archive_url = checkpoint.get("archive_url")
+    if archive_url is None or archive_url != function.get("sourceArchiveUrl"):
+        return False
+    try:
+        generation = _archive_generation(archive_url)
+    except Exception as e:
+        _logger.warning(f"Could not check the uploaded archive: {e}")
+        return False
+    # Someone else may have overwritten the archive since
+    return generation is not None and generation == checkpoint.get("generation")
+
+
+def _cloud_functions_service(credentials: service_account.Credentials) -> Any:
+    """
+    Build a Cloud Functions API client.
+
+    In the daemon the discovery document is parsed once and reused.
+
+    Args:
+        credentials: Credentials for the API client
+
+    Returns:
+        The ``cloudfunctions`` v1 service
+    """
+    document = clients.discovery_document("cloudfunctions", "v1")
+    if document is not None:
+        return discovery.build_from_document(document, credentials=credentials)
+    return discovery.build("cloudfunctions", "v1", credentials=credentials)
+
+
+def _cloud_functions_resource(credentials: service_account.Credentials) -> Any:
+    """
+    Build a Cloud Functions API resource.
+
+    API resources are not thread safe, so concurrent deploys build one each.
+
+    Args:
+        credentials: Credentials for the API client
 
+    Returns:
+        The ``projects.locations.functions`` resource
+    """
+    service = _cloud_functions_service(credentials)
+    return service.projects().locations().functions()
+
+
+def _operations_resource(credentials: service_account.Credentials) -> Any:
+    """
+    Build a Cloud Functions API ``operations`` resource.
+
+    Args:
+        credentials: Credentials for the API client
+
+    Returns:
+        The ``operations`` resource
+    """
+    service = _cloud_functions_service(credentials)
+    return service.operations()
+
+
+def _id_token(audience: str) -> str:
+    """
+    Mint an identity token for calling a function that requires authentication.
+
+    Args:
+        audience: The function's trigger URL
+
+    Returns:
+        The token, signed for the service account in ``credentials``
+    """
+    id_credentials = service_account.IDTokenCredentials.from_service_account_info(
+        json.loads(os.environ.get("credentials", "")), target_audience=audience
+    )
+    id_credentials.refresh(google.auth.transport.requests.Request())
+    return str(id_credentials.token)
+
+
+def _post_deploy(
+    target: DeployTarget,
+    function: dict[str, Any],
+    operation: dict[str, Any],
+    credentials: service_account.Credentials,
+    scheduler: RequestScheduler,
+) -> None:
+    """
+    Wait for the rollout, then track its build time, warm the function up
+    and benchmark it.
+
+    Nothing happens unless ``track_build_times``, ``warmup_requests`` or
+    ``benchmark_requests`` is set. Warm-up runs first so the benchmark
+    measures warm instances.
+
+    Args:
+        target: The patched function
+        function: Its definition, for the HTTPS trigger URL
+        operation: The operation returned by the patch
+        credentials: Credentials for the API client
+        scheduler: Scheduler used to rate limit the operation polls
+
+    Raises:
+        DeployFailed: If the rollout failed or did not finish in time
+        BenchmarkRegression: If the benchmark regressed and
+            ``benchmark_gate`` is ``fail``
+    """
+    total = env_int("warmup_requests", 0)
+    benchmark_total = env_int("benchmark_requests", 0)
+    track_build_times = env_bool("track_build_times")
+    if total <= 0 and benchmark_total <= 0 and not track_build_times:
+        return
+
+    waiting_since = datetime.now(UTC)
+    with tracing.span("wait for rollout", target=target.path):
+        finished = wait_for_operation(
+            _operations_resource(credentials),
+            scheduler,
+            operation["name"],
+            target.quota_key,
+            timeout=env_float("operation_timeout", DEFAULT_OPERATION_TIMEOUT),
+        )
+    if track_build_times:
+        timing = BuildTiming.from_operation(
+            operation, finished, waiting_since, datetime.now(UTC)
+        )
         try:
-            _logger.info("Patching cloud function...")
-            response = cloud_functions.patch(
-                name=function_path, body=function
-            ).execute()
-            _logger.info("Successfully patched Cloud Function")
-            _logger.info(f"Operation Name: {response['name']}")
-
-            if debug_mode:
-                _logger.debug(f"Response: {pformat(response)}")
+            _track_build_time(target, timing, credentials)
         except Exception as e:
-            deploy_failed = True
-            _handle_exception(e, debug_mode)
+            _logger.warning(f"Could not track the build time of {target.path}: {e}")
+    if total <= 0 and benchmark_total <= 0:
+        return
+    trigger_url = function.get("httpsTrigger", {}).get("url")
+    if not trigger_url:
+        _logger.info(f"Skipping requests to {target.path}, it has no HTTPS trigger")
+        return
+
+    url = trigger_url
+    if path := env_str("warmup_path").lstrip("/"):
+        url = f"{trigger_url.rstrip('/')}/{path}"
+    headers = {}
+    if env_bool("warmup_authenticated"):
+        headers["Authorization"] = f"Bearer {_id_token(trigger_url)}"
+    if total > 0:
+        _logger.info(f"Sending {total} warm-up requests to {url}")
+        with tracing.span("warm-up", target=target.path, requests=total):
+            report = warm_up(
+                url, total, env_int("warmup_concurrency", DEFAULT_CONCURRENCY), headers
+            )
+        _logger.info(f"Warm-up of {target.path}: {report.summary()}")
+        if report.errors:
+            _logger.warning(f"{report.errors} warm-up requests to {url} failed")
+    if benchmark_total > 0:
+        with tracing.span("benchmark", target=target.path, requests=benchmark_total):
+            _benchmark(target, trigger_url, headers, benchmark_total, credentials)
+
+
+def _track_build_time(
+    target: DeployTarget,
+    timing: BuildTiming,
+    credentials: service_account.Credentials,
+) -> None:
+    """
+    Record a remote build's duration and report its trend.
+
+    Timings are kept per function in ``state_bucket``; without it only
+    the build's own duration is reported. The trend is added to the build
+    as an annotation, as a warning when the build is an outlier.
+
+    Args:
+        target: The deployed function
+        timing: How long its build and rollout took
+        credentials: Credentials for the storage client
+    """
+    store = StateStore.from_env(credentials)
+    history = (
+        BuildTimeHistory(
+            store, target.path, env_int("build_time_history", DEFAULT_HISTORY)
+        )
+        if store is not None
+        else None
+    )
+    trend = build_trend(
+        timing,
+        history.timings() if history is not None else [],
+        env_float("build_time_outlier", DEFAULT_OUTLIER_FACTOR),
+    )
+    build = f" {timing.build_id}" if timing.build_id else ""
+    _logger.info(f"Remote build{build} of {target.path}: {trend.summary()}")
+    if trend.outlier:
+        _logger.warning(f"Remote build of {target.path} was unusually slow")
+    if buildkite.agent_path() is not None:
+        buildkite.annotate(
+            report_markdown(target.path, timing, trend),
+            style="warning" if trend.outlier else "info",
+            context=f"build-time-{target.path}",
+        )
+    if history is not None:
+        history.record(timing)
+
+
+def _benchmark(
+    target: DeployTarget,
+    url: str,
+    headers: dict[str, str],
+    total: int,
+    credentials: service_account.Credentials,
+) -> None:
+    """
+    Benchmark a deployed function against the previous deploy's results.
+
+    Results are kept in ``state_bucket`` and become the baseline of the
+    next deploy unless the gate fails the step. Without ``state_bucket``
+    only the error rate is checked.
+
+    Args:
+        target: The deployed function
+        url: Its HTTPS trigger URL
+        headers: Headers sent with every request
+        total: Number of requests to send
+        credentials: Credentials for the storage client
+
+    Raises:
+        ValueError: If ``benchmark_mix`` or ``benchmark_gate`` is invalid
+        BenchmarkRegression: If the benchmark regressed and
+            ``benchmark_gate`` is ``fail``
+    """
+    gate = env_str("benchmark_gate", benchmark.GATE_FAIL).lower()
+    if gate not in benchmark.GATES:
+        raise ValueError(
+            f"Unknown benchmark_gate {gate!r}, expected one of {benchmark.GATES}"
+        )
+    mix = benchmark.parse_mix(env_list("benchmark_mix") or [benchmark.DEFAULT_MIX])
+
+    _logger.info(f"Benchmarking {target.path} with {total} requests")
+    result = benchmark.run_benchmark(
+        url,
+        mix,
+        total,
+        env_int("benchmark_concurrency", benchmark.DEFAULT_CONCURRENCY),
+        headers,
+    )
+    _logger.info(f"Benchmark of {target.path}: {result.summary()}")
+
+    store = StateStore.from_env(credentials)
+    history = benchmark.BenchmarkHistory(store, target.path) if store else None
+    previous = history.previous() if history is not None else None
+    if previous is None:
+        _logger.info("No previous benchmark to compare with")
+    problems = benchmark.regressions(
+        result,
+        previous,
+        env_float("benchmark_threshold", benchmark.DEFAULT_THRESHOLD),
+        env_float("benchmark_max_error_rate", benchmark.DEFAULT_MAX_ERROR_RATE),
+    )
+    if problems:
+        failing = gate == benchmark.GATE_FAIL
+        for problem in problems:
+            _logger.warning(f"Benchmark regression in {target.path}: {problem}")
+        if buildkite.agent_path() is not None:
+            buildkite.annotate(
+                f"**Benchmark regression in `{target.path}`**\n\n"
+                + "".join(f"- {problem}\n" for problem in problems)
+                + "\n"
+                + benchmark.report_table(result, previous),
+                style="error" if failing else "warning",
+                context=f"benchmark-{target.path}",
+            )
+        if failing:
+            raise BenchmarkRegression(target.path, problems)
+    if history is not None:
+        history.save(result)
+
+
+def _get_function(
+    cloud_functions: Any,
+    scheduler: RequestScheduler,
+    target: DeployTarget,
+    debug_mode: bool,
+    inventory: FunctionInventory | None = None,
+) -> dict[str, Any]:
+    """
+    Fetch the definition of an existing cloud function.
+
+    Args:
+        cloud_functions: Cloud Functions API resource
+        scheduler: Scheduler used for API calls
+        target: The function to fetch
+        debug_mode: Whether to log the definition
+        inventory: Serve the definition from this inventory instead of a
+            ``get`` call
+
+    Returns:
+        The function definition
+
+    Raises:
+        DeployFailed: If the function does not exist or cannot be read
+    """
+    function: dict[str, Any] | None
+    try:
+        with tracing.span("get function", target=target.path):
+            if inventory is not None:
+                function = inventory.get(target)
+            else:
+                function = scheduler.execute(
+                    cloud_functions.get(name=target.path), target.quota_key
+                )
+    except Exception as e:
+        _logger.error(f"Failed to get cloud function: {e}")
+        if error_status(e) == 404:
+            raise DeployFailed(
+                f"Cloud function not found: {target.function}",
+                status_code=404,
+            ) from e
+        raise _api_failure("get cloud function", e) from e
+
+    if function is None:
+        _logger.error(f"Cloud function {target.path} does not exist")
+        raise DeployFailed(
+            f"Cloud function not found: {target.function}", status_code=404
+        )
+    _logger.info(f"Found existing cloud function: {target.function}")
+
+    if debug_mode:
+        _logger.debug(f"Function Definition: {pformat(function)}")
+    return function
+
+
+def _patch_function(
+    cloud_functions: Any,
+    scheduler: RequestScheduler,
+    target: DeployTarget,
+    function: dict[str, Any],
+    debug_mode: bool,
+    update_mask: str | None = None,
+) -> dict[str, Any]:
+    """
+    Patch a cloud function, starting the rollout of its new source.
+
+    Args:
+        cloud_functions: Cloud Functions API resource
+        scheduler: Scheduler used for API calls
+        target: The function to patch
+        function: The updated function definition
+        debug_mode: Whether to log the response
+        update_mask: Only update these comma separated fields
+
+    Returns:
+        The long running operation
+
+    Raises:
+        DeployFailed: If the patch fails
+    """
+    try:
+        _logger.info(f"Patching cloud function {target.path}...")
+        mask = {"updateMask": update_mask} if update_mask else {}
+        with tracing.span("patch function", target=target.path):
+            response = scheduler.execute(
+                cloud_functions.patch(name=target.path, body=function, **mask),
+                target.quota_key,
+                on_conflict=partial(
+                    _wait_for_in_flight_operation,
+                    cloud_functions,
+                    scheduler,
+                    target.path,
+                    target.quota_key,
+                ),
+            )
     except Exception as e:
-        deploy_failed = True
+        _logger.error(f"Failed to patch cloud function: {e}")
+        raise _api_failure("patch cloud function", e) from e
+
+    _logger.info("Successfully patched Cloud Function")
+    _logger.info(f"Operation Name: {response['name']}")
+    if debug_mode:
+        _logger.debug(f"Response: {pformat(response)}")
+    return response
+
+
+def _input_digest(archive_path: Path | None) -> str:
+    """
+    Identify the sources being deployed, for checkpoints.
+
+    Args:
+        archive_path: Prebuilt archive, if one is used
+
+    Returns:
+        Digest of the prebuilt archive or of the function directory and its
+        shared includes
+    """
+    if archive_path is not None:
+        with archive_path.open("rb") as prebuilt:
+            return archive_digest(prebuilt)
+    digest = source_digest(Path(os.environ.get("cloud_function_directory", "")))
+    includes = [SharedInclude.parse(value) for value in env_list("shared_includes")]
+    return includes_digest(digest, includes) if includes else digest
+
+
+def _preflight(functions: Iterable[tuple[DeployTarget, dict[str, Any]]]) -> None:
+    """
+    Validate the function sources before anything is uploaded.
+
+    Source checks run when ``preflight`` is enabled and dependency
+    resolution when ``resolve_dependencies`` is, both only for Python
+    runtimes.
+
+    Args:
+        functions: The targets and their current definitions
+
+    Raises:
+        SourceValidationFailed: Listing every problem found
+    """
+    check_sources = env_bool("preflight")
+    resolve = env_bool("resolve_dependencies")
+    if not (check_sources or resolve):
+        return
+
+    functions = list(functions)
+    entry_points = {
+        function.get("entryPoint") or target.function
+        for target, function in functions
+        if function.get("runtime", "python").startswith("python")
+    }
+    versions = {
+        version
+        for _, function in functions
+        if (version := runtime_version(function.get("runtime", ""))) is not None
+    }
+    if not entry_points:
+        _logger.info("Skipping pre-flight checks, they only cover Python runtimes")
+        return
+
+    directory = Path(os.environ.get("cloud_function_directory", ""))
+    _logger.info(f"Running pre-flight checks on {directory}")
+    problems = []
+    with tracing.span("preflight"):
+        if check_sources:
+            problems += validate_sources(directory, entry_points)
+        if resolve and not versions:
+            _logger.warning(
+                "No target has a Python runtime version, resolving requirements "
+                "for this interpreter's Python"
+            )
+            versions = {sys.version_info[:2]}
+        if resolve:
+            for version in sorted(versions):
+                resolver = DependencyResolver.from_env(version)
+                problems += resolver.resolve(directory)
+    if problems:
+        for problem in problems:
+            _logger.error(f"Pre-flight check failed: {problem}")
+        raise SourceValidationFailed(problems)
+    _logger.info("Pre-flight checks passed")
+
+
+def _release_stores(
+    credentials: service_account.Credentials, targets: Iterable[DeployTarget]
+) -> dict[DeployTarget, ReleaseStore]:
+    """
+    Open every target's retained releases.
+
+    Args:
+        credentials: Credentials for the storage client
+        targets: The functions being deployed
+
+    Returns:
+        Each target's releases, keeping ``retain_releases`` of them, or
+        nothing without ``state_bucket``
+    """
+    store = StateStore.from_env(credentials)
+    if store is None:
+        return {}
+    keep = env_int("retain_releases", 0)
+    return {target: ReleaseStore(store, target.path, keep) for target in targets}
+
+
+def _detach_release(function: dict[str, Any], releases: ReleaseStore | None) -> None:
+    """
+    Stop a rolled back function deploying from a retained archive.
+
+    A rollback points functions that used upload URLs at the retained
+    archive; overwriting it with the next deploy would corrupt the release.
+
+    Args:
+        function: Function definition, updated in place
+        releases: The function's retained releases
+    """
+    if releases is not None and releases.is_retained(function.get("sourceArchiveUrl")):
+        _logger.info("Function runs a rolled back release, switching to an upload")
+        del function["sourceArchiveUrl"]
+
+
+def _staged_archives(
+    credentials: service_account.Credentials,
+) -> StagedArchives | None:
+    """
+    Open the archives staged in ``state_bucket``.
+
+    Args:
+        credentials: Credentials for the storage client
+
+    Returns:
+        The staged archives, or None without ``state_bucket``
+    """
+    store = StateStore.from_env(credentials)
+    return StagedArchives(store) if store is not None else None
+
+
+def _detach_staged(function: dict[str, Any], staging: StagedArchives | None) -> bool:
+    """
+    Stop a function deploying from an archive staged by an earlier deploy.
+
+    Staged archives are named by their digest and shared by every target
+    of a deploy; writing the next archive over one would change the
+    sources behind its name.
+
+    Args:
+        function: Function definition, updated in place
+        staging: The archives staged in ``state_bucket``
+
+    Returns:
+        True if the function deployed from a staged archive
+    """
+    if staging is None or not staging.is_staged(function.get("sourceArchiveUrl")):
+        return False
+    _logger.info("Function runs a staged archive, switching to an upload")
+    del function["sourceArchiveUrl"]
+    return True
+
+
+def _roll_out(
+    target: DeployTarget,
+    function: dict[str, Any],
+    operation: dict[str, Any],
+    credentials: service_account.Credentials,
+    scheduler: RequestScheduler,
+    checkpoints: CheckpointStore | None,
+    digest: str | None,
+) -> None:
+    """
+    Checkpoint a patched function, then run its post-deploy checks.
+
+    The patch is checkpointed before the checks, so a retry after a failed
+    check runs only the checks again instead of patching once more.
+
+    Args:
+        target: The patched function
+        function: Its definition, for the HTTPS trigger URL
+        operation: The operation returned by the patch
+        credentials: Credentials for API and storage clients
+        scheduler: Scheduler used for API calls
+        checkpoints: The function's checkpoint store, if resuming is enabled
+        digest: Digest of the sources being deployed
+
+    Raises:
+        DeployFailed: If the rollout failed or did not finish in time
+    """
+    if checkpoints is not None:
+        checkpoints.save(
+            {
+                "phase": PHASE_PATCHED,
+                "source_digest": digest,
+                "operation": operation["name"],
+            }
+        )
+    _post_deploy(target, function, operation, credentials, scheduler)
+    if checkpoints is not None:
+        checkpoints.save(
+            {
+                "phase": PHASE_DEPLOYED,
+                "source_digest": digest,
+                "operation": operation["name"],
+            }
+        )
+
+
+def _deploy_single(target: DeployTarget, debug_mode: bool) -> None:
+    """
+    Package, upload and patch one cloud function.
+
+    Args:
+        target: The function to deploy
+        debug_mode: Whether to enable debug logging
+
+    Raises:
+        DeployFailed: If any step of the deploy fails
+    """
+    scheduler = RequestScheduler.from_env()
+    credentials = _get_bq_credentials()
+    cloud_functions = _cloud_functions_resource(credentials)
+
+    # check if cloud function exists, if it exists execution continues
+    # as is otherwise it will raise an exception
+    function = _get_function(cloud_functions, scheduler, target, debug_mode)
+    releases = _release_stores(credentials, [target]).get(target)
+    _detach_release(function, releases)
+    staging = _staged_archives(credentials)
+    detached = _detach_staged(function, staging)
+
+    archive_path = _prebuilt_archive()
+    if archive_path is None:
+        _preflight([(target, function)])
+
+    checkpoints = CheckpointStore.from_env(target.path)
+    checkpoint = None
+    digest = None
+    if checkpoints is not None:
+        digest = _input_digest(archive_path)
+        checkpoint = checkpoints.load()
+        if checkpoint and checkpoint.get("source_digest") != digest:
+            _logger.info("Sources changed since the last checkpoint, starting over")
+            if releases is not None and checkpoint.get("release"):
+                releases.discard(checkpoint["release"])
+            checkpoint = None
+
+    if checkpoint and checkpoint["phase"] == PHASE_DEPLOYED:
+        _logger.info(
+            "Function was already deployed by a previous attempt "
+            f"(operation {checkpoint.get('operation')}), nothing to do"
+        )
+        return
+    if checkpoint and checkpoint["phase"] == PHASE_PATCHED:
+        _logger.info(
+            "Function was already patched by a previous attempt "
+            f"(operation {checkpoint.get('operation')}), only checking its rollout"
+        )
+        _roll_out(
+            target,
+            function,
+            {"name": checkpoint["operation"]},
+            credentials,
+            scheduler,
+            checkpoints,
+            digest,
+        )
+        return
+
+    def upload() -> dict[str, Any]:
+        source = _package_and_upload(
+            function,
+            cloud_functions,
+            scheduler,
+            target.parent,
+            target.quota_key,
+            debug_mode,
+            archive_path,
+            releases if releases is not None and releases.keep else None,
+        )
+        if checkpoints is not None:
+            checkpoints.save(
+                {"phase": PHASE_UPLOADED, "source_digest": digest, **source}
+            )
+        return source
+
+    resumed = checkpoint is not None and _resume_upload(function, checkpoint)
+    if resumed:
+        _logger.info("Resuming from checkpoint, reusing the uploaded source")
+        source = cast(dict[str, Any], checkpoint)
+    else:
+        source = upload()
+
+    try:
+        response = _patch_function(
+            cloud_functions, scheduler, target, function, debug_mode
+        )
+    except DeployFailed as e:
+        if not resumed or not source_gone(e):
+            # A checkpointed upload is kept for the retry that resumes it
+            if releases is not None and "release" in source and checkpoints is None:
+                releases.discard(source["release"])
+            raise
+        # The reused source expired or was deleted, upload it again
+        _logger.warning(
+            f"Patching with the resumed source failed ({e}), uploading again"
+        )
+        if checkpoints is not None:
+            checkpoints.clear()
+        source = upload()
+        response = _patch_function(
+            cloud_functions, scheduler, target, function, debug_mode
+        )
+
+    if releases is not None and "release" in source:
+        releases.record(source["release"], response["name"])
+    if detached and staging is not None:
+        staging.record({target.path: None})
+    _roll_out(target, function, response, credentials, scheduler, checkpoints, digest)
+
+
+def _map_targets(
+    task: Callable[[DeployTarget], Any], targets: list[DeployTarget]
+) -> dict[DeployTarget, Any]:
+    """
+    Run a task for every target concurrently.
+
+    Args:
+        task: Callable invoked once per target
+        targets: The targets
+
+    Returns:
+        Each target's result, or the exception its task raised
+    """
+    workers = min(len(targets), env_int("max_parallel_targets", DEFAULT_PARALLEL))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Run each task in a copy of the caller's context, so its trace
+        # spans nest under the caller's
+        futures = {
+            target: executor.submit(contextvars.copy_context().run, task, target)
+            for target in targets
+        }
+    results: dict[DeployTarget, Any] = {}
+    for target, future in futures.items():
+        error = future.exception()
+        results[target] = error if error is not None else future.result()
+    return results
+
+
+def _raise_target_failures(results: dict[DeployTarget, Any], action: str) -> None:
+    """
+    Fail the deploy if any target's task raised.
+
+    Args:
+        results: Results returned by _map_targets
+        action: What the tasks were doing, for the error message
+
+    Raises:
+        DeployFailed: Listing every failed target
+    """
+    failures = {t: r for t, r in results.items() if isinstance(r, BaseException)}
+    if not failures:
+        return
+    for target, error in failures.items():
+        _logger.error(f"Failed to {action} {target.path}: {error}")
+    details = "; ".join(f"{t.path}: {e}" for t, e in failures.items())
+    status_codes = {getattr(e, "status_code", None) for e in failures.values()}
+    raise DeployFailed(
+        f"Failed to {action} {len(failures)} of {len(results)} targets: {details}",
+        status_code=status_codes.pop() if len(status_codes) == 1 else None,
+    )
+
+
+def _copy_archive(
+    source_url: str, destination_url: str, credentials: service_account.Credentials
+) -> None:
+    """
+    Copy an archive between GCS objects without downloading it.
+
+    Args:
+        source_url: ``gs://`` URL of the uploaded archive
+        destination_url: ``gs://`` URL the target function deploys from
+        credentials: Credentials for the storage client
+    """
+    storage_client = clients.client_for(credentials, storage.Client)
+    source = urlparse(source_url)
+    destination = urlparse(destination_url)
+    source_blob = storage_client.bucket(source.netloc).blob(source.path.lstrip("/"))
+    destination_blob = storage_client.bucket(destination.netloc).blob(
+        destination.path.lstrip("/")
+    )
+
+    # Large or cross-location copies take several rewrite calls
+    token, _, _ = destination_blob.rewrite(source_blob)
+    while token is not None:
+        token, _, _ = destination_blob.rewrite(source_blob, token=token)
+    _logger.info(f"Copied {source_url} to {destination_url}")
+
+
+def _distribute_archive(
+    data: BinaryIO,
+    functions: dict[DeployTarget, dict[str, Any]],
+    staging: StagedArchives | None,
+    credentials: service_account.Credentials,
+    scheduler: RequestScheduler,
+    debug_mode: bool,
+) -> str | None:
+    """
+    Upload the archive once and feed it to every target's source location.
+
+    The archive is uploaded to ``state_bucket`` when configured, otherwise
+    to the first target deployed from a GCS archive. Targets with their
+    own ``sourceArchiveUrl`` then receive a server side copy. Targets using
+    upload URLs, or an archive staged by an earlier deploy, are pointed at
+    the staged archive, or get their own upload when nothing was staged.
+
+    Args:
+        data: The archive
+        functions: Function definitions per target, updated in place
+        staging: The archives staged in ``state_bucket``, if configured
+        credentials: Credentials for API and storage clients
+        scheduler: Scheduler used for API calls
+        debug_mode: Whether to log debug information
+
+    Returns:
+        SHA-256 of the staged archive, or None if nothing was staged
+
+    Raises:
+        DeployFailed: If the archive cannot be delivered to every target
+    """
+    digest = archive_digest(data)
+    origin_url = staging.stage(data, digest) if staging is not None else None
+    staged = origin_url is not None
+
+    archive_targets = [t for t, f in functions.items() if "sourceArchiveUrl" in f]
+    if origin_url is None and archive_targets:
+        origin_url = functions[archive_targets[0]]["sourceArchiveUrl"]
+        _upload_source_code_using_archive_url(origin_url, data)
+        data.seek(0)
+
+    # Upload threads take turns reading the archive instead of each holding
+    # a copy of it in memory
+    read_lock = threading.Lock()
+
+    def deliver(target: DeployTarget) -> None:
+        function = functions[target]
+        archive_url = function.get("sourceArchiveUrl")
+        if archive_url is not None:
+            if archive_url != origin_url:
+                _copy_archive(str(origin_url), archive_url, credentials)
+        elif staged:
+            function.pop("sourceUploadUrl", None)
+            function["sourceArchiveUrl"] = origin_url
+        else:
+            cloud_functions = _cloud_functions_resource(credentials)
+            upload_url = scheduler.execute(
+                cloud_functions.generateUploadUrl(parent=target.parent, body={}),
+                target.quota_key,
+            )["uploadUrl"]
+            _upload_source_code_using_upload_url(
+                upload_url, debug_mode, SharedReader(data, read_lock)
+            )
+            function["sourceUploadUrl"] = upload_url
+
+    _raise_target_failures(
+        _map_targets(deliver, list(functions)), "deliver the archive to"
+    )
+    return digest if staged else None
+
+
+def _deploy_many(targets: list[DeployTarget], debug_mode: bool) -> None:
+    """
+    Deploy one package to several functions, regions or projects.
+
+    The sources are zipped and uploaded once; every target's patch then
+    runs concurrently.
+
+    Args:
+        targets: The functions to deploy
+        debug_mode: Whether to enable debug logging
+
+    Raises:
+        DeployFailed: If any target fails, listing the failed targets
+    """
+    _logger.info(f"Deploying to {len(targets)} targets")
+    credentials = _get_bq_credentials()
+    scheduler = RequestScheduler.from_env()
+    archive_path = _prebuilt_archive()
+
+    # One paginated list per location instead of a get per target
+    inventory = FunctionInventory(
+        partial(_cloud_functions_resource, credentials), scheduler
+    )
+    fetched = _map_targets(
+        lambda t: _get_function(None, scheduler, t, debug_mode, inventory),
+        targets,
+    )
+    _raise_target_failures(fetched, "get")
+    if archive_path is None:
+        _preflight((t, fetched[t]) for t in targets)
+    releases = _release_stores(credentials, targets)
+    staging = _staged_archives(credentials)
+    for target, function in fetched.items():
+        _detach_release(function, releases.get(target))
+        _detach_staged(function, staging)
+
+    digest = None
+    checkpoints = {t: CheckpointStore.from_env(t.path) for t in targets}
+    if any(store is not None for store in checkpoints.values()):
+        digest = _input_digest(archive_path)
+
+    def previous_phase(target: DeployTarget) -> dict[str, Any] | None:
+        store = checkpoints[target]
+        checkpoint = store.load() if store is not None else None
+        if (
+            checkpoint
+            and checkpoint.get("source_digest") == digest
+            and checkpoint["phase"] in (PHASE_PATCHED, PHASE_DEPLOYED)
+        ):
+            return checkpoint
+        return None
+
+    previous = {t: c for t in targets if (c := previous_phase(t)) is not None}
+    patched = {
+        t: {"name": c["operation"]}
+        for t, c in previous.items()
+        if c["phase"] == PHASE_PATCHED
+    }
+    functions = {t: fetched[t] for t in targets if t not in previous}
+    if previous:
+        _logger.info(
+            f"{len(previous)} targets were already patched by a previous "
+            f"attempt, {len(patched)} of them still need their rollout checked"
+        )
+    if not functions and not patched:
+        return
+
+    retaining = [releases[t] for t in functions if t in releases and releases[t].keep]
+    release = None
+    staged = None
+    if functions:
+        runtimes = {function.get("runtime", "") for function in functions.values()}
+        with _build_archive(archive_path, runtimes) as data:
+            with tracing.span("distribute archive", targets=len(functions)):
+                staged = _distribute_archive(
+                    data, functions, staging, credentials, scheduler, debug_mode
+                )
+            # Upload the release once, the other targets copy it server side
+            for store in retaining:
+                release = store.retain(data, copy_of=retaining[0] if release else None)
+
+    def patch(target: DeployTarget) -> dict[str, Any]:
+        if target in patched:
+            response = patched[target]
+        else:
+            try:
+                response = _patch_function(
+                    _cloud_functions_resource(credentials),
+                    scheduler,
+                    target,
+                    functions[target],
+                    debug_mode,
+                )
+            except DeployFailed:
+                if release is not None and releases[target].keep:
+                    releases[target].discard(release)
+                raise
+            if release is not None and releases[target].keep:
+                releases[target].record(release, response["name"])
+            if staging is not None:
+                source = functions[target].get("sourceArchiveUrl")
+                uses[target.path] = staged if staging.is_staged(source) else None
+        _roll_out(
+            target,
+            fetched[target],
+            response,
+            credentials,
+            scheduler,
+            checkpoints[target],
+            digest,
+        )
+        return response
+
+    # The staged archive each patched function now deploys from
+    uses: dict[str, str | None] = {}
+    results = _map_targets(patch, [*functions, *patched])
+    if staging is not None and (uses or staged):
+        staging.record(uses, staged)
+    _raise_target_failures(results, "patch")
+
+
+def _deploy(debug_mode: bool) -> None:
+    """
+    Deploy the cloud function to Google Cloud Platform.
+
+    Args:
+        debug_mode: Whether to enable debug logging
+
+    Raises:
+        DeployFailed: If deployment fails, carrying the original error's
+            message and HTTP status code
+    """
+    _logger.info("Starting cloud function deployment...")
+    failure: Exception | None = None
+
+    try:
+        targets = targets_from_env()
+        if len(targets) > 1:
+            _deploy_many(targets, debug_mode)
+        else:
+            _logger.info(f"Deploying function: {targets[0].path}")
+            _deploy_single(targets[0], debug_mode)
+    except Exception as e:
+        failure = e
         _handle_exception(e, debug_mode)
 
-    if deploy_failed:
-        raise DeployFailed("Deployment failed due to errors")
+    if failure is not None:
+        status_code = getattr(failure, "status_code", None) or error_status(failure)
+        raise DeployFailed(
+            f"Deployment failed due to errors: {failure}", status_code=status_code
+        ) from failure
+
+
+def _configure(debug_mode: bool) -> None:
+    """
+    Apply the configured settings to every target, leaving the source as is.
+
+    Only the fields that differ from a function's current definition are
+    patched, limited by an ``updateMask``; functions that already match
+    are not patched at all.
+
+    Args:
+        debug_mode: Whether to enable debug logging
+
+    Raises:
+        ValueError: If no setting to apply is configured
+        DeployFailed: If any target fails, listing the failed targets
+    """
+    desired = desired_config()
+    if not desired:
+        raise ValueError(
+            "config mode needs at least one of memory_mb, function_timeout, "
+            "max_instances, min_instances or environment_variables"
+        )
+
+    targets = targets_from_env()
+    _logger.info(f"Configuring {field_mask(desired)} on {len(targets)} targets")
+    credentials = _get_bq_credentials()
+    scheduler = RequestScheduler.from_env()
+
+    def configure(target: DeployTarget) -> dict[str, Any] | None:
+        cloud_functions = _cloud_functions_resource(credentials)
+        function = _get_function(cloud_functions, scheduler, target, debug_mode)
+        changes = config_changes(function, desired)
+        if not changes:
+            _logger.info(f"{target.path} already has the configured settings")
+            return None
+        mask = field_mask(changes)
+        _logger.info(f"Updating {mask} of {target.path}")
+        return _patch_function(
+            cloud_functions, scheduler, target, changes, debug_mode, mask
+        )
+
+    _raise_target_failures(_map_targets(configure, targets), "configure")
+
+
+def _rollback(debug_mode: bool) -> None:
+    """
+    Point every target back at a retained release, without packaging.
+
+    Functions deployed from their own GCS archive get the release copied
+    there server side; the others deploy straight from the retained
+    archive.
+
+    Args:
+        debug_mode: Whether to enable debug logging
+
+    Raises:
+        MissingConfigError: If ``state_bucket`` is not configured
+        DeployFailed: If any target fails, listing the failed targets
+    """
+    targets = targets_from_env()
+    credentials = _get_bq_credentials()
+    releases = _release_stores(credentials, targets)
+    if not releases:
+        _logger.error("rollback mode requires state_bucket to be set")
+        raise MissingConfigError("state_bucket")
+    selector = env_str("rollback_to")
+    scheduler = RequestScheduler.from_env()
+    staging = _staged_archives(credentials)
+
+    def rollback(target: DeployTarget) -> dict[str, Any]:
+        store = releases[target]
+        release = store.select(selector)
+        build = release.get("build_number", "unknown")
+        _logger.info(
+            f"Rolling back {target.path} to release {release['sha256'][:12]} "
+            f"from build {build}"
+        )
+        cloud_functions = _cloud_functions_resource(credentials)
+        function = _get_function(cloud_functions, scheduler, target, debug_mode)
+        archive_url = function.get("sourceArchiveUrl")
+        on_staged = staging is not None and staging.is_staged(archive_url)
+        if (
+            archive_url is not None
+            and not store.is_retained(archive_url)
+            and not on_staged
+        ):
+            _copy_archive(release["archive"], archive_url, credentials)
+        else:
+            function.pop("sourceUploadUrl", None)
+            function["sourceArchiveUrl"] = release["archive"]
+        response = _patch_function(
+            cloud_functions, scheduler, target, function, debug_mode
+        )
+        if on_staged and staging is not None:
+            staging.record({target.path: None})
+        store.mark_live(release["sha256"], response["name"])
+        _post_deploy(target, function, response, credentials, scheduler)
+        return response
+
+    _raise_target_failures(_map_targets(rollback, targets), "roll back")
+
+
+@contextmanager
+def _coalesced_deploy() -> Iterator[bool]:
+    """
+    Hold the deploy lock of every target when ``coalesce_deploys`` is enabled.
+
+    The locks are taken in the order of the function paths, so steps
+    sharing some of their targets cannot deadlock.
+
+    Yields:
+        True if this deploy should go ahead, False if a newer build of the
+        same pipeline superseded it while waiting for a lock
+
+    Raises:
+        MissingConfigError: If coalescing is enabled without ``state_bucket``
+    """
+    if not env_bool("coalesce_deploys"):
+        yield True
+        return
+
+    store = StateStore.from_env(_get_bq_credentials())
+    if store is None:
+        _logger.error("coalesce_deploys requires state_bucket to be set")
+        raise MissingConfigError("state_bucket")
+
+    build_number = os.environ.get("BUILDKITE_BUILD_NUMBER")
+    owner = os.environ.get("BUILDKITE_JOB_ID") or default_owner()
+    coalescers = [
+        DeployCoalescer(
+            store,
+            function_path=path,
+            pipeline=os.environ.get("BUILDKITE_PIPELINE_SLUG") or "default",
+            build_number=int(build_number) if build_number else None,
+            owner=owner,
+            lease_seconds=env_int("deploy_lock_lease", DEFAULT_LEASE_SECONDS),
+        )
+        for path in sorted(target.path for target in targets_from_env())
+    ]
+    held: list[DeployCoalescer] = []
+    try:
+        with tracing.span("acquire deploy lock", targets=len(coalescers)):
+            for coalescer in coalescers:
+                if not coalescer.acquire():
+                    break
+                held.append(coalescer)
+        yield len(held) == len(coalescers)
+    finally:
+        for coalescer in reversed(held):
+            coalescer.release()
 
 
 def main() -> None:
@@ -306,7 +1941,12 @@ def main() -> None:
             does not exist
         DeployFailed: If deployment fails
     """
+    profile: DeployProfile | None = None
     try:
+        tracing.configure()
+        profile = DeployProfile.from_env()
+        if profile is not None:
+            profile.start()
         env_debug_mode: str = os.environ.get("debug_mode", "False").title()
         debug_mode = ast.literal_eval(env_debug_mode)
 
@@ -316,16 +1956,46 @@ def main() -> None:
 
         _logger.info("Starting cloud function deployment process")
 
+        mode = env_str("mode", "deploy").lower()
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+
         _validate_env_variables()
-        if _validate_if_path_exists():
-            _deploy(debug_mode)
-            _logger.info("Cloud function deployment completed successfully")
-        else:
+        # Deploying a prebuilt archive, a release or only settings does not
+        # need the sources
+        needs_sources = mode == "package" or (
+            mode == "deploy" and not env_str("prebuilt_archive")
+        )
+        if needs_sources and not _validate_if_path_exists():
             cloud_function_directory = os.environ.get("cloud_function_directory", "")
             raise CloudFunctionDirectoryNonExistent(cloud_function_directory)
+
+        if mode == "package":
+            with tracing.span("package"):
+                _package(debug_mode)
+            _logger.info("Cloud function packaging completed successfully")
+            return
+
+        with _coalesced_deploy() as proceed:
+            if proceed and mode == "config":
+                with tracing.span("configure"):
+                    _configure(debug_mode)
+                _logger.info("Cloud function configuration completed successfully")
+            elif proceed and mode == "rollback":
+                with tracing.span("rollback"):
+                    _rollback(debug_mode)
+                _logger.info("Cloud function rollback completed successfully")
+            elif proceed:
+                with tracing.span("deploy"):
+                    _deploy(debug_mode)
+                _logger.info("Cloud function deployment completed successfully")
     except (CloudFunctionDirectoryNonExistent, DeployFailed, MissingConfigError):
         # Re-raise these custom exceptions as-is
         raise
     except Exception as e:
         _logger.error(f"Unexpected error during deployment: {e}")
         raise DeployFailed(f"Unexpected error: {e}") from e
+    finally:
+        if profile is not None:
+            profile.stop()
+        tracing.shutdown()
@@ -0,0 +1,94 @@
+"""Function settings applied by ``config`` mode without redeploying the source."""
+
+from collections.abc import Callable
+from typing import Any
+
+from plugin_scripts.config import env_int, env_str
+
+# Plugin setting, Cloud Functions API field and how the value is written
+_FIELDS: tuple[tuple[str, str, Callable[[int], Any]], ...] = (
+    ("memory_mb", "availableMemoryMb", int),
+    ("function_timeout", "timeout", lambda seconds: f"{seconds}s"),
+    ("max_instances", "maxInstances", int),
+    ("min_instances", "minInstances", int),
+)
+ENVIRONMENT_FIELD = "environmentVariables"
+
+# Values the API leaves out of a function definition when they are unset
+_API_DEFAULTS: dict[str, Any] = {
+    "maxInstances": 0,
+    "minInstances": 0,
+    ENVIRONMENT_FIELD: {},
+}
+
+
+def parse_environment(value: str) -> dict[str, str]:
+    """
+    Parse ``KEY=VALUE`` lines into environment variables.
+
+    Args:
+        value: One variable per line; values may contain ``=`` and commas
+
+    Returns:
+        The variables by name
+
+    Raises:
+        ValueError: If a line has no ``=`` or an empty name
+    """
+    variables = {}
+    for line in value.splitlines():
+        if not line.strip():
+            continue
+        name, separator, variable = line.partition("=")
+        if not separator or not name.strip():
+            raise ValueError(
+                f"Invalid environment variable {line!r}, expected KEY=VALUE"
+            )
+        variables[name.strip()] = variable
+    return variables
+
+
+def desired_config() -> dict[str, Any]:
+    """
+    Read the function settings ``config`` mode should apply.
+
+    ``environment_variables`` replaces the function's environment
+    variables as a whole; variables it does not list are removed.
+
+    Returns:
+        The configured fields, by Cloud Functions API name
+
+    Raises:
+        ValueError: If a setting is malformed
+    """
+    desired: dict[str, Any] = {}
+    for setting, field, convert in _FIELDS:
+        if env_str(setting):
+            desired[field] = convert(env_int(setting, 0))
+    environment = env_str("environment_variables")
+    if environment:
+        desired[ENVIRONMENT_FIELD] = parse_environment(environment)
+    return desired
+
+
+def config_changes(function: dict[str, Any], desired: dict[str, Any]) -> dict[str, Any]:
+    """
+    Pick the desired fields that differ from a function's definition.
+
+    Args:
+        function: The current function definition
+        desired: The fields to apply
+
+    Returns:
+        The fields that need patching
+    """
+    return {
+        field: value
+        for field, value in desired.items()
+        if function.get(field, _API_DEFAULTS.get(field)) != value
+    }
+
+
+def field_mask(changes: dict[str, Any]) -> str:
+    """Build the ``updateMask`` that limits a patch to the changed fields."""
+    return ",".join(sorted(changes))
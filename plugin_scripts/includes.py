@@ -0,0 +1,371 @@
+"""Shared source includes, compressed once into cached archive fragments."""
+
+import copy
+import hashlib
+import logging
+import os
+import struct
+import threading
+import zipfile
+from collections.abc import Callable, Iterable, Sequence
+from contextlib import closing
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.scanner import scan_tree
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_KEEP_FRAGMENTS = 64
+
+_CHUNK_SIZE = 1024 * 1024
+# Size of a local file header, and offset of its name and extra field lengths
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_LENGTHS_OFFSET = 26
+_DATA_DESCRIPTOR_FLAG = 0x08
+_ZIP64_EXTRA_ID = 0x0001
+# ZipFile internals splice relies on, checked so a zipfile change falls back
+_SPLICE_ATTRIBUTES = ("fp", "start_dir", "filelist", "NameToInfo")
+
+
+class IncludeMember(NamedTuple):
+    """A file of a shared include and where it goes in the archive."""
+
+    path: Path
+    arcname: str
+    mode: int
+
+
+class SharedInclude(NamedTuple):
+    """A file or directory outside the function directory mapped into its archive."""
+
+    source: Path
+    prefix: PurePosixPath
+
+    @classmethod
+    def parse(cls, value: str) -> "SharedInclude":
+        """
+        Parse a ``source`` or ``source:archive_path`` entry.
+
+        Without an archive path, the include keeps its name at the root of
+        the archive. ``.`` as archive path merges a directory into the root.
+
+        Args:
+            value: The entry from the ``shared_includes`` setting
+
+        Returns:
+            The parsed include
+
+        Raises:
+            ValueError: If the entry is malformed
+        """
+        source, _, target = value.strip().partition(":")
+        source = source.rstrip("/")
+        name = target.strip("/") if target else Path(source).name
+        if not source or not name:
+            raise ValueError(
+                f"Invalid shared include {value!r}, expected source or "
+                "source:archive_path"
+            )
+        prefix = PurePosixPath(name)
+        if ".." in prefix.parts:
+            raise ValueError(
+                f"Invalid shared include {value!r}, the archive path must stay "
+                "inside the archive"
+            )
+        return cls(Path(source), prefix)
+
+    def members(
+        self, exclude: Callable[[PurePosixPath], bool] | None = None
+    ) -> list[IncludeMember]:
+        """
+        List the files of the include.
+
+        Args:
+            exclude: Leave out the paths, relative to the include, it
+                matches. Excluded directories are not descended into.
+
+        Returns:
+            The files, in archive order
+
+        Raises:
+            DeployFailed: If the source does not exist
+        """
+        if self.source.is_file():
+            return [
+                IncludeMember(
+                    self.source, self.prefix.as_posix(), self.source.stat().st_mode
+                )
+            ]
+        if not self.source.is_dir():
+            raise DeployFailed(f"Shared include not found: {self.source}")
+        with closing(scan_tree(self.source, exclude)) as entries:
+            return [
+                IncludeMember(
+                    entry.path,
+                    (self.prefix / entry.relative).as_posix(),
+                    entry.stat.st_mode,
+                )
+                for entry in entries
+                if exclude is None or not exclude(entry.relative)
+            ]
+
+
+def fragment_digest(members: Iterable[IncludeMember]) -> str:
+    """
+    Hash the files of an include, independent of file timestamps.
+
+    Args:
+        members: The include's files
+
+    Returns:
+        Hex SHA-256 over every file's archive path, mode and contents
+    """
+    digest = hashlib.sha256()
+    for member in members:
+        digest.update(f"{member.arcname}\0{member.mode:o}\0".encode())
+        with member.path.open("rb") as f:
+            while chunk := f.read(_CHUNK_SIZE):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def includes_digest(source_digest: str, includes: Iterable[SharedInclude]) -> str:
+    """
+    Combine the digest of the function sources with its shared includes.
+
+    Args:
+        source_digest: Digest of the cloud function directory
+        includes: The shared includes
+
+    Returns:
+        Hex SHA-256 changing whenever the sources or an include change
+    """
+    digest = hashlib.sha256(source_digest.encode())
+    for include in includes:
+        digest.update(fragment_digest(include.members()).encode())
+    return digest.hexdigest()
+
+
+class FragmentCache:
+    """
+    Compressed fragments of shared includes, keyed by their contents.
+
+    A fragment is a zip of one include's files, named after their
+    ``fragment_digest``, so every function built from the same include
+    reuses it. The files keep the timestamps of the build that compressed
+    them. Using a fragment refreshes its modification time, and only the
+    ``keep`` most recently used fragments are kept. Fragments are moved
+    into place atomically so concurrent builds never see partial files.
+    """
+
+    def __init__(self, root: Path, keep: int = DEFAULT_KEEP_FRAGMENTS):
+        self.root = root
+        self.keep = keep
+
+    def fragment(self, members: Sequence[IncludeMember]) -> tuple[Path, bool]:
+        """
+        Provide the fragment of an include, compressing it on a miss.
+
+        Args:
+            members: The include's files
+
+        Returns:
+            The fragment and whether it was already cached
+        """
+        path = self.root / f"{fragment_digest(members)}.zip"
+        if path.is_file():
+            os.utime(path)
+            return path, True
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with zipfile.ZipFile(
+                staging, mode="w", compression=zipfile.ZIP_DEFLATED
+            ) as fragment:
+                for member in members:
+                    fragment.write(member.path, member.arcname)
+            staging.replace(path)
+        finally:
+            staging.unlink(missing_ok=True)
+        self.evict(keep=path)
+        return path, False
+
+    def evict(self, keep: Path | None = None) -> list[Path]:
+        """
+        Remove all but the ``keep`` most recently used fragments.
+
+        Args:
+            keep: A fragment in use, never evicted
+
+        Returns:
+            The evicted fragments
+        """
+        fragments = sorted(self.root.glob("*.zip"), key=_last_used, reverse=True)
+        evicted = [path for path in fragments[self.keep :] if path != keep]
+        for path in evicted:
+            path.unlink(missing_ok=True)
+        return evicted
+
+
+def _last_used(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        # Evicted by a concurrent build
+        return 0.0
+
+
+def _strip_zip64_extra(extra: bytes) -> bytes:
+    """Drop zip64 records from an extra field, the local header adds its own."""
+    kept = b""
+    while len(extra) >= 4:
+        header_id, size = struct.unpack("<HH", extra[:4])
+        if header_id != _ZIP64_EXTRA_ID:
+            kept += extra[: 4 + size]
+        extra = extra[4 + size :]
+    return kept
+
+
+def _can_splice(handler: zipfile.ZipFile) -> bool:
+    """Check whether this zipfile has the internals splice writes through."""
+    return all(hasattr(handler, name) for name in _SPLICE_ATTRIBUTES) and hasattr(
+        zipfile.ZipInfo, "FileHeader"
+    )
+
+
+def _copy_members(
+    handler: zipfile.ZipFile,
+    fragment_zip: zipfile.ZipFile,
+    members: Iterable[zipfile.ZipInfo],
+    on_write: Callable[[zipfile.ZipInfo], None] | None,
+) -> None:
+    """Copy fragment members through the public API, recompressing them."""
+    for info in members:
+        member = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+        member.external_attr = info.external_attr
+        member.compress_type = info.compress_type
+        handler.writestr(member, fragment_zip.read(info))
+        if on_write is not None:
+            on_write(member)
+
+
+def splice(
+    handler: zipfile.ZipFile,
+    fragment: Path,
+    skip: Iterable[str] = (),
+    on_write: Callable[[zipfile.ZipInfo], None] | None = None,
+) -> list[str]:
+    """
+    Copy the members of a fragment into an archive without recompressing.
+
+    The compressed data is copied as is behind a new local header, and the
+    members are registered with the archive so they are listed in its
+    central directory on close. This goes through ``ZipFile`` internals;
+    if a Python release drops them, the members are copied with
+    ``writestr`` instead, at the cost of recompressing them.
+
+    Args:
+        handler: ZipFile handler open for writing
+        fragment: The fragment to copy
+        skip: Names already in the archive, left out of the copy
+        on_write: Called with each member once it is written
+
+    Returns:
+        Names of the members copied
+    """
+    spliceable = _can_splice(handler)
+    if spliceable and handler.fp is None:
+        raise ValueError("Attempt to write to ZIP archive that was already closed")
+    output = handler.fp if spliceable else None
+    skip = set(skip)
+    copied = []
+    with fragment.open("rb") as source, zipfile.ZipFile(source) as fragment_zip:
+        members = [
+            info for info in fragment_zip.infolist() if info.filename not in skip
+        ]
+        if output is None:
+            _logger.debug("zipfile internals changed, copying the fragment instead")
+            _copy_members(handler, fragment_zip, members, on_write)
+            return [info.filename for info in members]
+        for info in members:
+            source.seek(info.header_offset + _LOCAL_LENGTHS_OFFSET)
+            name_length, extra_length = struct.unpack("<HH", source.read(4))
+            source.seek(
+                info.header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length
+            )
+            data = source.read(info.compress_size)
+
+            member = copy.copy(info)
+            member.flag_bits &= ~_DATA_DESCRIPTOR_FLAG
+            member.extra = _strip_zip64_extra(info.extra)
+            member.header_offset = handler.start_dir
+            header = member.FileHeader()
+            if output.tell() != handler.start_dir:
+                output.seek(handler.start_dir)
+            output.write(header)
+            output.write(data)
+            handler.start_dir += len(header) + len(data)
+            handler.filelist.append(member)
+            handler.NameToInfo[member.filename] = member
+            if on_write is not None:
+                on_write(member)
+            copied.append(member.filename)
+    return copied
+
+
+class SharedIncludes:
+    """The shared includes of a build and the cache of their fragments."""
+
+    def __init__(self, includes: Sequence[SharedInclude], cache: FragmentCache):
+        self.includes = includes
+        self.cache = cache
+
+    def splice_into(
+        self,
+        handler: zipfile.ZipFile,
+        exclude: Callable[[PurePosixPath], bool] | None = None,
+        on_write: Callable[[zipfile.ZipInfo], None] | None = None,
+    ) -> list[tuple[Path, str]]:
+        """
+        Add every include to an archive from its cached fragment.
+
+        Paths already in the archive win over the includes, so a function
+        can override a shared file.
+
+        Args:
+            handler: ZipFile handler open for writing
+            exclude: Leave out the include paths it matches
+            on_write: Called with each member once it is written
+
+        Returns:
+            The Python sources added, as path and archive path, so they can
+            be compiled to bytecode
+        """
+        written = {info.filename for info in handler.filelist}
+        sources = []
+        for include in self.includes:
+            members = include.members(exclude)
+            fragment, hit = self.cache.fragment(members)
+            copied = set(splice(handler, fragment, written, on_write))
+            overridden = len(members) - len(copied)
+            _logger.info(
+                f"Added {len(copied)} files of shared include {include.source} "
+                f"under {include.prefix}/ "
+                f"({'cached fragment' if hit else 'compressed fragment'})"
+            )
+            if overridden:
+                _logger.warning(
+                    f"{overridden} files of shared include {include.source} are "
+                    "already in the archive, keeping the function's copies"
+                )
+            written |= copied
+            sources += [
+                (member.path, member.arcname)
+                for member in members
+                if member.arcname in copied and member.arcname.endswith(".py")
+            ]
+        return sources
@@ -0,0 +1,85 @@
+"""Run-scoped inventory of the functions in each project and region."""
+
+import copy
+import logging
+import threading
+from collections.abc import Callable
+from typing import Any
+
+from plugin_scripts.scheduler import RequestScheduler
+from plugin_scripts.targets import DeployTarget
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_PAGE_SIZE = 1000
+
+
+class FunctionInventory:
+    """
+    Serve function definitions from one paginated ``list`` per location.
+
+    The first lookup in a project and region lists every function there;
+    later lookups in the same location are answered from memory. Concurrent
+    lookups of one location wait for a single listing.
+    """
+
+    def __init__(
+        self,
+        cloud_functions_factory: Callable[[], Any],
+        scheduler: RequestScheduler,
+        page_size: int = DEFAULT_PAGE_SIZE,
+    ):
+        self._factory = cloud_functions_factory
+        self._scheduler = scheduler
+        self.page_size = page_size
+        self._functions: dict[str, dict[str, dict[str, Any]]] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _location_lock(self, parent: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(parent, threading.Lock())
+
+    def _list(self, parent: str, quota_key: str) -> dict[str, dict[str, Any]]:
+        cloud_functions = self._factory()
+        functions: dict[str, dict[str, Any]] = {}
+        pages = 0
+        request = cloud_functions.list(parent=parent, pageSize=self.page_size)
+        while request is not None:
+            response = self._scheduler.execute(request, quota_key)
+            pages += 1
+            for function in response.get("functions", []):
+                functions[function["name"]] = function
+            request = cloud_functions.list_next(request, response)
+        _logger.info(f"Listed {len(functions)} functions in {parent} ({pages} pages)")
+        return functions
+
+    def functions(self, parent: str, quota_key: str) -> dict[str, dict[str, Any]]:
+        """
+        List the functions of a location, once per run.
+
+        Args:
+            parent: ``projects/<project>/locations/<region>``
+            quota_key: API quota bucket for the listing calls
+
+        Returns:
+            Function definitions by fully qualified name
+        """
+        with self._location_lock(parent):
+            if parent not in self._functions:
+                self._functions[parent] = self._list(parent, quota_key)
+            return self._functions[parent]
+
+    def get(self, target: DeployTarget) -> dict[str, Any] | None:
+        """
+        Look up a function definition.
+
+        Args:
+            target: The function to look up
+
+        Returns:
+            A copy of the definition, safe to modify, or None if the
+            function does not exist
+        """
+        function = self.functions(target.parent, target.quota_key).get(target.path)
+        return copy.deepcopy(function)
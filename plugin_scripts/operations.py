@@ -0,0 +1,64 @@
+"""Long running operations started by Cloud Functions API calls."""
+
+import logging
+import time
+from collections.abc import Callable
+from typing import Any
+
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.scheduler import RequestScheduler
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_OPERATION_TIMEOUT = 900.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+def wait_for_operation(
+    operations: Any,
+    scheduler: RequestScheduler,
+    name: str,
+    quota_key: str,
+    timeout: float = DEFAULT_OPERATION_TIMEOUT,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], None] = time.sleep,
+) -> dict[str, Any]:
+    """
+    Block until an operation, such as a function rollout, has finished.
+
+    Args:
+        operations: The Cloud Functions API ``operations`` resource
+        scheduler: Scheduler used to rate limit the polls
+        name: Name of the operation
+        quota_key: Quota bucket key for the function's location
+        timeout: Seconds to wait before giving up
+        poll_interval: Seconds between polls
+        clock: Monotonic clock, replaceable in tests
+        sleep: Sleep function, replaceable in tests
+
+    Returns:
+        The finished operation
+
+    Raises:
+        DeployFailed: If the operation failed or did not finish in time
+    """
+    deadline = clock() + timeout
+    while True:
+        operation = scheduler.execute(operations.get(name=name), quota_key)
+        if operation.get("done"):
+            break
+        if clock() >= deadline:
+            raise DeployFailed(
+                f"Timed out after {timeout:.0f}s waiting for operation {name}"
+            )
+        _logger.info(f"Operation {name} is running, checking again in {poll_interval}s")
+        sleep(poll_interval)
+
+    error = operation.get("error")
+    if error:
+        raise DeployFailed(
+            f"Operation {name} failed: {error.get('message', 'unknown error')}"
+        )
+    _logger.info(f"Operation {name} finished")
+    return operation
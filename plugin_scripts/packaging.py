@@ -0,0 +1,112 @@
+"""Archive digests and manifests for prebuilt function packages."""
+
+import hashlib
+import json
+import zipfile
+from pathlib import Path
+from typing import Any, BinaryIO
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def archive_digest(data: BinaryIO) -> str:
+    """
+    Hash an archive, leaving the stream positioned at the start.
+
+    Args:
+        data: Seekable binary stream containing the archive
+
+    Returns:
+        Hex SHA-256 of the archive bytes
+    """
+    digest = hashlib.sha256()
+    data.seek(0)
+    while chunk := data.read(_CHUNK_SIZE):
+        digest.update(chunk)
+    data.seek(0)
+    return digest.hexdigest()
+
+
+def manifest_path(archive_path: Path) -> Path:
+    """Return where the manifest for an archive is written."""
+    return archive_path.with_name(archive_path.stem + MANIFEST_SUFFIX)
+
+
+def describe_archive(data: BinaryIO) -> dict[str, Any]:
+    """
+    Describe an archive's contents, leaving the stream positioned at the start.
+
+    Args:
+        data: Seekable binary stream containing the archive
+
+    Returns:
+        The archive digest, total size and per-file sizes
+    """
+    digest = archive_digest(data)
+    with zipfile.ZipFile(data) as archive:
+        files = [
+            {
+                "path": info.filename,
+                "size": info.file_size,
+                "compressed_size": info.compress_size,
+            }
+            for info in archive.infolist()
+            if not info.is_dir()
+        ]
+    size = data.seek(0, 2)
+    data.seek(0)
+    return {"sha256": digest, "size": size, "files": files}
+
+
+def build_manifest(archive_path: Path, function_name: str) -> dict[str, Any]:
+    """
+    Describe a packaged archive.
+
+    Args:
+        archive_path: The zip archive
+        function_name: Name of the function the archive was built for
+
+    Returns:
+        Manifest with the archive digest, total size and per-file sizes
+    """
+    with archive_path.open("rb") as data:
+        description = describe_archive(data)
+    return {
+        "function_name": function_name,
+        "archive": archive_path.name,
+        **description,
+    }
+
+
+def write_manifest(archive_path: Path, manifest: dict[str, Any]) -> Path:
+    """
+    Write a manifest next to its archive.
+
+    Args:
+        archive_path: The zip archive
+        manifest: Manifest returned by build_manifest
+
+    Returns:
+        Path of the written manifest
+    """
+    path = manifest_path(archive_path)
+    path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return path
+
+
+def read_manifest(archive_path: Path) -> dict[str, Any] | None:
+    """
+    Read the manifest stored next to an archive, if there is one.
+
+    Args:
+        archive_path: The zip archive
+
+    Returns:
+        The manifest, or None if it does not exist
+    """
+    path = manifest_path(archive_path)
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text())
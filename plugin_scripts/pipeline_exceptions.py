@@ -12,10 +12,45 @@ class CloudFunctionDirectoryNonExistent(Exception):
 class DeployFailed(Exception):
     """Raised when the deployment to Google Cloud Functions fails."""
 
-    def __init__(self, message: str = "Deployment to Cloud Function failed"):
+    def __init__(
+        self,
+        message: str = "Deployment to Cloud Function failed",
+        status_code: int | None = None,
+    ):
+        self.status_code = status_code
         super().__init__(message)
 
 
+class SourceValidationFailed(DeployFailed):
+    """Raised when pre-flight checks find problems in the function sources."""
+
+    def __init__(self, problems: list[str]):
+        self.problems = problems
+        details = "\n".join(f"  {problem}" for problem in problems)
+        super().__init__(f"Pre-flight checks failed:\n{details}")
+
+
+class ArchiveTooLarge(DeployFailed):
+    """Raised when the function archive grows past its size budget."""
+
+    def __init__(self, size: int, budget: int, report: str = ""):
+        self.size = size
+        self.budget = budget
+        self.report = report
+        message = f"Archive exceeded its size budget: {size} > {budget} bytes"
+        super().__init__(f"{message}\n{report}" if report else message)
+
+
+class BenchmarkRegression(DeployFailed):
+    """Raised when the post-deploy benchmark is slower than the previous deploy."""
+
+    def __init__(self, function_path: str, problems: list[str]):
+        self.function_path = function_path
+        self.problems = problems
+        details = "; ".join(problems)
+        super().__init__(f"Benchmark of {function_path} regressed: {details}")
+
+
 class MissingConfigError(Exception):
     """Raised when a required configuration parameter is missing."""
 
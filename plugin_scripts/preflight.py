@@ -0,0 +1,177 @@
+"""Checks run on function sources before they are packaged and uploaded."""
+
+import ast
+import logging
+import os
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from packaging.requirements import InvalidRequirement, Requirement
+
+from plugin_scripts.scanner import scan_tree
+
+_logger = logging.getLogger("cloud-function")
+
+MAIN_MODULE = "main.py"
+REQUIREMENTS_FILE = "requirements.txt"
+
+# Below this many files a process pool costs more than it saves
+_POOL_THRESHOLD = 32
+
+
+def _compile_file(path: str, relative: str) -> str | None:
+    """Byte-compile one file in memory, returning its error if it has one."""
+    try:
+        with open(path, "rb") as f:  # noqa: PTH123 - runs in worker processes
+            compile(f.read(), relative, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return f"{relative}:{e.lineno}: {e.msg}"
+    return None
+
+
+def compile_sources(directory: Path, max_workers: int | None = None) -> list[str]:
+    """
+    Byte-compile every Python file, in parallel for larger functions.
+
+    Args:
+        directory: The cloud function directory
+        max_workers: Size of the process pool, defaults to the CPU count
+
+    Returns:
+        One message per file that does not compile
+    """
+    files = [entry for entry in scan_tree(directory) if entry.path.suffix == ".py"]
+    paths = [str(entry.path) for entry in files]
+    relatives = [entry.relative.as_posix() for entry in files]
+
+    if len(files) < _POOL_THRESHOLD:
+        results = list(map(_compile_file, paths, relatives))
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(files) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(_compile_file, paths, relatives, chunksize=chunksize)
+            )
+
+    _logger.info(f"Compiled {len(files)} Python files")
+    return [error for error in results if error is not None]
+
+
+def _top_level_names(statements: list[ast.stmt]) -> set[str]:
+    names: set[str] = set()
+    for node in statements:
+        if isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef):
+            names.add(node.name)
+        elif isinstance(node, ast.Assign):
+            names.update(t.id for t in node.targets if isinstance(t, ast.Name))
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            names.add(node.target.id)
+        elif isinstance(node, ast.Import | ast.ImportFrom):
+            names.update(
+                alias.asname or alias.name.split(".")[0] for alias in node.names
+            )
+        elif isinstance(node, ast.If | ast.Try | ast.With):
+            # Definitions guarded by feature checks or optional imports
+            for block in ("body", "orelse", "finalbody"):
+                names |= _top_level_names(getattr(node, block, []))
+            for handler in getattr(node, "handlers", []):
+                names |= _top_level_names(handler.body)
+    return names
+
+
+def check_entry_points(directory: Path, entry_points: Iterable[str]) -> list[str]:
+    """
+    Check that ``main.py`` defines every entry point.
+
+    Args:
+        directory: The cloud function directory
+        entry_points: Names the deployed functions invoke
+
+    Returns:
+        One message per missing entry point
+    """
+    main = directory / MAIN_MODULE
+    if not main.is_file():
+        return [f"{MAIN_MODULE} not found in {directory}"]
+    try:
+        tree = ast.parse(main.read_bytes(), MAIN_MODULE)
+    except SyntaxError:
+        # Reported by compile_sources
+        return []
+
+    names = _top_level_names(tree.body)
+    if "*" in names:
+        # A star import may provide anything
+        return []
+    return [
+        f"Entry point {name!r} is not defined in {MAIN_MODULE}"
+        for name in sorted(set(entry_points))
+        if name not in names
+    ]
+
+
+def _requirement_lines(text: str) -> Iterable[tuple[int, str]]:
+    lineno = 0
+    pending = ""
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not pending:
+            lineno = number
+        line = line.split(" #", 1)[0].rstrip()
+        if line.endswith("\\"):
+            pending += line[:-1] + " "
+            continue
+        line = (pending + line).strip()
+        pending = ""
+        if line and not line.startswith("#"):
+            yield lineno, line
+
+
+def check_requirements(directory: Path) -> list[str]:
+    """
+    Check the syntax of ``requirements.txt``.
+
+    pip options such as ``--index-url`` and ``-r`` lines are skipped and
+    per-requirement options such as ``--hash`` are ignored.
+
+    Args:
+        directory: The cloud function directory
+
+    Returns:
+        One message per invalid line
+    """
+    requirements = directory / REQUIREMENTS_FILE
+    if not requirements.is_file():
+        return []
+
+    errors = []
+    for lineno, line in _requirement_lines(requirements.read_text()):
+        if line.startswith("-"):
+            continue
+        specifier = line.split(" --", 1)[0].strip()
+        try:
+            Requirement(specifier)
+        except InvalidRequirement as e:
+            errors.append(f"{REQUIREMENTS_FILE}:{lineno}: {e}")
+    return errors
+
+
+def validate_sources(
+    directory: Path, entry_points: Iterable[str], max_workers: int | None = None
+) -> list[str]:
+    """
+    Run every pre-flight check on a Python function's sources.
+
+    Args:
+        directory: The cloud function directory
+        entry_points: Names the deployed functions invoke
+        max_workers: Size of the byte-compile process pool
+
+    Returns:
+        Every problem found, empty when the sources look deployable
+    """
+    problems = compile_sources(directory, max_workers)
+    problems += check_entry_points(directory, entry_points)
+    problems += check_requirements(directory)
+    return problems
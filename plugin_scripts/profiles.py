@@ -0,0 +1,194 @@
+"""Packaging profiles: which files of a function's sources go into its archive."""
+
+import logging
+import re
+from collections.abc import Iterable
+from fnmatch import fnmatchcase
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+from plugin_scripts.config import env_list, env_str
+
+_logger = logging.getLogger("cloud-function")
+
+PROFILE_AUTO = "auto"
+PROFILE_NONE = "none"
+PROFILE_GENERIC = "generic"
+
+_RUNTIME_FAMILY = re.compile(r"^([a-z]+?)\d*$")
+
+
+class PackagingProfile(NamedTuple):
+    """
+    Paths left out of a runtime's archives.
+
+    Patterns without a ``/`` match any file or directory name, patterns
+    with one match the path relative to the function directory. Both use
+    shell wildcards. ``installed`` pairs a directory with the manifest that
+    makes the remote build install it; the directory is only left out when
+    the manifest is present.
+    """
+
+    name: str
+    exclude: tuple[str, ...] = ()
+    include: tuple[str, ...] = ()
+    installed: tuple[tuple[str, str], ...] = ()
+
+    def extend(
+        self, exclude: Iterable[str] = (), include: Iterable[str] = ()
+    ) -> "PackagingProfile":
+        """
+        Add patterns to the profile.
+
+        Args:
+            exclude: More paths to leave out
+            include: Paths to keep even when an exclude pattern matches them
+
+        Returns:
+            The extended profile
+        """
+        return self._replace(
+            exclude=self.exclude + tuple(exclude),
+            include=self.include + tuple(include),
+        )
+
+    def for_directory(self, directory: Path) -> "PackagingProfile":
+        """
+        Resolve ``installed`` against a function directory.
+
+        Args:
+            directory: The cloud function directory
+
+        Returns:
+            The profile with the directories the build will install excluded
+        """
+        installed = tuple(
+            path
+            for path, manifest in self.installed
+            if (directory / manifest).is_file()
+        )
+        return self._replace(exclude=self.exclude + installed, installed=())
+
+    def excludes(self, relative: PurePosixPath) -> bool:
+        """
+        Check whether a path is left out of the archive.
+
+        Args:
+            relative: Path relative to the function directory
+
+        Returns:
+            True when an exclude pattern matches and no include pattern does
+        """
+        return _matches(relative, self.exclude) and not _matches(relative, self.include)
+
+
+def _matches(relative: PurePosixPath, patterns: Iterable[str]) -> bool:
+    path = relative.as_posix()
+    for pattern in patterns:
+        pattern = pattern.strip("/")
+        if "/" in pattern:
+            if fnmatchcase(path, pattern):
+                return True
+        elif fnmatchcase(relative.name, pattern):
+            return True
+    return False
+
+
+_COMMON_EXCLUDE = (
+    ".git",
+    ".gitignore",
+    ".gcloudignore",
+    ".hg",
+    ".svn",
+    ".DS_Store",
+    ".idea",
+    ".vscode",
+)
+
+PROFILES = {
+    PROFILE_NONE: PackagingProfile(PROFILE_NONE),
+    PROFILE_GENERIC: PackagingProfile(PROFILE_GENERIC, _COMMON_EXCLUDE),
+    "python": PackagingProfile(
+        "python",
+        _COMMON_EXCLUDE
+        + (
+            "__pycache__",
+            "*.py[co]",
+            ".venv",
+            "venv",
+            "*.egg-info",
+            ".pytest_cache",
+            ".mypy_cache",
+            ".ruff_cache",
+            ".tox",
+            ".coverage",
+            "tests",
+            "conftest.py",
+        ),
+    ),
+    "nodejs": PackagingProfile(
+        "nodejs",
+        _COMMON_EXCLUDE + ("__tests__", "coverage", ".nyc_output", ".npm"),
+        installed=(("node_modules", "package.json"),),
+    ),
+    "go": PackagingProfile("go", _COMMON_EXCLUDE + ("*_test.go", "testdata")),
+    "java": PackagingProfile(
+        "java", _COMMON_EXCLUDE + ("target", "build", ".gradle", "src/test")
+    ),
+    "ruby": PackagingProfile(
+        "ruby",
+        _COMMON_EXCLUDE + (".bundle", "spec", "test"),
+        installed=(("vendor/bundle", "Gemfile"),),
+    ),
+    "php": PackagingProfile(
+        "php", _COMMON_EXCLUDE + ("tests",), installed=(("vendor", "composer.json"),)
+    ),
+    "dotnet": PackagingProfile("dotnet", _COMMON_EXCLUDE + ("bin", "obj")),
+}
+
+
+def runtime_family(runtime: str) -> str:
+    """
+    Name the language of a Cloud Functions runtime.
+
+    Args:
+        runtime: Runtime identifier, e.g. ``nodejs20``
+
+    Returns:
+        The runtime without its version, e.g. ``nodejs``
+    """
+    match = _RUNTIME_FAMILY.match(runtime)
+    return match.group(1) if match else runtime
+
+
+def select_profile(runtimes: Iterable[str]) -> PackagingProfile:
+    """
+    Pick the profile from the ``packaging_profile`` setting or the runtimes.
+
+    ``auto`` uses the profile of the runtimes' language, or ``generic``
+    when they differ or have no profile. ``package_exclude`` and
+    ``package_include`` are added to the selected profile.
+
+    Args:
+        runtimes: Runtimes of the functions the archive is deployed to
+
+    Returns:
+        The profile
+
+    Raises:
+        ValueError: If ``packaging_profile`` names an unknown profile
+    """
+    name = env_str("packaging_profile", PROFILE_AUTO).lower() or PROFILE_AUTO
+    if name == PROFILE_AUTO:
+        families = {runtime_family(runtime) for runtime in runtimes if runtime}
+        name = families.pop() if len(families) == 1 else PROFILE_GENERIC
+        if name not in PROFILES:
+            name = PROFILE_GENERIC
+    elif name not in PROFILES:
+        known = ", ".join(sorted([PROFILE_AUTO, *PROFILES]))
+        raise ValueError(f"Unknown packaging_profile {name!r}, expected one of {known}")
+
+    _logger.info(f"Using the {name} packaging profile")
+    return PROFILES[name].extend(
+        env_list("package_exclude"), env_list("package_include")
+    )
@@ -0,0 +1,135 @@
+"""CPU and memory profiling of a deploy, uploaded as build artifacts."""
+
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import tracemalloc
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+from plugin_scripts import buildkite
+from plugin_scripts.config import env_bool, env_int, env_str
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_PROFILE_DIR = "cloud-functions-profile"
+DEFAULT_TOP = 30
+PROFILE_FILE = "deploy.prof"
+CPU_REPORT_FILE = "cpu.txt"
+ALLOCATIONS_FILE = "allocations.txt"
+# Allocations made by the profilers themselves
+_IGNORED_FRAMES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+# Before Python 3.12 a profiler only sees the thread that enabled it; since
+# then it sees every thread and only one can be enabled at a time
+_PROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+
+class DeployProfile:
+    """
+    Run the deploy under ``cProfile`` and ``tracemalloc``.
+
+    On stop it writes three files to ``output_dir``: the raw profile,
+    loadable with ``pstats`` or snakeviz, the functions with the most
+    cumulative time, and the lines that allocated the most memory. The
+    threads targets are deployed on are profiled too.
+    """
+
+    def __init__(self, output_dir: Path, top: int = DEFAULT_TOP):
+        self.output_dir = output_dir
+        self.top = top
+        self._profiler = cProfile.Profile()
+        self._thread_profilers: list[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "DeployProfile | None":
+        """
+        Build the profile from ``profile``, ``profile_dir`` and ``profile_top``.
+
+        Returns:
+            The profile, or None when profiling is disabled
+        """
+        if not env_bool("profile"):
+            return None
+        return cls(
+            Path(env_str("profile_dir", DEFAULT_PROFILE_DIR)),
+            max(1, env_int("profile_top", DEFAULT_TOP)),
+        )
+
+    def _profile_thread(self, frame: FrameType, event: str, arg: Any) -> None:
+        """Give a thread started while profiling a profiler of its own."""
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._thread_profilers.append(profiler)
+        profiler.enable()
+
+    def start(self) -> None:
+        """Start measuring CPU time and memory allocations."""
+        tracemalloc.start()
+        if _PROFILE_PER_THREAD:
+            threading.setprofile(self._profile_thread)
+        self._profiler.enable()
+
+    def stop(self) -> list[Path]:
+        """
+        Stop measuring, write the reports and upload them as artifacts.
+
+        Failing to write or upload the reports is logged and never fails
+        the deploy.
+
+        Returns:
+            The files written
+        """
+        self._profiler.disable()
+        if _PROFILE_PER_THREAD:
+            threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_FRAMES)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        cpu_report = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=cpu_report)
+        with self._lock:
+            for profiler in self._thread_profilers:
+                stats.add(profiler)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+
+        allocations = [
+            f"Peak traced memory: {peak / 1024:.1f} KiB, "
+            f"{current / 1024:.1f} KiB still allocated at exit",
+            f"Top {self.top} allocation sites:",
+            *(str(stat) for stat in snapshot.statistics("lineno")[: self.top]),
+        ]
+
+        files = [
+            self.output_dir / PROFILE_FILE,
+            self.output_dir / CPU_REPORT_FILE,
+            self.output_dir / ALLOCATIONS_FILE,
+        ]
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(files[0])
+            files[1].write_text(cpu_report.getvalue())
+            files[2].write_text("\n".join(allocations) + "\n")
+        except OSError as e:
+            _logger.warning(f"Could not write the deploy profile: {e}")
+            return []
+        _logger.info(
+            f"Wrote the deploy profile to {self.output_dir}, "
+            f"peak traced memory {peak / 1024 / 1024:.1f} MiB"
+        )
+
+        if buildkite.agent_path() is not None:
+            try:
+                buildkite.artifact_upload(*(str(path) for path in files))
+            except Exception as e:
+                _logger.warning(f"Could not upload the deploy profile: {e}")
+        return files
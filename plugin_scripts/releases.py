@@ -0,0 +1,239 @@
+"""Retained releases of a function's archive, for rollbacks without a rebuild."""
+
+import logging
+from collections.abc import Callable
+from datetime import UTC, datetime
+from typing import Any, BinaryIO
+
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts import buildkite
+from plugin_scripts.bandwidth import shaped
+from plugin_scripts.packaging import MANIFEST_SUFFIX, describe_archive
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.state import StateStore
+
+_logger = logging.getLogger("cloud-function")
+
+# Shortest archive digest prefix ``rollback_to`` accepts
+MIN_DIGEST_PREFIX = 7
+
+
+class ReleaseStore:
+    """
+    The last archives deployed to one function, kept in ``state_bucket``.
+
+    Every release is an archive and its manifest under
+    ``releases/<function>/``, named by the archive's SHA-256. The
+    ``index.json`` document next to them lists the releases newest first
+    and records which one is live. It is updated with a generation
+    precondition so concurrent deploys cannot drop each other's releases.
+    """
+
+    def __init__(self, store: StateStore, function_path: str, keep: int = 0):
+        self.store = store
+        self.function_path = function_path
+        self.keep = keep
+
+    @property
+    def prefix(self) -> str:
+        """State store key prefix of the function's releases."""
+        return f"releases/{self.function_path}"
+
+    @property
+    def index_key(self) -> str:
+        """State store key of the release index."""
+        return f"{self.prefix}/index.json"
+
+    def archive_key(self, digest: str) -> str:
+        """State store key of a retained archive."""
+        return f"{self.prefix}/{digest}.zip"
+
+    def manifest_key(self, digest: str) -> str:
+        """State store key of a retained archive's manifest."""
+        return f"{self.prefix}/{digest}{MANIFEST_SUFFIX}"
+
+    def is_retained(self, url: str | None) -> bool:
+        """Check whether a ``gs://`` URL points at one of the retained archives."""
+        return bool(url) and str(url).startswith(f"{self.store.url(self.prefix)}/")
+
+    def retain(self, data: BinaryIO, copy_of: "ReleaseStore | None" = None) -> str:
+        """
+        Keep an archive that is about to be deployed, with its manifest.
+
+        The archive only becomes a release once ``record`` is called after
+        the function was patched, or is deleted by ``discard`` if the patch
+        fails.
+
+        Args:
+            data: The archive, left positioned at the start
+            copy_of: Another function's store that already retained the
+                archive, copied from server side instead of uploading
+
+        Returns:
+            SHA-256 of the archive
+        """
+        description = describe_archive(data)
+        digest = description["sha256"]
+        blob = self.store.blob(self.archive_key(digest))
+        if blob.exists():
+            _logger.info(f"Release {digest[:12]} is already retained")
+        elif copy_of is not None:
+            source = copy_of.store.blob(copy_of.archive_key(digest))
+            token, _, _ = blob.rewrite(source)
+            while token is not None:
+                token, _, _ = blob.rewrite(source, token=token)
+        else:
+            blob.upload_from_file(
+                shaped(data, blob), rewind=True, content_type="application/zip"
+            )
+            data.seek(0)
+        self.store.write_json(
+            self.manifest_key(digest),
+            {
+                "function_name": self.function_path,
+                **description,
+                **buildkite.build_info(),
+            },
+        )
+        _logger.info(f"Retained archive at {self.store.url(self.archive_key(digest))}")
+        return digest
+
+    def discard(self, digest: str) -> None:
+        """
+        Delete an archive retained for a deploy that failed.
+
+        Archives the index lists are kept, as an earlier deploy of the same
+        sources made them a release.
+
+        Args:
+            digest: SHA-256 returned by ``retain``
+        """
+        releases, _ = self.releases()
+        if any(release["sha256"] == digest for release in releases):
+            return
+        self.store.delete(self.archive_key(digest))
+        self.store.delete(self.manifest_key(digest))
+        _logger.info(f"Discarded archive {digest[:12]} retained for a failed deploy")
+
+    def releases(self) -> tuple[list[dict[str, Any]], str | None]:
+        """
+        Read the release index.
+
+        Returns:
+            The releases, newest first, and the digest of the live one
+        """
+        index, _ = self.store.read_json(self.index_key)
+        if not index:
+            return [], None
+        return index["releases"], index.get("live")
+
+    def _update(self, change: Callable[[dict[str, Any]], dict[str, Any]]) -> None:
+        """Apply a change to the index, retrying when another writer wins."""
+        while True:
+            index, generation = self.store.read_json(self.index_key)
+            try:
+                self.store.write_json(
+                    self.index_key,
+                    change(index or {"releases": [], "live": None}),
+                    if_generation_match=generation,
+                )
+                return
+            except PreconditionFailed:
+                continue
+
+    def record(self, digest: str, operation: str | None = None) -> None:
+        """
+        Make a retained archive the newest, live release.
+
+        Releases beyond the newest ``keep`` are dropped from the index and
+        their archives and manifests deleted.
+
+        Args:
+            digest: SHA-256 returned by ``retain``
+            operation: The patch operation that deployed it
+        """
+        pruned: list[dict[str, Any]] = []
+
+        def add(index: dict[str, Any]) -> dict[str, Any]:
+            release = {
+                "sha256": digest,
+                "archive": self.store.url(self.archive_key(digest)),
+                "deployed_at": datetime.now(UTC).isoformat(timespec="seconds"),
+                "operation": operation,
+                **buildkite.build_info(),
+            }
+            others = [r for r in index["releases"] if r["sha256"] != digest]
+            releases = [release, *others]
+            pruned[:] = releases[max(self.keep, 1) :]
+            return {"releases": releases[: max(self.keep, 1)], "live": digest}
+
+        self._update(add)
+        for release in pruned:
+            self.store.delete(self.archive_key(release["sha256"]))
+            self.store.delete(self.manifest_key(release["sha256"]))
+        if pruned:
+            _logger.info(f"Pruned {len(pruned)} releases of {self.function_path}")
+
+    def mark_live(self, digest: str, operation: str | None = None) -> None:
+        """
+        Record that the function was rolled back to a release.
+
+        Args:
+            digest: SHA-256 of the release now deployed
+            operation: The patch operation that deployed it
+        """
+
+        def roll_back(index: dict[str, Any]) -> dict[str, Any]:
+            for release in index["releases"]:
+                if release["sha256"] == digest:
+                    release["rolled_back_at"] = datetime.now(UTC).isoformat(
+                        timespec="seconds"
+                    )
+                    release["operation"] = operation
+            return {**index, "live": digest}
+
+        self._update(roll_back)
+
+    def select(self, selector: str = "") -> dict[str, Any]:
+        """
+        Choose the release to roll back to.
+
+        Args:
+            selector: A build number or an archive SHA-256 prefix; empty
+                picks the release deployed before the live one
+
+        Returns:
+            The release from the index
+
+        Raises:
+            DeployFailed: If no retained release matches
+        """
+        releases, live = self.releases()
+        if not releases:
+            raise DeployFailed(
+                f"No retained releases of {self.function_path}", status_code=404
+            )
+
+        if not selector:
+            position = next(
+                (i for i, r in enumerate(releases) if r["sha256"] == live), 0
+            )
+            if position + 1 >= len(releases):
+                raise DeployFailed(
+                    f"No release of {self.function_path} is older than the live one",
+                    status_code=404,
+                )
+            return releases[position + 1]
+
+        by_build = [r for r in releases if r.get("build_number") == selector]
+        if by_build:
+            return by_build[0]
+        if len(selector) >= MIN_DIGEST_PREFIX:
+            by_digest = [r for r in releases if r["sha256"].startswith(selector)]
+            if len(by_digest) == 1:
+                return by_digest[0]
+        raise DeployFailed(
+            f"No single retained release of {self.function_path} matches {selector!r}",
+            status_code=404,
+        )
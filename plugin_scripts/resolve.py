@@ -0,0 +1,305 @@
+"""Resolve a function's requirements locally before GCP builds it."""
+
+import hashlib
+import json
+import logging
+import re
+import subprocess  # noqa: S404 - running pip from the current interpreter
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from packaging.markers import InvalidMarker, Marker
+
+from plugin_scripts.cache import cache_path
+from plugin_scripts.config import env_float, env_list, env_str
+from plugin_scripts.preflight import REQUIREMENTS_FILE
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_TIMEOUT = 300.0
+# Linux platforms the Cloud Functions Python runtimes can load wheels for
+DEFAULT_PLATFORMS = ("manylinux_2_28_x86_64", "manylinux2014_x86_64", "linux_x86_64")
+
+_INCLUDE = re.compile(r"^(-r|--requirement|-c|--constraint)[\s=]+(\S+)")
+_ERROR_LINES = 20
+
+
+def _requirement_files(path: Path, seen: set[Path] | None = None) -> list[Path]:
+    """List a requirements file and every file it includes with -r or -c."""
+    seen = seen if seen is not None else set()
+    path = path.resolve()
+    if path in seen or not path.is_file():
+        return []
+    seen.add(path)
+    files = [path]
+    for line in path.read_text().splitlines():
+        match = _INCLUDE.match(line.strip())
+        if match:
+            files += _requirement_files(path.parent / match.group(2), seen)
+    return files
+
+
+def requirements_digest(requirements: Path, *context: str) -> str:
+    """
+    Hash a requirements file, the files it includes and extra context.
+
+    Args:
+        requirements: The requirements file
+        context: Other values the result depends on, such as the index
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    for value in context:
+        digest.update(value.encode() + b"\0")
+    for path in _requirement_files(requirements):
+        digest.update(path.name.encode() + b"\0" + path.read_bytes() + b"\0")
+    return digest.hexdigest()
+
+
+def runtime_environment(python_version: tuple[int, int]) -> dict[str, str]:
+    """
+    Describe a Cloud Functions Python runtime for environment markers.
+
+    Args:
+        python_version: Python version of the runtime
+
+    Returns:
+        Marker variables as ``packaging.markers`` evaluates them
+    """
+    version = f"{python_version[0]}.{python_version[1]}"
+    return {
+        "python_version": version,
+        "python_full_version": f"{version}.0",
+        "implementation_name": "cpython",
+        "platform_python_implementation": "CPython",
+        "os_name": "posix",
+        "sys_platform": "linux",
+        "platform_system": "Linux",
+        "platform_machine": "x86_64",
+    }
+
+
+def _evaluate_markers(
+    path: Path,
+    environment: dict[str, str],
+    destination: Path,
+    written: dict[Path, Path],
+) -> Path:
+    """
+    Copy a requirements file and its includes with markers evaluated.
+
+    Requirements whose marker is false for ``environment`` are left out and
+    the markers of the others are dropped, since pip evaluates them for the
+    interpreter running it. Invalid markers are kept for pip to report.
+
+    Args:
+        path: The requirements file
+        environment: Marker variables of the runtime
+        destination: Directory the copies are written to
+        written: Copies already written, by original path
+
+    Returns:
+        The copy
+    """
+    path = path.resolve()
+    if path in written:
+        return written[path]
+    copy = destination / f"{len(written)}-{path.name}"
+    written[path] = copy
+    lines = []
+    for line in path.read_text().splitlines():
+        stripped = line.strip()
+        include = _INCLUDE.match(stripped)
+        if include and (path.parent / include.group(2)).is_file():
+            included = path.parent / include.group(2)
+            copied = _evaluate_markers(included, environment, destination, written)
+            line = f"{include.group(1)} {copied.name}"
+        elif stripped and not stripped.startswith(("#", "-")) and ";" in stripped:
+            requirement, _, marker = stripped.partition(";")
+            try:
+                if not Marker(marker.split(" #")[0]).evaluate(environment):
+                    continue
+                line = requirement.strip()
+            except InvalidMarker:
+                pass
+        lines.append(line)
+    copy.write_text("\n".join(lines) + "\n")
+    return copy
+
+
+class DependencyResolver:
+    """
+    Resolve requirements with ``pip install --dry-run`` against an index.
+
+    Requirements are resolved for the function's runtime rather than the
+    interpreter running pip: only wheels for its Python version and Linux
+    platforms are considered, and the markers of the requirements files are
+    evaluated for that version. pip still evaluates the markers in the
+    dependencies' metadata for its own interpreter.
+
+    Successful resolutions are cached under ``cache_dir``, keyed by a hash of
+    the requirements files, the index, the Python version and the platforms,
+    so unchanged requirements are not resolved again. pip's own HTTP cache is
+    kept there too. Failures are never cached.
+    """
+
+    def __init__(
+        self,
+        index_url: str = "",
+        find_links: str = "",
+        cache_dir: Path | None = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        python_version: tuple[int, int] = sys.version_info[:2],
+        platforms: tuple[str, ...] = DEFAULT_PLATFORMS,
+    ):
+        self.index_url = index_url
+        self.find_links = find_links
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.python_version = python_version
+        self.platforms = platforms
+
+    @classmethod
+    def from_env(cls, python_version: tuple[int, int]) -> "DependencyResolver":
+        """
+        Build a resolver for a runtime from the ``resolve_*`` settings.
+
+        Wheels are resolved for the ``vendor_platforms``, and cached under
+        ``cache_dir``.
+
+        Args:
+            python_version: Python version of the target runtime
+
+        Returns:
+            The resolver
+        """
+        return cls(
+            index_url=env_str("resolve_index_url"),
+            find_links=env_str("resolve_find_links"),
+            cache_dir=cache_path("resolve"),
+            timeout=env_float("resolve_timeout", DEFAULT_TIMEOUT),
+            python_version=python_version,
+            platforms=tuple(env_list("vendor_platforms")) or DEFAULT_PLATFORMS,
+        )
+
+    @property
+    def python_tag(self) -> str:
+        """Python version as ``X.Y``."""
+        return f"{self.python_version[0]}.{self.python_version[1]}"
+
+    def cache_key(self, requirements: Path) -> str:
+        """
+        Hash everything the resolution depends on.
+
+        Args:
+            requirements: The function's requirements file
+
+        Returns:
+            Hex SHA-256 of the requirements files, index, Python version
+            and platforms
+        """
+        return requirements_digest(
+            requirements,
+            self.index_url,
+            self.find_links,
+            self.python_tag,
+            ",".join(self.platforms),
+        )
+
+    def _command(
+        self, report: Path, requirements: Path | str = REQUIREMENTS_FILE
+    ) -> list[str]:
+        command = [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            "--dry-run",
+            "--ignore-installed",
+            "--disable-pip-version-check",
+            "--quiet",
+            "--only-binary=:all:",
+            "--implementation",
+            "cp",
+            "--python-version",
+            self.python_tag,
+            # Needed by older pips for the options above; nothing is installed
+            "--target",
+            str(report.parent / "target"),
+            "--report",
+            str(report),
+            "--requirement",
+            str(requirements),
+        ]
+        for platform in self.platforms:
+            command += ["--platform", platform]
+        if self.index_url:
+            command += ["--index-url", self.index_url]
+        elif self.find_links:
+            command.append("--no-index")
+        if self.find_links:
+            command += ["--find-links", self.find_links]
+        if self.cache_dir is not None:
+            command += ["--cache-dir", str(self.cache_dir / "pip")]
+        return command
+
+    def resolve(self, directory: Path) -> list[str]:
+        """
+        Resolve the requirements of a function directory.
+
+        Args:
+            directory: The cloud function directory
+
+        Returns:
+            Problems found, empty when the requirements resolve
+        """
+        requirements = directory / REQUIREMENTS_FILE
+        if not requirements.is_file():
+            return []
+
+        cached = None
+        if self.cache_dir is not None:
+            cached = self.cache_dir / f"{self.cache_key(requirements)}.json"
+            if cached.is_file():
+                _logger.info("Requirements are unchanged, skipping resolution")
+                return []
+
+        with TemporaryDirectory() as tmp:
+            report = Path(tmp) / "report.json"
+            runtime_requirements = _evaluate_markers(
+                requirements,
+                runtime_environment(self.python_version),
+                Path(tmp),
+                {},
+            )
+            _logger.info(f"Resolving requirements for Python {self.python_tag}...")
+            try:
+                subprocess.run(  # noqa: S603 - fixed interpreter, no shell
+                    self._command(report, runtime_requirements),
+                    cwd=directory,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                    timeout=self.timeout,
+                )
+            except subprocess.TimeoutExpired:
+                return [f"Resolving requirements timed out after {self.timeout:.0f}s"]
+            except subprocess.CalledProcessError as e:
+                lines = [line for line in e.stderr.splitlines() if line.strip()]
+                details = "\n".join(lines[-_ERROR_LINES:])
+                return [f"Requirements cannot be resolved:\n{details}"]
+            resolved = json.loads(report.read_text())
+
+        packages = sorted(
+            f"{item['metadata']['name']}=={item['metadata']['version']}"
+            for item in resolved.get("install", [])
+        )
+        _logger.info(f"Resolved {len(packages)} packages")
+        _logger.debug(f"Resolved packages: {', '.join(packages)}")
+        if cached is not None:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            cached.write_text(json.dumps({"packages": packages}))
+        return []
@@ -0,0 +1,87 @@
+"""Classification of API errors into retry categories."""
+
+from enum import Enum
+
+import httplib2
+from google.auth.exceptions import TransportError
+from googleapiclient.errors import HttpError
+
+# Transient server side failures worth retrying as-is
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Another operation on the same function is still rolling out
+CONFLICT_STATUSES = frozenset({409})
+
+# The source a patch points at is gone: an expired upload URL or an archive
+# that was deleted or replaced
+SOURCE_GONE_STATUSES = frozenset({404, 412})
+
+_RETRYABLE_EXCEPTIONS = (
+    ConnectionError,
+    TimeoutError,
+    TransportError,
+    httplib2.HttpLib2Error,
+)
+
+
+class ErrorClass(Enum):
+    """How a failed API call should be handled."""
+
+    RETRYABLE = "retryable"
+    CONFLICT = "conflict"
+    FATAL = "fatal"
+
+
+def error_status(error: BaseException) -> int | None:
+    """
+    Return the HTTP status code carried by an API error, if any.
+
+    Args:
+        error: The exception raised by the API client
+
+    Returns:
+        The status code, or None for errors without an HTTP response
+    """
+    resp = getattr(error, "resp", None)
+    status = getattr(resp, "status", None)
+    return int(status) if status is not None else None
+
+
+def source_gone(error: BaseException) -> bool:
+    """
+    Decide whether uploading the source again can fix a failed patch.
+
+    Args:
+        error: The exception raised by the API client, or the DeployFailed
+            wrapping it
+
+    Returns:
+        True if the patch failed because its source is missing or expired
+    """
+    status = getattr(error, "status_code", None) or error_status(error)
+    return status in SOURCE_GONE_STATUSES
+
+
+def classify_error(error: BaseException) -> ErrorClass:
+    """
+    Decide whether a failed API call can be retried.
+
+    Args:
+        error: The exception raised by the API client
+
+    Returns:
+        RETRYABLE for transient network and server errors, CONFLICT when an
+        operation on the same function is already in progress, FATAL otherwise
+    """
+    if isinstance(error, HttpError):
+        status = error_status(error)
+        if status in CONFLICT_STATUSES:
+            return ErrorClass.CONFLICT
+        if status in RETRYABLE_STATUSES:
+            return ErrorClass.RETRYABLE
+        return ErrorClass.FATAL
+
+    if isinstance(error, _RETRYABLE_EXCEPTIONS):
+        return ErrorClass.RETRYABLE
+
+    return ErrorClass.FATAL
@@ -0,0 +1,101 @@
+"""Concurrent directory scanning for large function source trees."""
+
+import logging
+import os
+from collections.abc import Callable, Generator, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_WORKERS = 8
+
+# A directory listing: each child's name and, for files, its stat result.
+# Directories have no stat result.
+_Listing = list[tuple[str, os.stat_result | None]]
+# A directory being walked: its path, the children left and their listings
+_Frame = tuple[
+    PurePosixPath,
+    Iterator[tuple[str, os.stat_result | None]],
+    dict[str, Future[_Listing]],
+]
+
+
+class ScanEntry(NamedTuple):
+    """A regular file found by ``scan_tree``."""
+
+    path: Path
+    relative: PurePosixPath
+    stat: os.stat_result
+
+
+def _list_directory(path: Path) -> _Listing:
+    """Read one directory, using the dirent type to avoid stats on directories."""
+    listing: _Listing = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        listing.append((entry.name, None))
+                    elif entry.is_file():
+                        listing.append((entry.name, entry.stat()))
+                except OSError:
+                    # Removed while scanning, or a dangling symlink
+                    continue
+    except OSError as e:
+        _logger.warning(f"Skipping unreadable directory {path}: {e}")
+    listing.sort()
+    return listing
+
+
+def scan_tree(
+    root: Path,
+    prune: Callable[[PurePosixPath], bool] | None = None,
+    max_workers: int = DEFAULT_WORKERS,
+) -> Generator[ScanEntry]:
+    """
+    Walk a directory tree, listing subdirectories concurrently.
+
+    Entries stream out in path order, comparing paths component by
+    component, while worker threads read the directories ahead of the
+    consumer. Symbolic links to files are followed, symbolic links to
+    directories are not, and unreadable directories are skipped with a
+    warning. Close the generator to stop a scan part way.
+
+    Args:
+        root: Directory to scan
+        prune: Called with each directory's path relative to ``root``,
+            returning True to skip it
+        max_workers: Number of directories read at once
+
+    Yields:
+        The regular files below ``root`` with their stat results
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def expand(relative: PurePosixPath, listing: Future[_Listing]) -> _Frame:
+        children = listing.result()
+        # Queue every subdirectory now so workers stay ahead of the consumer
+        pending = {
+            name: executor.submit(_list_directory, root / relative / name)
+            for name, stat in children
+            if stat is None and not (prune and prune(relative / name))
+        }
+        return relative, iter(children), pending
+
+    try:
+        stack = [expand(PurePosixPath(), executor.submit(_list_directory, root))]
+        while stack:
+            relative, children, pending = stack[-1]
+            for name, stat in children:
+                if stat is not None:
+                    yield ScanEntry(root / relative / name, relative / name, stat)
+                elif name in pending:
+                    stack.append(expand(relative / name, pending[name]))
+                    break
+            else:
+                stack.pop()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,241 @@
+"""Client-side rate limiting for Cloud Functions API calls."""
+
+import logging
+import random
+import threading
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from typing import Any
+
+from googleapiclient.errors import HttpError
+
+from plugin_scripts.config import env_float, env_int
+from plugin_scripts.retry import ErrorClass, classify_error, error_status
+
+_logger = logging.getLogger("cloud-function")
+
+# Statuses the API uses to tell callers to slow down
+THROTTLE_STATUSES = frozenset({429, 503})
+
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 5
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+
+# Adaptive rate control: halve on throttling, creep back up on success
+_THROTTLE_FACTOR = 0.5
+_RECOVERY_STEP = 0.1
+_MIN_RATE = 0.05
+
+
+class TokenBucket:
+    """A token bucket whose refill rate adapts to throttling responses."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive")
+        if capacity < 1:
+            raise ValueError("Token bucket capacity must be at least 1")
+
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._clock = clock
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self.tokens = min(float(self.capacity), self.tokens + elapsed * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """
+        Take a token, borrowing against future refills when none is left.
+
+        Returns:
+            Seconds the caller must wait before using the token
+        """
+        now = self._clock()
+        self._refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for at least the given number of seconds."""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def throttle(self) -> None:
+        """Reduce the refill rate after the server asked us to slow down."""
+        self.rate = max(_MIN_RATE, self.rate * _THROTTLE_FACTOR)
+
+    def recover(self) -> None:
+        """Gradually restore the refill rate after a successful call."""
+        self.rate = min(self.max_rate, self.rate + _RECOVERY_STEP * self.max_rate)
+
+
+def _retry_after_seconds(error: HttpError, now: datetime | None = None) -> float | None:
+    """
+    Extract the server supplied ``Retry-After`` delay from an error response.
+
+    Args:
+        error: The HTTP error returned by the API client
+        now: Current time, used when the header is an HTTP date
+
+    Returns:
+        Delay in seconds, or None if the header is missing or unparseable
+    """
+    resp = getattr(error, "resp", None)
+    value = resp.get("retry-after") if resp is not None else None
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = now or datetime.now(UTC)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
+class RequestScheduler:
+    """
+    Rate limit and retry API requests, with one token bucket per location.
+
+    Requests are keyed by ``project/region`` so that fanning out across
+    locations does not starve any single quota bucket.
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RequestScheduler":
+        """Build a scheduler from the optional plugin settings."""
+        return cls(
+            rate=env_float("api_rate_limit", DEFAULT_RATE),
+            burst=env_int("api_burst", DEFAULT_BURST),
+            max_attempts=env_int("api_max_attempts", DEFAULT_MAX_ATTEMPTS),
+        )
+
+    def bucket(self, key: str) -> TokenBucket:
+        """Return the token bucket for a location, creating it on first use."""
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rate, self.burst, self._clock)
+            return self._buckets[key]
+
+    def _acquire(self, bucket: TokenBucket) -> None:
+        with self._lock:
+            wait = bucket.reserve()
+        if wait > 0:
+            _logger.debug(f"Rate limiting API call for {wait:.2f}s")
+            self._sleep(wait)
+
+    def _backoff(self, attempt: int) -> float:
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)  # noqa: S311 - jitter, not crypto
+
+    def execute(
+        self,
+        request: Any,
+        key: str,
+        on_conflict: Callable[[], None] | None = None,
+    ) -> Any:
+        """
+        Execute an API request within the location's rate limit.
+
+        Failures are classified before deciding what to do:
+
+        - transient errors (5xx, 408, 429, connection failures) are retried
+          after the server supplied ``Retry-After`` delay, or with jittered
+          exponential backoff when no delay is given. Throttling responses
+          (429/503) also lower the bucket's rate so later calls back off too.
+        - conflicts (409, another operation on the function is in progress)
+          call ``on_conflict`` to wait for the in-flight operation, then retry.
+        - anything else is raised immediately.
+
+        Args:
+            request: An API client request exposing ``execute()``
+            key: Quota bucket key, usually ``project/region``
+            on_conflict: Blocks until the conflicting operation has finished
+
+        Returns:
+            The API response
+
+        Raises:
+            Exception: The last error if it is fatal or still failing after
+                ``max_attempts`` attempts
+        """
+        bucket = self.bucket(key)
+        for attempt in range(1, self.max_attempts + 1):
+            self._acquire(bucket)
+            try:
+                response = request.execute()
+            except Exception as e:
+                error_class = classify_error(e)
+                if error_class is ErrorClass.FATAL or attempt == self.max_attempts:
+                    raise
+
+                status = error_status(e)
+                if error_class is ErrorClass.CONFLICT and on_conflict is not None:
+                    _logger.warning(
+                        f"Operation already in progress for {key}, waiting for it "
+                        f"to finish (attempt {attempt}/{self.max_attempts})"
+                    )
+                    on_conflict()
+                    continue
+
+                delay = _retry_after_seconds(e) if isinstance(e, HttpError) else None
+                if delay is None:
+                    delay = self._backoff(attempt)
+                with self._lock:
+                    if status in THROTTLE_STATUSES:
+                        bucket.throttle()
+                    bucket.pause(delay)
+                _logger.warning(
+                    f"API call for {key} failed ({status or type(e).__name__}), "
+                    f"retrying in {delay:.1f}s (attempt {attempt}/{self.max_attempts})"
+                )
+                continue
+
+            with self._lock:
+                bucket.recover()
+            return response
+
+        raise AssertionError("unreachable")  # pragma: no cover
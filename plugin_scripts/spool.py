@@ -0,0 +1,179 @@
+"""Archive storage that stays in memory for small functions."""
+
+import errno
+import io
+import logging
+import os
+import shutil
+import threading
+from tempfile import TemporaryFile
+from typing import Any
+
+from plugin_scripts.config import env_int
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_MEMORY_LIMIT = 16 * 1024 * 1024
+DEFAULT_TMPFS_LIMIT = 256 * 1024 * 1024
+DEFAULT_TMPFS_DIR = "/dev/shm"  # noqa: S108 - tmpfs is the point
+
+TIER_MEMORY = "memory"
+TIER_TMPFS = "tmpfs"
+TIER_DISK = "disk"
+
+
+class ArchiveSpool(io.IOBase):
+    """
+    Seekable binary buffer that moves to slower storage as it grows.
+
+    Data stays in memory up to ``memory_limit`` bytes, then moves to a
+    temporary file on tmpfs up to ``tmpfs_limit`` bytes, then to a temporary
+    file on disk. Tmpfs is skipped when it is missing or short of space, and
+    a tmpfs that fills up mid-write hands over to disk.
+    """
+
+    def __init__(
+        self,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        tmpfs_limit: int = DEFAULT_TMPFS_LIMIT,
+        tmpfs_dir: str = DEFAULT_TMPFS_DIR,
+    ):
+        super().__init__()
+        self.memory_limit = memory_limit
+        self.tmpfs_limit = tmpfs_limit
+        self.tmpfs_dir = tmpfs_dir
+        self.tier = TIER_MEMORY
+        self._file: Any = io.BytesIO()
+        self._size = 0
+
+    @classmethod
+    def from_env(cls) -> "ArchiveSpool":
+        """Build a spool sized by the ``spool_*_limit`` settings."""
+        return cls(
+            memory_limit=env_int("spool_memory_limit", DEFAULT_MEMORY_LIMIT),
+            tmpfs_limit=env_int("spool_tmpfs_limit", DEFAULT_TMPFS_LIMIT),
+        )
+
+    @property
+    def size(self) -> int:
+        """Number of bytes written so far."""
+        return self._size
+
+    def _tmpfs_has_room(self, size: int) -> bool:
+        try:
+            stats = os.statvfs(self.tmpfs_dir)
+        except OSError:
+            return False
+        free = stats.f_bavail * stats.f_frsize
+        # Leave room for the archive to keep growing and for other users
+        return os.access(self.tmpfs_dir, os.W_OK) and free >= 2 * size
+
+    def _roll_over(self, size: int) -> None:
+        if (
+            self.tier == TIER_MEMORY
+            and size <= self.tmpfs_limit
+            and self._tmpfs_has_room(size)
+        ):
+            tier, target = TIER_TMPFS, TemporaryFile(dir=self.tmpfs_dir)
+        else:
+            tier, target = TIER_DISK, TemporaryFile()
+
+        position = self._file.tell()
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, target)
+        target.seek(position)
+        self._file.close()
+        self._file = target
+        _logger.debug(f"Archive spool moved to {tier} at {size} bytes")
+        self.tier = tier
+
+    def write(self, data: Any) -> int:
+        """Write bytes, moving to slower storage first if they would not fit."""
+        size = max(self._size, self._file.tell() + len(memoryview(data)))
+        if self.tier == TIER_MEMORY and size > self.memory_limit:
+            self._roll_over(size)
+        if self.tier == TIER_TMPFS and size > self.tmpfs_limit:
+            self._roll_over(size)
+
+        try:
+            written = self._file.write(data)
+        except OSError as e:
+            if self.tier != TIER_TMPFS or e.errno != errno.ENOSPC:
+                raise
+            _logger.info("tmpfs is full, moving the archive to disk")
+            self._roll_over(size)
+            written = self._file.write(data)
+        self._size = max(self._size, self._file.tell())
+        return written
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes from the current position."""
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move the current position."""
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        """Return the current position."""
+        return self._file.tell()
+
+    def flush(self) -> None:
+        """Flush buffered writes of file backed tiers."""
+        self._file.flush()
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        """Release the buffer or temporary file."""
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            self._file.close()
+
+
+class SharedReader:
+    """
+    Read position of its own over an archive shared between threads.
+
+    Every read seeks the shared stream under a lock, so concurrent uploads
+    each stream the whole archive from the spool without copying it.
+    Seeking and ``tell`` only move this reader, so HTTP clients can still
+    compute the content length and rewind for retries.
+    """
+
+    def __init__(self, data: Any, lock: threading.Lock):
+        self.data = data
+        self.lock = lock
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes from this reader's position."""
+        with self.lock:
+            self.data.seek(self._position)
+            chunk = self.data.read(size)
+        self._position += len(chunk)
+        return chunk
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move this reader's position."""
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            with self.lock:
+                offset += self.data.seek(0, io.SEEK_END)
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        """Return this reader's position."""
+        return self._position
@@ -0,0 +1,114 @@
+"""Archives staged once in ``state_bucket`` for every target of a deploy."""
+
+import logging
+from collections.abc import Mapping
+from typing import Any, BinaryIO
+
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts.bandwidth import shaped
+from plugin_scripts.state import StateStore
+
+_logger = logging.getLogger("cloud-function")
+
+
+class StagedArchives:
+    """
+    Deploy archives staged in ``state_bucket``, and the functions using them.
+
+    Archives are named by their SHA-256 under ``archives/``, so targets and
+    deploys with the same sources share one. The ``archives/index.json``
+    document maps every function deploying from a staged archive to its
+    digest; it is updated with a generation precondition so concurrent
+    deploys cannot drop each other's functions. An archive is deleted once
+    no function in the index uses it any more.
+    """
+
+    prefix = "archives"
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    @property
+    def index_key(self) -> str:
+        """State store key of the index of functions using staged archives."""
+        return f"{self.prefix}/index.json"
+
+    def archive_key(self, digest: str) -> str:
+        """State store key of a staged archive."""
+        return f"{self.prefix}/{digest}.zip"
+
+    def is_staged(self, url: str | None) -> bool:
+        """
+        Check whether a URL points at a staged archive.
+
+        Args:
+            url: ``gs://`` URL of a function's source archive
+
+        Returns:
+            True if the archive was staged by a deploy to several targets
+        """
+        return bool(url) and str(url).startswith(f"{self.store.url(self.prefix)}/")
+
+    def stage(self, data: BinaryIO, digest: str) -> str:
+        """
+        Upload an archive, unless it is already staged.
+
+        Args:
+            data: The archive, left positioned at the start
+            digest: SHA-256 of the archive
+
+        Returns:
+            ``gs://`` URL of the staged archive
+        """
+        key = self.archive_key(digest)
+        blob = self.store.blob(key)
+        if blob.exists():
+            _logger.info(f"Archive {digest} is already staged")
+        else:
+            blob.upload_from_file(
+                shaped(data, blob), rewind=True, content_type="application/zip"
+            )
+            _logger.info(f"Staged archive at {self.store.url(key)}")
+        data.seek(0)
+        return self.store.url(key)
+
+    def record(self, uses: Mapping[str, str | None], staged: str | None = None) -> None:
+        """
+        Record which staged archive functions now deploy from.
+
+        Archives that no function in the index uses any more are deleted,
+        including ``staged`` when none of the functions ended up using it.
+
+        Args:
+            uses: The digest each function deploys from, or None for
+                functions that no longer deploy from a staged archive
+            staged: Digest of the archive this deploy staged
+        """
+        while True:
+            index, generation = self.store.read_json(self.index_key)
+            previous: dict[str, Any] = index["functions"] if index else {}
+            functions = dict(previous)
+            for function_path, digest in uses.items():
+                if digest is None:
+                    functions.pop(function_path, None)
+                else:
+                    functions[function_path] = digest
+            if functions == previous and index:
+                break
+            try:
+                self.store.write_json(
+                    self.index_key,
+                    {"functions": functions},
+                    if_generation_match=generation,
+                )
+                break
+            except PreconditionFailed:
+                # Another deploy updated the index, re-read and apply again
+                continue
+        candidates = set(previous.values()) | ({staged} if staged else set())
+        unused = candidates - set(functions.values())
+        for digest in sorted(unused):
+            self.store.delete(self.archive_key(digest))
+        if unused:
+            _logger.info(f"Deleted {len(unused)} staged archives no function uses")
@@ -0,0 +1,135 @@
+"""JSON documents stored in GCS, shared between deploys of a function."""
+
+import json
+from typing import Any
+from urllib.parse import urlparse
+
+from google.api_core.exceptions import NotFound
+from google.cloud import storage
+from google.oauth2 import service_account
+
+from plugin_scripts import clients
+from plugin_scripts.config import env_str
+
+
+def parse_state_bucket(value: str) -> tuple[str, str]:
+    """
+    Split a ``state_bucket`` setting into bucket name and object prefix.
+
+    Args:
+        value: ``gs://bucket/prefix``, ``gs://bucket`` or a bare bucket name
+
+    Returns:
+        The bucket name and the prefix without surrounding slashes
+    """
+    if value.startswith("gs://"):
+        parsed = urlparse(value)
+        return parsed.netloc, parsed.path.strip("/")
+    bucket, _, prefix = value.partition("/")
+    return bucket, prefix.strip("/")
+
+
+class StateStore:
+    """
+    Read and write small JSON documents under a bucket prefix.
+
+    Writes accept a GCS generation precondition so callers can implement
+    compare-and-swap updates; generation ``0`` means "only if absent".
+    """
+
+    def __init__(self, bucket: Any, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    @classmethod
+    def from_env(cls, credentials: service_account.Credentials) -> "StateStore | None":
+        """
+        Build a store from the ``state_bucket`` setting.
+
+        Args:
+            credentials: Credentials for the storage client
+
+        Returns:
+            The store, or None when ``state_bucket`` is not configured
+        """
+        value = env_str("state_bucket")
+        if not value:
+            return None
+        bucket_name, prefix = parse_state_bucket(value)
+        client = clients.client_for(credentials, storage.Client)
+        return cls(client.bucket(bucket_name), prefix)
+
+    def object_name(self, key: str) -> str:
+        """Return the full object name for a key."""
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def url(self, key: str) -> str:
+        """Return the ``gs://`` URL for a key."""
+        return f"gs://{self.bucket.name}/{self.object_name(key)}"
+
+    def blob(self, key: str) -> Any:
+        """Return the blob handle for a key."""
+        return self.bucket.blob(self.object_name(key))
+
+    def read_json(self, key: str) -> tuple[Any, int]:
+        """
+        Read a JSON document.
+
+        Args:
+            key: Document key below the prefix
+
+        Returns:
+            The decoded document and its generation, or ``(None, 0)`` if the
+            document does not exist
+        """
+        blob = self.bucket.get_blob(self.object_name(key))
+        if blob is None:
+            return None, 0
+        try:
+            data = blob.download_as_bytes(if_generation_match=blob.generation)
+        except NotFound:
+            return None, 0
+        return json.loads(data), int(blob.generation)
+
+    def write_json(
+        self, key: str, document: Any, if_generation_match: int | None = None
+    ) -> int:
+        """
+        Write a JSON document.
+
+        Args:
+            key: Document key below the prefix
+            document: JSON serialisable document
+            if_generation_match: Only write if the stored generation matches
+
+        Returns:
+            The generation of the written document
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: If the stored
+                generation does not match ``if_generation_match``
+        """
+        blob = self.blob(key)
+        blob.upload_from_string(
+            json.dumps(document, sort_keys=True),
+            content_type="application/json",
+            if_generation_match=if_generation_match,
+        )
+        return int(blob.generation)
+
+    def delete(self, key: str, if_generation_match: int | None = None) -> None:
+        """
+        Delete a document, ignoring documents that are already gone.
+
+        Args:
+            key: Document key below the prefix
+            if_generation_match: Only delete if the stored generation matches
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: If the stored
+                generation does not match ``if_generation_match``
+        """
+        try:
+            self.blob(key).delete(if_generation_match=if_generation_match)
+        except NotFound:
+            pass
@@ -0,0 +1,80 @@
+"""Deploy targets: the functions one plugin step rolls a package out to."""
+
+import os
+from typing import NamedTuple
+
+from plugin_scripts.config import env_list
+
+
+class DeployTarget(NamedTuple):
+    """A cloud function in a specific project and region."""
+
+    project: str
+    region: str
+    function: str
+
+    @classmethod
+    def from_env(cls) -> "DeployTarget":
+        """The target set by gcp_project, gcp_region and cloud_function_name."""
+        return cls(
+            os.environ.get("gcp_project", ""),
+            os.environ.get("gcp_region", ""),
+            os.environ.get("cloud_function_name", ""),
+        )
+
+    @classmethod
+    def parse(cls, value: str, default_function: str) -> "DeployTarget":
+        """
+        Parse a ``project/region`` or ``project/region/function`` entry.
+
+        Args:
+            value: The entry from the ``targets`` setting
+            default_function: Function name used when the entry has none
+
+        Returns:
+            The parsed target
+
+        Raises:
+            ValueError: If the entry is malformed
+        """
+        parts = value.strip().strip("/").split("/")
+        if len(parts) == 2 and all(parts):
+            return cls(parts[0], parts[1], default_function)
+        if len(parts) == 3 and all(parts):
+            return cls(parts[0], parts[1], parts[2])
+        raise ValueError(
+            f"Invalid target {value!r}, expected project/region or "
+            "project/region/function"
+        )
+
+    @property
+    def parent(self) -> str:
+        """The ``projects/<project>/locations/<region>`` location name."""
+        return f"projects/{self.project}/locations/{self.region}"
+
+    @property
+    def path(self) -> str:
+        """The fully qualified function name."""
+        return f"{self.parent}/functions/{self.function}"
+
+    @property
+    def quota_key(self) -> str:
+        """Key of the API quota bucket the target's calls count against."""
+        return f"{self.project}/{self.region}"
+
+
+def targets_from_env() -> list[DeployTarget]:
+    """
+    Collect every target the step deploys to.
+
+    Returns:
+        The primary target followed by any extra ``targets`` entries,
+        without duplicates
+    """
+    primary = DeployTarget.from_env()
+    targets = [primary]
+    for value in env_list("targets"):
+        target = DeployTarget.parse(value, primary.function)
+        if target not in targets:
+            targets.append(target)
+    return targets
@@ -0,0 +1,308 @@
+"""
+Span based tracing of a deploy step, exported as OTLP JSON.
+
+The hook records its own phases (``docker pull``, ``docker create``,
+``docker cp``) and passes them in a file, with a W3C ``TRACEPARENT``
+naming the container's span, so one trace covers the whole step.
+"""
+
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+
+import requests
+
+from plugin_scripts import buildkite
+from plugin_scripts.config import env_str
+
+_logger = logging.getLogger("cloud-function")
+
+SERVICE_NAME = "cloud-functions-buildkite-plugin"
+EXPORT_TIMEOUT = 10.0
+_TRACES_PATH = "/v1/traces"
+# OTLP span status codes
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+def _new_id(size: int) -> str:
+    return secrets.token_hex(size)
+
+
+def parse_traceparent(value: str) -> tuple[str, str] | None:
+    """
+    Read the trace and parent span IDs from a W3C ``traceparent`` header.
+
+    Args:
+        value: e.g. ``00-<32 hex trace ID>-<16 hex span ID>-01``
+
+    Returns:
+        The trace ID and parent span ID, or None if the value is malformed
+    """
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2]
+
+
+class Span:
+    """One timed phase of the deploy."""
+
+    def __init__(
+        self,
+        name: str,
+        span_id: str,
+        parent_id: str | None,
+        start_ns: int,
+        end_ns: int | None = None,
+        attributes: dict[str, Any] | None = None,
+    ):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.attributes = attributes or {}
+        self.error: str | None = None
+
+    def to_otlp(self, trace_id: str) -> dict[str, Any]:
+        """Encode the span for the OTLP JSON protocol."""
+        span: dict[str, Any] = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in sorted(self.attributes.items())
+            ],
+            "status": (
+                {"code": _STATUS_ERROR, "message": self.error}
+                if self.error is not None
+                else {"code": _STATUS_OK}
+            ),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Tracer:
+    """Collect the spans of one trace and export them once the step ends."""
+
+    def __init__(self, trace_id: str, parent_id: str | None = None):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span) -> None:
+        """Add a span to the trace."""
+        with self._lock:
+            self.spans.append(span)
+
+    def load_hook_spans(self, path: Path) -> None:
+        """
+        Add the spans the hook wrote, one JSON object per line.
+
+        Spans without an end, such as the step and the container, are
+        ended when the trace is exported.
+
+        Args:
+            path: The file passed in ``trace_hook_spans``
+        """
+        try:
+            lines = path.read_text().splitlines()
+        except OSError as e:
+            _logger.warning(f"Could not read the hook's trace spans: {e}")
+            return
+        for line in lines:
+            try:
+                fields = json.loads(line)
+                self.record(
+                    Span(
+                        fields["name"],
+                        fields["span_id"],
+                        fields.get("parent_span_id") or None,
+                        int(fields["start"]),
+                        int(fields["end"]) if fields.get("end") else None,
+                    )
+                )
+            except (ValueError, KeyError, TypeError):
+                _logger.warning(f"Skipping malformed hook span {line!r}")
+
+    def to_otlp(self) -> dict[str, Any]:
+        """Encode the trace as an OTLP ``ExportTraceServiceRequest``."""
+        end_ns = time.time_ns()
+        for span in self.spans:
+            if span.end_ns is None:
+                span.end_ns = end_ns
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "plugin_scripts"},
+                            "spans": [s.to_otlp(self.trace_id) for s in self.spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+_tracer: Tracer | None = None
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def configure() -> Tracer | None:
+    """
+    Start tracing when ``trace_endpoint`` or ``trace_file`` is configured.
+
+    Continues the hook's trace from ``TRACEPARENT`` and adds the hook's
+    spans and the dependency install timed by the container command.
+
+    Returns:
+        The tracer, or None when tracing is disabled
+    """
+    global _tracer
+    if not (env_str("trace_endpoint") or env_str("trace_file")):
+        _tracer = None
+        return None
+
+    context = parse_traceparent(os.environ.get("TRACEPARENT", ""))
+    trace_id, parent_id = context if context else (_new_id(16), None)
+    _tracer = Tracer(trace_id, parent_id)
+
+    hook_spans = env_str("trace_hook_spans")
+    if hook_spans:
+        _tracer.load_hook_spans(Path(hook_spans))
+    started = os.environ.get("trace_install_started", "")
+    finished = os.environ.get("trace_install_finished", "")
+    if started.isdigit() and finished.isdigit():
+        _tracer.record(
+            Span(
+                "install dependencies",
+                _new_id(8),
+                parent_id,
+                int(started),
+                int(finished),
+            )
+        )
+        _tracer.record(
+            Span("python startup", _new_id(8), parent_id, int(finished), time.time_ns())
+        )
+    return _tracer
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """
+    Time a phase of the deploy as a child of the current span.
+
+    Does nothing unless tracing was configured. An exception escaping the
+    block marks the span as failed.
+
+    Args:
+        name: The phase, e.g. ``"patch function"``
+        attributes: Extra details recorded on the span
+
+    Yields:
+        The span, or None when tracing is disabled
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+
+    parent = _current.get()
+    current = Span(
+        name,
+        _new_id(8),
+        parent.span_id if parent is not None else tracer.parent_id,
+        time.time_ns(),
+        attributes=attributes,
+    )
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = str(e) or type(e).__name__
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current.reset(token)
+        tracer.record(current)
+
+
+def _otlp_headers() -> dict[str, str]:
+    """Read extra export headers from ``OTEL_EXPORTER_OTLP_HEADERS``."""
+    headers = {"Content-Type": "application/json"}
+    for pair in os.environ.get("OTEL_EXPORTER_OTLP_HEADERS", "").split(","):
+        key, separator, value = pair.partition("=")
+        if separator and key.strip():
+            headers[key.strip()] = value.strip()
+    return headers
+
+
+def shutdown() -> None:
+    """
+    Export the trace and stop tracing.
+
+    The trace is posted to ``trace_endpoint`` and written to
+    ``trace_file``, which is uploaded as a build artifact. Export
+    failures are logged and never fail the deploy.
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return
+    document = tracer.to_otlp()
+
+    trace_file = env_str("trace_file")
+    if trace_file:
+        try:
+            Path(trace_file).parent.mkdir(parents=True, exist_ok=True)
+            Path(trace_file).write_text(json.dumps(document))
+            _logger.info(f"Wrote trace {tracer.trace_id} to {trace_file}")
+            if buildkite.agent_path() is not None:
+                buildkite.artifact_upload(trace_file)
+        except Exception as e:
+            _logger.warning(f"Could not save the trace to {trace_file}: {e}")
+
+    endpoint = env_str("trace_endpoint")
+    if endpoint:
+        url = endpoint.rstrip("/")
+        if not url.endswith(_TRACES_PATH):
+            url += _TRACES_PATH
+        try:
+            response = requests.post(
+                url, json=document, headers=_otlp_headers(), timeout=EXPORT_TIMEOUT
+            )
+            response.raise_for_status()
+            _logger.info(f"Exported trace {tracer.trace_id} to {url}")
+        except requests.RequestException as e:
+            _logger.warning(f"Could not export the trace to {url}: {e}")
@@ -0,0 +1,377 @@
+"""Vendor a function's dependencies into its archive from a shared wheel cache."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess  # noqa: S404 - running pip from the current interpreter
+import sys
+import time
+import zipfile
+from collections.abc import Callable, Collection
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+
+from plugin_scripts.config import env_float, env_int, env_list, env_str
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.preflight import REQUIREMENTS_FILE
+from plugin_scripts.resolve import (
+    DEFAULT_PLATFORMS,
+    DEFAULT_TIMEOUT,
+    requirements_digest,
+)
+
+_logger = logging.getLogger("cloud-function")
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_GRACE_SECONDS = 3600.0
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WheelCache:
+    """
+    Content addressed wheel store shared by the builds on an agent.
+
+    Wheels live at ``wheels/<sha256>/<filename>``, so identical wheels
+    needed by different functions are stored once. ``sets/<key>.json``
+    records the wheels a requirements hash resolved to. Using a wheel
+    refreshes its modification time, and the least recently used wheels
+    are evicted once the store grows past ``max_bytes``. Wheels used within
+    ``grace_seconds`` are never evicted, so a build sharing the cache keeps
+    the wheels it loaded until it has vendored them. Entries are moved into
+    place atomically so concurrent builds never see partial files.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        grace_seconds: float = DEFAULT_GRACE_SECONDS,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+
+    def _wheel_dir(self, sha256: str) -> Path:
+        return self.root / "wheels" / sha256
+
+    def _set_path(self, key: str) -> Path:
+        return self.root / "sets" / f"{key}.json"
+
+    def _touch(self, sha256: str) -> bool:
+        now = time.time()
+        try:
+            os.utime(self._wheel_dir(sha256), (now, now))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _used_since(self, sha256: str, cutoff: float) -> bool:
+        # Read again, another build may have loaded the wheel since the scan
+        try:
+            return self._wheel_dir(sha256).stat().st_mtime > cutoff
+        except FileNotFoundError:
+            return False
+
+    def add(self, wheel: Path) -> dict[str, str]:
+        """
+        Store a wheel, or refresh an identical one already cached.
+
+        Args:
+            wheel: The downloaded wheel
+
+        Returns:
+            The cache entry, with the wheel's ``sha256`` and ``filename``
+        """
+        sha256 = _file_digest(wheel)
+        destination = self._wheel_dir(sha256)
+        if not self._touch(sha256):
+            staging = self.root / "tmp" / f"{sha256}.{os.getpid()}"
+            staging.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(wheel, staging / wheel.name)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                staging.rename(destination)
+            except OSError:
+                # Another build stored the same wheel first
+                shutil.rmtree(staging, ignore_errors=True)
+        return {"sha256": sha256, "filename": wheel.name}
+
+    def load_set(self, key: str) -> list[Path] | None:
+        """
+        Look up the wheels a requirements hash resolved to.
+
+        Args:
+            key: The requirements hash
+
+        Returns:
+            The cached wheels, or None if any of them is missing
+        """
+        path = self._set_path(key)
+        if not path.is_file():
+            return None
+        entries = json.loads(path.read_text())
+        # Refresh before checking, so a concurrent eviction skips the wheels
+        if not all(self._touch(entry["sha256"]) for entry in entries):
+            return None
+        wheels = [
+            self._wheel_dir(entry["sha256"]) / entry["filename"] for entry in entries
+        ]
+        if not all(wheel.is_file() for wheel in wheels):
+            return None
+        return wheels
+
+    def store_set(self, key: str, entries: list[dict[str, str]]) -> None:
+        """
+        Record the wheels a requirements hash resolved to.
+
+        Args:
+            key: The requirements hash
+            entries: Cache entries returned by ``add``
+        """
+        path = self._set_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staging = path.with_suffix(f".{os.getpid()}.tmp")
+        staging.write_text(json.dumps(entries, sort_keys=True))
+        staging.replace(path)
+
+    def evict(self, keep: Collection[str] = ()) -> list[str]:
+        """
+        Remove least recently used wheels until the cache fits ``max_bytes``.
+
+        Wheels used within ``grace_seconds`` are kept even if the cache stays
+        over ``max_bytes``, as another build may be vendoring them.
+
+        Args:
+            keep: Digests of wheels in use, never evicted
+
+        Returns:
+            Digests of the evicted wheels
+        """
+        entries = []
+        total = 0
+        for wheel_dir in (self.root / "wheels").glob("*"):
+            try:
+                size = sum(f.stat().st_size for f in wheel_dir.iterdir())
+                entries.append((wheel_dir.stat().st_mtime, wheel_dir.name, size))
+            except FileNotFoundError:
+                # Evicted by another build meanwhile
+                continue
+            total += size
+
+        cutoff = time.time() - self.grace_seconds
+        evicted = []
+        for _, sha256, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if sha256 in keep or self._used_since(sha256, cutoff):
+                continue
+            shutil.rmtree(self._wheel_dir(sha256), ignore_errors=True)
+            evicted.append(sha256)
+            total -= size
+        if evicted:
+            _logger.info(f"Evicted {len(evicted)} wheels from the wheel cache")
+        return evicted
+
+
+class WheelVendor:
+    """Download and cache the wheels a function's requirements need."""
+
+    def __init__(
+        self,
+        cache: WheelCache,
+        python_version: tuple[int, int],
+        platforms: tuple[str, ...] = DEFAULT_PLATFORMS,
+        index_url: str = "",
+        find_links: str = "",
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.cache = cache
+        self.python_version = python_version
+        self.platforms = platforms
+        self.index_url = index_url
+        self.find_links = find_links
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(
+        cls, python_version: tuple[int, int], cache_root: Path
+    ) -> "WheelVendor":
+        """
+        Build a vendor from the ``vendor_*`` and ``resolve_*`` settings.
+
+        Args:
+            python_version: Python version of the target runtime
+            cache_root: Wheel cache directory
+
+        Returns:
+            The vendor
+        """
+        cache = WheelCache(
+            cache_root, env_int("wheel_cache_max_bytes", DEFAULT_MAX_BYTES)
+        )
+        return cls(
+            cache,
+            python_version,
+            platforms=tuple(env_list("vendor_platforms")) or DEFAULT_PLATFORMS,
+            index_url=env_str("resolve_index_url"),
+            find_links=env_str("resolve_find_links"),
+            timeout=env_float("resolve_timeout", DEFAULT_TIMEOUT),
+        )
+
+    @property
+    def python_tag(self) -> str:
+        """Python version as ``X.Y``."""
+        return f"{self.python_version[0]}.{self.python_version[1]}"
+
+    def _command(self, destination: Path) -> list[str]:
+        command = [
+            sys.executable,
+            "-m",
+            "pip",
+            "download",
+            "--disable-pip-version-check",
+            "--quiet",
+            "--only-binary=:all:",
+            "--implementation",
+            "cp",
+            "--python-version",
+            self.python_tag,
+            "--dest",
+            str(destination),
+            "--requirement",
+            REQUIREMENTS_FILE,
+        ]
+        for platform in self.platforms:
+            command += ["--platform", platform]
+        if self.index_url:
+            command += ["--index-url", self.index_url]
+        elif self.find_links:
+            command.append("--no-index")
+        if self.find_links:
+            command += ["--find-links", self.find_links]
+        return command
+
+    def _download(self, directory: Path) -> list[dict[str, str]]:
+        with TemporaryDirectory(dir=self.cache.root) as tmp:
+            _logger.info(f"Downloading wheels for Python {self.python_tag}...")
+            try:
+                subprocess.run(  # noqa: S603 - fixed interpreter, no shell
+                    self._command(Path(tmp)),
+                    cwd=directory,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                    timeout=self.timeout,
+                )
+            except subprocess.TimeoutExpired as e:
+                raise DeployFailed(
+                    f"Downloading wheels timed out after {self.timeout:.0f}s"
+                ) from e
+            except subprocess.CalledProcessError as e:
+                raise DeployFailed(
+                    f"Could not download wheels for vendoring:\n{e.stderr.strip()}"
+                ) from e
+            return [self.cache.add(wheel) for wheel in sorted(Path(tmp).glob("*.whl"))]
+
+    def wheels(self, directory: Path) -> list[Path]:
+        """
+        Provide the wheels for a function directory, downloading on a miss.
+
+        Args:
+            directory: The cloud function directory
+
+        Returns:
+            Paths of the cached wheels, empty without ``requirements.txt``
+
+        Raises:
+            DeployFailed: If the wheels cannot be downloaded
+        """
+        requirements = directory / REQUIREMENTS_FILE
+        if not requirements.is_file():
+            return []
+
+        self.cache.root.mkdir(parents=True, exist_ok=True)
+        key = requirements_digest(
+            requirements,
+            self.python_tag,
+            ",".join(self.platforms),
+            self.index_url,
+            self.find_links,
+        )
+        wheels = self.cache.load_set(key)
+        if wheels is not None:
+            _logger.info(f"Wheel cache hit: {len(wheels)} wheels")
+            return wheels
+
+        entries = self._download(directory)
+        self.cache.store_set(key, entries)
+        self.cache.evict(keep={entry["sha256"] for entry in entries})
+        wheels = self.cache.load_set(key)
+        _logger.info(f"Cached {len(entries)} wheels")
+        return wheels or []
+
+
+def install_path(member: str) -> str | None:
+    """
+    Map a wheel member to its path in an installed package tree.
+
+    Args:
+        member: Path inside the wheel
+
+    Returns:
+        The install path, or None for scripts, headers and data files
+    """
+    parts = PurePosixPath(member).parts
+    if parts and parts[0].endswith(".data"):
+        if len(parts) > 2 and parts[1] in ("purelib", "platlib"):
+            return str(PurePosixPath(*parts[2:]))
+        return None
+    return member
+
+
+def vendor_wheels(
+    handler: zipfile.ZipFile,
+    wheels: list[Path],
+    on_write: Callable[[zipfile.ZipInfo], None] | None = None,
+) -> list[tuple[bytes, str]]:
+    """
+    Install wheels into the archive root, where the runtime imports them from.
+
+    Args:
+        handler: ZipFile handler to write files to
+        wheels: The wheels to install
+        on_write: Called with each member once it is written
+
+    Returns:
+        The Python sources installed, as contents and archive path, so they
+        can be compiled to bytecode
+    """
+    sources = []
+    for wheel in wheels:
+        with zipfile.ZipFile(wheel) as wheel_zip:
+            for info in wheel_zip.infolist():
+                arcname = install_path(info.filename)
+                if arcname is None or info.is_dir():
+                    continue
+                data = wheel_zip.read(info)
+                installed = zipfile.ZipInfo(arcname, date_time=info.date_time)
+                installed.external_attr = info.external_attr
+                installed.compress_type = handler.compression
+                handler.writestr(installed, data)
+                if on_write is not None:
+                    on_write(installed)
+                if arcname.endswith(".py"):
+                    sources.append((data, arcname))
+    _logger.info(f"Vendored {len(wheels)} wheels")
+    return sources
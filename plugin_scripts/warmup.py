@@ -0,0 +1,142 @@
+"""Warm-up requests sent to a function's HTTPS trigger after a deploy."""
+
+import math
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_REQUEST_TIMEOUT = 60.0
+
+
+class WarmupRequest(NamedTuple):
+    """One warm-up request and how long it took."""
+
+    wave: int
+    seconds: float
+    # None when no response was received
+    status: int | None
+
+    @property
+    def failed(self) -> bool:
+        """Whether the request got no response or a server error."""
+        return self.status is None or self.status >= 500
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """
+    Pick a percentile by the nearest rank method.
+
+    Args:
+        values: The samples
+        fraction: The percentile as a fraction, e.g. ``0.99``
+
+    Returns:
+        The sample at that rank, or 0 without samples
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+class WarmupReport:
+    """
+    Latencies of a warm-up burst, split into cold and warm requests.
+
+    The first wave reaches a freshly rolled out function with no instances
+    running, so its requests pay the cold start; later waves are served by
+    the instances it spawned.
+    """
+
+    def __init__(self, url: str, results: list[WarmupRequest]):
+        self.url = url
+        self.results = results
+
+    @property
+    def cold(self) -> list[float]:
+        """Latencies of the first wave, in seconds."""
+        return [r.seconds for r in self.results if r.wave == 0]
+
+    @property
+    def warm(self) -> list[float]:
+        """Latencies of the later waves, in seconds."""
+        return [r.seconds for r in self.results if r.wave > 0]
+
+    @property
+    def errors(self) -> int:
+        """Number of requests without a response or with a server error."""
+        return sum(r.failed for r in self.results)
+
+    def summary(self) -> str:
+        """Describe cold and warm latency in one line."""
+        parts = [
+            f"{len(latencies)} {label} requests p50 {percentile(latencies, 0.5):.3f}s "
+            f"max {max(latencies):.3f}s"
+            for label, latencies in (("cold", self.cold), ("warm", self.warm))
+            if latencies
+        ]
+        return ", ".join([*parts, f"{self.errors} errors"])
+
+
+def http_session(pool_size: int) -> requests.Session:
+    """
+    Build a session that keeps up to ``pool_size`` connections open.
+
+    Args:
+        pool_size: Number of requests sent at once
+
+    Returns:
+        The session, to be closed by the caller
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def warm_up(
+    url: str,
+    total: int,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    headers: dict[str, str] | None = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+) -> WarmupReport:
+    """
+    Send waves of concurrent requests to a function to spawn its instances.
+
+    Args:
+        url: The function's HTTPS trigger URL
+        total: Number of requests to send
+        concurrency: Requests per wave, sent at once
+        headers: Extra request headers, e.g. an ``Authorization`` token
+        timeout: Seconds to wait for each response
+
+    Returns:
+        The latency of every request
+    """
+    concurrency = max(1, min(concurrency, total))
+    session = http_session(concurrency)
+
+    def send(wave: int) -> WarmupRequest:
+        start = time.perf_counter()
+        try:
+            status: int | None = session.get(
+                url, headers=headers, timeout=timeout
+            ).status_code
+        except requests.RequestException:
+            status = None
+        return WarmupRequest(wave, time.perf_counter() - start, status)
+
+    results: list[WarmupRequest] = []
+    with session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for wave, start in enumerate(range(0, total, concurrency)):
+            size = min(concurrency, total - start)
+            futures = [executor.submit(send, wave) for _ in range(size)]
+            results += [future.result() for future in futures]
+    return WarmupReport(url, results)
@@ -0,0 +1,205 @@
+"""In-memory stand-ins for Google Cloud Storage and other test fixtures."""
+
+import threading
+import time
+import zipfile
+from collections.abc import Sequence
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+def make_wheel(
+    directory: Path,
+    name: str,
+    version: str,
+    requires: Sequence[str] = (),
+    files: dict[str, str] | None = None,
+) -> Path:
+    """Write a minimal pure Python wheel, usable as a local package index."""
+    dist_info = f"{name}-{version}.dist-info"
+    metadata = f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+    metadata += "".join(f"Requires-Dist: {requirement}\n" for requirement in requires)
+    path = directory / f"{name}-{version}-py3-none-any.whl"
+    with zipfile.ZipFile(path, mode="w") as zf:
+        for member, content in (files or {}).items():
+            zf.writestr(member, content)
+        zf.writestr(f"{dist_info}/METADATA", metadata)
+        zf.writestr(
+            f"{dist_info}/WHEEL",
+            "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\n"
+            "Tag: py3-none-any\n",
+        )
+        zf.writestr(f"{dist_info}/RECORD", "")
+    return path
+
+
+class FakeBlob:
+    """Subset of ``google.cloud.storage.Blob`` backed by a FakeBucket."""
+
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.generation: int | None = None
+        self.content_type: str | None = None
+
+    def _check(self, if_generation_match: int | None) -> None:
+        current = self.bucket.generations.get(self.name, 0)
+        if if_generation_match is not None and if_generation_match != current:
+            raise PreconditionFailed(f"generation {current} != {if_generation_match}")
+
+    def exists(self) -> bool:
+        return self.name in self.bucket.objects
+
+    def reload(self) -> None:
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        self.generation = self.bucket.generations[self.name]
+
+    @property
+    def size(self) -> int | None:
+        data = self.bucket.objects.get(self.name)
+        return None if data is None else len(data)
+
+    def upload_from_string(
+        self,
+        data: bytes | str,
+        content_type: str | None = None,
+        if_generation_match: int | None = None,
+    ) -> None:
+        self._check(if_generation_match)
+        if isinstance(data, str):
+            data = data.encode()
+        self.generation = self.bucket.store(self.name, bytes(data))
+        self.content_type = content_type
+
+    def upload_from_file(
+        self,
+        file_obj,
+        size: int | None = None,
+        content_type: str | None = None,
+        rewind: bool = False,
+        if_generation_match: int | None = None,
+    ) -> None:
+        if rewind:
+            file_obj.seek(0)
+        data = file_obj.read() if size is None else file_obj.read(size)
+        self.upload_from_string(data, content_type, if_generation_match)
+
+    def rewrite(
+        self, source: "FakeBlob", token: str | None = None
+    ) -> tuple[str | None, int, int]:
+        data = source.download_as_bytes()
+        self.upload_from_string(data, source.content_type)
+        return None, len(data), len(data)
+
+    def download_as_bytes(self, if_generation_match: int | None = None) -> bytes:
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        self._check(if_generation_match)
+        return self.bucket.objects[self.name]
+
+    def delete(self, if_generation_match: int | None = None) -> None:
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        self._check(if_generation_match)
+        del self.bucket.objects[self.name]
+        del self.bucket.generations[self.name]
+
+
+class FakeBucket:
+    """Subset of ``google.cloud.storage.Bucket`` keeping objects in a dict."""
+
+    def __init__(self, name: str = "state-bucket"):
+        self.name = name
+        self.objects: dict[str, bytes] = {}
+        self.generations: dict[str, int] = {}
+        self._next_generation = 1
+
+    def store(self, name: str, data: bytes) -> int:
+        self.objects[name] = data
+        self.generations[name] = self._next_generation
+        self._next_generation += 1
+        return self.generations[name]
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str) -> FakeBlob | None:
+        if name not in self.objects:
+            return None
+        blob = FakeBlob(self, name)
+        blob.generation = self.generations[name]
+        return blob
+
+    def list_blobs(self, prefix: str = "") -> list[FakeBlob]:
+        return [
+            blob
+            for name in sorted(self.objects)
+            if name.startswith(prefix) and (blob := self.get_blob(name)) is not None
+        ]
+
+    def copy_blob(
+        self, blob: FakeBlob, destination_bucket: "FakeBucket", new_name: str
+    ) -> FakeBlob:
+        data = blob.download_as_bytes()
+        copy = destination_bucket.blob(new_name)
+        copy.upload_from_string(data)
+        return copy
+
+
+class LocalFunction:
+    """
+    HTTP stand-in for a function's HTTPS trigger, served on localhost.
+
+    The first ``cold_starts`` requests are delayed by ``cold_delay`` to
+    mimic instances starting; every request's method, path and headers
+    are recorded.
+    """
+
+    def __init__(
+        self, cold_starts: int = 0, cold_delay: float = 0.0, status: int = 200
+    ):
+        self.cold_starts = cold_starts
+        self.cold_delay = cold_delay
+        self.status = status
+        self.requests: list[tuple[str, str, dict[str, str]]] = []
+        self._lock = threading.Lock()
+        function = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                with function._lock:
+                    function.requests.append(
+                        (self.command, self.path, dict(self.headers))
+                    )
+                    cold = len(function.requests) <= function.cold_starts
+                if cold:
+                    time.sleep(function.cold_delay)
+                self.send_response(function.status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def do_POST(self) -> None:
+                self.do_GET()
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    def __enter__(self) -> "LocalFunction":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.server.shutdown()
+        self.server.server_close()
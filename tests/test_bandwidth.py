@@ -0,0 +1,186 @@
+"""Tests for upload bandwidth shaping."""
+
+import io
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+from requests.utils import super_len
+
+from plugin_scripts import bandwidth, deploy
+from plugin_scripts.bandwidth import (
+    GCS_CHUNK_SIZE,
+    MIB,
+    BandwidthLimiter,
+    ThrottledReader,
+    shaped,
+    upload_limiter,
+)
+
+QUANTUM = 1024
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def _reset_limiters():
+    yield
+    bandwidth._limiters.clear()
+
+
+def _limiter(clock, share_file=None, rate=QUANTUM * 10):
+    return BandwidthLimiter(rate, share_file, QUANTUM, clock, clock.sleep)
+
+
+def test_limiter_paces_reservations():
+    """Test the first quantum goes at once and the next ones at the rate."""
+    clock = FakeClock()
+    limiter = _limiter(clock)
+
+    assert [limiter.reserve() for _ in range(3)] == pytest.approx([0.0, 0.1, 0.2])
+
+
+def test_limiter_refills_while_idle():
+    clock = FakeClock()
+    limiter = _limiter(clock)
+    limiter.acquire()
+    limiter.acquire()
+
+    clock.now += 10
+    assert limiter.reserve() == 0.0
+    assert clock.sleeps == pytest.approx([0.1])
+
+
+def test_limiter_rejects_invalid_rate():
+    with pytest.raises(ValueError, match="must be positive"):
+        BandwidthLimiter(0)
+
+
+def test_limiters_share_a_file(tmp_path):
+    """Test limiters in different processes draw from one budget."""
+    clock = FakeClock()
+    share_file = tmp_path / "bucket.json"
+    first = _limiter(clock, share_file)
+    second = _limiter(clock, share_file)
+
+    assert first.reserve() == 0.0
+    assert second.reserve() == pytest.approx(0.1)
+    assert first.reserve() == pytest.approx(0.2)
+
+
+def test_limiter_resets_a_corrupt_share_file(tmp_path):
+    share_file = tmp_path / "bucket.json"
+    share_file.write_text("{not json")
+
+    assert _limiter(FakeClock(), share_file).reserve() == 0.0
+    assert '"tokens": 0.0' in share_file.read_text()
+
+
+def test_throttled_reader_waits_for_every_quantum():
+    clock = FakeClock()
+    reader = ThrottledReader(io.BytesIO(b"x" * (QUANTUM * 3 + 10)), _limiter(clock))
+
+    chunks = iter(lambda: reader.read(512), b"")
+
+    assert sum(len(chunk) for chunk in chunks) == QUANTUM * 3 + 10
+    assert clock.sleeps == pytest.approx([0.1, 0.1, 0.1])
+
+
+def test_throttled_reader_keeps_stream_length():
+    data = io.BytesIO(b"0123456789")
+    data.seek(4)
+    reader = ThrottledReader(data, _limiter(FakeClock()))
+
+    assert super_len(reader) == 6
+    assert reader.tell() == 4
+    assert reader.read() == b"456789"
+    reader.seek(0)
+    assert reader.read(2) == b"01"
+
+
+def test_small_uploads_are_not_held_back_by_large_ones():
+    """Test concurrent streams share the bandwidth quantum by quantum."""
+    limiter = BandwidthLimiter(QUANTUM * 100, quantum=QUANTUM)
+    finished = {}
+
+    def upload(name, size):
+        reader = limiter.wrap(io.BytesIO(b"x" * size))
+        while reader.read(QUANTUM):
+            pass
+        finished[name] = time.monotonic()
+
+    threads = [
+        threading.Thread(target=upload, args=("large", QUANTUM * 40)),
+        threading.Thread(target=upload, args=("small", QUANTUM * 4)),
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert finished["large"] - start >= 0.38
+    assert finished["small"] - start < (finished["large"] - start) / 2
+
+
+def test_upload_limiter_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv("upload_rate_limit", raising=False)
+    assert upload_limiter() is None
+
+    monkeypatch.setenv("upload_rate_limit", "2.5")
+    monkeypatch.setenv("upload_share_file", str(tmp_path / "bucket.json"))
+    limiter = upload_limiter()
+
+    assert limiter is not None
+    assert limiter.rate == 2.5 * MIB
+    assert limiter.share_file == tmp_path / "bucket.json"
+    assert upload_limiter() is limiter
+
+
+def test_shaped(monkeypatch):
+    data = io.BytesIO(b"zip")
+    blob = Mock(chunk_size=None)
+    monkeypatch.delenv("upload_rate_limit", raising=False)
+    assert shaped(data, blob) is data
+    assert blob.chunk_size is None
+
+    monkeypatch.setenv("upload_rate_limit", "1")
+    monkeypatch.delenv("upload_share_file", raising=False)
+    reader = shaped(data, blob)
+
+    assert isinstance(reader, ThrottledReader)
+    assert reader.data is data
+    assert blob.chunk_size == GCS_CHUNK_SIZE
+
+
+def test_uploads_are_shaped(mocker, monkeypatch):
+    """Test both upload paths hand the shaped stream to their client."""
+    monkeypatch.setenv("upload_rate_limit", "10")
+    monkeypatch.delenv("upload_share_file", raising=False)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    blob = mocker.patch(
+        "plugin_scripts.deploy.storage.Client"
+    ).return_value.bucket.return_value.blob.return_value
+    mock_put = mocker.patch("plugin_scripts.deploy.requests.put")
+
+    deploy._upload_source_code_using_archive_url(
+        "gs://bucket/fn.zip", io.BytesIO(b"zip")
+    )
+    deploy._upload_source_code_using_upload_url("https://upload", False, io.BytesIO())
+
+    assert isinstance(blob.upload_from_file.call_args[0][0], ThrottledReader)
+    assert blob.upload_from_file.call_args[1]["size"] == 3
+    assert blob.chunk_size == GCS_CHUNK_SIZE
+    assert isinstance(mock_put.call_args[1]["data"], ThrottledReader)
@@ -0,0 +1,193 @@
+"""Tests for the post-deploy benchmark and its regression gate."""
+
+from unittest.mock import Mock
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.benchmark import (
+    BenchmarkHistory,
+    BenchmarkResult,
+    MixEntry,
+    parse_mix,
+    regressions,
+    report_table,
+    run_benchmark,
+)
+from plugin_scripts.pipeline_exceptions import BenchmarkRegression
+from plugin_scripts.state import StateStore
+from plugin_scripts.targets import DeployTarget
+from tests.fakes import FakeBucket, LocalFunction
+
+TARGET = DeployTarget("proj", "us-central1", "fn")
+BASELINE = BenchmarkResult(100, 0, 0.05, 0.1, 0.2)
+CREDENTIALS = Mock()
+
+
+def test_parse_mix():
+    assert parse_mix(["GET /health", "post /orders 3"]) == [
+        MixEntry("GET", "/health", 1),
+        MixEntry("POST", "/orders", 3),
+    ]
+
+
+@pytest.mark.parametrize(
+    "entry", ["GET", "GET health", "GET /a 0", "GET /a x", "GET /a 1 2"]
+)
+def test_parse_mix_invalid(entry):
+    with pytest.raises(ValueError, match="benchmark request"):
+        parse_mix([entry])
+
+
+def test_run_benchmark_follows_mix():
+    """Test requests are spread over the mix by weight."""
+    mix = [MixEntry("GET", "/a", 1), MixEntry("POST", "/b", 3)]
+    with LocalFunction() as function:
+        result = run_benchmark(function.url + "/", mix, 8, concurrency=3)
+
+    sent = sorted((method, path) for method, path, _ in function.requests)
+    assert sent == [("GET", "/a")] * 2 + [("POST", "/b")] * 6
+    assert result.requests == 8
+    assert result.errors == 0
+    assert 0 < result.p50 <= result.p95 <= result.p99
+
+
+def test_run_benchmark_counts_errors():
+    with LocalFunction(status=404) as function:
+        result = run_benchmark(function.url, [MixEntry("GET", "/", 1)], 4)
+        url = function.url
+
+    assert result.error_rate == 1.0
+    assert run_benchmark(url, [MixEntry("GET", "/", 1)], 1, timeout=1).errors == 1
+
+
+def test_regressions_within_threshold():
+    current = BenchmarkResult(100, 1, 0.055, 0.11, 0.23)
+    assert regressions(current, BASELINE, threshold=0.2) == []
+
+
+def test_regressions_past_threshold():
+    current = BenchmarkResult(100, 0, 0.05, 0.1, 0.6)
+    assert regressions(current, BASELINE, threshold=0.2) == [
+        "p99 rose from 200ms to 600ms (3.0x)"
+    ]
+
+
+def test_regressions_ignore_noise():
+    """Test tiny absolute increases are not regressions, whatever the ratio."""
+    previous = BenchmarkResult(10, 0, 0.001, 0.0, 0.002)
+    current = BenchmarkResult(10, 0, 0.004, 0.006, 0.004)
+    assert regressions(current, previous) == ["p95 rose from 0ms to 6ms"]
+
+
+def test_regressions_error_rate_without_history():
+    current = BenchmarkResult(100, 5, 0.05, 0.1, 0.2)
+    assert regressions(current, None, max_error_rate=0.01) == [
+        "error rate 5.0% is above 1.0%"
+    ]
+
+
+def test_report_table():
+    current = BenchmarkResult(100, 2, 0.05, 0.1, 0.6)
+    assert report_table(current, BASELINE).splitlines()[2:] == [
+        "| p50 | 50ms | 50ms |",
+        "| p95 | 100ms | 100ms |",
+        "| p99 | 200ms | 600ms |",
+        "| error rate | 0.0% | 2.0% |",
+    ]
+    assert report_table(current, None).splitlines()[2] == "| p50 | - | 50ms |"
+
+
+def test_history_round_trip(monkeypatch):
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "9")
+    store = StateStore(FakeBucket(), "deploys")
+    history = BenchmarkHistory(store, TARGET.path)
+
+    assert history.previous() is None
+    history.save(BASELINE)
+
+    assert history.previous() == BASELINE
+    document, _ = store.read_json(f"benchmarks/{TARGET.path}.json")
+    assert document["build_number"] == "9"
+
+
+@pytest.fixture
+def history(mocker, monkeypatch):
+    """Keep benchmark results in memory and hide the Buildkite agent."""
+    monkeypatch.delenv("BUILDKITE_AGENT_ACCESS_TOKEN", raising=False)
+    store = StateStore(FakeBucket(), "")
+    mocker.patch("plugin_scripts.deploy.StateStore.from_env", return_value=store)
+    return BenchmarkHistory(store, TARGET.path)
+
+
+def test__benchmark_stores_baseline(history):
+    with LocalFunction() as function:
+        deploy._benchmark(TARGET, function.url, {}, 5, CREDENTIALS)
+
+    assert history.previous().requests == 5
+
+
+def test__benchmark_gate_fails_step(mocker, monkeypatch, history):
+    """Test a regression fails the step, annotates and keeps the old baseline."""
+    mocker.patch("plugin_scripts.deploy.buildkite.agent_path", return_value="agent")
+    mock_annotate = mocker.patch("plugin_scripts.deploy.buildkite.annotate")
+    history.save(BenchmarkResult(5, 0, 0.0, 0.0, 0.0))
+
+    with LocalFunction(cold_starts=5, cold_delay=0.05) as function:
+        with pytest.raises(BenchmarkRegression, match="p50 rose from 0ms"):
+            deploy._benchmark(TARGET, function.url, {}, 5, CREDENTIALS)
+
+    assert history.previous() == BenchmarkResult(5, 0, 0.0, 0.0, 0.0)
+    body = mock_annotate.call_args[0][0]
+    assert body.startswith(f"**Benchmark regression in `{TARGET.path}`**")
+    assert "| p99 | 0ms |" in body
+    assert mock_annotate.call_args[1]["style"] == "error"
+
+
+def test__benchmark_annotate_gate(monkeypatch, history):
+    """Test the annotate gate only warns and accepts the new baseline."""
+    monkeypatch.setenv("benchmark_gate", "annotate")
+
+    with LocalFunction(status=500) as function:
+        deploy._benchmark(TARGET, function.url, {}, 2, CREDENTIALS)
+
+    assert history.previous().errors == 2
+
+
+def test__benchmark_without_state_bucket(mocker, monkeypatch):
+    monkeypatch.setenv("benchmark_mix", "GET /a,GET /b")
+    mocker.patch("plugin_scripts.deploy.StateStore.from_env", return_value=None)
+
+    with LocalFunction() as function:
+        deploy._benchmark(TARGET, function.url, {}, 2, CREDENTIALS)
+
+    assert sorted(path for _, path, _ in function.requests) == ["/a", "/b"]
+
+
+def test__benchmark_unknown_gate(monkeypatch):
+    monkeypatch.setenv("benchmark_gate", "ignore")
+
+    with pytest.raises(ValueError, match="Unknown benchmark_gate"):
+        deploy._benchmark(TARGET, "http://unused", {}, 1, CREDENTIALS)
+
+
+def test__post_deploy_benchmark_without_warm_up(mocker, monkeypatch):
+    """Test the benchmark alone still waits for the rollout first."""
+    monkeypatch.delenv("warmup_requests", raising=False)
+    monkeypatch.setenv("benchmark_requests", "3")
+    mocker.patch("plugin_scripts.deploy._operations_resource")
+    mock_wait = mocker.patch("plugin_scripts.deploy.wait_for_operation")
+    mock_warm_up = mocker.patch("plugin_scripts.deploy.warm_up")
+    mock_benchmark = mocker.patch("plugin_scripts.deploy._benchmark")
+
+    deploy._post_deploy(
+        TARGET,
+        {"httpsTrigger": {"url": "https://fn"}},
+        {"name": "op"},
+        CREDENTIALS,
+        Mock(),
+    )
+
+    mock_wait.assert_called_once()
+    mock_warm_up.assert_not_called()
+    mock_benchmark.assert_called_once_with(TARGET, "https://fn", {}, 3, CREDENTIALS)
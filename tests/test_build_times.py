@@ -0,0 +1,261 @@
+"""Tests for remote build duration tracking."""
+
+from datetime import UTC, datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts import deploy
+from plugin_scripts.build_times import (
+    BuildTimeHistory,
+    BuildTiming,
+    build_trend,
+    format_duration,
+    parse_timestamp,
+    report_markdown,
+)
+from plugin_scripts.state import StateStore
+from plugin_scripts.targets import DeployTarget
+from tests.fakes import FakeBucket
+
+TARGET = DeployTarget("proj", "us-central1", "fn")
+CREDENTIALS = Mock()
+NOW = datetime(2024, 5, 15, 12, 0, tzinfo=UTC)
+
+
+def _timing(seconds, days_ago=0.0, build_id="b"):
+    finished = NOW - timedelta(days=days_ago)
+    return BuildTiming(
+        "operations/1",
+        build_id,
+        (finished - timedelta(seconds=seconds)).isoformat(),
+        finished.isoformat(),
+        seconds,
+    )
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("2024-05-15T12:00:00Z", NOW),
+        ("2024-05-15T12:00:00.123456789Z", NOW.replace(microsecond=123456)),
+        ("2024-05-15T14:00:00+02:00", NOW),
+        ("2024-05-15T12:00:00", NOW),
+        ("yesterday", None),
+        (None, None),
+    ],
+)
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+@pytest.mark.parametrize(
+    ("seconds", "expected"), [(45.2, "45s"), (125, "2m 05s"), (0, "0s")]
+)
+def test_format_duration(seconds, expected):
+    assert format_duration(seconds) == expected
+
+
+def test_from_operation_uses_v1_update_times(monkeypatch):
+    """Test v1 operations are timed from the patch to the final update."""
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "7")
+    submitted = {
+        "name": "operations/1",
+        "metadata": {"updateTime": "2024-05-15T12:00:00Z"},
+    }
+    finished = {
+        "name": "operations/1",
+        "done": True,
+        "metadata": {
+            "updateTime": "2024-05-15T12:01:30.5Z",
+            "buildId": "build-1",
+        },
+    }
+
+    timing = BuildTiming.from_operation(submitted, finished, NOW, NOW)
+
+    assert timing == BuildTiming(
+        "operations/1",
+        "build-1",
+        "2024-05-15T12:00:00+00:00",
+        "2024-05-15T12:01:30+00:00",
+        90.5,
+        "7",
+    )
+
+
+def test_from_operation_prefers_create_and_end_times():
+    finished = {
+        "name": "operations/2",
+        "metadata": {
+            "createTime": "2024-05-15T12:00:10Z",
+            "endTime": "2024-05-15T12:00:40Z",
+            "updateTime": "2024-05-15T12:05:00Z",
+            "buildName": "projects/p/locations/l/builds/build-2",
+        },
+    }
+
+    timing = BuildTiming.from_operation({}, finished, NOW, NOW)
+
+    assert timing.seconds == 30.0
+    assert timing.build_id == "build-2"
+
+
+def test_from_operation_falls_back_to_observed_times():
+    timing = BuildTiming.from_operation(
+        {"name": "operations/3"}, {}, NOW, NOW + timedelta(seconds=12)
+    )
+
+    assert timing.operation == "operations/3"
+    assert timing.build_id == ""
+    assert timing.seconds == 12.0
+
+
+def test_build_trend_without_history():
+    trend = build_trend(_timing(60), [])
+
+    assert trend.baseline is None
+    assert not trend.outlier
+    assert trend.summary() == "build took 1m 00s"
+
+
+def test_build_trend_flags_outliers():
+    """Test a build far slower than the last week's median is an outlier."""
+    history = [_timing(40, 1), _timing(50, 2), _timing(60, 3), _timing(500, 30)]
+
+    trend = build_trend(_timing(150), history)
+
+    assert trend.baseline == 50
+    assert trend.previous_week is None
+    assert trend.outlier
+    assert trend.summary() == "build took 2m 30s, 3.0x the recent median of 50s"
+    assert not build_trend(_timing(90), history).outlier
+
+
+def test_build_trend_week_over_week():
+    history = [_timing(90, 1), _timing(90, 2), _timing(30, 8), _timing(30, 9)]
+
+    trend = build_trend(_timing(95), history)
+
+    assert trend.previous_week == 30
+    assert trend.summary().endswith("weekly median up 3.0x since last week")
+    faster = build_trend(_timing(10), [_timing(10, 1), _timing(40, 8)])
+    assert faster.summary().endswith("weekly median down 4.0x since last week")
+
+
+def test_build_trend_uses_older_builds_without_recent_ones():
+    trend = build_trend(_timing(100), [_timing(20, 20), _timing(40, 30)])
+
+    assert trend.baseline == 30
+    assert trend.previous_week is None
+
+
+def test_history_keeps_newest(monkeypatch):
+    store = StateStore(FakeBucket(), "deploys")
+    history = BuildTimeHistory(store, TARGET.path, keep=2)
+    assert history.timings() == []
+
+    for seconds in (10, 20, 30):
+        history.record(_timing(seconds))
+
+    assert [timing.seconds for timing in history.timings()] == [30, 20]
+    assert store.bucket.get_blob(f"deploys/build-times/{TARGET.path}.json")
+
+
+def test_history_retries_on_concurrent_writes(mocker):
+    store = StateStore(FakeBucket(), "")
+    history = BuildTimeHistory(store, TARGET.path, keep=5)
+    write_json = mocker.patch.object(
+        store, "write_json", side_effect=[PreconditionFailed("raced"), 1]
+    )
+
+    history.record(_timing(10))
+
+    assert write_json.call_count == 2
+
+
+def test_report_markdown():
+    trend = build_trend(_timing(150), [_timing(50, 1)])
+
+    assert report_markdown(TARGET.path, _timing(150), trend) == (
+        f"**Slow remote build of `{TARGET.path}`** (build `b`): "
+        "build took 2m 30s, 3.0x the recent median of 50s\n"
+    )
+    assert report_markdown(TARGET.path, _timing(5, build_id=""), trend).startswith(
+        f"**Slow remote build of `{TARGET.path}`**: "
+    )
+
+
+def test__track_build_time_records_and_annotates(mocker, monkeypatch):
+    store = StateStore(FakeBucket(), "")
+    mocker.patch("plugin_scripts.deploy.StateStore.from_env", return_value=store)
+    mocker.patch("plugin_scripts.deploy.buildkite.agent_path", return_value="agent")
+    mock_annotate = mocker.patch("plugin_scripts.deploy.buildkite.annotate")
+    history = BuildTimeHistory(store, TARGET.path, keep=10)
+    history.record(_timing(30, 1))
+
+    deploy._track_build_time(TARGET, _timing(100), CREDENTIALS)
+
+    assert [timing.seconds for timing in history.timings()] == [100, 30]
+    body = mock_annotate.call_args[0][0]
+    assert "3.3x the recent median of 30s" in body
+    assert mock_annotate.call_args[1] == {
+        "style": "warning",
+        "context": f"build-time-{TARGET.path}",
+    }
+
+
+def test__track_build_time_without_state_bucket(mocker, caplog):
+    mocker.patch("plugin_scripts.deploy.StateStore.from_env", return_value=None)
+    mocker.patch("plugin_scripts.deploy.buildkite.agent_path", return_value=None)
+
+    with caplog.at_level("INFO", logger="cloud-function"):
+        deploy._track_build_time(TARGET, _timing(30), CREDENTIALS)
+
+    assert f"Remote build b of {TARGET.path}: build took 30s" in caplog.text
+
+
+def test__post_deploy_tracks_build_time(mocker, monkeypatch):
+    """Test build times are tracked from the finished operation alone."""
+    monkeypatch.setenv("track_build_times", "true")
+    monkeypatch.delenv("warmup_requests", raising=False)
+    monkeypatch.delenv("benchmark_requests", raising=False)
+    mocker.patch("plugin_scripts.deploy._operations_resource")
+    finished = {
+        "name": "operations/1",
+        "done": True,
+        "metadata": {"updateTime": "2024-05-15T12:01:00Z", "buildId": "b1"},
+    }
+    mocker.patch("plugin_scripts.deploy.wait_for_operation", return_value=finished)
+    mock_track = mocker.patch("plugin_scripts.deploy._track_build_time")
+    mock_warm_up = mocker.patch("plugin_scripts.deploy.warm_up")
+
+    deploy._post_deploy(
+        TARGET,
+        {"httpsTrigger": {"url": "https://fn"}},
+        {"name": "operations/1", "metadata": {"updateTime": "2024-05-15T12:00:00Z"}},
+        CREDENTIALS,
+        Mock(),
+    )
+
+    target, timing, _ = mock_track.call_args[0]
+    assert target == TARGET
+    assert (timing.build_id, timing.seconds) == ("b1", 60.0)
+    mock_warm_up.assert_not_called()
+
+
+def test__post_deploy_build_time_failures_only_warn(mocker, monkeypatch, caplog):
+    monkeypatch.setenv("track_build_times", "true")
+    monkeypatch.delenv("warmup_requests", raising=False)
+    monkeypatch.delenv("benchmark_requests", raising=False)
+    mocker.patch("plugin_scripts.deploy._operations_resource")
+    mocker.patch("plugin_scripts.deploy.wait_for_operation", return_value={})
+    mocker.patch(
+        "plugin_scripts.deploy._track_build_time", side_effect=RuntimeError("down")
+    )
+
+    with caplog.at_level("WARNING", logger="cloud-function"):
+        deploy._post_deploy(TARGET, {}, {"name": "op"}, CREDENTIALS, Mock())
+
+    assert f"Could not track the build time of {TARGET.path}: down" in caplog.text
@@ -0,0 +1,101 @@
+"""Tests for the buildkite module."""
+
+import pytest
+
+from plugin_scripts import buildkite
+
+
+@pytest.fixture
+def agent(mocker, monkeypatch):
+    """Pretend buildkite-agent is available and capture its invocations."""
+    monkeypatch.setenv("BUILDKITE_AGENT_ACCESS_TOKEN", "token")
+    mocker.patch(
+        "plugin_scripts.buildkite.shutil.which",
+        return_value="/usr/bin/buildkite-agent",
+    )
+    run = mocker.patch("plugin_scripts.buildkite.subprocess.run")
+    run.return_value.stdout = "value"
+    return run
+
+
+def test_agent_path_requires_token(mocker, monkeypatch):
+    """Test the agent is ignored outside a Buildkite job."""
+    monkeypatch.delenv("BUILDKITE_AGENT_ACCESS_TOKEN", raising=False)
+    mocker.patch(
+        "plugin_scripts.buildkite.shutil.which",
+        return_value="/usr/bin/buildkite-agent",
+    )
+    assert buildkite.agent_path() is None
+
+
+def test_agent_path(agent):
+    """Test the agent binary is found on the PATH."""
+    assert buildkite.agent_path() == "/usr/bin/buildkite-agent"
+
+
+def test_meta_data_get(agent):
+    """Test meta-data is read with an empty default."""
+    assert buildkite.meta_data_get("key") == "value"
+    assert agent.call_args[0][0] == [
+        "/usr/bin/buildkite-agent",
+        "meta-data",
+        "get",
+        "key",
+        "--default",
+        "",
+    ]
+
+
+def test_meta_data_set(agent):
+    """Test meta-data values are passed on stdin."""
+    buildkite.meta_data_set("key", "value")
+    assert agent.call_args[0][0] == [
+        "/usr/bin/buildkite-agent",
+        "meta-data",
+        "set",
+        "key",
+    ]
+    assert agent.call_args[1]["input"] == "value"
+
+
+def test_run_without_agent(monkeypatch):
+    """Test calls fail clearly when the agent is not available."""
+    monkeypatch.delenv("BUILDKITE_AGENT_ACCESS_TOKEN", raising=False)
+    with pytest.raises(RuntimeError):
+        buildkite.meta_data_get("key")
+
+
+def test_artifact_upload(agent):
+    """Test several artifacts are uploaded in one call."""
+    buildkite.artifact_upload("out/fn.zip", "out/fn.manifest.json")
+    assert agent.call_args[0][0][1:] == [
+        "artifact",
+        "upload",
+        "out/fn.zip;out/fn.manifest.json",
+    ]
+
+
+def test_annotate(agent):
+    """Test the annotation body is passed on stdin."""
+    buildkite.annotate("**slow**", style="warning", context="benchmark")
+    assert agent.call_args[0][0][1:] == [
+        "annotate",
+        "--style",
+        "warning",
+        "--context",
+        "benchmark",
+    ]
+    assert agent.call_args[1]["input"] == "**slow**"
+
+
+def test_build_info(monkeypatch):
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "12")
+    monkeypatch.setenv("BUILDKITE_COMMIT", "abc")
+    monkeypatch.delenv("BUILDKITE_PIPELINE_SLUG", raising=False)
+    assert buildkite.build_info() == {"build_number": "12", "commit": "abc"}
+
+
+def test_artifact_download(agent):
+    """Test artifacts are downloaded into the working directory."""
+    buildkite.artifact_download("out/fn.zip")
+    assert agent.call_args[0][0][1:] == ["artifact", "download", "out/fn.zip", "."]
@@ -0,0 +1,163 @@
+"""Tests for precompiled bytecode."""
+
+import importlib
+import sys
+import zipfile
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.bytecode import (
+    BytecodeCompiler,
+    compile_unchecked,
+    pyc_name,
+    runtime_version,
+)
+
+CURRENT = f"python{sys.version_info[0]}{sys.version_info[1]}"
+CACHE_TAG = sys.implementation.cache_tag
+
+
+@pytest.mark.parametrize(
+    ("runtime", "version"),
+    [("python312", (3, 12)), ("python39", (3, 9)), ("nodejs20", None), ("", None)],
+)
+def test_runtime_version(runtime, version):
+    """Test Python versions are read from runtime identifiers."""
+    assert runtime_version(runtime) == version
+
+
+def test_pyc_name():
+    """Test pycs are placed where the import system looks for them."""
+    assert pyc_name("main.py", "cpython-312") == "__pycache__/main.cpython-312.pyc"
+    assert (
+        pyc_name("lib/util.py", "cpython-312") == "lib/__pycache__/util.cpython-312.pyc"
+    )
+
+
+def test_compiled_pyc_is_used_without_checking_source(monkeypatch, tmp_path):
+    """Test the interpreter loads the pyc even though the source differs."""
+    (tmp_path / "__pycache__").mkdir()
+    pyc = compile_unchecked(b"VALUE = 'compiled'\n", "bytecode_probe.py")
+    (tmp_path / "__pycache__" / f"bytecode_probe.{CACHE_TAG}.pyc").write_bytes(pyc)
+    (tmp_path / "bytecode_probe.py").write_text("VALUE = 'source'\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "bytecode_probe", raising=False)
+
+    module = importlib.import_module("bytecode_probe")
+
+    assert module.VALUE == "compiled"
+
+
+def test_for_runtime_matching_interpreter():
+    """Test the current interpreter compiles for its own runtime."""
+    compiler = BytecodeCompiler.for_runtime(CURRENT)
+
+    assert compiler is not None
+    assert compiler.interpreter is None
+    assert compiler.cache_tag == CACHE_TAG
+
+
+def test_for_runtime_other_version(mocker):
+    """Test other versions use the matching interpreter from PATH."""
+    which = mocker.patch(
+        "plugin_scripts.bytecode.shutil.which", return_value="/usr/bin/python3.9"
+    )
+
+    compiler = BytecodeCompiler.for_runtime("python39")
+
+    assert compiler is not None
+    assert compiler.interpreter == "/usr/bin/python3.9"
+    which.assert_called_once_with("python3.9")
+
+
+def test_for_runtime_unavailable(mocker):
+    """Test runtimes without an interpreter or Python get no compiler."""
+    mocker.patch("plugin_scripts.bytecode.shutil.which", return_value=None)
+
+    assert BytecodeCompiler.for_runtime("python39") is None
+    assert BytecodeCompiler.for_runtime("go121") is None
+
+
+@pytest.mark.parametrize("interpreter", [None, sys.executable])
+def test_compile_skips_broken_files(tmp_path, interpreter):
+    """Test both compile paths handle files and contents and skip broken files."""
+    (tmp_path / "good.py").write_text("x = 1\n")
+    (tmp_path / "bad.py").write_text("def (:\n")
+    compiler = BytecodeCompiler((3, 99), interpreter)
+
+    compiled = compiler.compile(
+        [
+            (tmp_path / "good.py", "pkg/good.py"),
+            (tmp_path / "bad.py", "bad.py"),
+            (b"y = 2\n", "vendored.py"),
+        ]
+    )
+
+    assert sorted(compiled) == [
+        "__pycache__/vendored.cpython-399.pyc",
+        "pkg/__pycache__/good.cpython-399.pyc",
+    ]
+    assert compiled["pkg/__pycache__/good.cpython-399.pyc"][8:16] == (
+        importlib.util.source_hash(b"x = 1\n")
+    )
+
+
+def test_compile_externally_interpreter_fails(tmp_path):
+    """Test a broken interpreter skips bytecode instead of failing."""
+    (tmp_path / "good.py").write_text("x = 1\n")
+    compiler = BytecodeCompiler((3, 99), str(tmp_path / "missing-python"))
+
+    assert compiler.compile([(tmp_path / "good.py", "good.py")]) == {}
+
+
+def test_zip_directory_adds_bytecode(monkeypatch, tmp_path):
+    """Test bytecode replaces __pycache__ directories from the sources."""
+    source_dir = tmp_path / "src"
+    (source_dir / "__pycache__").mkdir(parents=True)
+    (source_dir / "__pycache__" / "main.cpython-310.pyc").write_bytes(b"stale")
+    (source_dir / "main.py").write_text("def handler(request): ...\n")
+    (source_dir / "data.json").write_text("{}")
+    monkeypatch.setenv("cloud_function_directory", str(source_dir))
+    archive = tmp_path / "fn.zip"
+
+    with zipfile.ZipFile(archive, mode="w") as zf:
+        deploy._zip_directory(zf, [BytecodeCompiler(sys.version_info[:2])])
+
+    with zipfile.ZipFile(archive) as zf:
+        assert sorted(zf.namelist()) == [
+            f"__pycache__/main.{CACHE_TAG}.pyc",
+            "data.json",
+            "main.py",
+        ]
+
+
+def test_bytecode_compilers(mocker, monkeypatch):
+    """Test one compiler is used per Python version when enabled."""
+    monkeypatch.delenv("bytecode", raising=False)
+    assert deploy._bytecode_compilers([CURRENT]) == []
+
+    monkeypatch.setenv("bytecode", "true")
+    mocker.patch("plugin_scripts.bytecode.shutil.which", return_value=None)
+    compilers = deploy._bytecode_compilers([CURRENT, CURRENT, "nodejs20"])
+    assert [compiler.version for compiler in compilers] == [sys.version_info[:2]]
+
+    assert deploy._bytecode_compilers(["nodejs20"]) == []
+
+
+def test_package_mode_bytecode(mocker, monkeypatch, tmp_path):
+    """Test package mode compiles for the configured runtimes."""
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    (source_dir / "main.py").write_text("def handler(request): ...\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("cloud_function_name", "fn")
+    monkeypatch.setenv("cloud_function_directory", str(source_dir))
+    monkeypatch.setenv("bytecode", "true")
+    monkeypatch.setenv("package_runtimes", CURRENT)
+    monkeypatch.delenv("BUILDKITE_AGENT_ACCESS_TOKEN", raising=False)
+
+    deploy._package(False)
+
+    with zipfile.ZipFile(tmp_path / "cloud-function-packages" / "fn.zip") as zf:
+        assert f"__pycache__/main.{CACHE_TAG}.pyc" in zf.namelist()
@@ -0,0 +1,20 @@
+"""Tests for the cache directory helper."""
+
+from plugin_scripts.cache import cache_path
+
+
+def test_cache_path_disabled(monkeypatch):
+    """Test no cache is used unless cache_dir is configured."""
+    monkeypatch.delenv("cache_dir", raising=False)
+
+    assert cache_path("resolve") is None
+
+
+def test_cache_path_creates_directory(monkeypatch, tmp_path):
+    """Test cache directories are created below cache_dir."""
+    monkeypatch.setenv("cache_dir", str(tmp_path))
+
+    path = cache_path("wheels", "abc")
+
+    assert path == tmp_path / "wheels" / "abc"
+    assert path is not None and path.is_dir()
@@ -0,0 +1,146 @@
+"""Tests for the checkpoint module."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from plugin_scripts import checkpoint
+
+
+def test_source_digest_tracks_contents_and_paths(tmp_path):
+    """Test the digest changes with file contents and names only."""
+    (tmp_path / "main.py").write_text("print('a')")
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "util.py").write_text("x = 1")
+    first = checkpoint.source_digest(tmp_path)
+
+    assert checkpoint.source_digest(tmp_path) == first
+
+    (tmp_path / "main.py").write_text("print('b')")
+    assert checkpoint.source_digest(tmp_path) != first
+
+    (tmp_path / "main.py").write_text("print('a')")
+    (tmp_path / "lib" / "util.py").rename(tmp_path / "lib" / "other.py")
+    assert checkpoint.source_digest(tmp_path) != first
+
+
+def test_from_env_disabled(monkeypatch):
+    """Test checkpoints are off unless resume_on_retry is set."""
+    monkeypatch.delenv("resume_on_retry", raising=False)
+    assert checkpoint.CheckpointStore.from_env("fn") is None
+
+
+def test_from_env_checkpoint_file(monkeypatch, tmp_path):
+    """Test a local checkpoint file takes precedence."""
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.setenv("checkpoint_file", str(tmp_path / "state.json"))
+
+    store = checkpoint.CheckpointStore.from_env("fn")
+    assert store is not None
+    assert store.path == tmp_path / "state.json"
+
+
+def test_from_env_meta_data(mocker, monkeypatch):
+    """Test build meta-data is used inside a Buildkite job."""
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.delenv("checkpoint_file", raising=False)
+    mocker.patch(
+        "plugin_scripts.checkpoint.buildkite.agent_path", return_value="/bin/agent"
+    )
+
+    store = checkpoint.CheckpointStore.from_env("fn")
+    assert store is not None
+    assert store.path is None
+    assert store.key == "cloud-functions-checkpoint:fn"
+
+
+def test_from_env_nowhere_to_store(mocker, monkeypatch):
+    """Test checkpoints are disabled when there is nowhere to keep them."""
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.delenv("checkpoint_file", raising=False)
+    mocker.patch("plugin_scripts.checkpoint.buildkite.agent_path", return_value=None)
+
+    assert checkpoint.CheckpointStore.from_env("fn") is None
+
+
+def test_file_store_round_trip(tmp_path):
+    """Test checkpoints for several functions share one file."""
+    path = tmp_path / "state.json"
+    first = checkpoint.CheckpointStore("fn-1", path)
+    second = checkpoint.CheckpointStore("fn-2", path)
+
+    assert first.load() is None
+    first.save({"phase": checkpoint.PHASE_UPLOADED})
+    second.save({"phase": checkpoint.PHASE_PATCHED})
+
+    assert first.load() == {"phase": checkpoint.PHASE_UPLOADED}
+    first.clear()
+    assert first.load() is None
+    assert second.load() == {"phase": checkpoint.PHASE_PATCHED}
+
+
+def test_file_store_concurrent_saves(tmp_path):
+    """Test concurrent saves to one file do not lose each other's updates."""
+    path = tmp_path / "state.json"
+    stores = [checkpoint.CheckpointStore(f"fn-{i}", path) for i in range(16)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda s: s.save({"phase": "patched"}), stores))
+
+    assert all(store.load() == {"phase": "patched"} for store in stores)
+
+
+def test_meta_data_store_round_trip(mocker):
+    """Test checkpoints are stored as JSON build meta-data."""
+    stored: dict[str, str] = {}
+    mocker.patch(
+        "plugin_scripts.checkpoint.buildkite.meta_data_set",
+        side_effect=stored.__setitem__,
+    )
+    mocker.patch(
+        "plugin_scripts.checkpoint.buildkite.meta_data_get",
+        side_effect=lambda key: stored.get(key, ""),
+    )
+    store = checkpoint.CheckpointStore("fn")
+
+    assert store.load() is None
+    store.save({"phase": checkpoint.PHASE_UPLOADED})
+    assert store.load() == {"phase": checkpoint.PHASE_UPLOADED}
+
+
+def test_meta_data_store_leaves_out_upload_urls(mocker, tmp_path):
+    """Test signed upload URLs only go to the local checkpoint file."""
+    stored: dict[str, str] = {}
+    mocker.patch(
+        "plugin_scripts.checkpoint.buildkite.meta_data_set",
+        side_effect=stored.__setitem__,
+    )
+    mocker.patch(
+        "plugin_scripts.checkpoint.buildkite.meta_data_get",
+        side_effect=lambda key: stored.get(key, ""),
+    )
+    uploaded = {"phase": checkpoint.PHASE_UPLOADED, "upload_url": "https://signed"}
+    store = checkpoint.CheckpointStore("fn")
+    file_store = checkpoint.CheckpointStore("fn", tmp_path / "state.json")
+
+    store.save(uploaded)
+    file_store.save(uploaded)
+
+    assert "signed" not in stored["fn"]
+    assert store.load() == {"phase": checkpoint.PHASE_UPLOADED}
+    assert file_store.load() == uploaded
+
+
+@pytest.mark.parametrize("method", ["meta_data_get", "meta_data_set"])
+def test_store_errors_are_not_fatal(mocker, method):
+    """Test checkpoint failures never fail the deploy."""
+    mocker.patch(
+        f"plugin_scripts.checkpoint.buildkite.{method}",
+        side_effect=RuntimeError("agent down"),
+    )
+    store = checkpoint.CheckpointStore("fn")
+
+    if method == "meta_data_get":
+        assert store.load() is None
+    else:
+        store.save({"phase": checkpoint.PHASE_UPLOADED})
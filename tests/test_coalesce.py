@@ -0,0 +1,156 @@
+"""Tests for the coalesce module."""
+
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts import coalesce
+from plugin_scripts.state import StateStore
+from tests.fakes import FakeBucket
+
+FUNCTION = "projects/p/locations/r/functions/f"
+
+
+class FakeClock:
+    """Wall clock whose sleep advances time."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def _coalescer(store, build_number, clock=None, **kwargs):
+    clock = clock or FakeClock()
+    return coalesce.DeployCoalescer(
+        store,
+        FUNCTION,
+        pipeline="deploy",
+        build_number=build_number,
+        owner=f"job-{build_number}",
+        clock=clock,
+        sleep=clock.sleep,
+        **kwargs,
+    )
+
+
+def test_acquire_and_release():
+    """Test the lock is created and then removed."""
+    bucket = FakeBucket()
+    store = StateStore(bucket)
+    coalescer = _coalescer(store, 10)
+
+    assert coalescer.acquire()
+    assert store.read_json(coalescer.lock_key)[0]["owner"] == "job-10"
+    assert coalescer.latest_build() == 10
+
+    coalescer.release()
+    assert store.read_json(coalescer.lock_key) == (None, 0)
+    # Releasing twice is a no-op
+    coalescer.release()
+
+
+def test_older_build_is_skipped():
+    """Test a build skips itself when a newer build already registered."""
+    store = StateStore(FakeBucket())
+    _coalescer(store, 12).register()
+
+    assert not _coalescer(store, 11).acquire()
+
+
+def test_register_does_not_regress():
+    """Test the newest build number only moves forward."""
+    store = StateStore(FakeBucket())
+    _coalescer(store, 12).register()
+    _coalescer(store, 11).register()
+
+    assert _coalescer(store, 12).latest_build() == 12
+
+
+def test_waiting_build_is_superseded_while_locked():
+    """Test a waiting build skips itself once a newer one registers."""
+    store = StateStore(FakeBucket())
+    holder = _coalescer(store, 10)
+    assert holder.acquire()
+
+    clock = FakeClock()
+    waiting = _coalescer(store, 11, clock=clock)
+    newer = _coalescer(store, 12)
+
+    def newer_registers(seconds):
+        clock.now += seconds
+        newer.register()
+
+    waiting._sleep = newer_registers
+    assert not waiting.acquire()
+
+
+def test_waiter_gets_lock_after_release():
+    """Test a waiting build acquires the lock once the holder releases it."""
+    store = StateStore(FakeBucket())
+    holder = _coalescer(store, 10)
+    assert holder.acquire()
+
+    waiting = _coalescer(store, 11)
+    waiting._sleep = lambda seconds: holder.release()
+    assert waiting.acquire()
+
+
+def test_expired_lock_is_taken_over():
+    """Test a lock left behind by a crashed job can be taken over."""
+    store = StateStore(FakeBucket())
+    clock = FakeClock()
+    crashed = _coalescer(store, 10, clock=clock, lease_seconds=60)
+    assert crashed.acquire()
+
+    clock.now += 61
+    successor = _coalescer(store, 11, clock=clock)
+    assert successor.acquire()
+
+    # The crashed job must not delete the successor's lock
+    crashed.release()
+    assert store.read_json(successor.lock_key)[0]["owner"] == "job-11"
+
+
+def test_lock_race_is_retried(mocker):
+    """Test losing the create race waits and tries again."""
+    store = StateStore(FakeBucket())
+    coalescer = _coalescer(store, 10)
+    mocker.patch.object(
+        store,
+        "write_json",
+        side_effect=[1, PreconditionFailed("raced"), 3],
+    )
+    mocker.patch.object(store, "read_json", return_value=(None, 0))
+
+    assert coalescer.acquire()
+    assert coalescer._lock_generation == 3
+
+
+def test_register_retries_on_concurrent_update(mocker):
+    """Test the intent write is retried when another build raced it."""
+    store = StateStore(FakeBucket())
+    coalescer = _coalescer(store, 10)
+    write = mocker.patch.object(
+        store, "write_json", side_effect=[PreconditionFailed("raced"), 2]
+    )
+
+    coalescer.register()
+    assert write.call_count == 2
+
+
+def test_without_build_number_only_locks():
+    """Test coalescing is skipped when the build number is unknown."""
+    store = StateStore(FakeBucket())
+    coalescer = _coalescer(store, None)
+
+    assert coalescer.superseded_by() is None
+    assert coalescer.acquire()
+    assert coalescer.latest_build() is None
+
+
+def test_default_owner():
+    """Test the default owner identifies the host."""
+    assert ":" in coalesce.default_owner()
@@ -0,0 +1,132 @@
+"""Tests for the archive size budget and composition report."""
+
+import logging
+import os
+import zipfile
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.composition import (
+    MAX_ARCHIVE_SIZE,
+    ArchiveComposition,
+    format_size,
+)
+from plugin_scripts.pipeline_exceptions import ArchiveTooLarge
+
+
+@pytest.fixture
+def source_dir(tmp_path, monkeypatch):
+    """Sources with a large incompressible asset and compressible code."""
+    directory = tmp_path / "src"
+    (directory / "assets").mkdir(parents=True)
+    (directory / "main.py").write_text("def handler(request):\n    return 'ok'\n" * 50)
+    (directory / "assets" / "blob.bin").write_bytes(os.urandom(64 * 1024))
+    (directory / "assets" / "notes.txt").write_text("note " * 2000)
+    monkeypatch.setenv("cloud_function_directory", str(directory))
+    return directory
+
+
+@pytest.mark.parametrize(
+    ("size", "text"),
+    [(12, "12 B"), (1536, "1.5 KiB"), (5 * 1024 * 1024, "5.0 MiB"), (2**31, "2.0 GiB")],
+)
+def test_format_size(size, text):
+    assert format_size(size) == text
+
+
+def test_size_matches_written_archive(source_dir, tmp_path):
+    """Test the running size accounts for headers and the central directory."""
+    composition = ArchiveComposition(budget=0)
+    archive = tmp_path / "out.zip"
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as handler:
+        deploy._zip_directory(handler, composition=composition)
+
+    assert composition.size == archive.stat().st_size
+    assert composition.uncompressed_size == sum(
+        path.stat().st_size for path in source_dir.rglob("*") if path.is_file()
+    )
+
+
+def test_report(source_dir, tmp_path):
+    """Test the report lists directories, files and poorly compressed files."""
+    composition = ArchiveComposition(budget=0)
+    with zipfile.ZipFile(
+        tmp_path / "out.zip", "w", compression=zipfile.ZIP_DEFLATED
+    ) as handler:
+        deploy._zip_directory(handler, composition=composition)
+
+    lines = composition.report(top=2).splitlines()
+
+    assert lines[0].startswith("Archive composition:")
+    assert lines[0].endswith("3 files")
+    assert lines[1] == "Largest directories:"
+    assert lines[2].endswith("  assets/")
+    assert lines[3] == "Largest files:"
+    assert lines[4].endswith("  assets/blob.bin")
+    assert lines[6] == "Worst compression ratios (compressed / original):"
+    assert lines[7].endswith("assets/blob.bin (64.0 KiB)")
+    assert lines[8].endswith("assets/notes.txt (9.8 KiB)")
+
+
+def test_report_empty_archive():
+    assert ArchiveComposition().report() == (
+        "Archive composition: 22 B compressed, 0 B uncompressed, 0 files"
+    )
+
+
+def test_budget_aborts_packaging_early(mocker, source_dir, tmp_path):
+    """Test zipping stops at the first member past the budget."""
+    composition = ArchiveComposition(budget=32 * 1024)
+    with zipfile.ZipFile(
+        tmp_path / "out.zip", "w", compression=zipfile.ZIP_DEFLATED
+    ) as handler:
+        write = mocker.spy(handler, "write")
+        with pytest.raises(ArchiveTooLarge) as exc_info:
+            deploy._zip_directory(handler, composition=composition)
+
+    # assets/blob.bin is the first file written
+    assert write.call_count == 1
+    assert exc_info.value.budget == 32 * 1024
+    assert exc_info.value.size > 64 * 1024
+    assert "assets/blob.bin" in str(exc_info.value)
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("archive_size_budget", raising=False)
+    monkeypatch.delenv("archive_report", raising=False)
+    composition = ArchiveComposition.from_env()
+    assert composition.budget == MAX_ARCHIVE_SIZE
+    assert not composition.log_report
+
+    monkeypatch.setenv("archive_size_budget", "0")
+    monkeypatch.setenv("archive_report", "true")
+    composition = ArchiveComposition.from_env()
+    assert composition.budget == 0
+    assert composition.log_report
+
+
+def test_build_archive_logs_report(caplog, monkeypatch, source_dir):
+    """Test archives are deflated and the report is logged on request."""
+    monkeypatch.setenv("archive_report", "true")
+    monkeypatch.setenv("packaging_profile", "none")
+
+    with caplog.at_level(logging.INFO, logger="cloud-function"):
+        with deploy._build_archive() as data, zipfile.ZipFile(data) as zf:
+            info = zf.getinfo("main.py")
+
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    assert info.compress_size < info.file_size
+    assert "Archive composition:" in caplog.text
+
+
+def test_package_removes_oversized_archive(monkeypatch, source_dir, tmp_path):
+    """Test package mode leaves no partial archive behind."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("cloud_function_name", "fn")
+    monkeypatch.setenv("archive_size_budget", "1024")
+
+    with pytest.raises(ArchiveTooLarge):
+        deploy._package(False)
+
+    assert not (tmp_path / "cloud-function-packages" / "fn.zip").exists()
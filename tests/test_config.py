@@ -0,0 +1,76 @@
+"""Tests for the config module."""
+
+import pytest
+
+from plugin_scripts import config
+
+
+def test_env_str_default(monkeypatch):
+    """Test env_str falls back to the default when unset."""
+    monkeypatch.delenv("some_setting", raising=False)
+    assert config.env_str("some_setting", "fallback") == "fallback"
+
+
+def test_env_str_strips(monkeypatch):
+    """Test env_str strips surrounding whitespace."""
+    monkeypatch.setenv("some_setting", "  value \n")
+    assert config.env_str("some_setting") == "value"
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [("true", True), ("ON", True), ("1", True), ("false", False), ("0", False)],
+)
+def test_env_bool(monkeypatch, value, expected):
+    """Test env_bool accepts the spellings the hook accepts."""
+    monkeypatch.setenv("some_setting", value)
+    assert config.env_bool("some_setting") is expected
+
+
+def test_env_bool_default(monkeypatch):
+    """Test env_bool falls back to the default when unset."""
+    monkeypatch.delenv("some_setting", raising=False)
+    assert config.env_bool("some_setting", default=True) is True
+
+
+def test_env_bool_invalid(monkeypatch):
+    """Test env_bool rejects unknown values."""
+    monkeypatch.setenv("some_setting", "maybe")
+    with pytest.raises(ValueError) as exc_info:
+        config.env_bool("some_setting")
+    assert "some_setting" in str(exc_info.value)
+
+
+def test_env_int(monkeypatch):
+    """Test env_int parses integers and falls back on empty values."""
+    monkeypatch.setenv("some_setting", "42")
+    assert config.env_int("some_setting", 1) == 42
+    monkeypatch.setenv("some_setting", "")
+    assert config.env_int("some_setting", 1) == 1
+
+
+def test_env_int_invalid(monkeypatch):
+    """Test env_int rejects non-integers."""
+    monkeypatch.setenv("some_setting", "4.2")
+    with pytest.raises(ValueError) as exc_info:
+        config.env_int("some_setting", 1)
+    assert "Invalid integer" in str(exc_info.value)
+
+
+def test_env_float(monkeypatch):
+    """Test env_float parses numbers and rejects garbage."""
+    monkeypatch.setenv("some_setting", "0.5")
+    assert config.env_float("some_setting", 1.0) == 0.5
+    monkeypatch.delenv("some_setting")
+    assert config.env_float("some_setting", 1.0) == 1.0
+    monkeypatch.setenv("some_setting", "fast")
+    with pytest.raises(ValueError):
+        config.env_float("some_setting", 1.0)
+
+
+def test_env_list(monkeypatch):
+    """Test env_list splits on commas and newlines."""
+    monkeypatch.setenv("some_setting", "a, b\nc,,")
+    assert config.env_list("some_setting") == ["a", "b", "c"]
+    monkeypatch.delenv("some_setting")
+    assert config.env_list("some_setting") == []
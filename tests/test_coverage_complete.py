@@ -1,5 +1,6 @@
 """Tests for edge cases and error paths with full coverage."""
 
+import io
 import json
 import os
 import tempfile
@@ -126,8 +127,7 @@ def test__upload_source_code_using_archive_url_success_with_logging(
     mock_creds = mocker.Mock()
     mocker.patch("plugin_scripts.deploy._get_bq_credentials", return_value=mock_creds)
 
-    mock_data = mocker.Mock()
-    mock_data.read.return_value = b"test source code data"
+    mock_data = io.BytesIO(b"test source code data")
 
     # Execute
     deploy._upload_source_code_using_archive_url(
@@ -138,7 +138,9 @@ def test__upload_source_code_using_archive_url_success_with_logging(
     mock_storage.Client.assert_called_once_with(credentials=mock_creds)
     mock_client.bucket.assert_called_once_with("my-bucket")
     mock_bucket.blob.assert_called_once_with("functions/my-function.zip")
-    mock_blob.upload_from_string.assert_called_once_with(b"test source code data")
+    mock_blob.upload_from_file.assert_called_once_with(
+        mock_data, size=21, content_type="application/zip"
+    )
 
 
 def test__upload_source_code_using_upload_url_with_headers(mocker):
@@ -0,0 +1,217 @@
+"""Tests for the deploy daemon, its client and the warm client cache."""
+
+import io
+import logging
+import os
+import stat
+import tempfile
+import threading
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+from plugin_scripts import clients, daemon_client, deploy
+from plugin_scripts.daemon import DeployDaemon
+from plugin_scripts.daemon_client import job_environment, submit
+from plugin_scripts.pipeline_exceptions import DeployFailed
+
+
+@pytest.fixture(autouse=True)
+def _cold_clients():
+    clients.clear()
+    yield
+    clients.clear()
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to about a hundred bytes
+    path = Path(tempfile.gettempdir()) / f"cf-daemon-{os.getpid()}.sock"
+    yield str(path)
+    path.unlink(missing_ok=True)
+
+
+@pytest.fixture
+def server(socket_path):
+    server = DeployDaemon(socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_daemon_runs_job_in_its_environment(mocker, server, socket_path, tmp_path):
+    """Test a job sees its env and checkout, and the daemon's are restored."""
+    seen: dict[str, object] = {}
+
+    def fake_main():
+        seen["env"] = os.environ.get("cloud_function_name")
+        seen["cwd"] = Path.cwd()
+        logging.getLogger("cloud-function").info("deploying")
+        logging.getLogger("cloud-function").setLevel(logging.DEBUG)
+
+    mocker.patch("plugin_scripts.daemon.deploy.main", side_effect=fake_main)
+    cwd = Path.cwd()
+    out = io.StringIO()
+
+    code = submit(socket_path, {"cloud_function_name": "fn"}, str(tmp_path), out)
+
+    assert code == 0
+    assert seen == {"env": "fn", "cwd": tmp_path}
+    assert "deploying\n" in out.getvalue()
+    assert "cloud_function_name" not in os.environ
+    assert Path.cwd() == cwd
+    assert logging.getLogger("cloud-function").level == logging.INFO
+    assert stat.S_IMODE(Path(socket_path).stat().st_mode) == 0o600
+
+
+def test_daemon_reports_failed_deploys(mocker, server, socket_path, tmp_path):
+    mocker.patch(
+        "plugin_scripts.daemon.deploy.main", side_effect=DeployFailed("patch failed")
+    )
+    out = io.StringIO()
+
+    assert submit(socket_path, {}, str(tmp_path), out) == 1
+    assert "Deploy failed: patch failed" in out.getvalue()
+
+
+def test_daemon_rejects_invalid_jobs(server, socket_path, tmp_path, mocker):
+    mocker.patch("plugin_scripts.daemon_client.PROTOCOL_VERSION", 99)
+    mock_main = mocker.patch("plugin_scripts.daemon.deploy.main")
+
+    assert submit(socket_path, {}, str(tmp_path), io.StringIO()) == 2
+    mock_main.assert_not_called()
+
+
+def test_daemon_runs_jobs_one_at_a_time(mocker, server, socket_path, tmp_path):
+    running = []
+    overlapped = threading.Event()
+
+    def fake_main():
+        running.append(os.environ["job"])
+        if len(running) > 1:
+            overlapped.set()
+        threading.Event().wait(0.05)
+        running.remove(os.environ["job"])
+
+    mocker.patch("plugin_scripts.daemon.deploy.main", side_effect=fake_main)
+    codes = []
+    threads = [
+        threading.Thread(
+            target=lambda job=job: codes.append(
+                submit(socket_path, {"job": job}, str(tmp_path), io.StringIO())
+            )
+        )
+        for job in "abc"
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert codes == [0, 0, 0]
+    assert not overlapped.is_set()
+
+
+def test_daemon_keeps_clients_warm(server):
+    assert clients.cached("key", object) is clients.cached("key", object)
+
+
+def test_daemon_replaces_a_stale_socket(socket_path):
+    Path(socket_path).write_text("")
+
+    server = DeployDaemon(socket_path)
+    server.server_close()
+
+    assert not Path(socket_path).exists()
+
+
+def test_job_environment(monkeypatch):
+    monkeypatch.setenv("BUILDKITE_JOB_ID", "job-1")
+    monkeypatch.delenv("BUILDKITE_BUILD_ID", raising=False)
+    args = [
+        "-it",
+        "--env",
+        "BUILDKITE_JOB_ID",
+        "--env",
+        "BUILDKITE_BUILD_ID",
+        "--volume",
+        "/cache:/var/cache/cloud-functions",
+        "--env",
+        "environment_variables=A=1\nB=2",
+    ]
+
+    assert job_environment(args) == {
+        "BUILDKITE_JOB_ID": "job-1",
+        "environment_variables": "A=1\nB=2",
+    }
+
+
+def test_client_main_without_daemon(tmp_path, capsys):
+    stdin = io.StringIO("--env\0mode=package\0")
+
+    code = daemon_client.main([str(tmp_path / "missing.sock")], stdin)
+
+    assert code == 1
+    assert "Could not reach the deploy daemon" in capsys.readouterr().err
+    assert daemon_client.main([], stdin) == 2
+
+
+def test_client_main_submits_job(mocker, server, socket_path):
+    mock_main = mocker.patch("plugin_scripts.daemon.deploy.main")
+    seen: dict[str, str] = {}
+    mock_main.side_effect = lambda: seen.update(mode=os.environ["mode"])
+
+    assert daemon_client.main([socket_path], io.StringIO("--env\0mode=package\0")) == 0
+    assert seen == {"mode": "package"}
+
+
+def test_cached_builds_every_time_when_cold():
+    build = Mock(side_effect=[1, 2])
+
+    assert [clients.cached("key", build), clients.cached("key", build)] == [1, 2]
+    assert clients.discovery_document("cloudfunctions", "v1") is None
+
+
+def test_cached_reuses_values_when_warm():
+    clients.keep_warm()
+    credentials = Mock()
+    factory = Mock(side_effect=lambda credentials: Mock())
+
+    first = clients.client_for(credentials, factory)
+
+    assert clients.client_for(credentials, factory) is first
+    assert clients.client_for(Mock(), factory) is not first
+    assert factory.call_count == 2
+
+
+def test__get_bq_credentials_parsed_once_when_warm(mocker, monkeypatch):
+    monkeypatch.setenv("credentials", '{"type": "service_account"}')
+    from_info = mocker.patch(
+        "plugin_scripts.deploy.service_account.Credentials.from_service_account_info"
+    )
+    clients.keep_warm()
+
+    deploy._get_bq_credentials()
+    deploy._get_bq_credentials()
+
+    from_info.assert_called_once_with({"type": "service_account"})
+
+
+def test__cloud_functions_service_reuses_discovery_document(mocker):
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+    credentials = Mock()
+
+    deploy._cloud_functions_service(credentials)
+    mock_discovery.build.assert_called_once_with(
+        "cloudfunctions", "v1", credentials=credentials
+    )
+
+    clients.keep_warm()
+    deploy._cloud_functions_service(credentials)
+    document = mock_discovery.build_from_document.call_args[0][0]
+    assert document["name"] == "cloudfunctions"
+    assert clients.discovery_document("cloudfunctions", "v1") is document
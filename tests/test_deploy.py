@@ -1,5 +1,7 @@
 """Tests for the deploy module."""
 
+import io
+
 import pytest
 
 from plugin_scripts import deploy
@@ -269,14 +271,16 @@ def test__upload_source_code_using_archive_url_success(mocker, credentials):
     mock_storage_client.return_value.bucket.return_value = mock_bucket
     mock_bucket.blob.return_value = mock_blob
 
-    mock_data = mocker.Mock()
-    mock_data.read.return_value = b"test data"
+    mock_data = io.BytesIO(b"prefix:test data")
+    mock_data.seek(7)
 
     deploy._upload_source_code_using_archive_url(
         "gs://test-bucket/test-blob", mock_data
     )
 
-    mock_blob.upload_from_string.assert_called_once_with(b"test data")
+    mock_blob.upload_from_file.assert_called_once_with(
+        mock_data, size=9, content_type="application/zip"
+    )
 
 
 def test__upload_source_code_using_upload_url_success(mocker, credentials):
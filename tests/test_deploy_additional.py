@@ -2,11 +2,15 @@
 
 from unittest.mock import Mock
 
+import httplib2
 import pytest
 import requests
+from googleapiclient.errors import HttpError
 
 from plugin_scripts import deploy
-from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.pipeline_exceptions import DeployFailed, MissingConfigError
+from plugin_scripts.state import StateStore
+from tests.fakes import FakeBucket
 
 
 def test__upload_source_code_using_archive_url_exception(mocker):
@@ -359,3 +363,440 @@ def test__deploy_general_exception(mocker, monkeypatch):
         deploy._deploy(debug_mode=False)
 
     assert "Deployment failed due to errors" in str(exc_info.value)
+
+
+def test__deploy_preserves_api_error_details(mocker, monkeypatch):
+    """Test DeployFailed carries the original error message and status code."""
+    monkeypatch.setenv("gcp_project", "test-project")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "test-function")
+    monkeypatch.setenv("cloud_function_directory", "/test/dir")
+
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+    mock_service = Mock()
+    mock_cloud_functions = Mock()
+
+    mock_cloud_functions.get.return_value.execute.side_effect = HttpError(
+        resp=httplib2.Response({"status": 403}), content=b"Permission denied"
+    )
+
+    mock_service.projects.return_value.locations.return_value.functions.return_value = (
+        mock_cloud_functions
+    )
+    mock_discovery.build.return_value = mock_service
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy._deploy(debug_mode=False)
+
+    assert exc_info.value.status_code == 403
+    assert "Failed to get cloud function" in str(exc_info.value)
+    assert "Permission denied" in str(exc_info.value)
+
+
+def test__deploy_waits_for_in_flight_operation_on_conflict(mocker, monkeypatch):
+    """Test a 409 on patch waits for the running rollout and retries."""
+    monkeypatch.setenv("gcp_project", "test-project")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "test-function")
+    monkeypatch.setenv("cloud_function_directory", "/test/dir")
+
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+    mock_service = Mock()
+    mock_cloud_functions = Mock()
+
+    mock_cloud_functions.get.return_value.execute.side_effect = [
+        {"name": "test-function", "sourceArchiveUrl": "gs://bucket/fn.zip"},
+        {"name": "test-function", "status": "DEPLOY_IN_PROGRESS"},
+        {"name": "test-function", "status": "ACTIVE"},
+    ]
+    mock_cloud_functions.patch.return_value.execute.side_effect = [
+        HttpError(resp=httplib2.Response({"status": 409}), content=b"in progress"),
+        {"name": "operations/test-op"},
+    ]
+
+    mock_service.projects.return_value.locations.return_value.functions.return_value = (
+        mock_cloud_functions
+    )
+    mock_discovery.build.return_value = mock_service
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mocker.patch("plugin_scripts.deploy._zip_directory")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_archive_url")
+    mock_sleep = mocker.patch("plugin_scripts.deploy.time.sleep")
+
+    deploy._deploy(debug_mode=False)
+
+    assert mock_cloud_functions.patch.return_value.execute.call_count == 2
+    mock_sleep.assert_called_once()
+
+
+def test__wait_for_in_flight_operation_times_out(mocker, monkeypatch):
+    """Test waiting on a conflicting operation gives up after the timeout."""
+    monkeypatch.setenv("conflict_wait_timeout", "0")
+    mock_cloud_functions = Mock()
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "status": "DEPLOY_IN_PROGRESS"
+    }
+
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy._wait_for_in_flight_operation(
+            mock_cloud_functions,
+            deploy.RequestScheduler(),
+            "projects/p/locations/r/functions/f",
+            "p/r",
+        )
+    assert exc_info.value.status_code == 409
+    assert "Timed out" in str(exc_info.value)
+
+
+def test__deploy_function_not_found_404(mocker, monkeypatch):
+    """Test a 404 from get is reported as a missing function."""
+    monkeypatch.setenv("gcp_project", "test-project")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "missing-function")
+    monkeypatch.setenv("cloud_function_directory", "/test/dir")
+
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+    mock_cloud_functions = Mock()
+    mock_cloud_functions.get.return_value.execute.side_effect = HttpError(
+        resp=httplib2.Response({"status": 404}), content=b"Not found"
+    )
+    mock_service = Mock()
+    mock_service.projects.return_value.locations.return_value.functions.return_value = (
+        mock_cloud_functions
+    )
+    mock_discovery.build.return_value = mock_service
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy._deploy(debug_mode=False)
+
+    assert exc_info.value.status_code == 404
+    assert "Cloud function not found: missing-function" in str(exc_info.value)
+
+
+def _set_deploy_env(monkeypatch):
+    monkeypatch.setenv("debug_mode", "false")
+    monkeypatch.setenv("gcp_project", "test-project")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "test-function")
+    monkeypatch.setenv("cloud_function_directory", "/test/dir")
+    monkeypatch.setenv("credentials", '{"secret": "value"}')
+
+
+def test_main_coalesced_deploy_runs_and_releases_lock(mocker, monkeypatch):
+    """Test main deploys under the function lock when coalescing is on."""
+    _set_deploy_env(monkeypatch)
+    monkeypatch.setenv("coalesce_deploys", "true")
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "7")
+
+    bucket = FakeBucket()
+    mocker.patch(
+        "plugin_scripts.deploy.StateStore.from_env",
+        return_value=StateStore(bucket, "state"),
+    )
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mock_path = mocker.patch("plugin_scripts.deploy.Path")
+    mock_path.return_value.is_dir.return_value = True
+    mock_deploy = mocker.patch("plugin_scripts.deploy._deploy")
+
+    deploy.main()
+
+    mock_deploy.assert_called_once_with(False)
+    assert not any(name.startswith("state/locks/") for name in bucket.objects)
+
+
+def test_main_coalesced_deploy_skips_superseded_build(mocker, monkeypatch):
+    """Test main skips the deploy when a newer build is registered."""
+    _set_deploy_env(monkeypatch)
+    monkeypatch.setenv("coalesce_deploys", "true")
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "7")
+    monkeypatch.setenv("BUILDKITE_PIPELINE_SLUG", "deploy")
+
+    store = StateStore(FakeBucket())
+    store.write_json(
+        "intents/projects/test-project/locations/us-central1/"
+        "functions/test-function/deploy.json",
+        {"build_number": 8, "owner": "job-8"},
+    )
+    mocker.patch("plugin_scripts.deploy.StateStore.from_env", return_value=store)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mock_path = mocker.patch("plugin_scripts.deploy.Path")
+    mock_path.return_value.is_dir.return_value = True
+    mock_deploy = mocker.patch("plugin_scripts.deploy._deploy")
+
+    deploy.main()
+
+    mock_deploy.assert_not_called()
+
+
+def test_main_coalesced_deploy_locks_every_target(mocker, monkeypatch):
+    """Test a superseded secondary target skips the step and frees every lock."""
+    _set_deploy_env(monkeypatch)
+    monkeypatch.setenv("coalesce_deploys", "true")
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "7")
+    monkeypatch.setenv("BUILDKITE_PIPELINE_SLUG", "deploy")
+    monkeypatch.setenv("targets", "other/europe-west1/fn")
+
+    store = StateStore(FakeBucket())
+    mocker.patch("plugin_scripts.deploy.StateStore.from_env", return_value=store)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mock_path = mocker.patch("plugin_scripts.deploy.Path")
+    mock_path.return_value.is_dir.return_value = True
+    mock_deploy = mocker.patch("plugin_scripts.deploy._deploy")
+    acquire = mocker.spy(deploy.DeployCoalescer, "acquire")
+
+    deploy.main()
+    store.write_json(
+        "intents/projects/test-project/locations/us-central1/"
+        "functions/test-function/deploy.json",
+        {"build_number": 8, "owner": "job-8"},
+    )
+    deploy.main()
+
+    assert [call.args[0].function_path for call in acquire.call_args_list] == [
+        "projects/other/locations/europe-west1/functions/fn",
+        "projects/test-project/locations/us-central1/functions/test-function",
+    ] * 2
+    mock_deploy.assert_called_once_with(False)
+    assert not any(name.startswith("locks/") for name in store.bucket.objects)
+
+
+def test_main_coalesce_requires_state_bucket(mocker, monkeypatch):
+    """Test coalescing without a state bucket is a configuration error."""
+    _set_deploy_env(monkeypatch)
+    monkeypatch.setenv("coalesce_deploys", "true")
+    monkeypatch.delenv("state_bucket", raising=False)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mock_path = mocker.patch("plugin_scripts.deploy.Path")
+    mock_path.return_value.is_dir.return_value = True
+
+    with pytest.raises(MissingConfigError) as exc_info:
+        deploy.main()
+    assert exc_info.value.config_name == "state_bucket"
+
+
+def _mock_cloud_functions(mocker, function):
+    mock_cloud_functions = Mock()
+    mock_cloud_functions.get.return_value.execute.return_value = function
+    mock_cloud_functions.generateUploadUrl.return_value.execute.return_value = {
+        "uploadUrl": "https://upload.example.com/path"
+    }
+    mock_cloud_functions.patch.return_value.execute.return_value = {
+        "name": "operations/test-op"
+    }
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+    mock_service = mock_discovery.build.return_value
+    mock_service.projects.return_value.locations.return_value.functions.return_value = (
+        mock_cloud_functions
+    )
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    return mock_cloud_functions
+
+
+def _enable_checkpoints(monkeypatch, tmp_path):
+    source_dir = tmp_path / "fn"
+    source_dir.mkdir()
+    (source_dir / "main.py").write_text("def handler(request): pass")
+    _set_deploy_env(monkeypatch)
+    monkeypatch.setenv("cloud_function_directory", str(source_dir))
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.setenv("checkpoint_file", str(tmp_path / "checkpoint.json"))
+
+
+def test__deploy_resumes_after_failed_patch(mocker, monkeypatch, tmp_path):
+    """Test a retry after a failed patch reuses the previous upload."""
+    _enable_checkpoints(monkeypatch, tmp_path)
+    mock_cloud_functions = _mock_cloud_functions(mocker, {"name": "test-function"})
+    mock_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+    mock_cloud_functions.patch.return_value.execute.side_effect = [
+        HttpError(resp=httplib2.Response({"status": 400}), content=b"bad"),
+        {"name": "operations/test-op"},
+    ]
+
+    with pytest.raises(DeployFailed):
+        deploy._deploy(debug_mode=False)
+    assert mock_upload.call_count == 1
+
+    # The retry skips zipping and uploading
+    mock_zip = mocker.patch("plugin_scripts.deploy._zip_directory")
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "name": "test-function"
+    }
+    deploy._deploy(debug_mode=False)
+
+    mock_zip.assert_not_called()
+    assert mock_upload.call_count == 1
+    patched = mock_cloud_functions.patch.call_args[1]["body"]
+    assert patched["sourceUploadUrl"] == "https://upload.example.com/path"
+
+
+def test__deploy_skips_when_already_patched(mocker, monkeypatch, tmp_path):
+    """Test a retry after a successful patch does nothing."""
+    _enable_checkpoints(monkeypatch, tmp_path)
+    mock_cloud_functions = _mock_cloud_functions(mocker, {"name": "test-function"})
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    deploy._deploy(debug_mode=False)
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "name": "test-function"
+    }
+    deploy._deploy(debug_mode=False)
+
+    assert mock_cloud_functions.patch.call_count == 1
+
+
+def test__deploy_retry_after_failed_rollout_only_checks_it(
+    mocker, monkeypatch, tmp_path
+):
+    """Test a retry after a successful patch reruns only the post-deploy checks."""
+    _enable_checkpoints(monkeypatch, tmp_path)
+    mock_cloud_functions = _mock_cloud_functions(mocker, {"name": "test-function"})
+    mock_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+    mock_post_deploy = mocker.patch(
+        "plugin_scripts.deploy._post_deploy",
+        side_effect=[DeployFailed("rollout failed"), None],
+    )
+
+    with pytest.raises(DeployFailed):
+        deploy._deploy(debug_mode=False)
+    deploy._deploy(debug_mode=False)
+    deploy._deploy(debug_mode=False)
+
+    assert mock_cloud_functions.patch.call_count == 1
+    assert mock_upload.call_count == 1
+    assert mock_post_deploy.call_count == 2
+    assert mock_post_deploy.call_args[0][2] == {"name": "operations/test-op"}
+
+
+def test__deploy_starts_over_when_sources_change(mocker, monkeypatch, tmp_path):
+    """Test a checkpoint for different sources is ignored."""
+    _enable_checkpoints(monkeypatch, tmp_path)
+    mock_cloud_functions = _mock_cloud_functions(mocker, {"name": "test-function"})
+    mock_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+
+    deploy._deploy(debug_mode=False)
+    (tmp_path / "fn" / "main.py").write_text("def handler(request): return 'v2'")
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "name": "test-function"
+    }
+    deploy._deploy(debug_mode=False)
+
+    assert mock_upload.call_count == 2
+    assert mock_cloud_functions.patch.call_count == 2
+
+
+def _save_expired_upload(tmp_path):
+    store = deploy.CheckpointStore(
+        "cloud-functions-checkpoint:projects/test-project/locations/us-central1/"
+        "functions/test-function",
+        tmp_path / "checkpoint.json",
+    )
+    store.save(
+        {
+            "phase": "uploaded",
+            "source_digest": deploy.source_digest(tmp_path / "fn"),
+            "upload_url": "https://upload.example.com/expired",
+        }
+    )
+    return store
+
+
+def test__deploy_failed_resume_uploads_again(mocker, monkeypatch, tmp_path):
+    """Test a failing resumed patch uploads the sources again and retries."""
+    _enable_checkpoints(monkeypatch, tmp_path)
+    store = _save_expired_upload(tmp_path)
+    mock_cloud_functions = _mock_cloud_functions(mocker, {"name": "test-function"})
+    mock_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+    mock_cloud_functions.patch.return_value.execute.side_effect = [
+        HttpError(resp=httplib2.Response({"status": 404}), content=b"expired"),
+        {"name": "operations/test-op"},
+    ]
+
+    deploy._deploy(debug_mode=False)
+
+    assert mock_upload.call_count == 1
+    patched = mock_cloud_functions.patch.call_args[1]["body"]
+    assert patched["sourceUploadUrl"] == "https://upload.example.com/path"
+    assert store.load() == {
+        "phase": "deployed",
+        "source_digest": deploy.source_digest(tmp_path / "fn"),
+        "operation": "operations/test-op",
+    }
+
+
+def test__deploy_failed_resume_keeps_new_upload(mocker, monkeypatch, tmp_path):
+    """Test the next retry resumes from the new upload, not the expired one."""
+    _enable_checkpoints(monkeypatch, tmp_path)
+    store = _save_expired_upload(tmp_path)
+    mock_cloud_functions = _mock_cloud_functions(mocker, {"name": "test-function"})
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    mock_cloud_functions.patch.return_value.execute.side_effect = [
+        HttpError(resp=httplib2.Response({"status": 412}), content=b"expired"),
+        HttpError(resp=httplib2.Response({"status": 400}), content=b"bad"),
+    ]
+
+    with pytest.raises(DeployFailed):
+        deploy._deploy(debug_mode=False)
+    assert mock_cloud_functions.patch.call_count == 2
+    assert store.load()["upload_url"] == "https://upload.example.com/path"
+
+
+def test__deploy_failed_resume_fatal_error(mocker, monkeypatch, tmp_path):
+    """Test errors unrelated to the source fail without uploading again."""
+    _enable_checkpoints(monkeypatch, tmp_path)
+    store = _save_expired_upload(tmp_path)
+    mock_cloud_functions = _mock_cloud_functions(mocker, {"name": "test-function"})
+    mock_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+    mock_cloud_functions.patch.return_value.execute.side_effect = HttpError(
+        resp=httplib2.Response({"status": 403}), content=b"denied"
+    )
+
+    with pytest.raises(DeployFailed, match="denied"):
+        deploy._deploy(debug_mode=False)
+    assert mock_cloud_functions.patch.call_count == 1
+    mock_upload.assert_not_called()
+    assert store.load()["upload_url"] == "https://upload.example.com/expired"
+
+
+def test__resume_upload_archive_generation(mocker):
+    """Test an archive is only reused if nobody overwrote it since."""
+    function = {"sourceArchiveUrl": "gs://bucket/fn.zip"}
+    checkpoint = {"archive_url": "gs://bucket/fn.zip", "generation": 5}
+
+    mocker.patch("plugin_scripts.deploy._archive_generation", return_value=5)
+    assert deploy._resume_upload(function, checkpoint)
+
+    mocker.patch("plugin_scripts.deploy._archive_generation", return_value=6)
+    assert not deploy._resume_upload(function, checkpoint)
+
+    mocker.patch(
+        "plugin_scripts.deploy._archive_generation", side_effect=Exception("boom")
+    )
+    assert not deploy._resume_upload(function, checkpoint)
+
+    assert not deploy._resume_upload({}, checkpoint)
+
+
+def test__archive_generation(mocker):
+    """Test the archive generation is read from GCS."""
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mock_client = mocker.patch("plugin_scripts.deploy.storage.Client")
+    bucket = mock_client.return_value.bucket.return_value
+    bucket.get_blob.return_value.generation = "12"
+
+    assert deploy._archive_generation("gs://bucket/path/fn.zip") == 12
+    bucket.get_blob.assert_called_once_with("path/fn.zip")
+
+    bucket.get_blob.return_value = None
+    assert deploy._archive_generation("gs://bucket/path/fn.zip") is None
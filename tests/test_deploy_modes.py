@@ -0,0 +1,397 @@
+"""Tests for the package and config modes and deploying prebuilt archives."""
+
+import json
+import sys
+import zipfile
+from unittest.mock import Mock
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.packaging import build_manifest, write_manifest
+from plugin_scripts.pipeline_exceptions import DeployFailed, SourceValidationFailed
+from plugin_scripts.targets import DeployTarget
+
+
+@pytest.fixture
+def deploy_env(monkeypatch, tmp_path):
+    """Configure a function whose sources live in a temporary directory."""
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    (source_dir / "main.py").write_text("def handler(request): return 'ok'")
+    (source_dir / "requirements.txt").write_text("requests\n")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("debug_mode", "false")
+    monkeypatch.setenv("gcp_project", "test-project")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "test-function")
+    monkeypatch.setenv("cloud_function_directory", str(source_dir))
+    monkeypatch.setenv("credentials", '{"secret": "value"}')
+    monkeypatch.delenv("BUILDKITE_AGENT_ACCESS_TOKEN", raising=False)
+    return tmp_path
+
+
+def _package(tmp_path):
+    archive_path = tmp_path / "fn.zip"
+    with zipfile.ZipFile(archive_path, mode="w") as zf:
+        zf.writestr("main.py", "def handler(request): return 'prebuilt'")
+    write_manifest(archive_path, build_manifest(archive_path, "test-function"))
+    return archive_path
+
+
+def test_main_package_mode(mocker, monkeypatch, deploy_env):
+    """Test package mode writes the archive and manifest and uploads them."""
+    monkeypatch.setenv("mode", "package")
+    monkeypatch.setenv("debug_mode", "true")
+    mocker.patch(
+        "plugin_scripts.deploy.buildkite.agent_path", return_value="/bin/agent"
+    )
+    mock_upload = mocker.patch("plugin_scripts.deploy.buildkite.artifact_upload")
+    mock_deploy = mocker.patch("plugin_scripts.deploy._deploy")
+
+    deploy.main()
+
+    output = deploy_env / "cloud-function-packages"
+    manifest = json.loads((output / "test-function.manifest.json").read_text())
+    assert sorted(entry["path"] for entry in manifest["files"]) == [
+        "main.py",
+        "requirements.txt",
+    ]
+    with zipfile.ZipFile(output / "test-function.zip") as zf:
+        assert sorted(zf.namelist()) == ["main.py", "requirements.txt"]
+    mock_upload.assert_called_once_with(
+        "cloud-function-packages/test-function.zip",
+        "cloud-function-packages/test-function.manifest.json",
+    )
+    mock_deploy.assert_not_called()
+
+
+def test_main_package_mode_without_agent(mocker, monkeypatch, deploy_env):
+    """Test package mode still writes files outside Buildkite."""
+    monkeypatch.setenv("mode", "package")
+    monkeypatch.setenv("package_output_dir", "out")
+    mock_upload = mocker.patch("plugin_scripts.deploy.buildkite.artifact_upload")
+
+    deploy.main()
+
+    assert (deploy_env / "out" / "test-function.zip").is_file()
+    mock_upload.assert_not_called()
+
+
+def test_main_unknown_mode(monkeypatch, deploy_env):
+    """Test an unknown mode is rejected."""
+    monkeypatch.setenv("mode", "yolo")
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy.main()
+    assert "Unknown mode" in str(exc_info.value)
+
+
+def test_main_prebuilt_archive_skips_source_check(mocker, monkeypatch, deploy_env):
+    """Test deploying a prebuilt archive does not need the sources."""
+    monkeypatch.setenv("prebuilt_archive", "fn.zip")
+    monkeypatch.setenv("cloud_function_directory", "missing")
+    mock_deploy = mocker.patch("plugin_scripts.deploy._deploy")
+
+    deploy.main()
+    mock_deploy.assert_called_once_with(False)
+
+
+def test__prebuilt_archive_not_configured(monkeypatch):
+    """Test no archive is used unless configured."""
+    monkeypatch.delenv("prebuilt_archive", raising=False)
+    assert deploy._prebuilt_archive() is None
+
+
+def test__prebuilt_archive_verified(monkeypatch, deploy_env):
+    """Test a local archive is checked against its manifest."""
+    archive_path = _package(deploy_env)
+    monkeypatch.setenv("prebuilt_archive", str(archive_path))
+
+    assert deploy._prebuilt_archive() == archive_path
+
+
+def test__prebuilt_archive_digest_mismatch(monkeypatch, deploy_env):
+    """Test a tampered archive is rejected."""
+    archive_path = _package(deploy_env)
+    with zipfile.ZipFile(archive_path, mode="a") as zf:
+        zf.writestr("extra.py", "")
+    monkeypatch.setenv("prebuilt_archive", str(archive_path))
+
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy._prebuilt_archive()
+    assert "does not match its manifest" in str(exc_info.value)
+
+
+def test__prebuilt_archive_downloaded(mocker, monkeypatch, deploy_env):
+    """Test a missing archive is fetched from the build artifacts."""
+    monkeypatch.setenv("prebuilt_archive", "out/fn.zip")
+    mocker.patch(
+        "plugin_scripts.deploy.buildkite.agent_path", return_value="/bin/agent"
+    )
+
+    def download(path, destination="."):
+        if path == "out/fn.zip":
+            (deploy_env / "out").mkdir()
+            _package(deploy_env).rename(deploy_env / "out" / "fn.zip")
+
+    mock_download = mocker.patch(
+        "plugin_scripts.deploy.buildkite.artifact_download", side_effect=download
+    )
+
+    assert deploy._prebuilt_archive() is not None
+    assert [c[0][0] for c in mock_download.call_args_list] == [
+        "out/fn.zip",
+        "out/fn.manifest.json",
+    ]
+
+
+def test__prebuilt_archive_missing(mocker, monkeypatch, deploy_env):
+    """Test a missing archive fails the deploy."""
+    monkeypatch.setenv("prebuilt_archive", "out/fn.zip")
+    mocker.patch(
+        "plugin_scripts.deploy.buildkite.agent_path", return_value="/bin/agent"
+    )
+    mocker.patch(
+        "plugin_scripts.deploy.buildkite.artifact_download",
+        side_effect=RuntimeError("no such artifact"),
+    )
+
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy._prebuilt_archive()
+    assert "Prebuilt archive not found" in str(exc_info.value)
+
+
+def test__deploy_prebuilt_archive_is_not_rezipped(mocker, monkeypatch, deploy_env):
+    """Test the prebuilt archive is uploaded as-is."""
+    archive_path = _package(deploy_env)
+    monkeypatch.setenv("prebuilt_archive", str(archive_path))
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.setenv("checkpoint_file", str(deploy_env / "checkpoint.json"))
+
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+    mock_service = mock_discovery.build.return_value
+    cloud_functions = (
+        mock_service.projects.return_value.locations.return_value.functions.return_value
+    )
+    cloud_functions.get.return_value.execute.return_value = {
+        "name": "test-function",
+        "sourceArchiveUrl": "gs://bucket/fn.zip",
+    }
+    cloud_functions.patch.return_value.execute.return_value = {"name": "op"}
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mock_zip = mocker.patch("plugin_scripts.deploy._zip_directory")
+    uploaded = []
+
+    def upload(archive_url, data):
+        uploaded.append(data.read())
+        return 1
+
+    mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_archive_url",
+        side_effect=upload,
+    )
+
+    deploy._deploy(debug_mode=False)
+
+    mock_zip.assert_not_called()
+    assert uploaded == [archive_path.read_bytes()]
+
+
+def test__deploy_preflight_fails_before_upload(mocker, monkeypatch, deploy_env):
+    """Test pre-flight problems stop the deploy before anything is uploaded."""
+    monkeypatch.setenv("preflight", "true")
+    (deploy_env / "src" / "util.py").write_text("def broken(:\n")
+    mock_cloud_functions = Mock()
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "runtime": "python312",
+        "entryPoint": "main",
+        "sourceUploadUrl": "x",
+    }
+    mocker.patch(
+        "plugin_scripts.deploy._cloud_functions_resource",
+        return_value=mock_cloud_functions,
+    )
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy._deploy(False)
+
+    assert isinstance(exc_info.value.__cause__, SourceValidationFailed)
+    assert "util.py:1" in str(exc_info.value)
+    assert "Entry point 'main' is not defined" in str(exc_info.value)
+    mock_cloud_functions.generateUploadUrl.assert_not_called()
+    mock_cloud_functions.patch.assert_not_called()
+
+
+def test__deploy_preflight_skips_other_runtimes(mocker, monkeypatch, deploy_env):
+    """Test pre-flight checks only cover Python runtimes."""
+    monkeypatch.setenv("preflight", "true")
+    (deploy_env / "src" / "main.py").unlink()
+    mock_cloud_functions = Mock()
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "runtime": "nodejs20",
+        "sourceUploadUrl": "x",
+    }
+    mock_cloud_functions.generateUploadUrl.return_value.execute.return_value = {
+        "uploadUrl": "https://upload.example.com"
+    }
+    mock_cloud_functions.patch.return_value.execute.return_value = {"name": "op"}
+    mocker.patch(
+        "plugin_scripts.deploy._cloud_functions_resource",
+        return_value=mock_cloud_functions,
+    )
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    deploy._deploy(False)
+
+    mock_cloud_functions.patch.assert_called_once()
+
+
+def test__deploy_preflight_passes(mocker, monkeypatch, deploy_env):
+    """Test valid sources pass pre-flight checks and are deployed."""
+    monkeypatch.setenv("preflight", "true")
+    mock_cloud_functions = Mock()
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "runtime": "python312",
+        "entryPoint": "handler",
+        "sourceArchiveUrl": "gs://bucket/fn.zip",
+    }
+    mock_cloud_functions.patch.return_value.execute.return_value = {"name": "op"}
+    mocker.patch(
+        "plugin_scripts.deploy._cloud_functions_resource",
+        return_value=mock_cloud_functions,
+    )
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mock_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_archive_url"
+    )
+
+    deploy._deploy(False)
+
+    mock_upload.assert_called_once()
+    mock_cloud_functions.patch.assert_called_once()
+
+
+def test__deploy_resolve_dependencies_fails_before_upload(
+    mocker, monkeypatch, deploy_env
+):
+    """Test unresolvable requirements stop the deploy before upload."""
+    monkeypatch.setenv("resolve_dependencies", "true")
+    mock_resolve = mocker.patch(
+        "plugin_scripts.deploy.DependencyResolver.resolve",
+        return_value=["Requirements cannot be resolved:\nconflict"],
+    )
+    mock_cloud_functions = Mock()
+    mock_cloud_functions.get.return_value.execute.return_value = {
+        "runtime": "python312",
+        "sourceUploadUrl": "x",
+    }
+    mocker.patch(
+        "plugin_scripts.deploy._cloud_functions_resource",
+        return_value=mock_cloud_functions,
+    )
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+
+    with pytest.raises(DeployFailed, match="Requirements cannot be resolved"):
+        deploy._deploy(False)
+
+    mock_resolve.assert_called_once_with(deploy_env / "src")
+    mock_cloud_functions.generateUploadUrl.assert_not_called()
+
+
+def test__preflight_resolves_for_each_runtime(mocker, monkeypatch, deploy_env):
+    """Test requirements are resolved once per Python version of the targets."""
+    monkeypatch.setenv("resolve_dependencies", "true")
+    monkeypatch.delenv("preflight", raising=False)
+    mock_from_env = mocker.patch("plugin_scripts.deploy.DependencyResolver.from_env")
+    mock_from_env.return_value.resolve.return_value = []
+    functions = [
+        (DeployTarget("p", "r", name), {"runtime": runtime})
+        for name, runtime in [
+            ("a", "python312"),
+            ("b", "python310"),
+            ("c", "python312"),
+        ]
+    ]
+
+    deploy._preflight(functions)
+
+    assert mock_from_env.call_args_list == [mocker.call((3, 10)), mocker.call((3, 12))]
+
+    mock_from_env.reset_mock()
+    deploy._preflight([(DeployTarget("p", "r", "new"), {})])
+    mock_from_env.assert_called_once_with(sys.version_info[:2])
+
+
+def _mock_cloud_functions(mocker, functions):
+    """Serve function definitions by name and record patch calls."""
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+    mock_service = mock_discovery.build.return_value
+    cloud_functions = (
+        mock_service.projects.return_value.locations.return_value.functions.return_value
+    )
+
+    def get(name):
+        request = Mock()
+        request.execute.return_value = functions[name]
+        return request
+
+    cloud_functions.get.side_effect = get
+    cloud_functions.patch.return_value.execute.return_value = {"name": "op"}
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    return cloud_functions
+
+
+def test_main_config_mode_patches_only_settings(mocker, monkeypatch, deploy_env):
+    """Test config mode patches changed fields and never packages or uploads."""
+    monkeypatch.setenv("mode", "config")
+    monkeypatch.setenv("cloud_function_directory", "missing")
+    monkeypatch.setenv("memory_mb", "512")
+    monkeypatch.setenv("function_timeout", "60")
+    monkeypatch.setenv("targets", "test-project/europe-west1")
+    primary = "projects/test-project/locations/us-central1/functions/test-function"
+    europe = "projects/test-project/locations/europe-west1/functions/test-function"
+    cloud_functions = _mock_cloud_functions(
+        mocker,
+        {
+            primary: {"availableMemoryMb": 256, "timeout": "60s"},
+            europe: {"availableMemoryMb": 512, "timeout": "60s"},
+        },
+    )
+    mock_zip = mocker.patch("plugin_scripts.deploy._zip_directory")
+    mock_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+
+    deploy.main()
+
+    cloud_functions.patch.assert_called_once_with(
+        name=primary,
+        body={"availableMemoryMb": 512},
+        updateMask="availableMemoryMb",
+    )
+    mock_zip.assert_not_called()
+    mock_upload.assert_not_called()
+
+
+def test__configure_without_settings(monkeypatch):
+    """Test config mode needs something to apply."""
+    for name in ("memory_mb", "function_timeout", "max_instances", "min_instances"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.delenv("environment_variables", raising=False)
+
+    with pytest.raises(ValueError, match="config mode needs at least one of"):
+        deploy._configure(False)
+
+
+def test__configure_reports_failed_targets(mocker, monkeypatch, deploy_env):
+    """Test a function that cannot be read fails the step."""
+    monkeypatch.setenv("min_instances", "1")
+    monkeypatch.delenv("targets", raising=False)
+    cloud_functions = _mock_cloud_functions(mocker, {})
+    cloud_functions.get.side_effect = RuntimeError("boom")
+
+    with pytest.raises(DeployFailed, match="Failed to configure 1 of 1 targets"):
+        deploy._configure(False)
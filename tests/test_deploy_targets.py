@@ -0,0 +1,804 @@
+"""Tests for deploying one package to several targets."""
+
+import io
+import json
+import zipfile
+from unittest.mock import Mock
+from urllib.parse import urlparse
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from plugin_scripts import deploy
+from plugin_scripts.pipeline_exceptions import DeployFailed, MissingConfigError
+from tests.fakes import FakeBlob, FakeBucket
+
+PRIMARY = "projects/proj/locations/us-central1/functions/fn"
+EUROPE = "projects/proj/locations/europe-west1/functions/fn"
+OTHER = "projects/other/locations/us-east1/functions/other-fn"
+
+
+@pytest.fixture
+def targets_env(monkeypatch, tmp_path):
+    """Configure a function deployed to three targets."""
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    (source_dir / "main.py").write_text("def handler(request): return 'ok'")
+
+    monkeypatch.setenv("gcp_project", "proj")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "fn")
+    monkeypatch.setenv("cloud_function_directory", str(source_dir))
+    monkeypatch.setenv("targets", "proj/europe-west1,other/us-east1/other-fn")
+    monkeypatch.setenv("credentials", '{"secret": "value"}')
+    monkeypatch.delenv("BUILDKITE_AGENT_ACCESS_TOKEN", raising=False)
+    return tmp_path
+
+
+@pytest.fixture
+def buckets(mocker):
+    """Route every storage client to in-memory buckets."""
+    buckets: dict[str, FakeBucket] = {}
+
+    def bucket(name):
+        return buckets.setdefault(name, FakeBucket(name))
+
+    client = mocker.patch("plugin_scripts.deploy.storage.Client")
+    client.return_value.bucket.side_effect = bucket
+    state_client = mocker.patch("plugin_scripts.state.storage.Client")
+    state_client.return_value.bucket.side_effect = bucket
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    return buckets
+
+
+def _mock_functions(mocker, functions, patch_errors=None):
+    """Serve function definitions by name and record patched bodies."""
+    patch_errors = patch_errors or {}
+    patched = {}
+    cloud_functions = Mock()
+
+    def list_functions(parent, **_):
+        request = Mock()
+        request.execute.return_value = {
+            "functions": [
+                {"name": name, **json.loads(json.dumps(function))}
+                for name, function in functions.items()
+                if name.startswith(f"{parent}/")
+            ]
+        }
+        return request
+
+    def patch(name, body):
+        request = Mock()
+        if name in patch_errors:
+            request.execute.side_effect = patch_errors[name]
+        else:
+            patched[name] = body
+            request.execute.return_value = {"name": f"operations/{name}"}
+        return request
+
+    def get(name):
+        request = Mock()
+        request.execute.return_value = {
+            "name": name,
+            **json.loads(json.dumps(functions[name])),
+        }
+        return request
+
+    cloud_functions.list.side_effect = list_functions
+    cloud_functions.list_next.return_value = None
+    cloud_functions.get.side_effect = get
+    cloud_functions.patch.side_effect = patch
+    cloud_functions.generateUploadUrl.return_value.execute.return_value = {
+        "uploadUrl": "https://upload.example.com/signed"
+    }
+    mocker.patch(
+        "plugin_scripts.deploy._cloud_functions_resource",
+        return_value=cloud_functions,
+    )
+    return cloud_functions, patched
+
+
+def _archive_names(data):
+    with zipfile.ZipFile(data) as zf:
+        return zf.namelist()
+
+
+def test__deploy_many_copies_archive_between_targets(mocker, targets_env, buckets):
+    """Test the archive is uploaded once and copied to the other buckets."""
+    functions = {
+        PRIMARY: {"sourceArchiveUrl": "gs://us-sources/fn.zip"},
+        EUROPE: {"sourceArchiveUrl": "gs://eu-sources/fn.zip"},
+        OTHER: {"sourceArchiveUrl": "gs://other-sources/fn.zip"},
+    }
+    _, patched = _mock_functions(mocker, functions)
+    uploads = []
+
+    def upload(url, data):
+        uploads.append(url)
+        buckets.setdefault("us-sources", FakeBucket("us-sources")).store(
+            "fn.zip", data.read()
+        )
+
+    mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_archive_url",
+        side_effect=upload,
+    )
+    mock_zip = mocker.spy(deploy, "_zip_directory")
+
+    deploy._deploy(False)
+
+    assert mock_zip.call_count == 1
+    assert uploads == ["gs://us-sources/fn.zip"]
+    for name in ("eu-sources", "other-sources"):
+        copied = buckets[name].objects["fn.zip"]
+        assert copied == buckets["us-sources"].objects["fn.zip"]
+    assert set(patched) == {PRIMARY, EUROPE, OTHER}
+
+
+def test__deploy_many_stages_archive_in_state_bucket(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test upload URL targets deploy from the archive staged once."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "https://old"},
+        EUROPE: {"sourceUploadUrl": "https://old"},
+        OTHER: {"sourceArchiveUrl": "gs://other-sources/fn.zip"},
+    }
+    cloud_functions, patched = _mock_functions(mocker, functions)
+    mock_put = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+
+    deploy._deploy(False)
+
+    state = buckets["state"]
+    [staged] = [name for name in state.objects if name.endswith(".zip")]
+    staged_url = f"gs://state/{staged}"
+    assert patched[PRIMARY] == {"name": PRIMARY, "sourceArchiveUrl": staged_url}
+    assert patched[EUROPE] == {"name": EUROPE, "sourceArchiveUrl": staged_url}
+    assert buckets["other-sources"].objects["fn.zip"] == state.objects[staged]
+    mock_put.assert_not_called()
+    cloud_functions.generateUploadUrl.assert_not_called()
+
+
+def test__deploy_many_reuses_staged_archive(mocker, monkeypatch, targets_env, buckets):
+    """Test an archive staged by an earlier deploy is not uploaded again."""
+    monkeypatch.setenv("state_bucket", "gs://state")
+    monkeypatch.setenv("targets", "proj/europe-west1")
+    functions = {PRIMARY: {"sourceUploadUrl": "x"}, EUROPE: {"sourceUploadUrl": "y"}}
+    _mock_functions(mocker, functions)
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    deploy._deploy(False)
+    generations = dict(buckets["state"].generations)
+    deploy._deploy(False)
+
+    assert buckets["state"].generations == generations
+
+
+def test__deploy_many_never_overwrites_staged_archives(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test the next deploy stages new sources instead of writing over the last."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        EUROPE: {"sourceUploadUrl": "y"},
+        OTHER: {"sourceUploadUrl": "z"},
+    }
+    _, patched = _mock_functions(mocker, functions)
+    mock_archive_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_archive_url"
+    )
+    copies = mocker.spy(deploy, "_copy_archive")
+
+    deploy._deploy(False)
+    state = buckets["state"].objects
+    [first] = _staged_archives(state)
+    first_archive = state[first]
+    for name, body in patched.items():
+        functions[name] = {k: v for k, v in body.items() if k != "name"}
+    (targets_env / "src" / "main.py").write_text("def handler(request): return 'v2'")
+    # OTHER keeps deploying from the first archive
+    monkeypatch.setenv("targets", "proj/europe-west1")
+
+    deploy._deploy(False)
+
+    assert state[first] == first_archive
+    [second] = [name for name in _staged_archives(state) if name != first]
+    assert patched[PRIMARY]["sourceArchiveUrl"] == f"gs://state/{second}"
+    assert patched[EUROPE]["sourceArchiveUrl"] == f"gs://state/{second}"
+    mock_archive_upload.assert_not_called()
+    copies.assert_not_called()
+
+
+def _staged_archives(objects):
+    return [
+        name
+        for name in objects
+        if name.startswith("deploys/archives/") and name.endswith(".zip")
+    ]
+
+
+def _staged_index(buckets):
+    return json.loads(buckets["state"].objects["deploys/archives/index.json"])
+
+
+def test__deploy_many_prunes_unused_staged_archives(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test an archive is deleted once no function deploys from it."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("targets", "proj/europe-west1")
+    functions = {PRIMARY: {"sourceUploadUrl": "x"}, EUROPE: {"sourceUploadUrl": "y"}}
+    _, patched = _mock_functions(mocker, functions)
+
+    deploy._deploy(False)
+    state = buckets["state"].objects
+    [first] = _staged_archives(state)
+    for name, body in patched.items():
+        functions[name] = {k: v for k, v in body.items() if k != "name"}
+    (targets_env / "src" / "main.py").write_text("def handler(request): return 'v2'")
+    deploy._deploy(False)
+
+    [second] = _staged_archives(state)
+    assert second != first
+    digest = second.removeprefix("deploys/archives/").removesuffix(".zip")
+    assert _staged_index(buckets) == {"functions": {PRIMARY: digest, EUROPE: digest}}
+
+
+def test__deploy_many_prunes_archive_no_patch_used(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test the staged archive is deleted when every patch failed."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("targets", "proj/europe-west1")
+    functions = {PRIMARY: {"sourceUploadUrl": "x"}, EUROPE: {"sourceUploadUrl": "y"}}
+    _mock_functions(
+        mocker,
+        functions,
+        patch_errors={PRIMARY: DeployFailed("bad"), EUROPE: DeployFailed("bad")},
+    )
+
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+
+    assert _staged_archives(buckets["state"].objects) == []
+    assert _staged_index(buckets) == {"functions": {}}
+
+
+def test__deploy_single_never_overwrites_staged_archives(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test a function left on a staged archive switches to an upload."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.delenv("targets")
+    buckets.setdefault("state", FakeBucket("state")).store(
+        "deploys/archives/abc.zip", b"first"
+    )
+    functions = {PRIMARY: {"sourceArchiveUrl": "gs://state/deploys/archives/abc.zip"}}
+    _, patched = _mock_functions(mocker, functions)
+    mock_archive_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_archive_url"
+    )
+    mock_put = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+
+    deploy._deploy(False)
+
+    assert buckets["state"].objects["deploys/archives/abc.zip"] == b"first"
+    mock_archive_upload.assert_not_called()
+    mock_put.assert_called_once()
+    assert patched[PRIMARY]["sourceUploadUrl"] == "https://upload.example.com/signed"
+    assert "sourceArchiveUrl" not in patched[PRIMARY]
+
+
+def test__deploy_many_retry_after_failed_rollout(
+    mocker, monkeypatch, targets_env, buckets, tmp_path
+):
+    """Test a retry only checks the rollout of targets that were patched."""
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.setenv("checkpoint_file", str(tmp_path / "checkpoints.json"))
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        EUROPE: {"sourceUploadUrl": "y"},
+        OTHER: {"sourceUploadUrl": "z"},
+    }
+    patch_errors = {OTHER: DeployFailed("bad")}
+    cloud_functions, _ = _mock_functions(mocker, functions, patch_errors)
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    checked = []
+    rollout_errors = {EUROPE: DeployFailed("rollout failed")}
+
+    def post_deploy(target, function, operation, credentials, scheduler):
+        checked.append(target.path)
+        if target.path in rollout_errors:
+            raise rollout_errors.pop(target.path)
+
+    mocker.patch("plugin_scripts.deploy._post_deploy", side_effect=post_deploy)
+
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+    cloud_functions.patch.reset_mock()
+    checked.clear()
+    patch_errors.clear()
+    deploy._deploy(False)
+
+    patched = [call.kwargs["name"] for call in cloud_functions.patch.call_args_list]
+    assert patched == [OTHER]
+    assert sorted(checked) == sorted([EUROPE, OTHER])
+
+    checked.clear()
+    deploy._deploy(False)
+    assert checked == []
+
+
+def test__deploy_many_upload_urls_without_state_bucket(mocker, targets_env, buckets):
+    """Test upload URL targets each get their own upload of the same bytes."""
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        EUROPE: {"sourceUploadUrl": "y"},
+        OTHER: {"sourceUploadUrl": "z"},
+    }
+    _, patched = _mock_functions(mocker, functions)
+    payloads = []
+
+    def upload(url, debug_mode, data):
+        payloads.append(data.read())
+
+    mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url",
+        side_effect=upload,
+    )
+
+    deploy._deploy(False)
+
+    assert len(payloads) == 3
+    assert len(set(payloads)) == 1
+    assert _archive_names(io.BytesIO(payloads[0])) == ["main.py"]
+    assert all(
+        body["sourceUploadUrl"] == "https://upload.example.com/signed"
+        for body in patched.values()
+    )
+
+
+def test__deploy_many_reports_failed_targets(mocker, targets_env, buckets):
+    """Test one failed patch does not stop the others and is reported."""
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        EUROPE: {"sourceUploadUrl": "y"},
+        OTHER: {"sourceUploadUrl": "z"},
+    }
+    _, patched = _mock_functions(
+        mocker,
+        functions,
+        patch_errors={EUROPE: HttpError(httplib2.Response({"status": 400}), b"bad")},
+    )
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    with pytest.raises(DeployFailed) as exc_info:
+        deploy._deploy(False)
+
+    assert set(patched) == {PRIMARY, OTHER}
+    assert "1 of 3 targets" in str(exc_info.value)
+    assert EUROPE in str(exc_info.value)
+    assert exc_info.value.status_code == 400
+
+
+def test__deploy_many_missing_target_fails_before_upload(mocker, targets_env, buckets):
+    """Test every target is fetched before anything is uploaded."""
+    functions = {PRIMARY: {"sourceUploadUrl": "x"}, EUROPE: {"sourceUploadUrl": "y"}}
+    _, patched = _mock_functions(mocker, functions)
+    mock_put = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+
+    with pytest.raises(DeployFailed, match="Failed to get 1 of 3 targets"):
+        deploy._deploy(False)
+
+    mock_put.assert_not_called()
+    assert patched == {}
+
+
+def test__deploy_many_skips_patched_targets(mocker, monkeypatch, targets_env, buckets):
+    """Test a retried multi-target deploy only patches unfinished targets."""
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.setenv("checkpoint_file", str(targets_env / "checkpoint.json"))
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        EUROPE: {"sourceUploadUrl": "y"},
+        OTHER: {"sourceUploadUrl": "z"},
+    }
+    _mock_functions(mocker, functions, patch_errors={OTHER: DeployFailed("boom")})
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+
+    _, patched = _mock_functions(mocker, functions)
+    deploy._deploy(False)
+    assert set(patched) == {OTHER}
+
+    _, patched = _mock_functions(mocker, functions)
+    deploy._deploy(False)
+    assert patched == {}
+
+
+def test__copy_archive_follows_rewrite_tokens(mocker):
+    """Test large copies keep calling rewrite until the token is exhausted."""
+    client = mocker.patch("plugin_scripts.deploy.storage.Client")
+    destination = client.return_value.bucket.return_value.blob.return_value
+    destination.rewrite.side_effect = [("t1", 1, 3), ("t2", 2, 3), (None, 3, 3)]
+
+    deploy._copy_archive("gs://a/x.zip", "gs://b/y.zip", Mock())
+
+    assert destination.rewrite.call_count == 3
+    assert destination.rewrite.call_args.kwargs == {"token": "t2"}
+
+
+def test__deploy_many_lists_each_location_once(mocker, monkeypatch, targets_env):
+    """Test targets are looked up with one list per location, not a get each."""
+    monkeypatch.setenv("targets", "proj/europe-west1,proj/us-central1/second")
+    second = "projects/proj/locations/us-central1/functions/second"
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        second: {"sourceUploadUrl": "y"},
+        EUROPE: {"sourceUploadUrl": "z"},
+    }
+    cloud_functions, patched = _mock_functions(mocker, functions)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    deploy._deploy(False)
+
+    assert sorted(c.kwargs["parent"] for c in cloud_functions.list.call_args_list) == [
+        "projects/proj/locations/europe-west1",
+        "projects/proj/locations/us-central1",
+    ]
+    cloud_functions.get.assert_not_called()
+    assert set(patched) == {PRIMARY, second, EUROPE}
+
+
+def test__deploy_many_preflight_checks_every_entry_point(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test pre-flight checks cover each target's entry point before upload."""
+    monkeypatch.setenv("preflight", "true")
+    functions = {
+        PRIMARY: {"runtime": "python312", "entryPoint": "handler"},
+        EUROPE: {"runtime": "python312", "entryPoint": "handler"},
+        OTHER: {"runtime": "python312", "entryPoint": "other_handler"},
+    }
+    _, patched = _mock_functions(mocker, functions)
+    mock_put = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_upload_url"
+    )
+
+    with pytest.raises(DeployFailed, match="'other_handler' is not defined"):
+        deploy._deploy(False)
+
+    mock_put.assert_not_called()
+    assert patched == {}
+
+
+def test__deploy_many_prebuilt_archive_skips_preflight(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test prebuilt archives are deployed without checking the sources."""
+    archive_path = targets_env / "fn.zip"
+    with zipfile.ZipFile(archive_path, mode="w") as zf:
+        zf.writestr("main.py", "def handler(request): ...")
+    monkeypatch.setenv("prebuilt_archive", str(archive_path))
+    monkeypatch.setenv("preflight", "true")
+    monkeypatch.setenv("targets", "proj/europe-west1")
+    (targets_env / "src" / "main.py").unlink()
+    functions = {PRIMARY: {"sourceUploadUrl": "x"}, EUROPE: {"sourceUploadUrl": "y"}}
+    _, patched = _mock_functions(mocker, functions)
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    deploy._deploy(False)
+
+    assert set(patched) == {PRIMARY, EUROPE}
+
+
+def _release_index(buckets, function):
+    return json.loads(
+        buckets["state"].objects[f"deploys/releases/{function}/index.json"]
+    )
+
+
+def test__deploy_many_retains_releases(mocker, monkeypatch, targets_env, buckets):
+    """Test each target keeps the release, uploaded once and copied."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "2")
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "7")
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        EUROPE: {"sourceUploadUrl": "y"},
+        OTHER: {"sourceUploadUrl": "z"},
+    }
+    _mock_functions(mocker, functions)
+    uploads = mocker.spy(FakeBlob, "upload_from_file")
+
+    deploy._deploy(False)
+
+    # The staged archive and the first target's release
+    assert uploads.call_count == 2
+    state = buckets["state"].objects
+    [staged] = _staged_archives(state)
+    digest = staged.removeprefix("deploys/archives/").removesuffix(".zip")
+    for function in functions:
+        index = _release_index(buckets, function)
+        assert index["live"] == digest
+        assert index["releases"][0]["build_number"] == "7"
+        assert index["releases"][0]["operation"] == f"operations/{function}"
+        assert state[f"deploys/releases/{function}/{digest}.zip"] == state[staged]
+
+
+def test__deploy_single_retains_release(mocker, monkeypatch, targets_env, buckets):
+    """Test a single target deploy keeps its release."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "2")
+    monkeypatch.delenv("targets")
+    _mock_functions(mocker, {PRIMARY: {"sourceUploadUrl": "x"}})
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    deploy._deploy(False)
+
+    index = _release_index(buckets, PRIMARY)
+    assert len(index["releases"]) == 1
+    assert index["live"] == index["releases"][0]["sha256"]
+
+
+def test__deploy_single_resumed_upload_records_release(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test a retried deploy records the release retained by the first attempt."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "2")
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.setenv("checkpoint_file", str(targets_env / "checkpoint.json"))
+    monkeypatch.delenv("targets")
+    _mock_functions(
+        mocker, {PRIMARY: {"sourceUploadUrl": "x"}}, patch_errors={PRIMARY: OSError()}
+    )
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+    assert "deploys/releases/" + PRIMARY + "/index.json" not in buckets["state"].objects
+
+    _mock_functions(mocker, {PRIMARY: {"sourceUploadUrl": "x"}})
+    mock_zip = mocker.spy(deploy, "_zip_directory")
+    deploy._deploy(False)
+
+    mock_zip.assert_not_called()
+    assert len(_release_index(buckets, PRIMARY)["releases"]) == 1
+
+
+def _retained_archives(buckets, function):
+    prefix = f"deploys/releases/{function}/"
+    return sorted(
+        name
+        for name in buckets["state"].objects
+        if name.startswith(prefix) and not name.endswith("index.json")
+    )
+
+
+def test__deploy_single_failed_patch_discards_release(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test a failed patch leaves no retained archive behind."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "2")
+    monkeypatch.delenv("targets")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    _mock_functions(mocker, {PRIMARY: {"sourceUploadUrl": "x"}})
+    deploy._deploy(False)
+    kept = _retained_archives(buckets, PRIMARY)
+
+    _write_sources(targets_env, "def main(request):\n    return 'v2'\n")
+    _mock_functions(
+        mocker, {PRIMARY: {"sourceUploadUrl": "x"}}, patch_errors={PRIMARY: OSError()}
+    )
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+
+    assert _retained_archives(buckets, PRIMARY) == kept
+    assert len(_release_index(buckets, PRIMARY)["releases"]) == 1
+
+
+def test__deploy_single_failed_redeploy_keeps_release(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test a failed deploy of sources already released keeps the release."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "2")
+    monkeypatch.delenv("targets")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    _mock_functions(mocker, {PRIMARY: {"sourceUploadUrl": "x"}})
+    deploy._deploy(False)
+    kept = _retained_archives(buckets, PRIMARY)
+
+    _mock_functions(
+        mocker, {PRIMARY: {"sourceUploadUrl": "x"}}, patch_errors={PRIMARY: OSError()}
+    )
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+
+    assert _retained_archives(buckets, PRIMARY) == kept
+
+
+def test__deploy_single_changed_sources_discard_checkpointed_release(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test the release of a checkpoint that cannot be resumed is discarded."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "2")
+    monkeypatch.setenv("resume_on_retry", "true")
+    monkeypatch.setenv("checkpoint_file", str(targets_env / "checkpoint.json"))
+    monkeypatch.delenv("targets")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    _mock_functions(
+        mocker, {PRIMARY: {"sourceUploadUrl": "x"}}, patch_errors={PRIMARY: OSError()}
+    )
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+    # Kept for the retry that resumes the upload
+    [failed, _] = _retained_archives(buckets, PRIMARY)
+
+    _write_sources(targets_env, "def main(request):\n    return 'v2'\n")
+    _mock_functions(mocker, {PRIMARY: {"sourceUploadUrl": "x"}})
+    deploy._deploy(False)
+
+    index = _release_index(buckets, PRIMARY)
+    assert len(index["releases"]) == 1
+    assert failed not in _retained_archives(buckets, PRIMARY)
+    assert len(_retained_archives(buckets, PRIMARY)) == 2
+
+
+def test__deploy_many_failed_patch_discards_release(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test only the targets that were patched keep the retained archive."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "2")
+    functions = {PRIMARY: {"sourceUploadUrl": "x"}, EUROPE: {"sourceUploadUrl": "y"}}
+    monkeypatch.setenv("targets", "proj/europe-west1")
+    _mock_functions(mocker, functions, patch_errors={EUROPE: OSError()})
+
+    with pytest.raises(DeployFailed):
+        deploy._deploy(False)
+
+    assert len(_retained_archives(buckets, PRIMARY)) == 2
+    assert _retained_archives(buckets, EUROPE) == []
+
+
+def _write_sources(targets_env, content):
+    (targets_env / "src" / "main.py").write_text(content)
+
+
+def test_main_rollback_mode(mocker, monkeypatch, targets_env, buckets):
+    """Test rollback patches every target to the previous release, no packaging."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "3")
+    monkeypatch.setenv("targets", "other/us-east1/other-fn")
+    functions = {
+        PRIMARY: {"sourceUploadUrl": "x"},
+        OTHER: {"sourceArchiveUrl": "gs://other-sources/fn.zip"},
+    }
+    _mock_functions(mocker, functions)
+
+    def upload(url, data):
+        bucket = urlparse(url)
+        buckets.setdefault(bucket.netloc, FakeBucket(bucket.netloc)).store(
+            bucket.path.lstrip("/"), data.read()
+        )
+
+    mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_archive_url",
+        side_effect=upload,
+    )
+    for build, content in ((1, "v1"), (2, "v2")):
+        monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", str(build))
+        _write_sources(targets_env, content)
+        deploy._deploy(False)
+    v1 = _release_index(buckets, PRIMARY)["releases"][1]
+
+    monkeypatch.setenv("mode", "rollback")
+    monkeypatch.setenv("cloud_function_directory", "missing")
+    mock_zip = mocker.spy(deploy, "_zip_directory")
+    _, patched = _mock_functions(mocker, functions)
+    deploy.main()
+
+    mock_zip.assert_not_called()
+    assert patched[PRIMARY] == {"name": PRIMARY, "sourceArchiveUrl": v1["archive"]}
+    # A function with its own archive keeps deploying from it
+    assert patched[OTHER]["sourceArchiveUrl"] == "gs://other-sources/fn.zip"
+    retained = urlparse(v1["archive"]).path.lstrip("/")
+    assert (
+        buckets["other-sources"].objects["fn.zip"]
+        == (buckets["state"].objects[retained])
+    )
+    assert _release_index(buckets, PRIMARY)["live"] == v1["sha256"]
+    assert _release_index(buckets, OTHER)["live"] == v1["sha256"]
+
+
+def test_main_rollback_mode_releases_staged_archive(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test a rollback off a staged archive deletes it once nothing uses it."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "3")
+    monkeypatch.setenv("targets", "proj/europe-west1")
+    functions = {PRIMARY: {"sourceUploadUrl": "x"}, EUROPE: {"sourceUploadUrl": "y"}}
+    _, patched = _mock_functions(mocker, functions)
+    for content in ("v1", "v2"):
+        _write_sources(targets_env, content)
+        deploy._deploy(False)
+        for name, body in patched.items():
+            functions[name] = {k: v for k, v in body.items() if k != "name"}
+    [staged] = _staged_archives(buckets["state"].objects)
+
+    monkeypatch.setenv("mode", "rollback")
+    mocker.patch("plugin_scripts.deploy.Path").return_value.is_dir.return_value = True
+    deploy.main()
+
+    v1 = _release_index(buckets, PRIMARY)["releases"][1]
+    assert patched[PRIMARY]["sourceArchiveUrl"] == v1["archive"]
+    assert patched[EUROPE]["sourceArchiveUrl"] == v1["archive"].replace(PRIMARY, EUROPE)
+    assert staged not in buckets["state"].objects
+    assert _staged_index(buckets) == {"functions": {}}
+
+
+def test__deploy_after_rollback_leaves_release_intact(
+    mocker, monkeypatch, targets_env, buckets
+):
+    """Test the next deploy of a rolled back function does not overwrite it."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.setenv("retain_releases", "3")
+    monkeypatch.delenv("targets")
+    state = buckets["state"] = FakeBucket("state")
+    state.store(f"deploys/releases/{PRIMARY}/old.zip", b"old")
+    _, patched = _mock_functions(
+        mocker,
+        {
+            PRIMARY: {
+                "sourceArchiveUrl": f"gs://state/deploys/releases/{PRIMARY}/old.zip"
+            }
+        },
+    )
+    mock_archive_upload = mocker.patch(
+        "plugin_scripts.deploy._upload_source_code_using_archive_url"
+    )
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+
+    deploy._deploy(False)
+
+    mock_archive_upload.assert_not_called()
+    assert patched[PRIMARY] == {
+        "name": PRIMARY,
+        "sourceUploadUrl": "https://upload.example.com/signed",
+    }
+    assert state.objects[f"deploys/releases/{PRIMARY}/old.zip"] == b"old"
+
+
+def test__rollback_requires_state_bucket(mocker, monkeypatch, targets_env):
+    monkeypatch.delenv("state_bucket", raising=False)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+
+    with pytest.raises(MissingConfigError):
+        deploy._rollback(False)
+
+
+def test__rollback_without_releases(mocker, monkeypatch, targets_env, buckets):
+    """Test targets without a release to roll back to fail the step."""
+    monkeypatch.setenv("state_bucket", "gs://state/deploys")
+    monkeypatch.delenv("targets")
+    _, patched = _mock_functions(mocker, {PRIMARY: {"sourceUploadUrl": "x"}})
+
+    with pytest.raises(DeployFailed, match="Failed to roll back 1 of 1 targets"):
+        deploy._rollback(False)
+    assert patched == {}
@@ -0,0 +1,81 @@
+"""Tests for the settings applied by config mode."""
+
+import pytest
+
+from plugin_scripts.function_config import (
+    config_changes,
+    desired_config,
+    field_mask,
+    parse_environment,
+)
+
+_SETTINGS = (
+    "memory_mb",
+    "function_timeout",
+    "max_instances",
+    "min_instances",
+    "environment_variables",
+)
+
+
+@pytest.fixture
+def config_env(monkeypatch):
+    for name in _SETTINGS:
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_parse_environment():
+    """Test values keep their equals signs, commas and spacing."""
+    assert parse_environment("A=1\n\nB = x=y, z \n") == {"A": "1", "B": " x=y, z "}
+
+
+@pytest.mark.parametrize("line", ["NO_VALUE", "=value"])
+def test_parse_environment_invalid(line):
+    with pytest.raises(ValueError, match="expected KEY=VALUE"):
+        parse_environment(line)
+
+
+def test_desired_config(config_env):
+    config_env.setenv("memory_mb", "512")
+    config_env.setenv("function_timeout", "120")
+    config_env.setenv("min_instances", "0")
+    config_env.setenv("environment_variables", "LOG_LEVEL=debug")
+
+    assert desired_config() == {
+        "availableMemoryMb": 512,
+        "timeout": "120s",
+        "minInstances": 0,
+        "environmentVariables": {"LOG_LEVEL": "debug"},
+    }
+
+
+def test_desired_config_empty(config_env):
+    assert desired_config() == {}
+
+
+def test_desired_config_invalid(config_env):
+    config_env.setenv("memory_mb", "lots")
+
+    with pytest.raises(ValueError, match="memory_mb"):
+        desired_config()
+
+
+def test_config_changes():
+    """Test unchanged fields and unset API defaults are not patched."""
+    function = {
+        "availableMemoryMb": 256,
+        "timeout": "60s",
+        "environmentVariables": {"A": "1"},
+    }
+    desired = {
+        "availableMemoryMb": 256,
+        "timeout": "120s",
+        "minInstances": 0,
+        "environmentVariables": {"A": "1", "B": "2"},
+    }
+
+    changes = config_changes(function, desired)
+
+    assert changes == {"timeout": "120s", "environmentVariables": {"A": "1", "B": "2"}}
+    assert field_mask(changes) == "environmentVariables,timeout"
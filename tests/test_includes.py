@@ -0,0 +1,281 @@
+"""Tests for shared source includes and their cached archive fragments."""
+
+import io
+import os
+import struct
+import zipfile
+from pathlib import Path, PurePosixPath
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts import includes as includes_module
+from plugin_scripts.composition import ArchiveComposition
+from plugin_scripts.includes import (
+    FragmentCache,
+    SharedInclude,
+    SharedIncludes,
+    _strip_zip64_extra,
+    fragment_digest,
+    includes_digest,
+    splice,
+)
+from plugin_scripts.pipeline_exceptions import DeployFailed
+
+
+@pytest.fixture
+def checkout(tmp_path, monkeypatch):
+    """A checkout with a function and a shared library."""
+    function_dir = tmp_path / "fn"
+    function_dir.mkdir()
+    (function_dir / "main.py").write_text("import common\n")
+    library = tmp_path / "libs" / "common"
+    (library / "tests").mkdir(parents=True)
+    (library / "__init__.py").write_text("SHARED = 1\n")
+    (library / "util.py").write_text("def util():\n    return 1\n" * 50)
+    (library / "tests" / "test_util.py").write_text("")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("cloud_function_directory", "fn")
+    for name in ("cache_dir", "bytecode", "vendor_wheels", "spool_memory_limit"):
+        monkeypatch.delenv(name, raising=False)
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    ("value", "source", "prefix"),
+    [
+        ("libs/common", "libs/common", "common"),
+        ("libs/common/", "libs/common", "common"),
+        ("libs/common:pkg/common", "libs/common", "pkg/common"),
+        ("libs/common:.", "libs/common", "."),
+        ("VERSION", "VERSION", "VERSION"),
+    ],
+)
+def test_parse(value, source, prefix):
+    assert SharedInclude.parse(value) == (Path(source), PurePosixPath(prefix))
+
+
+@pytest.mark.parametrize("value", ["", ":common", ".", "libs/common:/", "libs:../up"])
+def test_parse_rejects_malformed_entries(value):
+    with pytest.raises(ValueError, match="Invalid shared include"):
+        SharedInclude.parse(value)
+
+
+def test_members(checkout):
+    include = SharedInclude.parse("libs/common:pkg")
+
+    members = include.members(lambda relative: relative.name == "tests")
+
+    assert [member.arcname for member in members] == ["pkg/__init__.py", "pkg/util.py"]
+    assert SharedInclude.parse("fn/main.py:main.py").members()[0].arcname == "main.py"
+    with pytest.raises(DeployFailed, match="Shared include not found: missing"):
+        SharedInclude.parse("missing").members()
+
+
+def test_fragment_digest_ignores_timestamps(checkout):
+    include = SharedInclude.parse("libs/common")
+    digest = fragment_digest(include.members())
+
+    os.utime(checkout / "libs/common/util.py", (0, 0))
+    assert fragment_digest(include.members()) == digest
+
+    (checkout / "libs/common/util.py").write_text("changed\n")
+    assert fragment_digest(include.members()) != digest
+    assert fragment_digest(SharedInclude.parse("libs/common:other").members()) != digest
+
+
+def test_fragment_cache_compresses_once(checkout):
+    cache = FragmentCache(checkout / "fragments")
+    members = SharedInclude.parse("libs/common").members()
+
+    fragment, hit = cache.fragment(members)
+    again, hit_again = cache.fragment(members)
+
+    assert (hit, hit_again) == (False, True)
+    assert again == fragment
+    with zipfile.ZipFile(fragment) as zf:
+        assert zf.namelist() == [
+            "common/__init__.py",
+            "common/tests/test_util.py",
+            "common/util.py",
+        ]
+        assert zf.getinfo("common/util.py").compress_type == zipfile.ZIP_DEFLATED
+    assert list(cache.root.iterdir()) == [fragment]
+
+
+def test_fragment_cache_evicts_least_recently_used(tmp_path):
+    cache = FragmentCache(tmp_path, keep=1)
+    for age, name in enumerate(["new", "old", "older"]):
+        path = tmp_path / f"{name}.zip"
+        path.write_bytes(b"")
+        os.utime(path, (1000 - age, 1000 - age))
+
+    assert cache.evict(keep=tmp_path / "older.zip") == [tmp_path / "old.zip"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["new.zip", "older.zip"]
+
+
+def test_splice_copies_compressed_members(checkout):
+    """Test spliced members read back intact from a seekable archive."""
+    fragment, _ = FragmentCache(checkout / "fragments").fragment(
+        SharedInclude.parse("libs/common").members()
+    )
+    composition = ArchiveComposition()
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", compression=zipfile.ZIP_DEFLATED) as handler:
+        handler.writestr("main.py", "import common\n")
+        copied = splice(handler, fragment, {"common/__init__.py"}, composition.add)
+        handler.writestr("after.py", "")
+
+    assert copied == ["common/tests/test_util.py", "common/util.py"]
+    with zipfile.ZipFile(data) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["main.py", *copied, "after.py"]
+        assert (
+            zf.read("common/util.py") == (checkout / "libs/common/util.py").read_bytes()
+        )
+    assert composition.uncompressed_size == len(
+        (checkout / "libs/common/util.py").read_bytes()
+    )
+
+
+def _splice_to_file(checkout, path, on_write=None):
+    fragment, _ = FragmentCache(checkout / "fragments").fragment(
+        SharedInclude.parse("libs/common").members()
+    )
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as handler:
+        handler.writestr("main.py", "import common\n")
+        copied = splice(handler, fragment, on_write=on_write)
+        handler.writestr("after.py", "")
+    return copied
+
+
+def test_splice_to_file_passes_testzip(checkout, tmp_path):
+    """Test an archive spliced on disk reopens and checks clean."""
+    copied = _splice_to_file(checkout, tmp_path / "function.zip")
+
+    with zipfile.ZipFile(tmp_path / "function.zip") as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["main.py", *copied, "after.py"]
+        assert zf.getinfo("common/util.py").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_splice_without_zipfile_internals(mocker, checkout, tmp_path):
+    """Test the members are copied with writestr when internals are missing."""
+    mocker.patch(
+        "plugin_scripts.includes._SPLICE_ATTRIBUTES", ("fp", "removed_internal")
+    )
+    fallback = mocker.spy(includes_module, "_copy_members")
+    composition = ArchiveComposition()
+
+    copied = _splice_to_file(checkout, tmp_path / "function.zip", composition.add)
+
+    assert copied == [
+        "common/__init__.py",
+        "common/tests/test_util.py",
+        "common/util.py",
+    ]
+    fallback.assert_called_once()
+    assert composition.uncompressed_size == sum(
+        (checkout / "libs" / name).stat().st_size for name in copied
+    )
+    with zipfile.ZipFile(tmp_path / "function.zip") as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["main.py", *copied, "after.py"]
+        assert (
+            zf.read("common/util.py") == (checkout / "libs/common/util.py").read_bytes()
+        )
+        assert zf.getinfo("common/util.py").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_splice_into_closed_archive(tmp_path):
+    handler = zipfile.ZipFile(io.BytesIO(), "w")
+    handler.close()
+
+    with pytest.raises(ValueError, match="already closed"):
+        splice(handler, tmp_path / "fragment.zip")
+
+
+def test_strip_zip64_extra():
+    zip64 = struct.pack("<HHQ", 0x0001, 8, 1)
+    other = struct.pack("<HH", 0x5455, 1) + b"\x01"
+
+    assert _strip_zip64_extra(zip64 + other) == other
+
+
+def test_splice_into_lets_the_function_win(checkout, caplog):
+    (checkout / "libs" / "VERSION").write_text("1\n")
+    includes = SharedIncludes(
+        [
+            SharedInclude.parse("libs/common:."),
+            SharedInclude.parse("libs/VERSION"),
+        ],
+        FragmentCache(checkout / "fragments"),
+    )
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as handler:
+        handler.writestr("util.py", "# the function's own\n")
+        with caplog.at_level("INFO", logger="cloud-function"):
+            sources = includes.splice_into(
+                handler, lambda relative: relative.name == "tests"
+            )
+
+    assert sources == [(Path("libs/common/__init__.py"), "__init__.py")]
+    with zipfile.ZipFile(data) as zf:
+        assert zf.read("util.py") == b"# the function's own\n"
+        assert zf.read("VERSION") == b"1\n"
+    assert "Added 1 files of shared include libs/common under ./" in caplog.text
+    assert "1 files of shared include libs/common are already in" in caplog.text
+
+
+def test_build_archive_with_shared_includes(checkout, monkeypatch, caplog):
+    """Test every build after the first reuses the compressed fragment."""
+    monkeypatch.setenv("shared_includes", "libs/common,libs/common:vendor/common")
+    monkeypatch.setenv("cache_dir", str(checkout / "cache"))
+
+    with caplog.at_level("INFO", logger="cloud-function"):
+        for _ in range(2):
+            with deploy._build_archive(runtimes=["python312"]) as data:
+                with zipfile.ZipFile(data) as zf:
+                    names = zf.namelist()
+                    assert zf.testzip() is None
+
+    assert names == [
+        "main.py",
+        "common/__init__.py",
+        "common/util.py",
+        "vendor/common/__init__.py",
+        "vendor/common/util.py",
+    ]
+    assert caplog.text.count("(compressed fragment)") == 2
+    assert caplog.text.count("(cached fragment)") == 2
+    assert len(list((checkout / "cache" / "includes").iterdir())) == 2
+
+
+def test_shared_includes_without_cache_dir(checkout, monkeypatch, caplog):
+    monkeypatch.setenv("shared_includes", "libs/common")
+
+    with caplog.at_level("WARNING", logger="cloud-function"):
+        with deploy._shared_includes() as includes:
+            assert includes is not None
+            assert includes.cache.root.is_dir()
+
+    assert not includes.cache.root.exists()
+    assert "shared include fragments are not kept" in caplog.text
+
+
+def test_shared_includes_not_configured(monkeypatch):
+    monkeypatch.delenv("shared_includes", raising=False)
+
+    with deploy._shared_includes() as includes:
+        assert includes is None
+
+
+def test_input_digest_covers_shared_includes(checkout, monkeypatch):
+    monkeypatch.delenv("shared_includes", raising=False)
+    sources_only = deploy._input_digest(None)
+    monkeypatch.setenv("shared_includes", "libs/common")
+    digest = deploy._input_digest(None)
+
+    assert digest == includes_digest(sources_only, [SharedInclude.parse("libs/common")])
+    (checkout / "libs/common/util.py").write_text("changed\n")
+    assert deploy._input_digest(None) != digest
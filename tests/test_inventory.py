@@ -0,0 +1,92 @@
+"""Tests for the function inventory."""
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import pytest
+
+from plugin_scripts.inventory import FunctionInventory
+from plugin_scripts.scheduler import RequestScheduler
+from plugin_scripts.targets import DeployTarget
+
+PARENT = "projects/proj/locations/us-central1"
+
+
+def _paged_resource(pages):
+    """Serve list pages the way googleapiclient's list/list_next do."""
+    cloud_functions = Mock()
+    requests = [Mock(name=f"page{i}") for i in range(len(pages))]
+    for request, page in zip(requests, pages, strict=True):
+        request.execute.return_value = page
+    cloud_functions.list.return_value = requests[0]
+
+    def list_next(previous_request, previous_response):
+        index = requests.index(previous_request) + 1
+        return requests[index] if index < len(requests) else None
+
+    cloud_functions.list_next.side_effect = list_next
+    return cloud_functions
+
+
+@pytest.fixture
+def scheduler():
+    return RequestScheduler(rate=1000, burst=1000, sleep=lambda _: None)
+
+
+def test_get_follows_pages(scheduler):
+    """Test every page is fetched and definitions are served by name."""
+    cloud_functions = _paged_resource(
+        [
+            {"functions": [{"name": f"{PARENT}/functions/a"}], "nextPageToken": "t"},
+            {"functions": [{"name": f"{PARENT}/functions/b", "runtime": "py"}]},
+        ]
+    )
+    inventory = FunctionInventory(lambda: cloud_functions, scheduler, page_size=1)
+
+    function = inventory.get(DeployTarget("proj", "us-central1", "b"))
+
+    assert function == {"name": f"{PARENT}/functions/b", "runtime": "py"}
+    cloud_functions.list.assert_called_once_with(parent=PARENT, pageSize=1)
+    assert cloud_functions.list_next.call_count == 2
+
+
+def test_get_missing_function(scheduler):
+    """Test a function absent from the listing is reported as None."""
+    inventory = FunctionInventory(lambda: _paged_resource([{}]), scheduler)
+
+    assert inventory.get(DeployTarget("proj", "us-central1", "nope")) is None
+
+
+def test_get_caches_listing_and_returns_copies(scheduler):
+    """Test a location is listed once and callers cannot corrupt the cache."""
+    cloud_functions = _paged_resource(
+        [{"functions": [{"name": f"{PARENT}/functions/a", "labels": {}}]}]
+    )
+    inventory = FunctionInventory(lambda: cloud_functions, scheduler)
+    target = DeployTarget("proj", "us-central1", "a")
+
+    first = inventory.get(target)
+    assert first is not None
+    first["labels"]["changed"] = "yes"
+
+    assert inventory.get(target) == {"name": f"{PARENT}/functions/a", "labels": {}}
+    cloud_functions.list.assert_called_once()
+
+
+def test_concurrent_lookups_list_once(scheduler):
+    """Test concurrent lookups in one location share a single listing."""
+    cloud_functions = _paged_resource(
+        [{"functions": [{"name": f"{PARENT}/functions/{n}"} for n in "abcd"]}]
+    )
+    inventory = FunctionInventory(lambda: cloud_functions, scheduler)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        found = list(
+            executor.map(
+                lambda n: inventory.get(DeployTarget("proj", "us-central1", n)),
+                "abcd",
+            )
+        )
+
+    assert all(found)
+    cloud_functions.list.assert_called_once()
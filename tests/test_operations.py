@@ -0,0 +1,51 @@
+"""Tests for waiting on long running operations."""
+
+from unittest.mock import Mock
+
+import pytest
+
+from plugin_scripts.operations import wait_for_operation
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.scheduler import RequestScheduler
+
+
+def _operations(*states):
+    operations = Mock()
+    operations.get.return_value.execute.side_effect = list(states)
+    return operations
+
+
+def test_wait_for_operation_polls_until_done():
+    operations = _operations({"done": False}, {"done": False}, {"done": True})
+    sleep = Mock()
+
+    operation = wait_for_operation(
+        operations, RequestScheduler(), "operations/1", "q", sleep=sleep
+    )
+
+    assert operation == {"done": True}
+    assert sleep.call_count == 2
+    operations.get.assert_called_with(name="operations/1")
+
+
+def test_wait_for_operation_failed():
+    operations = _operations({"done": True, "error": {"code": 3, "message": "bad"}})
+
+    with pytest.raises(DeployFailed, match="Operation operations/1 failed: bad"):
+        wait_for_operation(operations, RequestScheduler(), "operations/1", "q")
+
+
+def test_wait_for_operation_times_out():
+    operations = _operations({"done": False}, {"done": False})
+    times = iter([0.0, 5.0, 11.0])
+
+    with pytest.raises(DeployFailed, match="Timed out after 10s"):
+        wait_for_operation(
+            operations,
+            RequestScheduler(),
+            "operations/1",
+            "q",
+            timeout=10,
+            clock=lambda: next(times),
+            sleep=Mock(),
+        )
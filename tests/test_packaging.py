@@ -0,0 +1,52 @@
+"""Tests for the packaging module."""
+
+import hashlib
+import io
+import zipfile
+
+from plugin_scripts import packaging
+
+
+def _write_archive(path, files):
+    with zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+
+
+def test_archive_digest_rewinds():
+    """Test the digest covers the whole stream and rewinds it."""
+    data = io.BytesIO(b"archive bytes")
+    data.seek(5)
+
+    assert (
+        packaging.archive_digest(data) == hashlib.sha256(b"archive bytes").hexdigest()
+    )
+    assert data.tell() == 0
+
+
+def test_manifest_path(tmp_path):
+    """Test the manifest sits next to its archive."""
+    assert packaging.manifest_path(tmp_path / "fn.zip") == (
+        tmp_path / "fn.manifest.json"
+    )
+
+
+def test_build_and_read_manifest(tmp_path):
+    """Test the manifest lists the archive digest and files."""
+    archive_path = tmp_path / "fn.zip"
+    _write_archive(archive_path, {"main.py": "x = 1\n" * 100, "lib/util.py": "y"})
+
+    manifest = packaging.build_manifest(archive_path, "fn")
+
+    assert manifest["function_name"] == "fn"
+    assert manifest["archive"] == "fn.zip"
+    assert manifest["sha256"] == hashlib.sha256(archive_path.read_bytes()).hexdigest()
+    assert manifest["size"] == archive_path.stat().st_size
+    files = {entry["path"]: entry for entry in manifest["files"]}
+    assert files["main.py"]["size"] == 600
+    assert files["main.py"]["compressed_size"] < 600
+    assert set(files) == {"main.py", "lib/util.py"}
+
+    assert packaging.read_manifest(archive_path) is None
+    packaging.write_manifest(archive_path, manifest)
+    assert packaging.read_manifest(archive_path) == manifest
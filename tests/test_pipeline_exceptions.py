@@ -3,9 +3,12 @@
 import pytest
 
 from plugin_scripts.pipeline_exceptions import (
+    ArchiveTooLarge,
+    BenchmarkRegression,
     CloudFunctionDirectoryNonExistent,
     DeployFailed,
     MissingConfigError,
+    SourceValidationFailed,
 )
 
 
@@ -38,6 +41,12 @@ def test_deploy_failed_default_message():
     assert "Deployment to Cloud Function failed" in str(e)
 
 
+def test_deploy_failed_status_code():
+    """Test DeployFailed keeps the HTTP status code of the original error."""
+    assert DeployFailed("Conflict", status_code=409).status_code == 409
+    assert DeployFailed().status_code is None
+
+
 def test_deploy_failed_throws():
     """Test DeployFailed exception can be raised."""
     e = DeployFailed("Test error")
@@ -71,3 +80,39 @@ def test_missing_config_error_throws():
 def test_all_exceptions_are_exceptions(exception_object):
     """Test that all custom exceptions inherit from Exception."""
     assert isinstance(exception_object, Exception)
+
+
+def test_source_validation_failed():
+    """Test SourceValidationFailed lists its problems."""
+    error = SourceValidationFailed(["main.py:1: invalid syntax", "missing entry"])
+
+    assert isinstance(error, DeployFailed)
+    assert error.problems == ["main.py:1: invalid syntax", "missing entry"]
+    assert str(error) == (
+        "Pre-flight checks failed:\n  main.py:1: invalid syntax\n  missing entry"
+    )
+
+
+def test_archive_too_large():
+    """Test ArchiveTooLarge reports the sizes and the composition."""
+    error = ArchiveTooLarge(2048, 1024, "Largest files:")
+
+    assert isinstance(error, DeployFailed)
+    assert (error.size, error.budget) == (2048, 1024)
+    assert str(error) == (
+        "Archive exceeded its size budget: 2048 > 1024 bytes\nLargest files:"
+    )
+    assert str(ArchiveTooLarge(2048, 1024)).endswith("bytes")
+
+
+def test_benchmark_regression():
+    """Test BenchmarkRegression lists every regression."""
+    error = BenchmarkRegression(
+        "projects/p/locations/r/functions/f", ["p99 a", "p50 b"]
+    )
+
+    assert isinstance(error, DeployFailed)
+    assert error.problems == ["p99 a", "p50 b"]
+    assert str(error) == (
+        "Benchmark of projects/p/locations/r/functions/f regressed: p99 a; p50 b"
+    )
@@ -0,0 +1,115 @@
+"""Tests for the pre-flight source checks."""
+
+import pytest
+
+from plugin_scripts import preflight
+from plugin_scripts.preflight import (
+    check_entry_points,
+    check_requirements,
+    compile_sources,
+    validate_sources,
+)
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    """A deployable function directory."""
+    (tmp_path / "main.py").write_text("def handler(request):\n    return 'ok'\n")
+    (tmp_path / "requirements.txt").write_text("requests>=2\n")
+    return tmp_path
+
+
+def test_validate_sources_passes(source_dir):
+    """Test a valid function has no problems."""
+    assert validate_sources(source_dir, ["handler"]) == []
+
+
+def test_compile_sources_reports_syntax_errors(source_dir):
+    """Test syntax errors are reported with their file and line."""
+    (source_dir / "lib").mkdir()
+    (source_dir / "lib" / "broken.py").write_text("x = 1\ndef f(:\n")
+    (source_dir / "nul.py").write_bytes(b"x = 1\0")
+
+    errors = compile_sources(source_dir)
+
+    assert errors[0].startswith("lib/broken.py:2:")
+    assert errors[1].startswith("nul.py:")
+    assert len(errors) == 2
+
+
+def test_compile_sources_uses_process_pool(monkeypatch, source_dir):
+    """Test larger functions are compiled in a process pool."""
+    monkeypatch.setattr(preflight, "_POOL_THRESHOLD", 2)
+    for i in range(4):
+        (source_dir / f"mod{i}.py").write_text(f"value = {i}\n")
+    (source_dir / "bad.py").write_text("def\n")
+
+    assert compile_sources(source_dir, max_workers=2) == ["bad.py:1: invalid syntax"]
+
+
+def test_check_entry_points(source_dir):
+    """Test functions, classes, assignments and imports count as defined."""
+    (source_dir / "main.py").write_text(
+        "import json\n"
+        "print('loading')\n"
+        "from app import build as built\n"
+        "class Handler: ...\n"
+        "alias = Handler\n"
+        "typed: object = None\n"
+        "try:\n"
+        "    from fast import guarded\n"
+        "except ImportError:\n"
+        "    def fallback(request): ...\n"
+        "def _helper():\n"
+        "    def nested(request): ...\n"
+    )
+
+    defined = ["json", "built", "Handler", "alias", "typed", "guarded", "fallback"]
+    assert check_entry_points(source_dir, defined) == []
+    assert check_entry_points(source_dir, ["nested", "handler"]) == [
+        "Entry point 'handler' is not defined in main.py",
+        "Entry point 'nested' is not defined in main.py",
+    ]
+
+
+def test_check_entry_points_missing_main(tmp_path):
+    """Test a function without main.py is rejected."""
+    assert check_entry_points(tmp_path, ["handler"]) == [
+        f"main.py not found in {tmp_path}"
+    ]
+
+
+def test_check_entry_points_star_import_and_syntax_error(source_dir):
+    """Test undecidable modules are not reported as missing entry points."""
+    (source_dir / "main.py").write_text("from app import *\n")
+    assert check_entry_points(source_dir, ["handler"]) == []
+
+    (source_dir / "main.py").write_text("def handler(:\n")
+    assert check_entry_points(source_dir, ["handler"]) == []
+
+
+def test_check_requirements(source_dir):
+    """Test invalid requirement lines are reported and pip syntax is allowed."""
+    (source_dir / "requirements.txt").write_text(
+        "# pinned\n"
+        "--index-url https://pypi.example.com/simple\n"
+        "-r shared.txt\n"
+        "flask==3.0.0 --hash=sha256:abc  # web\n"
+        "numpy>=2; python_version >= '3.12'\n"
+        "mylib @ https://example.com/mylib-1.0.whl\n"
+        "google-cloud-storage \\\n"
+        "    >=2.0\n"
+        "requests=>2\n"
+        "\n"
+        "bad name\n"
+    )
+
+    errors = check_requirements(source_dir)
+
+    assert [error.split(":", 2)[1] for error in errors] == ["9", "11"]
+    assert all(error.startswith("requirements.txt:") for error in errors)
+
+
+def test_check_requirements_without_file(tmp_path):
+    """Test functions without requirements.txt pass."""
+    assert check_requirements(tmp_path) == []
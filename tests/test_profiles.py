@@ -0,0 +1,126 @@
+"""Tests for packaging profiles."""
+
+import zipfile
+from pathlib import PurePosixPath
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.profiles import (
+    PROFILES,
+    PackagingProfile,
+    runtime_family,
+    select_profile,
+)
+
+
+@pytest.fixture
+def profile_env(monkeypatch):
+    for name in ("packaging_profile", "package_exclude", "package_include"):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+@pytest.mark.parametrize(
+    ("runtime", "family"),
+    [("python312", "python"), ("nodejs20", "nodejs"), ("go122", "go"), ("", "")],
+)
+def test_runtime_family(runtime, family):
+    assert runtime_family(runtime) == family
+
+
+@pytest.mark.parametrize(
+    ("path", "excluded"),
+    [
+        ("tests", True),
+        ("pkg/__pycache__", True),
+        ("pkg/mod.pyc", True),
+        ("pkg/mod.py", False),
+        (".git", True),
+        ("docs/tests.md", False),
+    ],
+)
+def test_python_profile_excludes(path, excluded):
+    assert PROFILES["python"].excludes(PurePosixPath(path)) is excluded
+
+
+def test_path_patterns_and_includes():
+    """Test patterns with a slash match whole paths and includes win."""
+    profile = PackagingProfile("custom", ("src/test", "*.md"), ("README.md",))
+
+    assert profile.excludes(PurePosixPath("src/test"))
+    assert not profile.excludes(PurePosixPath("lib/src/test"))
+    assert profile.excludes(PurePosixPath("CHANGES.md"))
+    assert not profile.excludes(PurePosixPath("README.md"))
+
+
+def test_installed_directories_need_their_manifest(tmp_path):
+    """Test node_modules is only dropped when the build installs it."""
+    profile = PROFILES["nodejs"]
+
+    assert not profile.for_directory(tmp_path).excludes(PurePosixPath("node_modules"))
+    (tmp_path / "package.json").write_text("{}")
+    assert profile.for_directory(tmp_path).excludes(PurePosixPath("node_modules"))
+
+
+@pytest.mark.parametrize(
+    ("runtimes", "name"),
+    [
+        (["python312"], "python"),
+        (["nodejs20", "nodejs22"], "nodejs"),
+        (["python312", "nodejs20"], "generic"),
+        (["cobol1"], "generic"),
+        ([], "generic"),
+    ],
+)
+def test_select_profile_auto(profile_env, runtimes, name):
+    assert select_profile(runtimes).name == name
+
+
+def test_select_profile_overrides(profile_env):
+    """Test the configured profile and extra patterns are used."""
+    profile_env.setenv("packaging_profile", "none")
+    profile_env.setenv("package_exclude", "*.md,fixtures")
+    profile_env.setenv("package_include", "README.md")
+
+    profile = select_profile(["python312"])
+
+    assert profile.name == "none"
+    assert profile.exclude == ("*.md", "fixtures")
+    assert profile.include == ("README.md",)
+
+
+def test_select_profile_unknown(profile_env):
+    profile_env.setenv("packaging_profile", "cobol")
+
+    with pytest.raises(ValueError, match="Unknown packaging_profile 'cobol'"):
+        select_profile([])
+
+
+def test_zip_directory_applies_profile(mocker, monkeypatch, tmp_path):
+    """Test excluded files are left out and excluded directories not walked."""
+    source_dir = tmp_path / "src"
+    for path in (
+        "main.py",
+        "package.json",
+        "lib/util.js",
+        "node_modules/dep/index.js",
+        "__tests__/main.test.js",
+        ".git/HEAD",
+        ".DS_Store",
+    ):
+        (source_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (source_dir / path).write_text("x")
+    (source_dir / "dangling").symlink_to(source_dir / "missing")
+    monkeypatch.setenv("cloud_function_directory", str(source_dir))
+    excludes = mocker.spy(PackagingProfile, "excludes")
+
+    archive = tmp_path / "out.zip"
+    with zipfile.ZipFile(archive, mode="w") as handler:
+        deploy._zip_directory(handler, profile=PROFILES["nodejs"])
+
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.namelist() == ["lib/util.js", "main.py", "package.json"]
+    checked = {call.args[1].as_posix() for call in excludes.call_args_list}
+    assert "node_modules" in checked
+    assert "node_modules/dep" not in checked
@@ -0,0 +1,132 @@
+"""Tests for deploy profiling."""
+
+import logging
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.profiling import (
+    ALLOCATIONS_FILE,
+    CPU_REPORT_FILE,
+    PROFILE_FILE,
+    DeployProfile,
+)
+
+
+def _allocate():
+    return [bytearray(1024) for _ in range(200)]
+
+
+def test_profile_writes_reports(tmp_path, monkeypatch):
+    monkeypatch.setattr("plugin_scripts.buildkite.agent_path", lambda: None)
+    profile = DeployProfile(tmp_path / "profile", top=5)
+
+    profile.start()
+    kept = _allocate()
+    files = profile.stop()
+
+    assert [path.name for path in files] == [
+        PROFILE_FILE,
+        CPU_REPORT_FILE,
+        ALLOCATIONS_FILE,
+    ]
+    stats = pstats.Stats(str(files[0]))
+    assert any(name == "_allocate" for _, _, name in stats.stats)  # type: ignore[attr-defined]
+    assert "_allocate" in files[1].read_text()
+    allocations = files[2].read_text().splitlines()
+    assert allocations[0].startswith("Peak traced memory:")
+    assert "test_profiling.py" in allocations[2]
+    assert len(allocations) <= 7
+    assert len(kept) == 200
+
+
+def _in_worker():
+    return sum(range(1000))
+
+
+def test_profile_covers_worker_threads(tmp_path, monkeypatch):
+    """Test work done in the target thread pool shows up in the profile."""
+    monkeypatch.setattr("plugin_scripts.buildkite.agent_path", lambda: None)
+    profile = DeployProfile(tmp_path)
+
+    profile.start()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda _: _in_worker(), range(4)))
+    files = profile.stop()
+
+    stats = pstats.Stats(str(files[0]))
+    calls = {
+        name: stat[1]
+        for (_, _, name), stat in stats.stats.items()  # type: ignore[attr-defined]
+    }
+    assert calls["_in_worker"] == 4
+
+
+def test_profile_uploads_artifacts(mocker, tmp_path):
+    mocker.patch("plugin_scripts.buildkite.agent_path", return_value="/agent")
+    upload = mocker.patch("plugin_scripts.buildkite.artifact_upload")
+    profile = DeployProfile(tmp_path)
+
+    profile.start()
+    files = profile.stop()
+
+    upload.assert_called_once_with(*(str(path) for path in files))
+
+
+def test_profile_failures_only_warn(mocker, tmp_path, caplog):
+    mocker.patch("plugin_scripts.buildkite.agent_path", return_value="/agent")
+    mocker.patch(
+        "plugin_scripts.buildkite.artifact_upload", side_effect=RuntimeError("down")
+    )
+    profile = DeployProfile(tmp_path)
+    profile.start()
+    with caplog.at_level(logging.WARNING, logger="cloud-function"):
+        assert len(profile.stop()) == 3
+    assert "Could not upload the deploy profile: down" in caplog.text
+
+    (tmp_path / "file").write_text("")
+    profile = DeployProfile(tmp_path / "file")
+    profile.start()
+    with caplog.at_level(logging.WARNING, logger="cloud-function"):
+        assert profile.stop() == []
+    assert "Could not write the deploy profile" in caplog.text
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("profile", raising=False)
+    assert DeployProfile.from_env() is None
+
+    monkeypatch.setenv("profile", "true")
+    monkeypatch.setenv("profile_dir", "out/profile")
+    monkeypatch.setenv("profile_top", "0")
+    profile = DeployProfile.from_env()
+
+    assert profile is not None
+    assert str(profile.output_dir) == "out/profile"
+    assert profile.top == 1
+
+
+def test_main_invalid_profile_setting(monkeypatch):
+    """Test a malformed profiling setting fails with the plugin's error."""
+    monkeypatch.setenv("profile", "true")
+    monkeypatch.setenv("profile_top", "many")
+
+    with pytest.raises(deploy.DeployFailed, match="profile_top"):
+        deploy.main()
+
+
+def test_main_profiles_failed_deploys(monkeypatch, tmp_path):
+    """Test the profile is written even when the deploy fails."""
+    monkeypatch.setenv("profile", "true")
+    monkeypatch.setenv("profile_dir", str(tmp_path))
+    monkeypatch.setattr("plugin_scripts.buildkite.agent_path", lambda: None)
+    monkeypatch.setenv("mode", "unknown")
+
+    with pytest.raises(deploy.DeployFailed):
+        deploy.main()
+
+    assert (tmp_path / CPU_REPORT_FILE).read_text().strip()
+    stats = pstats.Stats(str(tmp_path / PROFILE_FILE))
+    assert any(name == "env_str" for _, _, name in stats.stats)  # type: ignore[attr-defined]
@@ -0,0 +1,178 @@
+"""Tests for retained releases."""
+
+import io
+import json
+import zipfile
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.releases import ReleaseStore
+from plugin_scripts.state import StateStore
+from tests.fakes import FakeBlob, FakeBucket
+
+FUNCTION = "projects/proj/locations/us-central1/functions/fn"
+
+
+def _archive(content: str) -> io.BytesIO:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as zf:
+        zf.writestr("main.py", content)
+    data.seek(0)
+    return data
+
+
+@pytest.fixture
+def bucket():
+    return FakeBucket("state")
+
+
+@pytest.fixture
+def releases(bucket, monkeypatch):
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", "1")
+    monkeypatch.setenv("BUILDKITE_COMMIT", "abc123")
+    return ReleaseStore(StateStore(bucket, "deploys"), FUNCTION, keep=2)
+
+
+def _deploy(releases, monkeypatch, build, content):
+    monkeypatch.setenv("BUILDKITE_BUILD_NUMBER", str(build))
+    digest = releases.retain(_archive(content))
+    releases.record(digest, f"operations/{build}")
+    return digest
+
+
+def test_retain_uploads_archive_and_manifest(bucket, releases):
+    """Test the archive and its manifest are kept under the function prefix."""
+    data = _archive("v1")
+    digest = releases.retain(data)
+
+    prefix = f"deploys/releases/{FUNCTION}"
+    assert bucket.objects[f"{prefix}/{digest}.zip"] == data.getvalue()
+    manifest = json.loads(bucket.objects[f"{prefix}/{digest}.manifest.json"])
+    assert manifest["sha256"] == digest
+    assert manifest["function_name"] == FUNCTION
+    assert manifest["build_number"] == "1"
+    assert manifest["commit"] == "abc123"
+    assert [f["path"] for f in manifest["files"]] == ["main.py"]
+    assert data.tell() == 0
+    # Not a release until the function was patched
+    assert releases.releases() == ([], None)
+
+
+def test_retain_copies_from_another_function(mocker, bucket, releases):
+    """Test further targets copy the retained archive instead of uploading."""
+    other = ReleaseStore(releases.store, "projects/p/locations/r/functions/g", 2)
+    digest = releases.retain(_archive("v1"))
+    upload = mocker.spy(FakeBlob, "upload_from_file")
+
+    assert other.retain(_archive("v1"), copy_of=releases) == digest
+    upload.assert_not_called()
+    assert (
+        bucket.objects[f"deploys/{other.archive_key(digest)}"]
+        == (bucket.objects[f"deploys/{releases.archive_key(digest)}"])
+    )
+
+
+def test_record_prunes_old_releases(bucket, releases, monkeypatch):
+    """Test only the newest releases are kept, with their archives."""
+    first = _deploy(releases, monkeypatch, 1, "v1")
+    second = _deploy(releases, monkeypatch, 2, "v2")
+    third = _deploy(releases, monkeypatch, 3, "v3")
+
+    index, live = releases.releases()
+    assert [r["sha256"] for r in index] == [third, second]
+    assert [r["build_number"] for r in index] == ["3", "2"]
+    assert index[0]["operation"] == "operations/3"
+    assert index[0]["archive"] == f"gs://state/deploys/releases/{FUNCTION}/{third}.zip"
+    assert live == third
+    assert not any(first in name for name in bucket.objects)
+
+
+def test_discard_keeps_listed_releases(bucket, releases, monkeypatch):
+    """Test only archives that never became a release are discarded."""
+    released = _deploy(releases, monkeypatch, 1, "v1")
+    failed = releases.retain(_archive("v2"))
+
+    releases.discard(failed)
+    releases.discard(released)
+
+    prefix = f"deploys/releases/{FUNCTION}"
+    assert not any(failed in name for name in bucket.objects)
+    assert f"{prefix}/{released}.zip" in bucket.objects
+    assert f"{prefix}/{released}.manifest.json" in bucket.objects
+
+
+def test_record_redeploy_moves_release_to_front(releases, monkeypatch):
+    first = _deploy(releases, monkeypatch, 1, "v1")
+    second = _deploy(releases, monkeypatch, 2, "v2")
+    _deploy(releases, monkeypatch, 3, "v1")
+
+    index, _ = releases.releases()
+    assert [r["sha256"] for r in index] == [first, second]
+    assert index[0]["build_number"] == "3"
+
+
+def test_record_retries_concurrent_update(mocker, releases, monkeypatch):
+    """Test a lost compare-and-swap re-reads the index instead of clobbering."""
+    _deploy(releases, monkeypatch, 1, "v1")
+    second = releases.retain(_archive("v2"))
+    racer = ReleaseStore(releases.store, FUNCTION, keep=2)
+    third = racer.retain(_archive("v3"))
+
+    def raced(*args, **kwargs):
+        # Another deploy records its release between our read and write
+        mocker.stopall()
+        racer.record(third)
+        raise PreconditionFailed("raced")
+
+    mocker.patch.object(releases.store, "write_json", side_effect=raced)
+
+    releases.record(second)
+
+    index, live = releases.releases()
+    assert [r["sha256"] for r in index] == [second, third]
+    assert live == second
+
+
+def test_select_previous_walks_back(releases, monkeypatch):
+    """Test repeated rollbacks step further back in history."""
+    first = _deploy(releases, monkeypatch, 1, "v1")
+    second = _deploy(releases, monkeypatch, 2, "v2")
+
+    assert releases.select()["sha256"] == first
+    releases.mark_live(first, "operations/rollback")
+
+    index, live = releases.releases()
+    assert live == first
+    assert [r["sha256"] for r in index] == [second, first]
+    assert index[1]["operation"] == "operations/rollback"
+    assert "rolled_back_at" in index[1]
+    with pytest.raises(DeployFailed, match="older than the live one"):
+        releases.select()
+
+
+def test_select_by_build_or_digest(releases, monkeypatch):
+    first = _deploy(releases, monkeypatch, 41, "v1")
+    _deploy(releases, monkeypatch, 42, "v2")
+
+    assert releases.select("41")["sha256"] == first
+    assert releases.select(first[:7])["sha256"] == first
+    with pytest.raises(DeployFailed, match="matches 'abc'"):
+        releases.select("abc")
+    with pytest.raises(DeployFailed, match="matches '40'"):
+        releases.select("40")
+
+
+def test_select_without_releases(releases):
+    with pytest.raises(DeployFailed, match="No retained releases") as exc_info:
+        releases.select()
+    assert exc_info.value.status_code == 404
+
+
+def test_is_retained(releases):
+    assert releases.is_retained(
+        f"gs://state/deploys/releases/{FUNCTION}/{'0' * 64}.zip"
+    )
+    assert not releases.is_retained("gs://state/deploys/archives/x.zip")
+    assert not releases.is_retained(None)
@@ -0,0 +1,201 @@
+"""Tests for resolving requirements against a local wheel index."""
+
+import subprocess
+
+import pytest
+
+from plugin_scripts.resolve import (
+    DEFAULT_PLATFORMS,
+    DependencyResolver,
+    _evaluate_markers,
+    runtime_environment,
+)
+from tests.fakes import make_wheel
+
+
+@pytest.fixture
+def index(tmp_path):
+    """A local index where alpha needs beta<2 and beta has 1.5 and 2.0."""
+    wheels = tmp_path / "wheels"
+    wheels.mkdir()
+    make_wheel(wheels, "alpha", "1.0", ["beta<2"])
+    make_wheel(wheels, "beta", "1.5")
+    make_wheel(wheels, "beta", "2.0")
+    return wheels
+
+
+@pytest.fixture
+def function_dir(tmp_path):
+    directory = tmp_path / "fn"
+    directory.mkdir()
+    return directory
+
+
+def test_resolve_succeeds_and_caches(mocker, index, function_dir, tmp_path):
+    """Test resolvable requirements pass and are not resolved twice."""
+    requirements = function_dir / "requirements.txt"
+    requirements.write_text("alpha\n")
+    resolver = DependencyResolver(find_links=str(index), cache_dir=tmp_path / "c")
+
+    assert resolver.resolve(function_dir) == []
+    cached = tmp_path / "c" / f"{resolver.cache_key(requirements)}.json"
+    assert cached.read_text() == '{"packages": ["alpha==1.0", "beta==1.5"]}'
+
+    mock_run = mocker.patch("plugin_scripts.resolve.subprocess.run")
+    assert resolver.resolve(function_dir) == []
+    mock_run.assert_not_called()
+
+
+def test_resolve_without_cache(index, function_dir):
+    """Test resolution works without a cache directory."""
+    (function_dir / "requirements.txt").write_text("alpha\n")
+
+    assert DependencyResolver(find_links=str(index)).resolve(function_dir) == []
+
+
+def test_resolve_reports_conflicts(index, function_dir, tmp_path):
+    """Test conflicting pins are reported and the failure is not cached."""
+    (function_dir / "requirements.txt").write_text("alpha\nbeta>=2\n")
+    resolver = DependencyResolver(find_links=str(index), cache_dir=tmp_path / "c")
+
+    [problem] = resolver.resolve(function_dir)
+
+    assert problem.startswith("Requirements cannot be resolved:")
+    assert "ResolutionImpossible" in problem
+    assert list((tmp_path / "c").glob("*.json")) == []
+
+
+def test_resolve_evaluates_markers_for_the_runtime(index, function_dir):
+    """Test requirements are resolved for the runtime, not this interpreter."""
+    (function_dir / "requirements.txt").write_text(
+        'alpha\nbeta>=2; python_version >= "3.13"\n'
+    )
+
+    def resolve(version):
+        return DependencyResolver(
+            find_links=str(index), python_version=version
+        ).resolve(function_dir)
+
+    assert resolve((3, 12)) == []
+    [problem] = resolve((3, 13))
+    assert problem.startswith("Requirements cannot be resolved:")
+
+
+def test_evaluate_markers_follows_includes(tmp_path):
+    """Test included files are rewritten too, and unknown lines kept for pip."""
+    (tmp_path / "base.txt").write_text(
+        "-r requirements.txt\nold; python_version < '3.12'\n"
+    )
+    (tmp_path / "requirements.txt").write_text(
+        "# pinned\n-c base.txt\n-r missing.txt\n"
+        "new; python_version >= '3.12'  # runtime\nodd; not a marker\n"
+    )
+    out = tmp_path / "out"
+    out.mkdir()
+
+    copy = _evaluate_markers(
+        tmp_path / "requirements.txt", runtime_environment((3, 12)), out, {}
+    )
+
+    assert copy.read_text().splitlines() == [
+        "# pinned",
+        "-c 1-base.txt",
+        "-r missing.txt",
+        "new",
+        "odd; not a marker",
+    ]
+    assert (out / "1-base.txt").read_text() == "-r 0-requirements.txt\n"
+
+
+def test_resolve_without_requirements(function_dir):
+    """Test functions without requirements.txt have nothing to resolve."""
+    assert DependencyResolver().resolve(function_dir) == []
+
+
+def test_resolve_timeout(mocker, function_dir):
+    """Test a resolution that takes too long is reported."""
+    (function_dir / "requirements.txt").write_text("alpha\n")
+    mocker.patch(
+        "plugin_scripts.resolve.subprocess.run",
+        side_effect=subprocess.TimeoutExpired("pip", 5),
+    )
+
+    assert DependencyResolver(timeout=5).resolve(function_dir) == [
+        "Resolving requirements timed out after 5s"
+    ]
+
+
+def test_command_uses_index_url(tmp_path):
+    """Test an index URL replaces PyPI and find-links add to it."""
+    resolver = DependencyResolver(
+        index_url="https://mirror/simple", find_links="/wheels", cache_dir=tmp_path
+    )
+
+    command = resolver._command(tmp_path / "report.json")
+
+    assert command[command.index("--index-url") + 1] == "https://mirror/simple"
+    assert command[command.index("--find-links") + 1] == "/wheels"
+    assert command[command.index("--cache-dir") + 1] == str(tmp_path / "pip")
+    assert "--no-index" not in command
+
+
+def test_command_targets_the_runtime(tmp_path):
+    """Test only wheels for the runtime's Python and platforms are considered."""
+    resolver = DependencyResolver(python_version=(3, 10), platforms=("linux_x86_64",))
+
+    command = resolver._command(tmp_path / "report.json")
+
+    assert "--only-binary=:all:" in command
+    assert command[command.index("--implementation") + 1] == "cp"
+    assert command[command.index("--python-version") + 1] == "3.10"
+    assert command[command.index("--platform") + 1] == "linux_x86_64"
+
+
+def test_cache_key_follows_included_files(function_dir):
+    """Test the cache key changes with files included through -r."""
+    (function_dir / "requirements.txt").write_text(
+        "-r base.txt\n--constraint=requirements.txt\n"
+    )
+    (function_dir / "base.txt").write_text("alpha\n")
+    resolver = DependencyResolver()
+    first = resolver.cache_key(function_dir / "requirements.txt")
+
+    (function_dir / "base.txt").write_text("alpha==1.0\n")
+
+    assert resolver.cache_key(function_dir / "requirements.txt") != first
+    assert DependencyResolver(index_url="x").cache_key(
+        function_dir / "requirements.txt"
+    ) != resolver.cache_key(function_dir / "requirements.txt")
+
+
+def test_cache_key_follows_runtime(function_dir):
+    (function_dir / "requirements.txt").write_text("alpha\n")
+    requirements = function_dir / "requirements.txt"
+    key = DependencyResolver(python_version=(3, 12)).cache_key(requirements)
+
+    assert DependencyResolver(python_version=(3, 11)).cache_key(requirements) != key
+    assert (
+        DependencyResolver(python_version=(3, 12), platforms=("x",)).cache_key(
+            requirements
+        )
+        != key
+    )
+
+
+def test_from_env(monkeypatch, tmp_path):
+    """Test the resolver reads its settings and caches under cache_dir."""
+    monkeypatch.setenv("resolve_index_url", "https://mirror/simple")
+    monkeypatch.setenv("resolve_find_links", "/wheels")
+    monkeypatch.setenv("resolve_timeout", "30")
+    monkeypatch.setenv("cache_dir", str(tmp_path))
+    monkeypatch.delenv("vendor_platforms", raising=False)
+
+    resolver = DependencyResolver.from_env((3, 11))
+
+    assert resolver.index_url == "https://mirror/simple"
+    assert resolver.find_links == "/wheels"
+    assert resolver.timeout == 30
+    assert resolver.python_version == (3, 11)
+    assert resolver.platforms == DEFAULT_PLATFORMS
+    assert resolver.cache_dir == tmp_path / "resolve"
+    assert resolver.cache_dir is not None and resolver.cache_dir.is_dir()
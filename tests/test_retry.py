@@ -0,0 +1,63 @@
+"""Tests for the retry module."""
+
+import httplib2
+import pytest
+from google.auth.exceptions import TransportError
+from googleapiclient.errors import HttpError
+
+from plugin_scripts import retry
+from plugin_scripts.pipeline_exceptions import DeployFailed
+
+
+def _http_error(status: int) -> HttpError:
+    return HttpError(resp=httplib2.Response({"status": status}), content=b"{}")
+
+
+@pytest.mark.parametrize("status", [408, 429, 500, 502, 503, 504])
+def test_classify_error_retryable_statuses(status):
+    """Test transient HTTP statuses are retryable."""
+    assert retry.classify_error(_http_error(status)) is retry.ErrorClass.RETRYABLE
+
+
+def test_classify_error_conflict():
+    """Test 409 means another operation is in progress."""
+    assert retry.classify_error(_http_error(409)) is retry.ErrorClass.CONFLICT
+
+
+@pytest.mark.parametrize("status", [400, 403, 404])
+def test_classify_error_fatal_statuses(status):
+    """Test client errors are fatal."""
+    assert retry.classify_error(_http_error(status)) is retry.ErrorClass.FATAL
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        ConnectionResetError("reset"),
+        TimeoutError("timed out"),
+        TransportError("token refresh failed"),
+        httplib2.ServerNotFoundError("dns"),
+    ],
+)
+def test_classify_error_network_failures(error):
+    """Test network level failures are retryable."""
+    assert retry.classify_error(error) is retry.ErrorClass.RETRYABLE
+
+
+def test_classify_error_other_exceptions():
+    """Test unknown exceptions are fatal."""
+    assert retry.classify_error(KeyError("uploadUrl")) is retry.ErrorClass.FATAL
+
+
+@pytest.mark.parametrize(("status", "gone"), [(404, True), (412, True), (400, False)])
+def test_source_gone(status, gone):
+    """Test only missing or expired sources are worth uploading again."""
+    assert retry.source_gone(_http_error(status)) is gone
+    assert retry.source_gone(DeployFailed("patch", status_code=status)) is gone
+    assert not retry.source_gone(DeployFailed("patch"))
+
+
+def test_error_status():
+    """Test the status code is read from HTTP errors only."""
+    assert retry.error_status(_http_error(409)) == 409
+    assert retry.error_status(ValueError("nope")) is None
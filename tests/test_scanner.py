@@ -0,0 +1,121 @@
+"""Tests for the concurrent directory scanner."""
+
+import logging
+import os
+from pathlib import PurePosixPath
+
+import pytest
+
+from plugin_scripts import scanner
+from plugin_scripts.scanner import scan_tree
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "tree"
+    for path in ("b.py", "a/z.txt", "a/b/c.txt", "a-b/x.txt", "e/f/g/h.txt"):
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(path)
+    (root / "empty").mkdir()
+    return root
+
+
+def _relatives(entries):
+    return [entry.relative.as_posix() for entry in entries]
+
+
+def test_scan_tree_sorted_with_stat(tree):
+    """Test files stream out in path order with their stat results."""
+    entries = list(scan_tree(tree, max_workers=4))
+
+    assert _relatives(entries) == [
+        "a/b/c.txt",
+        "a/z.txt",
+        "a-b/x.txt",
+        "b.py",
+        "e/f/g/h.txt",
+    ]
+    assert [e.relative for e in entries] == sorted(
+        PurePosixPath(p.relative_to(tree)) for p in tree.rglob("*") if p.is_file()
+    )
+    for entry in entries:
+        assert entry.path == tree / entry.relative
+        assert entry.stat.st_size == len(entry.relative.as_posix())
+
+
+def test_scan_tree_symlinks(tree, tmp_path):
+    """Test links to files are followed, links to directories and dangling are not."""
+    (tree / "link.txt").symlink_to(tree / "b.py")
+    (tree / "linked-dir").symlink_to(tree / "a")
+    (tree / "dangling").symlink_to(tmp_path / "missing")
+
+    entries = {e.relative.as_posix(): e for e in scan_tree(tree)}
+
+    assert entries["link.txt"].stat.st_size == len("b.py")
+    assert not any(name.startswith(("linked-dir", "dangling")) for name in entries)
+
+
+def test_scan_tree_prune(mocker, tree):
+    """Test pruned directories are never read."""
+    listed = mocker.spy(scanner, "_list_directory")
+
+    entries = scan_tree(tree, prune=lambda relative: relative.name in ("a", "f"))
+
+    assert _relatives(entries) == ["a-b/x.txt", "b.py"]
+    read = {path.relative_to(tree).as_posix() for (path,), _ in listed.call_args_list}
+    assert read == {".", "a-b", "e", "empty"}
+
+
+def test_scan_tree_unreadable_directory(mocker, caplog, tree):
+    """Test unreadable directories are skipped with a warning."""
+    scandir = os.scandir
+
+    def fail_for_a(path):
+        if path == tree / "a":
+            raise PermissionError("denied")
+        return scandir(path)
+
+    mocker.patch("plugin_scripts.scanner.os.scandir", side_effect=fail_for_a)
+
+    with caplog.at_level(logging.WARNING, logger="cloud-function"):
+        assert "a/z.txt" not in _relatives(scan_tree(tree))
+    assert "Skipping unreadable directory" in caplog.text
+
+
+def test_scan_tree_file_removed_while_scanning(mocker, tree):
+    """Test files that vanish between listing and stat are skipped."""
+    scandir = os.scandir
+
+    class Vanished:
+        name = "gone.txt"
+
+        def is_dir(self, follow_symlinks=True):
+            return False
+
+        def is_file(self):
+            return True
+
+        def stat(self):
+            raise FileNotFoundError(self.name)
+
+    class Entries:
+        def __init__(self, path):
+            self.entries = scandir(path)
+
+        def __enter__(self):
+            return [*self.entries, Vanished()]
+
+        def __exit__(self, *args):
+            self.entries.close()
+
+    mocker.patch("plugin_scripts.scanner.os.scandir", side_effect=Entries)
+
+    assert "gone.txt" not in _relatives(scan_tree(tree))
+
+
+def test_scan_tree_stops_early(tree):
+    """Test closing the scan part way cancels the remaining work."""
+    entries = scan_tree(tree)
+
+    assert next(entries).relative.as_posix() == "a/b/c.txt"
+    entries.close()
@@ -0,0 +1,213 @@
+"""Tests for the scheduler module."""
+
+from datetime import UTC, datetime
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from plugin_scripts import scheduler
+
+
+class FakeClock:
+    """Deterministic clock whose sleep advances time."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _http_error(status: int, headers: dict | None = None) -> HttpError:
+    info = {"status": status, **(headers or {})}
+    return HttpError(resp=httplib2.Response(info), content=b"{}")
+
+
+def _scheduler(clock: FakeClock, **kwargs) -> scheduler.RequestScheduler:
+    return scheduler.RequestScheduler(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket_allows_burst_then_waits():
+    """Test the bucket serves its capacity immediately, then paces callers."""
+    clock = FakeClock()
+    bucket = scheduler.TokenBucket(rate=2.0, capacity=2, clock=clock)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_token_bucket_throttle_and_recover():
+    """Test the adaptive rate halves on throttling and recovers on success."""
+    bucket = scheduler.TokenBucket(rate=2.0, capacity=1, clock=FakeClock())
+
+    bucket.throttle()
+    assert bucket.rate == pytest.approx(1.0)
+    for _ in range(20):
+        bucket.recover()
+    assert bucket.rate == pytest.approx(2.0)
+
+
+def test_token_bucket_rejects_invalid_settings():
+    """Test the bucket validates its settings."""
+    with pytest.raises(ValueError):
+        scheduler.TokenBucket(rate=0, capacity=1)
+    with pytest.raises(ValueError):
+        scheduler.TokenBucket(rate=1, capacity=0)
+
+
+def test_retry_after_seconds():
+    """Test Retry-After is read as seconds or as an HTTP date."""
+    assert scheduler._retry_after_seconds(
+        _http_error(429, {"retry-after": "7"})
+    ) == pytest.approx(7.0)
+
+    now = datetime(2026, 1, 1, 12, 0, 0, tzinfo=UTC)
+    error = _http_error(429, {"retry-after": "Thu, 01 Jan 2026 12:00:30 GMT"})
+    assert scheduler._retry_after_seconds(error, now=now) == pytest.approx(30.0)
+
+    assert scheduler._retry_after_seconds(_http_error(429)) is None
+    assert (
+        scheduler._retry_after_seconds(_http_error(429, {"retry-after": "soon"}))
+        is None
+    )
+
+
+def test_execute_honours_retry_after(mocker):
+    """Test a throttled call is retried after the server supplied delay."""
+    clock = FakeClock()
+    request = mocker.Mock()
+    request.execute.side_effect = [
+        _http_error(429, {"retry-after": "3"}),
+        {"name": "fn"},
+    ]
+
+    result = _scheduler(clock).execute(request, "project/region")
+
+    assert result == {"name": "fn"}
+    assert request.execute.call_count == 2
+    assert clock.sleeps == [pytest.approx(3.0)]
+
+
+def test_execute_backs_off_without_retry_after(mocker):
+    """Test jittered backoff is used when no Retry-After header is sent."""
+    clock = FakeClock()
+    mocker.patch("plugin_scripts.scheduler.random.uniform", return_value=0.25)
+    request = mocker.Mock()
+    request.execute.side_effect = [_http_error(503), "ok"]
+
+    sched = _scheduler(clock)
+    assert sched.execute(request, "project/region") == "ok"
+    assert clock.sleeps == [pytest.approx(0.25)]
+    # The rate was halved and then nudged back up by the success
+    assert sched.bucket("project/region").rate == pytest.approx(1.2)
+
+
+def test_execute_gives_up_after_max_attempts(mocker):
+    """Test the throttling error is raised once attempts are exhausted."""
+    clock = FakeClock()
+    request = mocker.Mock()
+    request.execute.side_effect = _http_error(429, {"retry-after": "1"})
+
+    with pytest.raises(HttpError):
+        _scheduler(clock, max_attempts=3).execute(request, "project/region")
+    assert request.execute.call_count == 3
+
+
+def test_execute_does_not_retry_other_errors(mocker):
+    """Test non-throttling errors are raised immediately."""
+    request = mocker.Mock()
+    request.execute.side_effect = _http_error(404)
+
+    with pytest.raises(HttpError):
+        _scheduler(FakeClock()).execute(request, "project/region")
+    assert request.execute.call_count == 1
+
+
+def test_execute_rate_limits_per_location(mocker):
+    """Test each location has its own bucket."""
+    clock = FakeClock()
+    request = mocker.Mock()
+    request.execute.return_value = "ok"
+    sched = _scheduler(clock, rate=1.0, burst=1)
+
+    sched.execute(request, "project/us-central1")
+    sched.execute(request, "project/europe-west1")
+    assert clock.sleeps == []
+
+    sched.execute(request, "project/us-central1")
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_from_env(monkeypatch):
+    """Test the scheduler reads its settings from the environment."""
+    monkeypatch.setenv("api_rate_limit", "0.5")
+    monkeypatch.setenv("api_burst", "3")
+    monkeypatch.setenv("api_max_attempts", "7")
+
+    sched = scheduler.RequestScheduler.from_env()
+    assert sched.rate == 0.5
+    assert sched.burst == 3
+    assert sched.max_attempts == 7
+
+
+def test_rejects_invalid_max_attempts():
+    """Test max_attempts must allow at least one call."""
+    with pytest.raises(ValueError):
+        scheduler.RequestScheduler(max_attempts=0)
+
+
+def test_execute_retries_server_errors(mocker):
+    """Test transient server errors are retried without lowering the rate."""
+    clock = FakeClock()
+    mocker.patch("plugin_scripts.scheduler.random.uniform", return_value=0.1)
+    request = mocker.Mock()
+    request.execute.side_effect = [_http_error(500), ConnectionResetError(), "ok"]
+
+    sched = _scheduler(clock)
+    assert sched.execute(request, "project/region") == "ok"
+    assert request.execute.call_count == 3
+    assert sched.bucket("project/region").rate == pytest.approx(2.0)
+
+
+def test_execute_waits_for_conflicting_operation(mocker):
+    """Test a 409 waits for the in-flight operation and then retries."""
+    clock = FakeClock()
+    on_conflict = mocker.Mock()
+    request = mocker.Mock()
+    request.execute.side_effect = [_http_error(409), {"name": "operations/1"}]
+
+    result = _scheduler(clock).execute(
+        request, "project/region", on_conflict=on_conflict
+    )
+
+    assert result == {"name": "operations/1"}
+    on_conflict.assert_called_once_with()
+    assert clock.sleeps == []
+
+
+def test_execute_conflict_without_handler_backs_off(mocker):
+    """Test a 409 falls back to backoff when there is nothing to wait on."""
+    clock = FakeClock()
+    mocker.patch("plugin_scripts.scheduler.random.uniform", return_value=2.0)
+    request = mocker.Mock()
+    request.execute.side_effect = [_http_error(409), "ok"]
+
+    assert _scheduler(clock).execute(request, "project/region") == "ok"
+    assert clock.sleeps == [pytest.approx(2.0)]
+
+
+def test_execute_does_not_retry_fatal_exceptions(mocker):
+    """Test unclassified exceptions are raised immediately."""
+    request = mocker.Mock()
+    request.execute.side_effect = KeyError("uploadUrl")
+
+    with pytest.raises(KeyError):
+        _scheduler(FakeClock()).execute(request, "project/region")
+    assert request.execute.call_count == 1
@@ -0,0 +1,150 @@
+"""Tests for the adaptive archive spool."""
+
+import errno
+import io
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from plugin_scripts.spool import (
+    TIER_DISK,
+    TIER_MEMORY,
+    TIER_TMPFS,
+    ArchiveSpool,
+    SharedReader,
+)
+
+
+def test_small_archive_stays_in_memory(tmp_path):
+    """Test data below the memory limit never touches a file."""
+    spool = ArchiveSpool(memory_limit=1024, tmpfs_limit=4096, tmpfs_dir=str(tmp_path))
+    spool.write(b"x" * 1024)
+
+    assert spool.tier == TIER_MEMORY
+    assert spool.size == 1024
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rolls_over_to_tmpfs_then_disk(tmp_path):
+    """Test growing data moves to tmpfs and then to disk, keeping its bytes."""
+    spool = ArchiveSpool(memory_limit=10, tmpfs_limit=20, tmpfs_dir=str(tmp_path))
+    spool.write(b"a" * 8)
+    spool.write(b"b" * 8)
+    assert spool.tier == TIER_TMPFS
+
+    spool.write(b"c" * 8)
+    assert spool.tier == TIER_DISK
+
+    spool.seek(0)
+    assert spool.read() == b"a" * 8 + b"b" * 8 + b"c" * 8
+    assert spool.size == 24
+
+
+def test_skips_missing_tmpfs(tmp_path):
+    """Test a missing tmpfs directory falls through to disk."""
+    spool = ArchiveSpool(
+        memory_limit=4, tmpfs_limit=100, tmpfs_dir=str(tmp_path / "missing")
+    )
+    spool.write(b"12345")
+
+    assert spool.tier == TIER_DISK
+
+
+def test_skips_tmpfs_without_room(mocker, tmp_path):
+    """Test tmpfs is skipped when it has too little free space."""
+    stats = mocker.Mock(f_bavail=1, f_frsize=4)
+    mocker.patch("plugin_scripts.spool.os.statvfs", return_value=stats)
+    spool = ArchiveSpool(memory_limit=4, tmpfs_limit=100, tmpfs_dir=str(tmp_path))
+    spool.write(b"12345")
+
+    assert spool.tier == TIER_DISK
+
+
+def test_full_tmpfs_hands_over_to_disk(mocker, tmp_path):
+    """Test a write failing with ENOSPC on tmpfs is retried on disk."""
+    spool = ArchiveSpool(memory_limit=4, tmpfs_limit=100, tmpfs_dir=str(tmp_path))
+    spool.write(b"12345")
+    assert spool.tier == TIER_TMPFS
+
+    full = mocker.patch.object(
+        spool._file, "write", side_effect=OSError(errno.ENOSPC, "full")
+    )
+    spool.write(b"678")
+
+    full.assert_called_once()
+    assert spool.tier == TIER_DISK
+    spool.seek(0)
+    assert spool.read() == b"12345678"
+
+
+def test_other_tmpfs_errors_propagate(mocker, tmp_path):
+    """Test write errors other than ENOSPC are not swallowed."""
+    spool = ArchiveSpool(memory_limit=4, tmpfs_limit=100, tmpfs_dir=str(tmp_path))
+    spool.write(b"12345")
+    mocker.patch.object(spool._file, "write", side_effect=OSError(errno.EIO, "io"))
+
+    with pytest.raises(OSError, match="io"):
+        spool.write(b"678")
+
+
+def test_zipfile_round_trip():
+    """Test the spool works as a ZipFile target and source across tiers."""
+    with ArchiveSpool(memory_limit=64, tmpfs_limit=128) as spool:
+        with zipfile.ZipFile(spool, mode="w") as zf:
+            zf.writestr("main.py", os.urandom(256))
+        assert spool.tier != TIER_MEMORY
+
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as zf:
+            assert zf.namelist() == ["main.py"]
+            assert len(zf.read("main.py")) == 256
+        assert spool.readable() and spool.writable() and spool.seekable()
+    assert spool.closed
+    spool.close()
+
+
+def test_from_env(monkeypatch):
+    """Test the limits are read from the settings."""
+    monkeypatch.setenv("spool_memory_limit", "100")
+    monkeypatch.setenv("spool_tmpfs_limit", "200")
+
+    spool = ArchiveSpool.from_env()
+
+    assert (spool.memory_limit, spool.tmpfs_limit) == (100, 200)
+
+
+def test_shared_readers_stream_independently():
+    """Test concurrent readers each read the whole spool from their own position."""
+    payload = os.urandom(64 * 1024)
+    spool = ArchiveSpool(memory_limit=1024)
+    spool.write(payload)
+    lock = threading.Lock()
+
+    def read_all(reader):
+        chunks = []
+        while chunk := reader.read(1000):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(read_all, [SharedReader(spool, lock) for _ in range(8)])
+        )
+
+    assert results == [payload] * 8
+
+
+def test_shared_reader_seek():
+    """Test seeking moves only the reader, as HTTP clients measure the body."""
+    data = io.BytesIO(b"0123456789")
+    reader = SharedReader(data, threading.Lock())
+
+    assert reader.seek(0, io.SEEK_END) == 10
+    assert reader.seek(-4, io.SEEK_CUR) == 6
+    assert reader.read() == b"6789"
+    assert reader.seek(2) == reader.tell() == 2
+    data.seek(0)
+    assert reader.read(3) == b"234"
@@ -0,0 +1,80 @@
+"""Tests for archives staged in the state bucket."""
+
+import io
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts.staging import StagedArchives
+from plugin_scripts.state import StateStore
+from tests.fakes import FakeBucket
+
+FIRST = "projects/proj/locations/us-central1/functions/first"
+SECOND = "projects/proj/locations/us-central1/functions/second"
+
+
+@pytest.fixture
+def staging():
+    return StagedArchives(StateStore(FakeBucket("state"), "deploys"))
+
+
+def _functions(staging):
+    index, _ = staging.store.read_json(staging.index_key)
+    return index["functions"]
+
+
+def test_stage_uploads_once(mocker, staging):
+    data = io.BytesIO(b"archive")
+    uploads = mocker.spy(staging.store.bucket, "store")
+
+    url = staging.stage(data, "abc")
+    assert staging.stage(data, "abc") == url
+
+    assert url == "gs://state/deploys/archives/abc.zip"
+    assert uploads.call_count == 1
+    assert data.tell() == 0
+    assert staging.is_staged(url)
+    assert not staging.is_staged("gs://state/deploys/releases/fn/abc.zip")
+    assert not staging.is_staged(None)
+
+
+def test_record_deletes_archives_nobody_uses(staging):
+    for digest in ("a", "b", "c"):
+        staging.stage(io.BytesIO(digest.encode()), digest)
+    staging.record({FIRST: "a", SECOND: "a"}, staged="a")
+
+    staging.record({FIRST: "b"}, staged="b")
+    assert staging.store.blob(staging.archive_key("a")).exists()
+
+    staging.record({SECOND: None}, staged="c")
+
+    assert _functions(staging) == {FIRST: "b"}
+    assert not staging.store.blob(staging.archive_key("a")).exists()
+    assert not staging.store.blob(staging.archive_key("c")).exists()
+    assert staging.store.blob(staging.archive_key("b")).exists()
+
+
+def test_record_unchanged_index_is_not_written(mocker, staging):
+    staging.record({FIRST: "a"})
+    write = mocker.spy(staging.store, "write_json")
+
+    staging.record({FIRST: "a"})
+
+    write.assert_not_called()
+
+
+def test_record_retries_concurrent_update(mocker, staging):
+    """Test a lost compare-and-swap re-reads the index instead of clobbering."""
+    racer = StagedArchives(staging.store)
+
+    def raced(*args, **kwargs):
+        # Another deploy records its function between our read and write
+        mocker.stopall()
+        racer.record({SECOND: "b"})
+        raise PreconditionFailed("raced")
+
+    mocker.patch.object(staging.store, "write_json", side_effect=raced)
+
+    staging.record({FIRST: "a"})
+
+    assert _functions(staging) == {FIRST: "a", SECOND: "b"}
@@ -0,0 +1,72 @@
+"""Tests for the state module."""
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+from plugin_scripts import state
+from tests.fakes import FakeBucket
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("gs://bucket/some/prefix/", ("bucket", "some/prefix")),
+        ("gs://bucket", ("bucket", "")),
+        ("bucket/prefix", ("bucket", "prefix")),
+        ("bucket", ("bucket", "")),
+    ],
+)
+def test_parse_state_bucket(value, expected):
+    """Test bucket and prefix are split from the setting."""
+    assert state.parse_state_bucket(value) == expected
+
+
+def test_read_missing_document():
+    """Test reading a missing document returns generation 0."""
+    store = state.StateStore(FakeBucket(), "prefix")
+    assert store.read_json("missing.json") == (None, 0)
+
+
+def test_write_and_read_document():
+    """Test documents round trip under the prefix."""
+    bucket = FakeBucket()
+    store = state.StateStore(bucket, "/prefix/")
+
+    generation = store.write_json("doc.json", {"a": 1})
+
+    assert "prefix/doc.json" in bucket.objects
+    assert store.read_json("doc.json") == ({"a": 1}, generation)
+    assert store.url("doc.json") == "gs://state-bucket/prefix/doc.json"
+
+
+def test_write_with_generation_precondition():
+    """Test a stale generation makes the write fail."""
+    store = state.StateStore(FakeBucket())
+    store.write_json("doc.json", {"a": 1}, if_generation_match=0)
+
+    with pytest.raises(PreconditionFailed):
+        store.write_json("doc.json", {"a": 2}, if_generation_match=0)
+
+
+def test_delete_ignores_missing_documents():
+    """Test deleting twice is harmless."""
+    store = state.StateStore(FakeBucket())
+    generation = store.write_json("doc.json", {})
+
+    store.delete("doc.json", if_generation_match=generation)
+    store.delete("doc.json")
+    assert store.read_json("doc.json") == (None, 0)
+
+
+def test_from_env(mocker, monkeypatch):
+    """Test the store is only built when state_bucket is configured."""
+    monkeypatch.delenv("state_bucket", raising=False)
+    assert state.StateStore.from_env(mocker.Mock()) is None
+
+    monkeypatch.setenv("state_bucket", "gs://my-bucket/deploys")
+    mock_client = mocker.patch("plugin_scripts.state.storage.Client")
+    store = state.StateStore.from_env(mocker.Mock())
+
+    assert store is not None
+    assert store.prefix == "deploys"
+    mock_client.return_value.bucket.assert_called_once_with("my-bucket")
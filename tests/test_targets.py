@@ -0,0 +1,53 @@
+"""Tests for deploy targets."""
+
+import pytest
+
+from plugin_scripts.targets import DeployTarget, targets_from_env
+
+
+def test_parse_project_region():
+    """Test a project/region entry reuses the default function name."""
+    target = DeployTarget.parse("proj/europe-west1", "fn")
+    assert target == DeployTarget("proj", "europe-west1", "fn")
+    assert target.parent == "projects/proj/locations/europe-west1"
+    assert target.path == "projects/proj/locations/europe-west1/functions/fn"
+    assert target.quota_key == "proj/europe-west1"
+
+
+def test_parse_with_function():
+    """Test a project/region/function entry."""
+    assert DeployTarget.parse(" proj/us-east1/other/ ", "fn") == DeployTarget(
+        "proj", "us-east1", "other"
+    )
+
+
+@pytest.mark.parametrize("value", ["proj", "proj//fn", "a/b/c/d", ""])
+def test_parse_invalid(value):
+    """Test malformed entries are rejected."""
+    with pytest.raises(ValueError, match="Invalid target"):
+        DeployTarget.parse(value, "fn")
+
+
+def test_targets_from_env(monkeypatch):
+    """Test the primary target comes first and duplicates are dropped."""
+    monkeypatch.setenv("gcp_project", "proj")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "fn")
+    monkeypatch.setenv(
+        "targets", "proj/us-central1,proj/europe-west1,proj/europe-west1"
+    )
+
+    assert targets_from_env() == [
+        DeployTarget("proj", "us-central1", "fn"),
+        DeployTarget("proj", "europe-west1", "fn"),
+    ]
+
+
+def test_targets_from_env_single(monkeypatch):
+    """Test only the primary target is used without extra targets."""
+    monkeypatch.setenv("gcp_project", "proj")
+    monkeypatch.setenv("gcp_region", "us-central1")
+    monkeypatch.setenv("cloud_function_name", "fn")
+    monkeypatch.delenv("targets", raising=False)
+
+    assert targets_from_env() == [DeployTarget("proj", "us-central1", "fn")]
@@ -0,0 +1,253 @@
+"""Tests for deploy tracing."""
+
+import json
+import logging
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from plugin_scripts import deploy, tracing
+from plugin_scripts.targets import DeployTarget
+
+TRACE_ID = "0af7651916cd43dd8448eb211c80319c"
+CONTAINER_SPAN = "b7ad6b7169203331"
+
+
+@pytest.fixture(autouse=True)
+def _reset_tracer():
+    yield
+    tracing._tracer = None
+
+
+@pytest.fixture
+def trace_file(monkeypatch, tmp_path):
+    """Enable tracing to a file, continuing the hook's trace."""
+    path = tmp_path / "trace.json"
+    monkeypatch.setenv("trace_file", str(path))
+    monkeypatch.setenv("TRACEPARENT", f"00-{TRACE_ID}-{CONTAINER_SPAN}-01")
+    monkeypatch.delenv("trace_endpoint", raising=False)
+    monkeypatch.delenv("trace_hook_spans", raising=False)
+    monkeypatch.delenv("trace_install_started", raising=False)
+    monkeypatch.setattr("plugin_scripts.buildkite.agent_path", lambda: None)
+    return path
+
+
+def _spans(path):
+    document = json.loads(path.read_text())
+    spans = document["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    return {span["name"]: span for span in spans}
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (f"00-{TRACE_ID}-{CONTAINER_SPAN}-01", (TRACE_ID, CONTAINER_SPAN)),
+        ("", None),
+        (f"00-{TRACE_ID}-{CONTAINER_SPAN}", None),
+        (f"00-{'x' * 32}-{CONTAINER_SPAN}-01", None),
+        (f"00-{TRACE_ID}-short-01", None),
+    ],
+)
+def test_parse_traceparent(value, expected):
+    assert tracing.parse_traceparent(value) == expected
+
+
+def test_span_is_a_no_op_when_disabled(monkeypatch):
+    monkeypatch.delenv("trace_file", raising=False)
+    monkeypatch.delenv("trace_endpoint", raising=False)
+
+    assert tracing.configure() is None
+    with tracing.span("phase") as span:
+        assert span is None
+    tracing.shutdown()
+
+
+def test_spans_nest_under_the_container_span(trace_file):
+    tracing.configure()
+    with tracing.span("deploy"), tracing.span("patch function", target="fn"):
+        pass
+    tracing.shutdown()
+
+    spans = _spans(trace_file)
+    assert spans["deploy"]["traceId"] == TRACE_ID
+    assert spans["deploy"]["parentSpanId"] == CONTAINER_SPAN
+    assert spans["patch function"]["parentSpanId"] == spans["deploy"]["spanId"]
+    assert spans["patch function"]["attributes"] == [
+        {"key": "target", "value": {"stringValue": "fn"}}
+    ]
+    assert spans["deploy"]["status"] == {"code": 1}
+    assert int(spans["deploy"]["endTimeUnixNano"]) >= int(
+        spans["deploy"]["startTimeUnixNano"]
+    )
+
+
+def test_span_records_failures(trace_file):
+    tracing.configure()
+    with pytest.raises(RuntimeError), tracing.span("upload archive"):
+        raise RuntimeError("connection reset")
+    tracing.shutdown()
+
+    assert _spans(trace_file)["upload archive"]["status"] == {
+        "code": 2,
+        "message": "connection reset",
+    }
+
+
+def test_configure_adds_hook_and_install_spans(monkeypatch, tmp_path, trace_file):
+    """Test the hook's spans join the trace and open ones end at export."""
+    hook_spans = tmp_path / "hook.jsonl"
+    hook_spans.write_text(
+        '{"name":"docker pull","span_id":"1111111111111111",'
+        '"parent_span_id":"2222222222222222","start":10,"end":20}\n'
+        '{"name":"buildkite step","span_id":"2222222222222222",'
+        '"parent_span_id":"","start":5,"end":null}\n'
+        "not json\n"
+    )
+    monkeypatch.setenv("trace_hook_spans", str(hook_spans))
+    monkeypatch.setenv("trace_install_started", "30")
+    monkeypatch.setenv("trace_install_finished", "40")
+
+    tracing.configure()
+    tracing.shutdown()
+
+    spans = _spans(trace_file)
+    assert spans["docker pull"]["startTimeUnixNano"] == "10"
+    assert spans["docker pull"]["endTimeUnixNano"] == "20"
+    assert "parentSpanId" not in spans["buildkite step"]
+    assert int(spans["buildkite step"]["endTimeUnixNano"]) > 40
+    assert spans["install dependencies"]["parentSpanId"] == CONTAINER_SPAN
+    assert spans["install dependencies"]["endTimeUnixNano"] == "40"
+    assert spans["python startup"]["startTimeUnixNano"] == "40"
+
+
+def test_configure_without_hook_spans_file(monkeypatch, tmp_path, caplog, trace_file):
+    monkeypatch.setenv("trace_hook_spans", str(tmp_path / "missing.jsonl"))
+    monkeypatch.delenv("TRACEPARENT")
+
+    with caplog.at_level(logging.WARNING, logger="cloud-function"):
+        tracer = tracing.configure()
+
+    assert tracer is not None
+    assert len(tracer.trace_id) == 32
+    assert tracer.parent_id is None
+    assert "Could not read the hook's trace spans" in caplog.text
+
+
+def test_shutdown_uploads_trace_file(mocker, trace_file):
+    mocker.patch("plugin_scripts.buildkite.agent_path", return_value="/agent")
+    upload = mocker.patch("plugin_scripts.buildkite.artifact_upload")
+
+    tracing.configure()
+    tracing.shutdown()
+
+    upload.assert_called_once_with(str(trace_file))
+
+
+@pytest.mark.parametrize(
+    "endpoint", ["http://collector:4318", "http://collector:4318/v1/traces/"]
+)
+def test_shutdown_exports_to_endpoint(mocker, monkeypatch, trace_file, endpoint):
+    monkeypatch.delenv("trace_file")
+    monkeypatch.setenv("trace_endpoint", endpoint)
+    monkeypatch.setenv("OTEL_EXPORTER_OTLP_HEADERS", "x-team=abc, broken")
+    post = mocker.patch("plugin_scripts.tracing.requests.post")
+
+    tracing.configure()
+    with tracing.span("deploy"):
+        pass
+    tracing.shutdown()
+
+    url = post.call_args.args[0]
+    assert url == "http://collector:4318/v1/traces"
+    document = post.call_args.kwargs["json"]
+    assert document["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"] == (
+        "deploy"
+    )
+    assert post.call_args.kwargs["headers"] == {
+        "Content-Type": "application/json",
+        "x-team": "abc",
+    }
+    assert not trace_file.exists()
+
+
+def test_shutdown_export_failures_only_warn(mocker, monkeypatch, caplog, trace_file):
+    monkeypatch.setenv("trace_endpoint", "http://collector:4318")
+    mocker.patch(
+        "plugin_scripts.tracing.requests.post",
+        side_effect=requests.ConnectionError("refused"),
+    )
+    mocker.patch("pathlib.Path.write_text", side_effect=OSError("read-only"))
+
+    tracing.configure()
+    with caplog.at_level(logging.WARNING, logger="cloud-function"):
+        tracing.shutdown()
+
+    assert "Could not save the trace" in caplog.text
+    assert "Could not export the trace" in caplog.text
+
+
+def test_map_targets_nests_spans_under_the_caller(trace_file):
+    """Test spans in target threads are children of the caller's span."""
+    tracing.configure()
+    targets = [DeployTarget("p", "r", "a"), DeployTarget("p", "r", "b")]
+
+    def task(target):
+        with tracing.span(f"task {target.function}"):
+            pass
+
+    with tracing.span("deploy"):
+        deploy._map_targets(task, targets)
+    tracing.shutdown()
+
+    spans = _spans(trace_file)
+    assert spans["task a"]["parentSpanId"] == spans["deploy"]["spanId"]
+    assert spans["task b"]["parentSpanId"] == spans["deploy"]["spanId"]
+
+
+def test_main_unreadable_hook_spans(monkeypatch, tmp_path, trace_file):
+    """Test a broken tracing setup fails with the plugin's error."""
+    spans = tmp_path / "spans.jsonl"
+    spans.write_bytes(b"\xff\xfe")
+    monkeypatch.setenv("trace_hook_spans", str(spans))
+
+    with pytest.raises(deploy.DeployFailed, match="Unexpected error"):
+        deploy.main()
+
+
+def test_main_exports_trace_of_the_deploy(mocker, monkeypatch, tmp_path, trace_file):
+    """Test a failed deploy still exports its trace, marking the failure."""
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    (source_dir / "main.py").write_text("def handler(request): return 'ok'")
+    for name, value in {
+        "gcp_project": "proj",
+        "gcp_region": "us-central1",
+        "cloud_function_name": "fn",
+        "cloud_function_directory": str(source_dir),
+        "credentials": "{}",
+    }.items():
+        monkeypatch.setenv(name, value)
+    for name in ("targets", "mode", "prebuilt_archive", "coalesce_deploys"):
+        monkeypatch.delenv(name, raising=False)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    cloud_functions = Mock()
+    cloud_functions.get.return_value.execute.return_value = {"runtime": "python313"}
+    cloud_functions.generateUploadUrl.return_value.execute.return_value = {
+        "uploadUrl": "https://upload"
+    }
+    cloud_functions.patch.return_value.execute.side_effect = RuntimeError("denied")
+    mocker.patch(
+        "plugin_scripts.deploy._cloud_functions_resource",
+        return_value=cloud_functions,
+    )
+
+    with pytest.raises(deploy.DeployFailed):
+        deploy.main()
+
+    spans = _spans(trace_file)
+    assert {"deploy", "get function", "build archive", "upload archive"} <= set(spans)
+    assert spans["get function"]["parentSpanId"] == spans["deploy"]["spanId"]
+    assert spans["patch function"]["status"]["message"] == "denied"
+    assert spans["deploy"]["status"]["code"] == 2
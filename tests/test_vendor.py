@@ -0,0 +1,309 @@
+"""Tests for vendoring wheels from the shared wheel cache."""
+
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.vendor import (
+    DEFAULT_PLATFORMS,
+    WheelCache,
+    WheelVendor,
+    install_path,
+    vendor_wheels,
+)
+from tests.fakes import make_wheel
+
+CURRENT = f"python{sys.version_info[0]}{sys.version_info[1]}"
+
+
+@pytest.fixture
+def index(tmp_path):
+    """A local index where alpha needs beta."""
+    wheels = tmp_path / "index"
+    wheels.mkdir()
+    make_wheel(
+        wheels, "alpha", "1.0", ["beta"], {"alpha/": "", "alpha/__init__.py": "A = 1\n"}
+    )
+    make_wheel(wheels, "beta", "2.0", files={"beta.py": "B = 2\n"})
+    return wheels
+
+
+@pytest.fixture
+def function_dir(tmp_path):
+    directory = tmp_path / "fn"
+    directory.mkdir()
+    (directory / "main.py").write_text("import alpha\n")
+    (directory / "requirements.txt").write_text("alpha\n")
+    return directory
+
+
+def test_cache_add_deduplicates(index, tmp_path):
+    """Test identical wheels are stored once under their digest."""
+    cache = WheelCache(tmp_path / "cache")
+    wheel = index / "beta-2.0-py3-none-any.whl"
+
+    entry = cache.add(wheel)
+    assert cache.add(wheel) == entry
+
+    stored = tmp_path / "cache" / "wheels" / entry["sha256"] / wheel.name
+    assert stored.read_bytes() == wheel.read_bytes()
+    assert list((tmp_path / "cache" / "tmp").iterdir()) == []
+
+
+def test_cache_add_lost_race(mocker, index, tmp_path):
+    """Test a wheel stored concurrently by another build is kept."""
+    cache = WheelCache(tmp_path / "cache")
+    wheel = index / "beta-2.0-py3-none-any.whl"
+    mocker.patch("pathlib.Path.rename", side_effect=OSError("exists"))
+
+    entry = cache.add(wheel)
+
+    assert entry["filename"] == wheel.name
+    assert list((tmp_path / "cache" / "tmp").iterdir()) == []
+
+
+def test_cache_sets(index, tmp_path):
+    """Test sets resolve to their wheels and refresh their last use."""
+    cache = WheelCache(tmp_path / "cache")
+    entries = [cache.add(wheel) for wheel in sorted(index.iterdir())]
+    cache.store_set("key", entries)
+    for wheel_dir in (tmp_path / "cache" / "wheels").iterdir():
+        os.utime(wheel_dir, (0, 0))
+
+    wheels = cache.load_set("key")
+
+    assert wheels is not None
+    assert [wheel.name for wheel in wheels] == [e["filename"] for e in entries]
+    assert all(wheel.parent.stat().st_mtime > 0 for wheel in wheels)
+    assert cache.load_set("other") is None
+
+
+def test_cache_set_with_evicted_wheel(index, tmp_path):
+    """Test a set is a miss once any of its wheels is gone."""
+    cache = WheelCache(tmp_path / "cache")
+    entries = [cache.add(wheel) for wheel in sorted(index.iterdir())]
+    cache.store_set("key", entries)
+    (cache.root / "wheels" / entries[0]["sha256"] / entries[0]["filename"]).unlink()
+
+    assert cache.load_set("key") is None
+
+    shutil.rmtree(cache.root / "wheels" / entries[1]["sha256"])
+
+    assert cache.load_set("key") is None
+
+
+def test_cache_evicts_least_recently_used(index, tmp_path):
+    """Test eviction removes the oldest wheels not in use."""
+    wheels = sorted(index.iterdir())
+    cache = WheelCache(
+        tmp_path / "cache", max_bytes=max(w.stat().st_size for w in wheels)
+    )
+    alpha, beta = (cache.add(wheel)["sha256"] for wheel in wheels)
+    os.utime(cache.root / "wheels" / alpha, (1, 1))
+    os.utime(cache.root / "wheels" / beta, (2, 2))
+
+    assert cache.evict(keep={alpha}) == [beta]
+    assert [p.name for p in (cache.root / "wheels").iterdir()] == [alpha]
+    assert cache.evict() == []
+
+
+def test_cache_keeps_wheels_another_build_loaded(index, tmp_path):
+    """Test eviction spares wheels used within the grace window."""
+    cache = WheelCache(tmp_path / "cache")
+    entries = [cache.add(wheel) for wheel in sorted(index.iterdir())]
+    cache.store_set("key", entries)
+    for wheel_dir in (cache.root / "wheels").iterdir():
+        os.utime(wheel_dir, (1, 1))
+    wheels = cache.load_set("key")
+
+    other_build = WheelCache(cache.root, max_bytes=0)
+
+    assert other_build.evict() == []
+    assert wheels is not None
+    assert all(wheel.is_file() for wheel in wheels)
+    assert WheelCache(cache.root, max_bytes=0, grace_seconds=-60).evict()
+
+
+def test_cache_evicts_concurrently_with_another_build(mocker, index, tmp_path):
+    """Test wheels another build evicts meanwhile are skipped."""
+    cache = WheelCache(tmp_path / "cache", max_bytes=0, grace_seconds=-60)
+    sha256 = cache.add(index / "beta-2.0-py3-none-any.whl")["sha256"]
+
+    mocker.patch("pathlib.Path.iterdir", side_effect=FileNotFoundError)
+    assert cache.evict() == []
+    mocker.stopall()
+
+    shutil.rmtree(cache.root / "wheels" / sha256)
+    assert not cache._used_since(sha256, 0)
+
+
+def test_cache_add_refreshes_cached_wheel(index, tmp_path):
+    """Test storing a wheel already cached counts as using it."""
+    cache = WheelCache(tmp_path / "cache", max_bytes=0)
+    wheel = index / "beta-2.0-py3-none-any.whl"
+    sha256 = cache.add(wheel)["sha256"]
+    os.utime(cache.root / "wheels" / sha256, (1, 1))
+
+    cache.add(wheel)
+
+    assert cache.evict() == []
+
+
+@pytest.mark.parametrize(
+    ("member", "path"),
+    [
+        ("pkg/mod.py", "pkg/mod.py"),
+        ("pkg-1.0.data/purelib/pkg/extra.py", "pkg/extra.py"),
+        ("pkg-1.0.data/platlib/pkg/_ext.so", "pkg/_ext.so"),
+        ("pkg-1.0.data/scripts/tool", None),
+        ("pkg-1.0.data/headers/pkg.h", None),
+    ],
+)
+def test_install_path(member, path):
+    assert install_path(member) == path
+
+
+def test_vendor_wheels(index, tmp_path):
+    """Test wheels are installed at the archive root."""
+    archive = tmp_path / "out.zip"
+    with zipfile.ZipFile(archive, mode="w") as handler:
+        sources = vendor_wheels(handler, sorted(index.iterdir()))
+
+    assert sources == [(b"A = 1\n", "alpha/__init__.py"), (b"B = 2\n", "beta.py")]
+    with zipfile.ZipFile(archive) as zf:
+        assert "alpha-1.0.dist-info/METADATA" in zf.namelist()
+        assert zf.read("beta.py") == b"B = 2\n"
+
+
+def test_wheels_download_and_cache(mocker, index, function_dir, tmp_path):
+    """Test wheels are downloaded for the runtime once, then served from cache."""
+    vendor = WheelVendor(WheelCache(tmp_path / "cache"), (3, 12), find_links=str(index))
+
+    wheels = vendor.wheels(function_dir)
+    assert sorted(wheel.name for wheel in wheels) == [
+        "alpha-1.0-py3-none-any.whl",
+        "beta-2.0-py3-none-any.whl",
+    ]
+
+    mock_run = mocker.patch("plugin_scripts.vendor.subprocess.run")
+    assert (
+        WheelVendor(vendor.cache, (3, 12), find_links=str(index)).wheels(function_dir)
+        == wheels
+    )
+    mock_run.assert_not_called()
+
+
+def test_wheels_without_requirements(function_dir, tmp_path):
+    (function_dir / "requirements.txt").unlink()
+
+    assert (
+        WheelVendor(WheelCache(tmp_path / "cache"), (3, 12)).wheels(function_dir) == []
+    )
+
+
+def test_wheels_download_fails(index, function_dir, tmp_path):
+    """Test requirements without wheels fail the build."""
+    (function_dir / "requirements.txt").write_text("gamma\n")
+    vendor = WheelVendor(WheelCache(tmp_path / "cache"), (3, 12), find_links=str(index))
+
+    with pytest.raises(DeployFailed, match="Could not download wheels"):
+        vendor.wheels(function_dir)
+
+
+def test_wheels_download_timeout(mocker, function_dir, tmp_path):
+    mocker.patch(
+        "plugin_scripts.vendor.subprocess.run",
+        side_effect=subprocess.TimeoutExpired("pip", 5),
+    )
+    vendor = WheelVendor(WheelCache(tmp_path / "cache"), (3, 12), timeout=5)
+
+    with pytest.raises(DeployFailed, match="timed out after 5s"):
+        vendor.wheels(function_dir)
+
+
+def test_command_uses_index_url(tmp_path):
+    vendor = WheelVendor(
+        WheelCache(tmp_path),
+        (3, 12),
+        platforms=("linux_x86_64",),
+        index_url="https://pypi.example.com/simple",
+        find_links="/wheels",
+    )
+
+    command = vendor._command(tmp_path / "dest")
+
+    assert command[-6:] == [
+        "--platform",
+        "linux_x86_64",
+        "--index-url",
+        "https://pypi.example.com/simple",
+        "--find-links",
+        "/wheels",
+    ]
+    assert "--no-index" not in command
+    assert command[command.index("--python-version") + 1] == "3.12"
+
+
+def test_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("wheel_cache_max_bytes", "1024")
+    monkeypatch.setenv("vendor_platforms", "manylinux2014_aarch64")
+    monkeypatch.setenv("resolve_find_links", "/wheels")
+    monkeypatch.delenv("resolve_index_url", raising=False)
+
+    vendor = WheelVendor.from_env((3, 13), tmp_path)
+
+    assert vendor.cache.max_bytes == 1024
+    assert vendor.platforms == ("manylinux2014_aarch64",)
+    assert vendor.find_links == "/wheels"
+    assert vendor.python_tag == "3.13"
+
+    monkeypatch.delenv("vendor_platforms")
+    assert WheelVendor.from_env((3, 13), tmp_path).platforms == DEFAULT_PLATFORMS
+
+
+def test_vendored_wheels_disabled(monkeypatch):
+    monkeypatch.delenv("vendor_wheels", raising=False)
+
+    with deploy._vendored_wheels([CURRENT]) as wheels:
+        assert wheels == []
+
+
+def test_vendored_wheels_without_python(monkeypatch):
+    monkeypatch.setenv("vendor_wheels", "true")
+
+    with deploy._vendored_wheels(["nodejs20"]) as wheels:
+        assert wheels == []
+
+
+def test_vendored_wheels_mixed_versions(monkeypatch):
+    """Test targets on different Python versions cannot share vendored wheels."""
+    monkeypatch.setenv("vendor_wheels", "true")
+
+    with pytest.raises(DeployFailed, match="found 3.12, 3.13"):
+        with deploy._vendored_wheels(["python313", "python312"]):
+            pass
+
+
+def test_zip_directory_vendors_wheels(monkeypatch, index, function_dir, tmp_path):
+    """Test the archive carries the vendored wheels instead of requirements."""
+    monkeypatch.setenv("vendor_wheels", "true")
+    monkeypatch.setenv("resolve_find_links", str(index))
+    monkeypatch.setenv("cloud_function_directory", str(function_dir))
+    monkeypatch.delenv("cache_dir", raising=False)
+    monkeypatch.delenv("bytecode", raising=False)
+    monkeypatch.delenv("spool_memory_limit", raising=False)
+
+    with deploy._build_archive(runtimes=[CURRENT]) as data:
+        with zipfile.ZipFile(data) as zf:
+            names = zf.namelist()
+
+    assert "main.py" in names
+    assert "alpha/__init__.py" in names
+    assert "beta.py" in names
+    assert "requirements.txt" not in names
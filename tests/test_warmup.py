@@ -0,0 +1,182 @@
+"""Tests for post-deploy warm-up requests."""
+
+import logging
+from unittest.mock import Mock
+
+import pytest
+
+from plugin_scripts import deploy
+from plugin_scripts.pipeline_exceptions import DeployFailed
+from plugin_scripts.warmup import WarmupReport, WarmupRequest, percentile, warm_up
+from tests.fakes import LocalFunction
+
+
+@pytest.mark.parametrize(
+    ("fraction", "expected"), [(0.5, 5.0), (0.95, 10.0), (0.1, 1.0), (0.0, 1.0)]
+)
+def test_percentile(fraction, expected):
+    assert percentile([float(v) for v in range(10, 0, -1)], fraction) == expected
+
+
+def test_percentile_without_samples():
+    assert percentile([], 0.99) == 0.0
+
+
+def test_warm_up_sends_waves():
+    """Test requests go out in concurrent waves and cold starts are reported."""
+    with LocalFunction(cold_starts=3, cold_delay=0.2) as function:
+        report = warm_up(function.url + "/ping", 7, concurrency=3)
+
+    assert len(function.requests) == 7
+    assert {path for _, path, _ in function.requests} == {"/ping"}
+    assert [r.wave for r in report.results] == [0, 0, 0, 1, 1, 1, 2]
+    assert len(report.cold) == 3
+    assert min(report.cold) >= 0.2
+    assert max(report.warm) < 0.2
+    assert report.errors == 0
+
+
+def test_warm_up_sends_headers():
+    with LocalFunction() as function:
+        warm_up(function.url, 1, headers={"Authorization": "Bearer token"})
+
+    assert function.requests[0][2]["Authorization"] == "Bearer token"
+
+
+def test_warm_up_counts_errors():
+    """Test server errors and unreachable functions are counted, not raised."""
+    with LocalFunction(status=503) as function:
+        assert warm_up(function.url, 2).errors == 2
+
+        url = function.url
+    assert warm_up(url, 1, timeout=1).errors == 1
+
+
+def test_report_summary():
+    report = WarmupReport(
+        "https://fn",
+        [
+            WarmupRequest(0, 2.0, 200),
+            WarmupRequest(0, 1.0, 200),
+            WarmupRequest(1, 0.05, 200),
+            WarmupRequest(1, 0.1, None),
+        ],
+    )
+
+    assert report.summary() == (
+        "2 cold requests p50 1.000s max 2.000s, "
+        "2 warm requests p50 0.050s max 0.100s, 1 errors"
+    )
+    assert WarmupReport("https://fn", []).summary() == "0 errors"
+
+
+@pytest.fixture
+def warmup_env(mocker, monkeypatch, tmp_path):
+    """Deploy a single function whose rollout has finished when first polled."""
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    (source_dir / "main.py").write_text("def handler(request): return 'ok'")
+    for name, value in {
+        "gcp_project": "proj",
+        "gcp_region": "us-central1",
+        "cloud_function_name": "fn",
+        "cloud_function_directory": str(source_dir),
+        "warmup_requests": "4",
+        "warmup_concurrency": "2",
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("targets", raising=False)
+    mocker.patch("plugin_scripts.deploy._get_bq_credentials")
+    mocker.patch("plugin_scripts.deploy._upload_source_code_using_upload_url")
+    operations = Mock()
+    operations.get.return_value.execute.return_value = {"done": True}
+    mocker.patch("plugin_scripts.deploy._operations_resource", return_value=operations)
+    return operations
+
+
+def _mock_function(mocker, function):
+    cloud_functions = Mock()
+    cloud_functions.get.return_value.execute.return_value = function
+    cloud_functions.patch.return_value.execute.return_value = {"name": "operations/1"}
+    cloud_functions.generateUploadUrl.return_value.execute.return_value = {
+        "uploadUrl": "https://upload"
+    }
+    mocker.patch(
+        "plugin_scripts.deploy._cloud_functions_resource",
+        return_value=cloud_functions,
+    )
+
+
+def test__deploy_warms_up_after_rollout(mocker, monkeypatch, caplog, warmup_env):
+    """Test the warm-up burst starts once the rollout has finished."""
+    monkeypatch.setenv("warmup_path", "/health")
+    monkeypatch.setenv("warmup_authenticated", "true")
+    mock_token = mocker.patch("plugin_scripts.deploy._id_token", return_value="tok")
+
+    with LocalFunction() as function:
+        _mock_function(mocker, {"httpsTrigger": {"url": function.url}})
+        with caplog.at_level(logging.INFO, logger="cloud-function"):
+            deploy._deploy(False)
+
+    warmup_env.get.assert_called_once_with(name="operations/1")
+    mock_token.assert_called_once_with(function.url)
+    assert [path for _, path, _ in function.requests] == ["/health"] * 4
+    assert function.requests[0][2]["Authorization"] == "Bearer tok"
+    assert "2 cold requests" in caplog.text
+    assert "2 warm requests" in caplog.text
+
+
+def test__deploy_warm_up_failures_only_warn(mocker, caplog, warmup_env):
+    with LocalFunction(status=500) as function:
+        _mock_function(mocker, {"httpsTrigger": {"url": function.url}})
+        with caplog.at_level(logging.WARNING, logger="cloud-function"):
+            deploy._deploy(False)
+
+    assert "4 warm-up requests" in caplog.text
+
+
+def test__deploy_without_https_trigger_skips_warm_up(mocker, caplog, warmup_env):
+    _mock_function(mocker, {"eventTrigger": {}})
+    mock_warm_up = mocker.patch("plugin_scripts.deploy.warm_up")
+
+    with caplog.at_level(logging.INFO, logger="cloud-function"):
+        deploy._deploy(False)
+
+    mock_warm_up.assert_not_called()
+    assert "it has no HTTPS trigger" in caplog.text
+
+
+def test__deploy_failed_rollout_fails_step(mocker, warmup_env):
+    """Test waiting for the rollout surfaces a failed build."""
+    warmup_env.get.return_value.execute.return_value = {
+        "done": True,
+        "error": {"message": "build failed"},
+    }
+    _mock_function(mocker, {"httpsTrigger": {"url": "https://fn"}})
+
+    with pytest.raises(DeployFailed, match="build failed"):
+        deploy._deploy(False)
+
+
+def test__id_token(mocker, monkeypatch):
+    """Test identity tokens are minted for the trigger URL."""
+    monkeypatch.setenv("credentials", '{"type": "service_account"}')
+    from_info = mocker.patch(
+        "plugin_scripts.deploy.service_account.IDTokenCredentials"
+        ".from_service_account_info"
+    )
+    token = from_info.return_value.token
+
+    assert deploy._id_token("https://fn") == str(token)
+    from_info.assert_called_once_with(
+        {"type": "service_account"}, target_audience="https://fn"
+    )
+    from_info.return_value.refresh.assert_called_once()
+
+
+def test__operations_resource(mocker):
+    mock_discovery = mocker.patch("plugin_scripts.deploy.discovery")
+
+    operations = deploy._operations_resource(Mock())
+
+    assert operations is mock_discovery.build.return_value.operations.return_value